@@ -2,14 +2,15 @@
   Sketch de Arduino para retornar por consola serial los valores recibidos desde los ADCs.
   Retorna valores según lo recibido en cada pin analógico
   Incluye una función para mantener pulsado un botón y mandar su estado por serial
+  La cantidad de canales se define con N_CANALES y sus pines en CANAL_PINES. En
+  Python, 'n_canales' de lectura_3ch_rawEMG.py debe tener el mismo valor
 */
 #define SAMPLE_FREQ 1000 // Frecuencia de muestreo en Hz
 #define SAMPLE_PERIOD_US (1000000 / SAMPLE_FREQ) // Periodo de muestreo en microsegundos
 
 // Definición de pines
-#define CH1_PIN A0
-#define CH2_PIN A1
-#define CH3_PIN A2
+#define N_CANALES 3
+const int CANAL_PINES[N_CANALES] = {A0, A1, A2}; // Canal 1, 2, 3, ...
 #define ONSET_PIN A3
 unsigned long lastSampleTime = 0; // Variable para almacenar el tiempo del último muestreo
 
@@ -18,10 +19,10 @@ void setup() {
   // Inicializar la comunicación serial a 115200 baud
   Serial.begin(115200);
   
-  // Configurar los pines A0, A1, A2 y A3 como entradas
-  pinMode(CH1_PIN, INPUT); // Canal 1
-  pinMode(CH2_PIN, INPUT); // Canal 2
-  pinMode(CH3_PIN, INPUT); // Canal 3
+  // Configurar los pines de los canales y el de onset como entradas
+  for (int i = 0; i < N_CANALES; i++) {
+    pinMode(CANAL_PINES[i], INPUT);
+  }
   pinMode(ONSET_PIN, INPUT); // Onset (1 si se mantiene pulsado el botón)
 }
 
@@ -35,23 +36,23 @@ void loop() {
     // Actualizar el tiempo del último muestreo
     lastSampleTime = currentTime;
 
-    // Leer los valores analógicos desde los pines A0, CH2_PIN y A2
-    int sensorValue1 = analogRead(CH1_PIN); // Canal 1
-    int sensorValue2 = analogRead(CH2_PIN); // Canal 2
-    int sensorValue3 = analogRead(CH3_PIN); // Canal 3
+    // Leer los valores analógicos de todos los canales
+    int sensorValues[N_CANALES];
+    for (int i = 0; i < N_CANALES; i++) {
+      sensorValues[i] = analogRead(CANAL_PINES[i]);
+    }
     
     // Leer estado del botón de onset
     // Mantenerlo presionado mientras se haga un gesto
     int onset = digitalRead(ONSET_PIN);
 
     // Enviar los valores de voltaje a través de la consola serial
-    // Formato: <onset>,<CH1>,<CH2>,<CH3>
+    // Formato: <onset>,<CH1>,<CH2>,...,<CHN>
     Serial.print(onset);
-    Serial.print(",");
-    Serial.print(sensorValue1);
-    Serial.print(",");
-    Serial.print(sensorValue2);
-    Serial.print(",");
-    Serial.println(sensorValue3);
+    for (int i = 0; i < N_CANALES; i++) {
+      Serial.print(",");
+      Serial.print(sensorValues[i]);
+    }
+    Serial.println();
   }
 }
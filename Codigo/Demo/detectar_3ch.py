@@ -5,6 +5,11 @@ funcionar con 3 canales, donde cada canal corresponde a 1 un grupo muscular
 y gesto.
 Espera recibirlos con el formato <onset>,<CH1>,<CH2>,<CH3>,...
 
+La decisión la toma la máquina de estados de 'maquina_gestos.py' (histéresis,
+votación, permanencia mínima y prioridad entre canales), con ventanas cortas
+evaluadas cada pocas muestras en lugar de una ventana de 100 muestras. La 
+detección anterior se obtiene con ConfigDeteccion.legado().
+
 Uso
 ---
     - Posicionar equipo en el brazo y conectar a la computadora.
@@ -13,82 +18,80 @@ Uso
 Bastián Rivas
 '''
 import serial
+import time
+from dataclasses import replace
 
-# Función para obtener el promedio luego de centrar los datos en cero y obtener su valor absoluto
-def centrar_y_promediar(datos):
-    datos_centrados = [dato - sum(datos) / len(datos) for dato in datos]
-    return sum(abs(dato) for dato in datos_centrados) / len(datos_centrados)
+# Máquina de estados de la detección
+from maquina_gestos import ConfigDeteccion, MaquinaGestos, destino_eventos
 
 # Configurar el puerto serial
-puerto_serial = 'COM4' # Cambiar según el puerto utilizado
-baud_rate = 115200
+PUERTO_SERIAL = 'COM4' # Cambiar según el puerto utilizado
+BAUD_RATE = 115200
 
 # Definir el valor umbral de activación para cada canal
-umbral_ch1 = 15  # Flex. radial: levantar muñeca
-umbral_ch2 = 26  # Ext. com. dedos: abrir mano
-umbral_ch3 = 25  # Flex. dedos: puño/muñeca abajo
-
-# Listas con tamaño definido para actuar como buffers
-BUFFER_SIZE = 100
-
-buffer_ch1 = [0] * BUFFER_SIZE
-buffer_ch2 = [0] * BUFFER_SIZE
-buffer_ch3 = [0] * BUFFER_SIZE
-
-i = 0 # Contador para el buffer
-
-# Variable para almacenar el último gesto detectado
-ultimo_gesto = None
-gesto_actual = None
-
-# Abrir el puerto serial y comenzar a leer datos
-try:
+UMBRALES = (
+    15,  # Flex. radial: levantar muñeca
+    26,  # Ext. com. dedos: abrir mano
+    25,  # Flex. dedos: puño/muñeca abajo
+)
+
+
+def detectar(puerto_serial=PUERTO_SERIAL, baud_rate=BAUD_RATE, 
+             umbrales=UMBRALES, tamano_buffer=None, al_detectar=print,
+             duracion=None, config=None, eventos=None):
+    """
+    Lee el puerto serial y avisa cada vez que cambia el gesto detectado.
+
+    Parameters
+    ----------
+        puerto_serial (str): Puerto de la placa
+        baud_rate (int): Velocidad del puerto
+        umbrales (tuple): Umbral de activación de CH1, CH2 y CH3
+        tamano_buffer (int): Muestras por ventana. Por defecto, las de 
+                             'config'
+        al_detectar (callable): Función que recibe el nombre del gesto nuevo
+        duracion (float): Segundos a leer. None para leer hasta Ctrl+C
+        config (ConfigDeteccion): Parámetros de la máquina de estados. Por 
+                                  defecto, ConfigDeteccion con 'umbrales'
+        eventos (callable o cola): Destino de los eventos con su instante 
+                                   ('maquina_gestos.Evento')
+    """
+    if config is None:
+        config = ConfigDeteccion(umbrales=tuple(umbrales))
+    if tamano_buffer is not None:
+        config = replace(config, ventana=tamano_buffer,
+                         salto=min(config.salto, tamano_buffer))
+    emitir = destino_eventos(eventos)
+
+    def al_evento(evento):
+        al_detectar(evento.gesto)
+        if emitir is not None:
+            emitir(evento)
+
+    maquina = MaquinaGestos(config, al_evento)
+    n_canales = len(config.umbrales)
+
+    inicio = time.monotonic()
+    # Abrir el puerto serial y comenzar a leer datos
     with serial.Serial(puerto_serial, baud_rate, timeout=1) as ser:
         print(f"Leyendo desde {puerto_serial} a {baud_rate} baud...\nFinalizar con Ctrl+C")
-        while True:
+        while duracion is None or time.monotonic() - inicio < duracion:
             # Leer línea desde el puerto serial
             if ser.in_waiting > 0:
                 try:
                     data = ser.readline().decode('ascii').rstrip()
                     valores = data.split(',')
 
-                    # Asegurarse de que hay al menos tres valores (CH1, CH2, CH3)
-                    if len(valores) >= 3:
+                    # Asegurarse de que hay un valor por canal además del onset
+                    if len(valores) > n_canales:
                         try:
                             # Convertir los valores a enteros
-                            ch1 = int(valores[1])
-                            ch2 = int(valores[2])
-                            ch3 = int(valores[3])
-
-                            # Registrar los valores en el buffer
-                            buffer_ch1[i] = ch1
-                            buffer_ch2[i] = ch2
-                            buffer_ch3[i] = ch3
-
-                            # Lógica para detectar gestos
-                            # Se ejecuta cada vez que reciben la cantidad de datos configurada en BUFFER_SIZE
-                            if i == BUFFER_SIZE-1:
-                                promedio_ch1 = centrar_y_promediar(buffer_ch1)
-                                promedio_ch2 = centrar_y_promediar(buffer_ch2)
-                                promedio_ch3 = centrar_y_promediar(buffer_ch3)
-
-                                # Descomentar esta línea para ver los promedios
-                                #print(f"Promedios:\tCH1: {promedio_ch1},\tCH2: {promedio_ch2},\tCH3: {promedio_ch3}")
-                                if promedio_ch1 > umbral_ch1:
-                                    gesto_actual = "Arriba"
-                                #elif promedio_ch2 > umbral_ch2:
-                                    #gesto_actual = "Mano abierta"
-                                elif promedio_ch3 > umbral_ch3:
-                                    gesto_actual = "Abajo"
-                                else:
-                                    gesto_actual = "Reposo"
-                                i = 0
-
-                            # Solo imprimir el gesto si se ha cambiado
-                            if gesto_actual != ultimo_gesto:
-                                print(gesto_actual)
-                                ultimo_gesto = gesto_actual
-                            i += 1
+                            muestra = [int(valor) for valor 
+                                       in valores[1:n_canales + 1]]
+
+                            # La máquina de estados decide cada 'salto' 
+                            # muestras y avisa solo si cambió el gesto
+                            maquina.agregar(muestra)
 
                         except ValueError:
                             print(f"Error al convertir los datos a enteros: {data}")
@@ -99,7 +102,11 @@ try:
                     # Ignorar errores en la decodificación
                     pass
 
-except serial.SerialException as e:
-    print(f"Error al acceder al puerto serial: {e}")
-except KeyboardInterrupt:
-    print("\nLectura interrumpida. Saliendo...")
\ No newline at end of file
+
+if __name__ == '__main__':
+    try:
+        detectar()
+    except serial.SerialException as e:
+        print(f"Error al acceder al puerto serial: {e}")
+    except KeyboardInterrupt:
+        print("\nLectura interrumpida. Saliendo...")
@@ -0,0 +1,414 @@
+''' Máquina de estados de la detección
+
+Decide el gesto en ejecución a partir de ventanas cortas de la señal, sin el
+parpadeo que produce decidir con una sola ventana:
+
+    - Ventanas de 'ventana' muestras evaluadas cada 'salto' muestras. La
+      actividad de cada canal es el promedio del valor absoluto de la señal
+      centrada, igual que en la detección anterior
+    - Histéresis: un canal se activa sobre su umbral y se desactiva recién
+      bajo 'histeresis' * umbral
+    - Votación: el gesto candidato de cada salto entra a una votación de los
+      últimos 'votos' saltos y solo cambia si tiene mayoría
+    - Permanencia: un gesto dura al menos 'permanencia' segundos antes de
+      cambiar a otro
+    - Prioridad: con varios canales activos gana el de mayor actividad
+      respecto a su umbral ('relativa') o el primero de 'gestos' ('orden',
+      como el if/elif anterior, donde CH1 siempre ganaba). En 'relativa' el
+      gesto actual se mantiene mientras su canal siga activo, salvo que otro
+      lo supere 'ventaja' veces, para no alternar entre dos canales que se
+      activan juntos
+
+Cada cambio de gesto se entrega como un 'Evento' con su instante a una
+función o a una cola (queue.Queue, asyncio.Queue, ...). La misma máquina se
+puede alimentar con gestos guardados ('reproducir') y comparar con el onset
+registrado para medir la latencia y las transiciones falsas
+('metricas_reproduccion').
+
+Ejemplo
+-------
+    eventos = queue.Queue()
+    maquina = MaquinaGestos(ConfigDeteccion(ventana=40, salto=10), eventos)
+    for muestra in muestras:            # (CH1, CH2, CH3) del ADC
+        maquina.agregar(muestra)
+    evento = eventos.get()              # Evento(tiempo, muestra, gesto, ...)
+
+Bastián Rivas
+'''
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Nombre del estado sin gesto
+REPOSO = "Reposo"
+
+# Reglas de prioridad entre canales activos
+PRIORIDADES = ('relativa', 'orden')
+
+
+#%% Configuración y eventos
+@dataclass(frozen=True)
+class ConfigDeteccion:
+    """
+    Parámetros de la máquina de estados.
+
+    Attributes
+    ----------
+        umbrales (tuple): Umbral de activación de cada canal (CH1, CH2, ...),
+                          en unidades del ADC
+        gestos (tuple): Pares (canal, gesto) de los canales que indican un
+                        gesto, en orden de prioridad
+        fs (int): Frecuencia de muestreo en Hertz
+        ventana (int): Muestras de cada ventana
+        salto (int): Muestras entre una decisión y la siguiente
+        histeresis (float): Fracción del umbral bajo la cual un canal activo
+                            se desactiva. 1.0 para no usar histéresis
+        votos (int): Saltos de la votación por mayoría. 1 para no votar
+        permanencia (float): Segundos mínimos en un gesto antes de cambiar
+        prioridad (str): 'relativa' u 'orden' (ver PRIORIDADES)
+        ventaja (float): Veces que otro canal debe superar al del gesto
+                         actual (respecto a sus umbrales) para reemplazarlo,
+                         con prioridad 'relativa'
+    """
+    umbrales: tuple = (15, 26, 25)
+    gestos: tuple = ((1, "Arriba"), (3, "Abajo"))
+    fs: int = 1000
+    ventana: int = 40
+    salto: int = 10
+    histeresis: float = 0.7
+    votos: int = 3
+    permanencia: float = 0.15
+    prioridad: str = 'relativa'
+    ventaja: float = 1.5
+
+    def __post_init__(self):
+        if not 0 < self.salto <= self.ventana:
+            raise ValueError(f"El salto ({self.salto}) debe estar entre 1 y "
+                             f"la ventana ({self.ventana})")
+        if not 0 < self.histeresis <= 1:
+            raise ValueError(f"La histéresis ({self.histeresis}) debe estar "
+                             f"entre 0 y 1")
+        if self.ventaja < 1:
+            raise ValueError(f"La ventaja ({self.ventaja}) debe ser al "
+                             f"menos 1")
+        if self.votos < 1:
+            raise ValueError("Se necesita al menos un voto")
+        if self.prioridad not in PRIORIDADES:
+            raise ValueError(f"Prioridad desconocida: '{self.prioridad}'. "
+                             f"Opciones: {', '.join(PRIORIDADES)}")
+        for canal, _ in self.gestos:
+            if not 1 <= canal <= len(self.umbrales):
+                raise ValueError(f"El canal {canal} no tiene umbral")
+
+    @classmethod
+    def legado(cls, umbrales=(15, 26, 25), tamano_buffer=100, fs=1000):
+        """
+        Configuración equivalente a la detección anterior: ventanas sin
+        traslape de 'tamano_buffer' muestras, sin histéresis, votación ni
+        permanencia, y CH1 por sobre CH3.
+        """
+        return cls(umbrales=tuple(umbrales), fs=fs, ventana=tamano_buffer,
+                   salto=tamano_buffer, histeresis=1.0, votos=1,
+                   permanencia=0.0, prioridad='orden')
+
+    @property
+    def latencia_minima(self):
+        """Segundos mínimos entre el inicio de un gesto y su evento"""
+        return (self.ventana + (self.votos // 2) * self.salto) / self.fs
+
+
+@dataclass(frozen=True)
+class Evento:
+    """
+    Cambio de gesto detectado.
+
+    Attributes
+    ----------
+        tiempo (float): Instante del cambio, del reloj de la máquina o en
+                        segundos desde la primera muestra si no tiene reloj
+        muestra (int): Número de muestras recibidas al detectar el cambio
+        gesto (str): Gesto nuevo
+        anterior (str): Gesto anterior. None en el primer evento
+        actividad (tuple): Actividad de cada canal en la ventana del cambio
+    """
+    tiempo: float
+    muestra: int
+    gesto: str
+    anterior: str
+    actividad: tuple
+
+
+def destino_eventos(salida):
+    """Función que entrega un evento a 'salida' (función o cola)"""
+    if salida is None:
+        return None
+    if hasattr(salida, 'put_nowait'):
+        return salida.put_nowait
+    if hasattr(salida, 'put'):
+        return salida.put
+    return salida
+
+
+#%% Máquina de estados
+class MaquinaGestos:
+    """
+    Detección de gestos por histéresis, votación, permanencia y prioridad.
+
+    Parameters
+    ----------
+        config (ConfigDeteccion): Parámetros. Por defecto, los de
+                                  ConfigDeteccion()
+        eventos (callable o cola): Destino de los eventos
+        reloj (callable): Reloj para el instante de los eventos. None para
+                          usar el número de muestra / fs (reproducciones)
+    """
+
+    def __init__(self, config=None, eventos=None, reloj=time.monotonic):
+        self.config = config if config is not None else ConfigDeteccion()
+        self._emitir = destino_eventos(eventos)
+        self.reloj = reloj
+        n_canales = len(self.config.umbrales)
+        self._umbrales = np.asarray(self.config.umbrales, dtype=float)
+        self._buffer = np.zeros((self.config.ventana, n_canales))
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Vuelve al estado inicial, sin gesto ni muestras"""
+        self.estado = None
+        self.n_muestras = 0
+        self._inicio_estado = 0
+        self._activos = np.zeros(len(self._umbrales), dtype=bool)
+        self._votos = deque(maxlen=self.config.votos)
+        self._buffer[:] = 0
+
+    #%% Entrada de muestras
+    def agregar(self, muestra):
+        """
+        Agrega una muestra (un valor por canal) y decide si corresponde.
+
+        Return
+        ------
+            Evento: Si cambió el gesto, o None
+        """
+        ventana = self.config.ventana
+        self._buffer[self.n_muestras % ventana] = muestra
+        self.n_muestras += 1
+        if (self.n_muestras >= ventana
+                and (self.n_muestras - ventana) % self.config.salto == 0):
+            return self._decidir(self._buffer)
+        return None
+
+    def agregar_bloque(self, datos):
+        """
+        Agrega varias muestras de (n_muestras, canales) de una vez, con las
+        ventanas como vistas del arreglo en lugar de copiar muestra a muestra.
+
+        Return
+        ------
+            list: Eventos generados, en orden
+        """
+        datos = np.asarray(datos, dtype=float)
+        ventana, salto = self.config.ventana, self.config.salto
+        # Completar con el final del buffer las ventanas que empiezan antes
+        # del bloque
+        previas = min(self.n_muestras, ventana - 1)
+        if previas:
+            orden = (np.arange(self.n_muestras - previas, self.n_muestras)
+                     % ventana)
+            datos = np.concatenate([self._buffer[orden], datos])
+        inicio_muestras = self.n_muestras - previas
+
+        eventos = []
+        if len(datos) >= ventana:
+            vistas = np.lib.stride_tricks.sliding_window_view(
+                datos, ventana, axis=0)
+            # La ventana k termina en la muestra inicio_muestras + k +
+            # ventana, y se decide si inicio_muestras + k es múltiplo del
+            # salto (igual que en 'agregar')
+            for k in range(-inicio_muestras % salto, len(vistas), salto):
+                self.n_muestras = inicio_muestras + k + ventana
+                evento = self._decidir(vistas[k].T)
+                if evento is not None:
+                    eventos.append(evento)
+
+        # Dejar el buffer como si las muestras hubieran llegado una a una
+        self.n_muestras = inicio_muestras + len(datos)
+        ultimas = datos[-ventana:]
+        self._buffer[np.arange(self.n_muestras - len(ultimas),
+                               self.n_muestras) % ventana] = ultimas
+        return eventos
+
+    #%% Decisión
+    def actividad(self, ventana):
+        """Promedio del valor absoluto de la señal centrada, por canal"""
+        return np.abs(ventana - ventana.mean(axis=0)).mean(axis=0)
+
+    def _candidato(self, actividad):
+        """Gesto de los canales activos según la regla de prioridad"""
+        # Histéresis: los canales activos se mantienen hasta bajar del umbral
+        # reducido
+        umbral_salida = self._umbrales * self.config.histeresis
+        self._activos = np.where(self._activos, actividad > umbral_salida,
+                                 actividad > self._umbrales)
+        activos = [(canal, gesto) for canal, gesto in self.config.gestos
+                   if self._activos[canal - 1]]
+        if not activos:
+            return REPOSO
+        if self.config.prioridad == 'orden':
+            return activos[0][1]
+        relativa = {gesto: actividad[canal - 1] / self._umbrales[canal - 1]
+                    for canal, gesto in activos}
+        # max() se queda con el primero en caso de empate
+        mejor = max(relativa, key=relativa.get)
+        if (self.estado in relativa and relativa[mejor]
+                < self.config.ventaja * relativa[self.estado]):
+            return self.estado
+        return mejor
+
+    def _decidir(self, ventana):
+        actividad = self.actividad(ventana)
+        self._votos.append(self._candidato(actividad))
+
+        # Votación: el candidato con más de la mitad de los votos
+        gesto = max(set(self._votos), key=self._votos.count)
+        if self._votos.count(gesto) * 2 <= self.config.votos:
+            return None
+        if gesto == self.estado:
+            return None
+        # Permanencia mínima en el gesto actual
+        permanencia = (self.n_muestras - self._inicio_estado) / self.config.fs
+        if self.estado is not None and permanencia < self.config.permanencia:
+            return None
+
+        evento = Evento(
+            tiempo=(self.reloj() if self.reloj is not None
+                    else self.n_muestras / self.config.fs),
+            muestra=self.n_muestras, gesto=gesto, anterior=self.estado,
+            actividad=tuple(float(valor) for valor in actividad))
+        self.estado = gesto
+        self._inicio_estado = self.n_muestras
+        if self._emitir is not None:
+            self._emitir(evento)
+        return evento
+
+
+#%% Reproducción y métricas
+def reproducir(datos, config=None, eventos=None):
+    """
+    Pasa un gesto guardado por la máquina de estados, como si llegara por el
+    puerto serial.
+
+    Parameters
+    ----------
+        datos (np.array): Señal de (n_muestras, canales), en unidades del ADC
+        config (ConfigDeteccion): Parámetros de la detección
+        eventos (callable o cola): Destino adicional de los eventos
+
+    Return
+    ------
+        list: Eventos, con 'tiempo' en segundos desde la primera muestra
+    """
+    maquina = MaquinaGestos(config, eventos, reloj=None)
+    return maquina.agregar_bloque(datos)
+
+
+def metricas_reproduccion(eventos, onset, fs=1000, tolerancia=0.5):
+    """
+    Compara los eventos de una reproducción con el onset registrado.
+
+    Cada inicio de onset se empareja con el primer evento hacia un gesto que
+    ocurra entre ese inicio y el fin del onset más 'tolerancia' segundos, y
+    cada fin de onset con el primer evento hacia 'Reposo' antes del inicio
+    siguiente. Los eventos sin pareja son transiciones falsas. El primer
+    evento (desde None) no se cuenta.
+
+    Parameters
+    ----------
+        eventos (list): Eventos de 'reproducir'
+        onset (array_like): Onset registrado, 0 o 1 por muestra
+        fs (float): Frecuencia de muestreo en Hertz
+        tolerancia (float): Segundos después del flanco en que todavía se
+                            acepta un evento
+
+    Return
+    ------
+        dict: 'flancos', 'detectados', 'latencia_inicio' y 'latencia_fin'
+              (listas en segundos), 'falsas', 'falsas_por_min' y
+              'duracion' en segundos
+    """
+    onset = np.asarray(onset, dtype=np.int8)
+    cambios = np.flatnonzero(np.diff(onset)) + 1
+    subidas = [int(k) for k in cambios if onset[k] == 1]
+    bajadas = [int(k) for k in cambios if onset[k] == 0]
+    margen = int(round(tolerancia * fs))
+    fin = len(onset)
+
+    transiciones = [evento for evento in eventos if evento.anterior is not None]
+    usados = set()
+
+    def emparejar(flanco, limite, hacia_reposo):
+        for i, evento in enumerate(transiciones):
+            if i in usados or evento.muestra < flanco:
+                continue
+            if evento.muestra > limite:
+                return None
+            if (evento.gesto == REPOSO) == hacia_reposo:
+                usados.add(i)
+                return (evento.muestra - flanco) / fs
+        return None
+
+    latencia_inicio, latencia_fin = [], []
+    for subida in subidas:
+        siguiente = min([b for b in bajadas if b > subida] + [fin])
+        latencia = emparejar(subida, min(siguiente + margen, fin), False)
+        if latencia is not None:
+            latencia_inicio.append(latencia)
+    for bajada in bajadas:
+        siguiente = min([s for s in subidas if s > bajada] + [fin])
+        latencia = emparejar(bajada, min(siguiente + margen, fin), True)
+        if latencia is not None:
+            latencia_fin.append(latencia)
+
+    falsas = len(transiciones) - len(usados)
+    return {
+        'flancos': len(subidas) + len(bajadas),
+        'detectados': len(latencia_inicio) + len(latencia_fin),
+        'latencia_inicio': latencia_inicio,
+        'latencia_fin': latencia_fin,
+        'falsas': falsas,
+        'falsas_por_min': falsas / (fin / fs / 60) if fin else 0.0,
+        'duracion': fin / fs,
+    }
+
+
+def resumir_metricas(metricas):
+    """
+    Junta las métricas de varios gestos.
+
+    Return
+    ------
+        dict: 'flancos', 'detectados', 'falsas', 'falsas_por_min', y mediana
+              y percentil 95 de las latencias en milisegundos
+    """
+    inicio = np.concatenate([m['latencia_inicio'] for m in metricas] + [[]])
+    fin = np.concatenate([m['latencia_fin'] for m in metricas] + [[]])
+    minutos = sum(m['duracion'] for m in metricas) / 60
+    falsas = sum(m['falsas'] for m in metricas)
+
+    def percentil(latencias, q):
+        return float(np.percentile(latencias, q)) * 1e3 if len(latencias) \
+            else float('nan')
+
+    return {
+        'flancos': sum(m['flancos'] for m in metricas),
+        'detectados': sum(m['detectados'] for m in metricas),
+        'falsas': falsas,
+        'falsas_por_min': falsas / minutos if minutos else 0.0,
+        'inicio_p50_ms': percentil(inicio, 50),
+        'inicio_p95_ms': percentil(inicio, 95),
+        'fin_p50_ms': percentil(fin, 50),
+        'fin_p95_ms': percentil(fin, 95),
+    }
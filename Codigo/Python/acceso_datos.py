@@ -0,0 +1,364 @@
+''' Acceso a datos
+
+Capa única para leer la base de datos desde los scripts, en lugar de que cada
+uno abra su propia conexión, escriba sus consultas y convierta las filas a
+listas y luego a arreglos.
+
+    - Se usa una sola conexión por proceso y base de datos ('conectar').
+    - Los métodos entregan arreglos de NumPy (o un 'RegistroEMG') y no filas.
+    - Los arreglos leídos quedan en un caché LRU de tamaño acotado, para que
+      en una sesión interactiva graficar dos veces el mismo gesto no vuelva a
+      consultar SQLite. Los arreglos del caché son de solo lectura; para
+      modificarlos hay que copiarlos.
+
+Ejemplo
+-------
+    bd = BaseDatos('Datos/datos_gestos_3ch.db')
+    bd.imprimir_gestos()
+    registro = bd.obtener_raw(5)                  # RegistroEMG en volts
+    envolvente, normalizada = bd.obtener_norm(5)  # Una sola consulta
+    cvm = bd.obtener_cvm(sesion_id=2, canal=1)
+    rms = bd.resumen_gestos(sesion_id=2, onset=1)  # Sin leer las muestras
+
+Bastián Rivas
+'''
+import sqlite3
+import threading
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# Gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG, detectar_canales, leer_muestras
+# Segmentos de onset precalculados
+from segmentos_onset import obtener_segmentos, tabla_segmentos
+# Registros CVM de cada canal
+from esquema_canales import (es_cvm_de_canal, columnas_raw, columnas_norm,
+                             columnas_existentes)
+# Tablas 'norm' guardadas solo con la envolvente
+from escala_cvm import guarda_normalizada, a_porcentaje
+# Estadísticas precalculadas de los datos brutos
+from estadisticas_raw import resumen_gestos
+# Eje de frecuencias de la FFT real
+from espectro_emg import frecuencias_fft
+
+
+#%% Conexión por proceso
+_conexiones = {}
+_candado = threading.Lock()
+
+
+def conectar(ruta_db='Datos/datos_gestos_3ch.db'):
+    """
+    Conexión compartida a una base de datos. Se abre una sola vez por proceso
+    (un proceso hijo abre la suya) y se reutiliza en las llamadas siguientes.
+    """
+    llave = (os.path.abspath(ruta_db), os.getpid())
+    with _candado:
+        if llave not in _conexiones:
+            _conexiones[llave] = sqlite3.connect(ruta_db,
+                                                 check_same_thread=False)
+        return _conexiones[llave]
+
+
+def _solo_lectura(valor):
+    """Marca como de solo lectura los arreglos que van al caché"""
+    if isinstance(valor, np.ndarray):
+        valor.flags.writeable = False
+    elif isinstance(valor, RegistroEMG):
+        for arreglo in (valor.datos, valor.onset, valor.segmentos):
+            if arreglo is not None:
+                arreglo.flags.writeable = False
+    elif isinstance(valor, tuple):
+        for elemento in valor:
+            _solo_lectura(elemento)
+    return valor
+
+
+#%% Acceso a datos
+class BaseDatos:
+    """
+    Acceso a las tablas de la base de datos de gestos.
+
+    Parameters
+    ----------
+        ruta_db (str): Ruta a la base de datos
+        reescalado (float): Factor para pasar los datos del ADC a volts
+        tamano_cache (int): Cantidad máxima de resultados en el caché
+        tabla_raw, tabla_norm, tabla_fft (str): Nombres de las tablas
+    """
+    def __init__(self, ruta_db='Datos/datos_gestos_3ch.db',
+                 reescalado=5.0/1023, tamano_cache=32, tabla_raw='raw',
+                 tabla_norm='norm', tabla_fft='fft'):
+        self.ruta_db = ruta_db
+        self.reescalado = reescalado
+        self.tamano_cache = tamano_cache
+        self.tabla_raw = tabla_raw
+        self.tabla_norm = tabla_norm
+        self.tabla_fft = tabla_fft
+        self._cache = OrderedDict()
+        self._candado = threading.Lock()
+
+    @classmethod
+    def desde_perfil(cls, perfil, tamano_cache=32):
+        """
+        Acceso a los resultados de un perfil de procesamiento: sus tablas
+        'norm' y 'fft' son las que llevan la huella del perfil.
+        """
+        return cls(perfil.ruta_db, perfil.reescalado, tamano_cache,
+                   perfil.tabla_raw, perfil.tabla('norm'), perfil.tabla('fft'))
+
+    @property
+    def conexion(self):
+        return conectar(self.ruta_db)
+
+    #%% Caché
+    def _cacheado(self, llave, calcular):
+        """Retorna el resultado guardado para 'llave' o lo calcula"""
+        with self._candado:
+            if llave in self._cache:
+                self._cache.move_to_end(llave)
+                return self._cache[llave]
+            valor = _solo_lectura(calcular())
+            self._cache[llave] = valor
+            if len(self._cache) > self.tamano_cache:
+                self._cache.popitem(last=False)
+            return valor
+
+    def limpiar_cache(self):
+        """Vacía el caché, por ejemplo después de registrar datos nuevos"""
+        with self._candado:
+            self._cache.clear()
+
+    #%% Gestos
+    def listar_gestos(self, tabla=None, sesion_id=None, nombre_gesto=None):
+        """
+        Gestos registrados en una tabla, sin repetir gesto_id.
+
+        Parameters
+        ----------
+            tabla (str): Tabla a consultar. Por defecto la de datos brutos
+            sesion_id (int): Filtrar por sesión
+            nombre_gesto (str): Filtrar por nombre, con comodines de LIKE
+
+        Return
+        ------
+            list: Tuplas (gesto_id, fecha, sesion_id, nombre_gesto)
+        """
+        tabla = tabla or self.tabla_raw
+        condiciones, parametros = [], []
+        if sesion_id is not None:
+            condiciones.append("sesion_id = ?")
+            parametros.append(sesion_id)
+        if nombre_gesto is not None:
+            condiciones.append("nombre_gesto LIKE ?")
+            parametros.append(nombre_gesto)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        cursor = self.conexion.execute(f"""
+            SELECT gesto_id, MIN(fecha), sesion_id, nombre_gesto
+            FROM {tabla}
+            {donde}
+            GROUP BY gesto_id
+        """, parametros)
+        return cursor.fetchall()
+
+    def imprimir_gestos(self, tabla=None, **filtros):
+        """Imprime por consola la lista de gestos registrados"""
+        print("""--- Gestos registrados ---
+ID  \tFecha              \tSesión\tNombre del gesto
+----\t-------------------\t------\t----------------""")
+        for gesto_id, fecha, sesion_id, nombre_gesto in self.listar_gestos(
+                tabla, **filtros):
+            print(f"{gesto_id}\t{fecha}\t{sesion_id}\t{nombre_gesto}")
+
+    def ultimo_gesto(self, tabla=None):
+        """ID del gesto más nuevo, o None si la tabla está vacía"""
+        cursor = self.conexion.execute(
+            f"SELECT MAX(gesto_id) FROM {tabla or self.tabla_raw}")
+        return cursor.fetchone()[0]
+
+    def canales(self, tabla=None, columna='CH{}'):
+        """Números de canal disponibles en una tabla"""
+        return detectar_canales(self.conexion, tabla or self.tabla_raw,
+                                columna)
+
+    def resumen_gestos(self, sesion_id=None, onset=None):
+        """
+        Media, RMS, desviación, mínimo y máximo por canal de cada gesto, en
+        volts, desde la tabla de estadísticas y sin leer las muestras. Ver
+        'estadisticas_raw.resumen_gestos'.
+        """
+        return resumen_gestos(self.conexion, sesion_id, onset,
+                              self.reescalado, tabla_raw=self.tabla_raw)
+
+    #%% Señales
+    def obtener_raw(self, gesto_id, canales=None, activos=False):
+        """
+        Datos brutos de un gesto, reescalados a volts.
+
+        Parameters
+        ----------
+            gesto_id (int): ID del gesto
+            canales (list): Canales a leer. Por defecto todos
+            activos (bool): Entregar solo las muestras con onset = 1
+
+        Return
+        ------
+            RegistroEMG: Con 'datos' de (n_muestras, n_canales)
+        """
+        canales = tuple(canales) if canales else tuple(self.canales())
+        return self._cacheado(
+            ('raw', gesto_id, canales, activos),
+            lambda: self._leer_raw(gesto_id, list(canales), activos))
+
+    def _leer_raw(self, gesto_id, canales, activos):
+        registro = RegistroEMG.desde_db(self.conexion, gesto_id,
+                                        self.tabla_raw, canales,
+                                        self.reescalado,
+                                        tabla_raw=self.tabla_raw)
+        return registro.activos() if activos else registro
+
+    def obtener_norm(self, gesto_id, canales=None, activos=False):
+        """
+        Envolvente filtrada y señal normalizada de un gesto, leídas con una
+        sola consulta. Si la tabla se guardó solo con la envolvente, la señal
+        normalizada se calcula con la escala de la CVM de la sesión.
+
+        Return
+        ------
+            envolvente (RegistroEMG): Columnas chX_env_fil, en volts
+            normalizada (RegistroEMG): Columnas chX_norm, en % de la CVM
+        """
+        if not canales:
+            canales = self.canales(self.tabla_norm, 'ch{}_env_fil')
+        canales = tuple(canales)
+        return self._cacheado(
+            ('norm', gesto_id, canales, activos),
+            lambda: self._leer_norm(gesto_id, list(canales), activos))
+
+    def _leer_norm(self, gesto_id, canales, activos):
+        con_norm = guarda_normalizada(self.conexion, self.tabla_norm)
+        columnas = ", ".join(columnas_norm(canales, con_norm))
+        paso = 2 if con_norm else 1
+        cursor = self.conexion.cursor()
+        cursor.execute(f"""
+            SELECT fs, fecha, sesion_id, nombre_gesto
+            FROM {self.tabla_norm}
+            WHERE gesto_id = ?
+            LIMIT 1
+        """, (gesto_id,))
+        metadatos = cursor.fetchone()
+        if metadatos is None:
+            raise ValueError(f"No existe el gesto con ID {gesto_id} en la "
+                             f"tabla '{self.tabla_norm}'")
+        fs, fecha, sesion_id, nombre_gesto = metadatos
+        filas = leer_muestras(cursor, f"""
+            SELECT onset, {columnas}
+            FROM {self.tabla_norm}
+            WHERE gesto_id = ?
+            ORDER BY id
+        """, (gesto_id,), float)
+
+        envolvente = RegistroEMG(
+            datos=np.ascontiguousarray(filas[:, 1::paso]), fs=fs,
+            canales=list(canales), onset=filas[:, 0].astype(np.int8),
+            segmentos=obtener_segmentos(self.conexion, gesto_id,
+                                        tabla_segmentos(self.tabla_norm,
+                                                        self.tabla_raw),
+                                        tabla_raw=self.tabla_norm),
+            gesto_id=gesto_id, sesion_id=sesion_id,
+            nombre_gesto=nombre_gesto, fecha=fecha)
+        if con_norm:
+            normalizada = envolvente.con_datos(
+                np.ascontiguousarray(filas[:, 2::2]))
+        else:
+            normalizada = a_porcentaje(envolvente, self.conexion,
+                                       self.tabla_norm)
+        if activos:
+            return envolvente.activos(), normalizada.activos()
+        return envolvente, normalizada
+
+    def obtener_cvm(self, sesion_id, canal, tabla=None, mapa_cvm=None):
+        """
+        Señal de la CVM de un canal en una sesión, en volts (datos brutos) o
+        tal como está en la tabla (por ejemplo la envolvente de 'norm').
+
+        Parameters
+        ----------
+            sesion_id (int): ID de la sesión
+            canal (int): Número del canal
+            tabla (str): Tabla a leer. Por defecto la de datos brutos
+            mapa_cvm (dict): Registro CVM de cada canal, {canal: nombre_gesto}
+
+        Return
+        ------
+            np.array: Muestras de todos los registros CVM del canal, en orden
+        """
+        tabla = tabla or self.tabla_raw
+        llave_mapa = tuple(sorted((mapa_cvm or {}).items()))
+        return self._cacheado(
+            ('cvm', sesion_id, canal, tabla, llave_mapa),
+            lambda: self._leer_cvm(sesion_id, canal, tabla, mapa_cvm))
+
+    def _leer_cvm(self, sesion_id, canal, tabla, mapa_cvm):
+        es_raw = tabla == self.tabla_raw
+        columna = columnas_raw([canal])[0] if es_raw else f"ch{canal}_env_fil"
+        nombres = [fila[0] for fila in self.conexion.execute(
+            f"SELECT DISTINCT nombre_gesto FROM {tabla} WHERE sesion_id = ?",
+            (sesion_id,))]
+        registros = [n for n in nombres if es_cvm_de_canal(n, canal, mapa_cvm)]
+        cvm = leer_muestras(self.conexion.cursor(), f"""
+            SELECT {columna}
+            FROM {tabla}
+            WHERE sesion_id = ?
+            AND nombre_gesto IN ({', '.join('?' * len(registros))})
+            ORDER BY id
+        """, (sesion_id, *registros), np.int32 if es_raw else float)
+        return cvm.reshape(-1) * (self.reescalado if es_raw else 1.0)
+
+    def obtener_fft(self, gesto_id, canales=None):
+        """
+        FFT en dB registrada en la tabla de FFT.
+
+        Return
+        ------
+            frecuencias (np.array): Eje de frecuencias en Hertz
+            magnitud (np.array): Magnitud en dB, de (n_frecuencias, n_canales)
+            nombre_gesto (str): Nombre del gesto
+        """
+        if not canales:
+            canales = self.canales(self.tabla_fft, 'ch{}_fft')
+        canales = tuple(canales)
+        return self._cacheado(('fft', gesto_id, canales),
+                              lambda: self._leer_fft(gesto_id, canales))
+
+    def _leer_fft(self, gesto_id, canales):
+        cursor = self.conexion.cursor()
+        # Las tablas de antes del motor de 'espectro_emg' no tienen n_fft
+        tiene_n_fft = 'n_fft' in columnas_existentes(cursor, self.tabla_fft)
+        cursor.execute(f"""
+            SELECT fs, nombre_gesto, {'n_fft' if tiene_n_fft else 'NULL'}
+            FROM {self.tabla_fft}
+            WHERE gesto_id = ?
+            LIMIT 1
+        """, (gesto_id,))
+        metadatos = cursor.fetchone()
+        if metadatos is None:
+            raise ValueError(f"No existe el gesto con ID {gesto_id} en la "
+                             f"tabla '{self.tabla_fft}'")
+        fs, nombre_gesto, n_fft = metadatos
+        cursor.execute(f"""
+            SELECT {', '.join(f'ch{c}_fft' for c in canales)}
+            FROM {self.tabla_fft}
+            WHERE gesto_id = ?
+            ORDER BY id
+        """, (gesto_id,))
+        magnitud = np.array(cursor.fetchall(), dtype=float)
+        if n_fft:
+            # FFT real: n_fft // 2 + 1 valores, separados por fs / n_fft
+            frecuencias = frecuencias_fft(n_fft, fs)
+        else:
+            # FFT anterior, lado derecho: N // 2 valores hasta fs / 2
+            frecuencias = np.arange(len(magnitud)) * fs / (2 * len(magnitud))
+        return frecuencias, magnitud, nombre_gesto
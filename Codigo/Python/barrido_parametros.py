@@ -0,0 +1,396 @@
+''' Barrido de parámetros
+Evalúa combinaciones de frecuencia de corte, orden del filtro y 'nperseg' de
+Welch sobre todos los gestos, sin editar constantes ni volver a correr todo el
+procesamiento, y guarda las métricas en una tabla para compararlas.
+
+    python barrido_parametros.py --grilla-fc 50 100 150 200 --grilla-forden 2 4
+
+Funcionamiento
+--------------
+    - Cada tarea es un gesto con todos los puntos de la grilla que le faltan,
+      y las tareas se reparten en un pool de procesos.
+    - Dentro de una tarea el gesto se lee y se rectifica una sola vez; la
+      rectificación no depende del filtro, así que para cada (fc, forden) solo
+      se aplica el pasabajos ('filtrar_envolvente'). La PSD de Welch no
+      depende del filtro y se calcula una vez por 'nperseg'.
+    - Cada proceso guarda los registros CVM y Reposo de las sesiones que ya
+      leyó (rectificados), y la referencia de cada (sesión, fc, forden).
+    - Cada punto de la grilla es un perfil de procesamiento
+      ('perfil_procesamiento.py') y los resultados se guardan con su huella.
+      Al repetir un barrido solo se calculan los puntos que faltan: si ya
+      están todos, no se lee ningún gesto.
+
+Las métricas son las mismas del procesamiento completo (el SNR coincide con
+el de la tabla 'fft' del perfil equivalente), así que el mejor punto se puede
+fijar luego como perfil.
+
+Estructura de la base de datos
+------------------------------
+Tabla 'barrido', una fila por gesto, canal y punto de la grilla:
+              huella: Huella del perfil del punto de la grilla
+            gesto_id: ID del gesto
+               canal: Número del canal
+           sesion_id: ID de la sesión
+        nombre_gesto: Nombre del gesto
+                  fc: Frecuencia de corte del pasabajos en Hertz
+              forden: Orden del pasabajos
+             nperseg: Muestras por segmento de Welch
+                 snr: SNR de la envolvente activa respecto al reposo, en dB
+          norm_media: Media de la envolvente activa, en % de la CVM
+    frecuencia_media: Frecuencia media de la PSD de los segmentos activos, Hz
+  frecuencia_mediana: Frecuencia mediana de la misma PSD, en Hertz
+               fecha: Fecha del cálculo, YYYY-MM-DD HH:MM:SS
+
+Bastián Rivas
+'''
+import sqlite3
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+from scipy.signal import welch
+
+# Perfil de procesamiento de cada punto de la grilla
+from perfil_procesamiento import (agregar_argumentos,
+                                  perfil_desde_argumentos, registrar_perfil)
+# Conexión por proceso
+from acceso_datos import conectar
+from registro_emg import RegistroEMG
+from segmentos_onset import obtener_segmentos
+# Rectificación una vez y pasabajos por cada punto de la grilla
+from kernels_emg import rectificar, filtrar_envolvente
+from referencia_sesion import (leer_registros_referencia,
+                               referencia_desde_registros)
+
+
+# Parámetros que se pueden barrer
+PARAMETROS_BARRIDO = ('fc', 'forden', 'nperseg')
+
+# Sesiones guardadas por proceso
+MAX_SESIONES = 8
+
+
+#%% Tabla de resultados
+def crear_tabla_barrido(cursor, tabla='barrido'):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        huella TEXT,
+        gesto_id INTEGER,
+        canal INTEGER,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        fc REAL,
+        forden INTEGER,
+        nperseg INTEGER,
+        snr REAL,
+        norm_media REAL,
+        frecuencia_media REAL,
+        frecuencia_mediana REAL,
+        fecha TEXT,
+        PRIMARY KEY (huella, gesto_id, canal)
+    );
+    """)
+
+
+def expandir_grilla(perfil, grilla):
+    """
+    Perfiles de todas las combinaciones de la grilla.
+
+    Parameters
+    ----------
+        perfil (Perfil): Perfil con los parámetros que no se barren
+        grilla (dict): Valores de cada parámetro, por ejemplo
+                       {'fc': [100, 150], 'forden': [2, 4]}. Los que no estén
+                       quedan con el valor del perfil
+
+    Return
+    ------
+        list: Un Perfil por punto de la grilla
+    """
+    desconocidos = set(grilla) - set(PARAMETROS_BARRIDO)
+    if desconocidos:
+        raise ValueError(f"No se pueden barrer: {', '.join(desconocidos)}. "
+                         f"Parámetros válidos: {PARAMETROS_BARRIDO}")
+    valores = [grilla.get(p) or [getattr(perfil, p)]
+               for p in PARAMETROS_BARRIDO]
+    return [perfil.con_cambios(**dict(zip(PARAMETROS_BARRIDO, punto)))
+            for punto in itertools.product(*valores)]
+
+
+#%% Cálculo (en los procesos del pool)
+_registros_sesion = {}
+_referencias = {}
+
+
+def _registros_referencia(conexion, perfil, sesion_id, canales):
+    """Registros CVM y Reposo rectificados de una sesión, leídos una vez"""
+    llave = (perfil.ruta_db, perfil.tabla_raw, perfil.reescalado, sesion_id,
+             tuple(canales), tuple(sorted(perfil.mapa_cvm.items())), perfil.fs)
+    if llave not in _registros_sesion:
+        if len(_registros_sesion) >= MAX_SESIONES:
+            _registros_sesion.clear()
+            _referencias.clear()
+        _registros_sesion[llave] = leer_registros_referencia(
+            conexion, sesion_id, perfil.tabla_raw, perfil.reescalado,
+            canales, perfil.mapa_cvm, perfil.fs)
+    return llave, _registros_sesion[llave]
+
+
+def _referencia(llave, registros, fs, fc, forden):
+    """Referencia de la sesión para un filtro, calculada una vez por proceso"""
+    if (llave, fc, forden) not in _referencias:
+        _referencias[llave, fc, forden] = referencia_desde_registros(
+            registros, fs, fc, forden, nperseg=None)
+    return _referencias[llave, fc, forden]
+
+
+def frecuencias_psd(frecuencias, psd):
+    """
+    Frecuencia media y mediana de una PSD de (n_frecuencias, canales)
+
+    Return
+    ------
+        media (np.array), mediana (np.array): Un valor por canal, en Hertz
+    """
+    total = psd.sum(axis=0)
+    media = (frecuencias[:, None] * psd).sum(axis=0) / total
+    acumulada = np.cumsum(psd, axis=0)
+    indices = np.argmax(acumulada >= total / 2, axis=0)
+    return media, frecuencias[indices]
+
+
+def evaluar_gesto(gesto_id, perfiles):
+    """
+    Calcula las métricas de un gesto en varios puntos de la grilla. Todos los
+    perfiles deben compartir la base de datos, la tabla y el reescalado.
+
+    Return
+    ------
+        list: Filas para la tabla de resultados
+    """
+    base = perfiles[0]
+    conexion = conectar(base.ruta_db)
+    registro = RegistroEMG.desde_db(conexion, gesto_id, base.tabla_raw,
+                                    reescalado=base.reescalado,
+                                    tabla_raw=base.tabla_raw
+                                    ).remuestrear(base.fs)
+    fs = registro.fs
+    canales = registro.canales
+    llave, registros = _registros_referencia(conexion, base,
+                                             registro.sesion_id, canales)
+
+    # Intermedios compartidos por todos los puntos de la grilla
+    rectificada = rectificar(registro.datos)
+    activos = registro.activos().datos
+    activos = activos - activos.mean(axis=0) if len(activos) else activos
+    envolventes = {}
+    psds = {}
+
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    filas = []
+    for perfil in perfiles:
+        fc, forden, nperseg = perfil.fc, perfil.forden, perfil.nperseg
+        if (fc, forden) not in envolventes:
+            envolvente = filtrar_envolvente(rectificada, fs, fc, forden)
+            envolventes[fc, forden] = registro.con_datos(envolvente) \
+                                              .activos().datos
+        envolvente = envolventes[fc, forden]
+        referencia = _referencia(llave, registros, fs, fc, forden)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rms = np.sqrt(np.mean(np.square(envolvente), axis=0))
+            snr = 20 * np.log10(rms / referencia['rms_reposo'])
+            norm_media = np.mean(envolvente / referencia['cvm_max'] * 100,
+                                 axis=0)
+            if nperseg not in psds:
+                if len(activos) > 1:
+                    psds[nperseg] = frecuencias_psd(*welch(
+                        activos, fs, nperseg=min(nperseg, len(activos)),
+                        axis=0))
+                else:
+                    psds[nperseg] = (np.full(len(canales), np.nan),) * 2
+        frecuencia_media, frecuencia_mediana = psds[nperseg]
+
+        for i, canal in enumerate(canales):
+            filas.append((perfil.huella, gesto_id, canal, registro.sesion_id,
+                          registro.nombre_gesto, fc, forden, nperseg,
+                          float(snr[i]), float(norm_media[i]),
+                          float(frecuencia_media[i]),
+                          float(frecuencia_mediana[i]), fecha))
+    return filas
+
+
+def _evaluar_tarea(tarea):
+    """Punto de entrada de los procesos del pool"""
+    gesto_id, perfiles = tarea
+    return gesto_id, evaluar_gesto(gesto_id, perfiles)
+
+
+#%% Barrido
+def puntos_pendientes(conexion, gestos, perfiles, tabla='barrido'):
+    """
+    Puntos de la grilla que faltan por gesto.
+
+    Return
+    ------
+        dict: {gesto_id: [perfiles sin resultados]}, solo los gestos con
+              puntos pendientes
+    """
+    cursor = conexion.cursor()
+    crear_tabla_barrido(cursor, tabla)
+    huellas = [perfil.huella for perfil in perfiles]
+    cursor.execute(f"""
+        SELECT DISTINCT gesto_id, huella FROM {tabla}
+        WHERE huella IN ({', '.join('?' * len(huellas))})
+    """, huellas)
+    hechos = set(cursor.fetchall())
+    pendientes = {}
+    for gesto_id in gestos:
+        faltan = [p for p in perfiles if (gesto_id, p.huella) not in hechos]
+        if faltan:
+            pendientes[gesto_id] = faltan
+    return pendientes
+
+
+def barrer(perfil, grilla, gestos=None, sesion_id=None, procesos=None,
+           tabla='barrido'):
+    """
+    Evalúa todos los puntos de la grilla en los gestos pedidos, calculando
+    solo los que no están en la tabla de resultados.
+
+    Parameters
+    ----------
+        perfil (Perfil): Perfil base (base de datos, reescalado, mapa_cvm...)
+        grilla (dict): Valores a barrer de 'fc', 'forden' y/o 'nperseg'
+        gestos (list): IDs de los gestos. Por defecto todos los que no son
+                       CVM ni Reposo (de la sesión 'sesion_id', si se indica)
+        procesos (int): Procesos del pool. Por defecto uno por núcleo; con 1
+                        se calcula en este mismo proceso
+
+    Return
+    ------
+        int: Cantidad de tareas (gestos) calculadas
+    """
+    perfiles = expandir_grilla(perfil, grilla)
+    conexion = sqlite3.connect(perfil.ruta_db)
+    if gestos is None:
+        cursor = conexion.execute(f"""
+            SELECT DISTINCT gesto_id FROM {perfil.tabla_raw}
+            WHERE nombre_gesto NOT LIKE '%CVM%'
+            AND nombre_gesto NOT LIKE '%Reposo%'
+            {'AND sesion_id = ?' if sesion_id is not None else ''}
+            ORDER BY sesion_id, gesto_id
+        """, () if sesion_id is None else (sesion_id,))
+        gestos = [fila[0] for fila in cursor.fetchall()]
+
+    pendientes = puntos_pendientes(conexion, gestos, perfiles, tabla)
+    if not pendientes:
+        conexion.close()
+        return 0
+
+    # Los segmentos de onset faltantes se registran antes de repartir, para
+    # que los procesos del pool solo lean la base de datos
+    for gesto_id in pendientes:
+        obtener_segmentos(conexion, gesto_id, tabla_raw=perfil.tabla_raw)
+
+    tareas = list(pendientes.items())
+    cursor = conexion.cursor()
+    consulta = f"""INSERT OR REPLACE INTO {tabla}
+                   VALUES ({', '.join('?' * 13)})"""
+
+    def guardar(n, gesto_id, filas):
+        cursor.executemany(consulta, filas)
+        conexion.commit()
+        print(f"[{n}/{len(tareas)}] Gesto {gesto_id}: "
+              f"{len(pendientes[gesto_id])} puntos")
+
+    if procesos == 1:
+        for n, tarea in enumerate(tareas, 1):
+            guardar(n, *_evaluar_tarea(tarea))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = [pool.submit(_evaluar_tarea, tarea) for tarea in tareas]
+            for n, futuro in enumerate(as_completed(futuros), 1):
+                guardar(n, *futuro.result())
+
+    for punto in perfiles:
+        registrar_perfil(conexion, punto)
+    conexion.close()
+    return len(tareas)
+
+
+def resumen_barrido(conexion, parametros=('fc', 'forden'), metrica='snr',
+                    sesion_id=None, canal=None, tabla='barrido'):
+    """
+    Promedio de una métrica sobre los gestos para cada combinación de
+    parámetros, para comparar puntos de la grilla.
+
+    Return
+    ------
+        list: (valores de los parámetros..., promedio, desviación, n_gestos)
+    """
+    condiciones, valores = [], []
+    if sesion_id is not None:
+        condiciones.append("sesion_id = ?")
+        valores.append(sesion_id)
+    if canal is not None:
+        condiciones.append("canal = ?")
+        valores.append(canal)
+    donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    columnas = ", ".join(parametros)
+    cursor = conexion.execute(f"""
+        SELECT {columnas}, AVG({metrica}),
+               AVG({metrica} * {metrica}) - AVG({metrica}) * AVG({metrica}),
+               COUNT(DISTINCT gesto_id)
+        FROM {tabla}
+        {donde}
+        GROUP BY {columnas}
+        ORDER BY {columnas}
+    """, valores)
+    return [(*fila[:-3], fila[-3], np.sqrt(max(fila[-2] or 0, 0)), fila[-1])
+            for fila in cursor.fetchall()]
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Barrer la grilla pedida y mostrar el SNR promedio de cada filtro y la
+    frecuencia mediana de cada 'nperseg'
+    '''
+    parser = agregar_argumentos(argparse.ArgumentParser(
+        description="Barrido de parámetros de filtrado y de Welch"))
+    parser.add_argument('--grilla-fc', nargs='+', type=float, default=[],
+                        help="frecuencias de corte a evaluar [Hz]")
+    parser.add_argument('--grilla-forden', nargs='+', type=int, default=[],
+                        help="órdenes del pasabajos a evaluar")
+    parser.add_argument('--grilla-nperseg', nargs='+', type=int, default=[],
+                        help="muestras por segmento de Welch a evaluar")
+    parser.add_argument('--sesion', type=int, help="solo una sesión")
+    parser.add_argument('--procesos', type=int,
+                        help="procesos del pool (por defecto, uno por núcleo)")
+    args = parser.parse_args()
+    perfil = perfil_desde_argumentos(args)
+    grilla = {'fc': args.grilla_fc, 'forden': args.grilla_forden,
+              'nperseg': args.grilla_nperseg}
+    print(f"Usando base de datos en: {os.path.abspath(perfil.ruta_db)}")
+
+    inicio = time.perf_counter()
+    n_tareas = barrer(perfil, grilla, sesion_id=args.sesion,
+                      procesos=args.procesos)
+    print(f"{n_tareas} gestos calculados en "
+          f"{time.perf_counter() - inicio:.2f} s")
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    print("\nfc [Hz]\tOrden\tSNR [dB]\t\tGestos")
+    for fc, forden, media, desviacion, n in resumen_barrido(
+            conexion, ('fc', 'forden'), 'snr', args.sesion):
+        print(f"{fc:g}\t{forden}\t{media:.2f} ± {desviacion:.2f}\t\t{n}")
+    print("\nnperseg\tFrecuencia mediana [Hz]")
+    for nperseg, media, desviacion, n in resumen_barrido(
+            conexion, ('nperseg',), 'frecuencia_mediana', args.sesion):
+        print(f"{nperseg}\t{media:.1f} ± {desviacion:.1f}")
+    conexion.close()
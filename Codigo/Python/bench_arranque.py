@@ -0,0 +1,120 @@
+''' Benchmark de arranque
+
+Script para medir cuánto tardan en arrancar los scripts y 'emg_cli.py'.
+scipy.signal, scipy.fftpack, matplotlib.pyplot y Numba se importan recién en
+las funciones que los usan, así que listar gestos o capturar no los cargan.
+
+Cada prueba se ejecuta en un proceso nuevo (el arranque real, sin módulos ya
+importados) y se informa el mejor tiempo de varias repeticiones. Como
+referencia de la carga anticipada de antes, cada módulo se mide también
+importando primero todos los módulos pesados (el peor caso: no todos los
+scripts los importaban todos).
+
+Uso
+---
+    python bench_arranque.py [repeticiones] [ruta_db]
+
+Para ver el detalle de un módulo, módulo por módulo:
+
+    python -X importtime -c "import emg_cli" 2> importtime.txt
+
+Bastián Rivas
+'''
+import os
+import subprocess
+import sys
+import time
+
+# Módulos que antes se importaban al inicio y ahora solo cuando se usan
+PESADOS = ('scipy.signal', 'scipy.fftpack', 'matplotlib.pyplot', 'numba')
+
+# Puntos de entrada a medir
+MODULOS = ('emg_cli', 'acceso_datos', 'lectura_3ch_rawEMG',
+           'emg_cvm_norm_sql', 'generar_tabla_fft_gestos')
+
+_CODIGO = '''
+import sys
+{previo}
+import {modulo}
+print(','.join(m for m in {pesados!r} if m in sys.modules))
+'''
+
+
+#%% Mediciones
+def medir_proceso(comando, repeticiones=5):
+    """
+    Ejecuta 'comando' en un proceso nuevo, en la carpeta de este script.
+
+    Return
+    ------
+        float: Mejor tiempo en milisegundos, o None si el comando falló
+        str: Salida estándar de la última ejecución
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = subprocess.run(comando, cwd=directorio,
+                                   capture_output=True, text=True)
+        tiempos.append(time.perf_counter() - inicio)
+        if resultado.returncode not in (0, 1):
+            error = resultado.stderr.strip().splitlines() or ['']
+            return None, error[-1]
+    return min(tiempos) * 1e3, resultado.stdout.strip()
+
+
+def medir_importacion(modulo, anticipada=False, repeticiones=5):
+    """
+    Tiempo de arranque de un proceso que solo importa 'modulo'.
+
+    Parameters
+    ----------
+        modulo (str): Módulo a importar
+        anticipada (bool): Importar antes los módulos de 'PESADOS', como con
+                           las importaciones al inicio del archivo
+        repeticiones (int): Procesos a lanzar; se usa el más rápido
+
+    Return
+    ------
+        float: Mejor tiempo en milisegundos, o None si no se pudo importar
+        str: Módulos pesados cargados al importar, separados por coma
+    """
+    previo = '\n'.join(f'import {m}' for m in PESADOS) if anticipada else ''
+    codigo = _CODIGO.format(previo=previo, modulo=modulo, pesados=PESADOS)
+    return medir_proceso([sys.executable, '-c', codigo], repeticiones)
+
+
+def ejecutar_benchmark(repeticiones=5, ruta_db='Datos/datos_gestos_3ch.db'):
+    """Mide todos los puntos de entrada e imprime la tabla por consola"""
+    # Los procesos corren en la carpeta de este script
+    ruta_db = os.path.abspath(ruta_db)
+    base, _ = medir_proceso([sys.executable, '-c', 'pass'], repeticiones)
+    print(f"Intérprete sin módulos: {base:.0f} ms")
+    print("Módulo                  \tAhora [ms]\tAnticipada [ms]\tx"
+          "\tCargados al importar")
+    for modulo in MODULOS:
+        t_ahora, cargados = medir_importacion(modulo, False, repeticiones)
+        if t_ahora is None:
+            print(f"{modulo:<24}\tno se pudo importar: {cargados}")
+            continue
+        t_antes, _ = medir_importacion(modulo, True, repeticiones)
+        print(f"{modulo:<24}\t{t_ahora:10.0f}\t{t_antes:15.0f}\t"
+              f"{t_antes / t_ahora:.1f}\t{cargados or '-'}")
+
+    # Comandos completos, con la lectura de la base de datos
+    print("\nComando                 \tTiempo [ms]")
+    comandos = [
+        ("emg_cli.py --help", ['emg_cli.py', '--help']),
+        ("emg_cli.py listar", ['emg_cli.py', 'listar', '--db', ruta_db]),
+    ]
+    for nombre, argumentos in comandos:
+        tiempo, _ = medir_proceso([sys.executable] + argumentos, repeticiones)
+        print(f"{nombre:<24}\t" + (f"{tiempo:11.0f}" if tiempo is not None
+                                   else "falló"))
+
+
+#%%
+if __name__ == '__main__':
+    ejecutar_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5,
+                       sys.argv[2] if len(sys.argv) > 2
+                       else 'Datos/datos_gestos_3ch.db')
@@ -0,0 +1,108 @@
+''' Benchmark de canales
+
+Script para medir cómo escala la captura y el procesamiento con la cantidad de
+canales. Para 3, 8 y 16 canales a 1 y 2 kHz mide:
+    - Lectura: convertir las líneas '<onset>,<CH1>,...,<CHN>' con
+      'parsear_linea', como en lectura_3ch_rawEMG.py
+    - SQLite: insertar las filas en la tabla 'raw' en lotes de 100, en una base
+      de datos en memoria
+    - Envolvente: rectificación + filtfilt y normalización por CVM de todos los
+      canales a la vez, como en 'normalizar_3ch_sql'
+    - FFT: magnitud de la FFT de todos los canales, como en 'calcular_fft_snr'
+
+Se muestran los tiempos en milisegundos, el tiempo por canal (que debería
+mantenerse casi constante si el procesamiento escala linealmente) y cuántas
+veces más rápido que el tiempo real es la lectura + inserción, que es lo que
+tiene que alcanzar a hacer la captura.
+
+Usa señales sintéticas, por lo que no necesita la base de datos ni la placa.
+
+Uso
+---
+    python bench_canales.py [segundos]
+
+Bastián Rivas
+'''
+import sys
+import sqlite3
+import timeit
+import numpy as np
+
+from esquema_canales import parsear_linea, crear_tabla_raw, columnas_raw
+from kernels_emg import calcular_envolvente
+from espectro_emg import magnitud_fft as magnitud_rfft
+
+
+def generar_lineas(n_muestras, n_canales, rng):
+    """Líneas como las envía la placa, con valores de un ADC de 10 bits"""
+    datos = np.clip(512 + rng.normal(0, 40, (n_muestras, n_canales)), 0, 1023)
+    onset = (np.arange(n_muestras) // 1000) % 2
+    filas = np.column_stack((onset, datos)).astype(int)
+    return [",".join(map(str, fila)) for fila in filas.tolist()]
+
+
+def leer_lineas(lineas, n_canales):
+    return [parsear_linea(linea, n_canales) for linea in lineas]
+
+
+def insertar_filas(filas, canales, fs):
+    conexion = sqlite3.connect(':memory:')
+    cursor = conexion.cursor()
+    crear_tabla_raw(cursor, 'raw', canales)
+    consulta = (f"""INSERT INTO raw (gesto_id, sesion_id, nombre_gesto, fecha,
+                    fs, onset, {', '.join(columnas_raw(canales))})
+                    VALUES ({', '.join(['?'] * (len(canales) + 6))})""")
+    fijos = (1, 1, 'Bench', '2025-01-01 00:00:00', fs)
+    for i in range(0, len(filas), 100):
+        cursor.executemany(consulta, [fijos + fila for fila in filas[i:i+100]])
+        conexion.commit()
+    conexion.close()
+
+
+def normalizar(datos, fs, cvm_max):
+    return calcular_envolvente(datos, fs, 150, 2) / cvm_max * 100
+
+
+def magnitud_fft(datos, fs):
+    return magnitud_rfft(datos, fs)[1]
+
+
+def medir(funcion, repeticiones=3):
+    """Retorna el mejor tiempo en milisegundos de 'repeticiones' llamadas"""
+    return min(timeit.repeat(funcion, number=1, repeat=repeticiones)) * 1e3
+
+
+#%%
+def ejecutar_benchmark(segundos=10.0):
+    """Mide todas las etapas e imprime la tabla de tiempos por consola"""
+    rng = np.random.default_rng(0)
+
+    print(f"{segundos:g} s de captura por prueba")
+    print("fs [Hz]\tCanales\tEtapa      \t[ms]\t\t[ms/canal]\tx tiempo real")
+    for fs in (1000, 2000):
+        n_muestras = int(segundos * fs)
+        for n_canales in (3, 8, 16):
+            canales = list(range(1, n_canales + 1))
+            lineas = generar_lineas(n_muestras, n_canales, rng)
+            filas = leer_lineas(lineas, n_canales)
+            datos = np.array(filas, dtype=float)[:, 1:] * 5.0 / 1023
+            cvm_max = datos.max(axis=0)
+
+            etapas = [
+                ("Lectura", lambda: leer_lineas(lineas, n_canales)),
+                ("SQLite", lambda: insertar_filas(filas, canales, fs)),
+                ("Envolvente", lambda: normalizar(datos, fs, cvm_max)),
+                ("FFT", lambda: magnitud_fft(datos, fs)),
+            ]
+            tiempos = {}
+            for nombre, funcion in etapas:
+                tiempos[nombre] = medir(funcion)
+                print(f"{fs}\t{n_canales}\t{nombre:<11}\t"
+                      f"{tiempos[nombre]:8.2f}\t{tiempos[nombre]/n_canales:8.3f}")
+            captura = tiempos["Lectura"] + tiempos["SQLite"]
+            print(f"{fs}\t{n_canales}\tCaptura    \t{captura:8.2f}\t"
+                  f"{captura/n_canales:8.3f}\t{segundos * 1e3 / captura:.1f}")
+
+
+if __name__ == '__main__':
+    ejecutar_benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0)
@@ -0,0 +1,86 @@
+''' Benchmark de la FFT
+
+Script para comparar la FFT anterior (scipy.fftpack.fft compleja, descartando
+las frecuencias negativas, como en 'calcular_fft_snr' y 'fft_datos_3ch.py')
+con el motor de 'espectro_emg.py' (scipy.fft.rfft):
+
+    - Por largo: un largo potencia de 2, uno compuesto cualquiera y largos
+      primos, que son el peor caso de la FFT y aparecen cuando los segmentos
+      de onset tienen un largo arbitrario
+    - Muchos gestos de largos al azar, uno por uno con la FFT anterior y con
+      'magnitud_fft'
+
+Usa señales sintéticas, por lo que no necesita la base de datos.
+
+Uso
+---
+    python bench_fft.py [n_canales] [n_gestos]
+
+Bastián Rivas
+'''
+import sys
+import timeit
+import numpy as np
+from scipy.fftpack import fft
+
+import espectro_emg as espectro
+
+
+# Largos a probar: 2^16, un largo compuesto y tres primos
+LARGOS = (65536, 60000, 10007, 60013, 100003)
+
+
+#%% FFT anterior
+def magnitud_anterior(datos):
+    """Lado derecho de la FFT como antes: FFT compleja completa y recorte"""
+    N = len(datos)
+    return 2.0 / N * np.abs(fft(datos, axis=0)[:N // 2])
+
+
+def medir(funcion, repeticiones=5):
+    """Retorna el mejor tiempo en milisegundos de 'repeticiones' llamadas"""
+    return min(timeit.repeat(funcion, number=1, repeat=repeticiones)) * 1e3
+
+
+#%% Benchmark
+def ejecutar_benchmark(n_canales=3, n_gestos=200):
+    """Mide todas las variantes e imprime las tablas de tiempos por consola"""
+    rng = np.random.default_rng(0)
+
+    print(f"FFT de un gesto con {n_canales} canales")
+    print("Largo \tPrimo\tn_fft \tAnterior [ms]\tExacto [ms]\tRápido [ms]"
+          "\tRápido, hilos [ms]\tx")
+    for largo in LARGOS:
+        datos = rng.normal(0, 1, (largo, n_canales))
+        primo = largo > 3 and all(largo % d for d in range(2, int(largo ** 0.5)
+                                                           + 1))
+        t_anterior = medir(lambda: magnitud_anterior(datos), repeticiones=3)
+        t_exacto = medir(lambda: espectro.magnitud_fft(datos, 1000, 'exacto'))
+        t_rapido = medir(lambda: espectro.magnitud_fft(datos, 1000, 'rapido'))
+        t_hilos = medir(lambda: espectro.magnitud_fft(datos, 1000, 'rapido',
+                                                      workers=-1))
+        n_fft = espectro.largo_fft(largo)
+        print(f"{largo:<6}\t{'sí' if primo else 'no':<5}\t{n_fft:<6}\t"
+              f"{t_anterior:13.2f}\t{t_exacto:11.2f}\t{t_rapido:11.2f}\t"
+              f"{t_hilos:18.2f}\t{t_anterior / t_rapido:.1f}")
+
+    # Gestos de 1 a 8 segundos a 1 kHz, con largos al azar
+    largos = rng.integers(1000, 8000, n_gestos)
+    senales = [rng.normal(0, 1, (largo, n_canales)) for largo in largos]
+    n_distintos = len({espectro.largo_fft(largo) for largo in largos})
+    t_anterior = medir(lambda: [magnitud_anterior(s) for s in senales],
+                       repeticiones=3)
+    t_uno = medir(lambda: [espectro.magnitud_fft(s, 1000) for s in senales],
+                  repeticiones=3)
+    print(f"\n{n_gestos} gestos de largos al azar ({len(set(largos))} largos "
+          f"distintos, {n_distintos} largos de FFT)")
+    print("Variante                \tTiempo [ms]\tx")
+    for nombre, tiempo in [("Anterior, uno por uno", t_anterior),
+                           ("rfft, uno por uno", t_uno)]:
+        print(f"{nombre:<24}\t{tiempo:11.2f}\t{t_anterior / tiempo:.1f}")
+
+
+#%%
+if __name__ == '__main__':
+    ejecutar_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 3,
+                       int(sys.argv[2]) if len(sys.argv) > 2 else 200)
@@ -0,0 +1,125 @@
+''' Benchmark de kernels EMG
+
+Script para comparar los tiempos de 'kernels_emg' con el procesamiento
+anterior, que iba canal por canal usando diccionarios {1: [], 2: [], 3: []} y
+listas de Python entre cada paso (como en 'normalizar_3ch_sql' y en la
+detección anterior de detectar_3ch.py).
+
+Usa señales sintéticas, por lo que no necesita la base de datos. Si Numba está
+instalado se miden ambas versiones de los kernels; la primera llamada con
+Numba se hace antes de medir para no contar el tiempo de compilación.
+
+Uso
+---
+    python bench_kernels.py [n_muestras] [n_canales]
+
+Bastián Rivas
+'''
+import sys
+import timeit
+import numpy as np
+from scipy.signal import butter, filtfilt
+
+import kernels_emg as kernels
+
+
+#%% Procesamiento anterior, canal por canal
+def envolvente_por_canal(datos, fs, fc, forden):
+    """
+    Envolvente filtrada como en 'normalizar_3ch_sql' + 'ajusta_emg_func':
+    listas por canal, conversión a arreglo y filtrado de a un canal.
+    """
+    canales = range(1, datos.shape[1] + 1)
+    filas = datos.tolist()
+    df_funcional = {num_canal: [] for num_canal in canales}
+    emg_f_env = {num_canal: [] for num_canal in canales}
+    for num_canal in canales:
+        df_funcional[num_canal] = [dato[num_canal - 1] for dato in filas]
+        emg_fun = np.array(df_funcional[num_canal])
+        emg_fun_env = abs(emg_fun - np.mean(emg_fun))
+        b, a = butter(int(forden), (int(fc)/(fs/2)), btype = 'low')
+        emg_f_env[num_canal] = filtfilt(b, a, emg_fun_env)
+    return emg_f_env
+
+
+def mav_por_canal(datos, ventana):
+    """
+    MAV móvil con un buffer circular en Python, como 'getEnvelop' del sketch
+    EnvolventeEMG, de a un canal
+    """
+    resultado = {}
+    for k in range(datos.shape[1]):
+        canal = datos[:, k].tolist()
+        media = sum(canal) / len(canal)
+        buffer = [0.0] * ventana
+        suma = 0.0
+        salida = []
+        for i, dato in enumerate(canal):
+            valor = abs(dato - media)
+            suma += valor - buffer[i % ventana]
+            buffer[i % ventana] = valor
+            salida.append(suma / ventana)
+        resultado[k + 1] = salida
+    return resultado
+
+
+def cruces_por_canal(datos):
+    """
+    Cruces por cero recorriendo las muestras en Python, de a un canal
+    """
+    resultado = {}
+    for k in range(datos.shape[1]):
+        canal = datos[:, k].tolist()
+        media = sum(canal) / len(canal)
+        centrado = [dato - media for dato in canal]
+        resultado[k + 1] = sum(1 for i in range(1, len(centrado))
+                               if centrado[i - 1] * centrado[i] < 0)
+    return resultado
+
+
+#%%
+def medir(funcion, repeticiones=5):
+    """Retorna el mejor tiempo en milisegundos de 'repeticiones' llamadas"""
+    return min(timeit.repeat(funcion, number=1, repeat=repeticiones)) * 1e3
+
+
+def ejecutar_benchmark(n_muestras=60_000, n_canales=3):
+    """Compara todos los kernels e imprime la tabla de tiempos por consola"""
+    fs, fc, forden, ventana = 1000, 150, 2, 128
+
+    rng = np.random.default_rng(0)
+    datos = 512 + rng.normal(0, 40, (n_muestras, n_canales))
+
+    pruebas = [
+        ("Envolvente (filtfilt)",
+         lambda: envolvente_por_canal(datos, fs, fc, forden),
+         lambda numba: kernels.calcular_envolvente(datos, fs, fc, forden,
+                                                   usar_numba=numba)),
+        ("MAV móvil",
+         lambda: mav_por_canal(datos, ventana),
+         lambda numba: kernels.mav_movil(datos, ventana, usar_numba=numba)),
+        ("Cruces por cero",
+         lambda: cruces_por_canal(datos),
+         lambda numba: kernels.cruces_por_cero(datos, usar_numba=numba)),
+    ]
+
+    versiones = [False] + ([True] if kernels.NUMBA_DISPONIBLE else [])
+    encabezado = "Anterior [ms]\tNumPy [ms]\tx"
+    if kernels.NUMBA_DISPONIBLE:
+        encabezado += "\tNumba [ms]\tx"
+    print(f"{n_muestras} muestras, {n_canales} canales")
+    print(f"Kernel                \t{encabezado}")
+
+    for nombre, anterior, nuevo in pruebas:
+        t_anterior = medir(anterior, repeticiones=3)
+        fila = f"{nombre:<22}\t{t_anterior:10.2f}"
+        for numba in versiones:
+            nuevo(numba)  # Compilar antes de medir
+            t_nuevo = medir(lambda: nuevo(numba))
+            fila += f"\t{t_nuevo:10.2f}\t{t_anterior / t_nuevo:.1f}"
+        print(fila)
+
+
+if __name__ == '__main__':
+    ejecutar_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 60_000,
+                       int(sys.argv[2]) if len(sys.argv) > 2 else 3)
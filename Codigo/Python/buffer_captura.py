@@ -0,0 +1,318 @@
+''' Buffer de captura
+
+Buffer en disco para que un corte de la captura (un error, una desconexión
+del USB o cerrar el proceso) no pierda más que unos pocos milisegundos de
+datos. Reemplaza a la lista 'datos_lote' de lectura_3ch_rawEMG.py, que solo se
+guardaba cada 100 muestras o al pulsar Ctrl+C.
+
+Funcionamiento
+--------------
+    - 'agregar' solo empaqueta la muestra en binario y la suma a un buffer en
+      memoria, por lo que no frena el ciclo de 1 kHz.
+    - Un hilo escritor agrega el buffer a un archivo de segmento (solo se
+      escribe al final) y hace fsync cada 'max_perdida_ms' milisegundos. Es
+      lo máximo que se puede perder si el proceso se cae.
+    - Cada 'duracion_segmento' segundos se cierra el segmento y un hilo
+      compactador lo inserta en la tabla 'raw' de SQLite, suma sus
+      estadísticas a 'estadisticas_raw' y lo borra.
+    - Al iniciar, 'recuperar_segmentos' inserta los segmentos que quedaron sin
+      compactar de una captura anterior.
+    - 'estado_cola' entrega cuántas muestras esperan al escritor, cuántos
+      segmentos esperan al compactador y la latencia de cada uno, para la
+      telemetría de la captura ('telemetria_captura.py').
+
+Formato de los segmentos
+------------------------
+Archivos '<gesto_id>_<n>.wal' en 'directorio'. La primera línea es un JSON con
+los datos del gesto (gesto_id, sesion_id, nombre_gesto, fecha, fs, canales y
+tabla) y luego van las muestras como enteros int32 little-endian
+(onset, CH1, ..., CHN). Un registro incompleto al final del archivo, de una
+escritura cortada, se descarta al recuperar.
+
+Estructura de la base de datos
+------------------------------
+Tabla 'segmentos_wal', con los segmentos ya compactados. Evita insertar dos
+veces un segmento si el proceso se cae entre el commit y el borrado del
+archivo:
+       archivo: Nombre del archivo del segmento
+      gesto_id: ID del gesto
+    n_muestras: Muestras insertadas desde el segmento
+         fecha: Fecha de compactación, YYYY-MM-DD HH:MM:SS
+
+Bastián Rivas
+'''
+import sqlite3
+import threading
+import queue
+import struct
+import json
+import time
+import os
+from datetime import datetime
+
+import numpy as np
+
+# Columnas de la tabla 'raw' para N canales
+from esquema_canales import crear_tabla_raw, columnas_raw
+# Estadísticas por gesto, canal y onset acumuladas al insertar
+from estadisticas_raw import acumular_estadisticas
+
+
+#%% Compactación
+def crear_tabla_segmentos_wal(cursor, tabla_wal='segmentos_wal'):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_wal} (
+        archivo TEXT PRIMARY KEY,
+        gesto_id INTEGER,
+        n_muestras INTEGER,
+        fecha TEXT
+    );
+    """)
+
+
+def leer_segmento(ruta):
+    """
+    Lee un archivo de segmento.
+
+    Return
+    ------
+        metadatos (dict): Datos del gesto guardados en la cabecera
+        muestras (np.array): Muestras completas, de (n_muestras, 1 + canales)
+    """
+    with open(ruta, 'rb') as archivo:
+        cabecera = archivo.readline()
+        contenido = archivo.read()
+    if not cabecera.endswith(b'\n'):
+        # El proceso se cayó antes de terminar de escribir la cabecera
+        return None, np.zeros((0, 0), dtype=np.int32)
+    metadatos = json.loads(cabecera)
+    ancho = 1 + len(metadatos['canales'])
+    n_completas = len(contenido) // (4 * ancho)
+    muestras = np.frombuffer(contenido, dtype='<i4',
+                             count=n_completas * ancho).reshape(-1, ancho)
+    return metadatos, muestras
+
+
+def compactar_segmento(conexion, ruta, tabla_wal='segmentos_wal'):
+    """
+    Inserta las muestras de un segmento en su tabla y borra el archivo.
+
+    Return
+    ------
+        int: Cantidad de muestras insertadas
+    """
+    archivo = os.path.basename(ruta)
+    metadatos, muestras = leer_segmento(ruta)
+    cursor = conexion.cursor()
+    crear_tabla_segmentos_wal(cursor, tabla_wal)
+    cursor.execute(f"SELECT 1 FROM {tabla_wal} WHERE archivo = ?", (archivo,))
+    ya_compactado = cursor.fetchone() is not None
+
+    n_muestras = 0
+    if metadatos is not None and not ya_compactado:
+        tabla = metadatos['tabla']
+        canales = metadatos['canales']
+        crear_tabla_raw(cursor, tabla, canales)
+        fijos = (metadatos['gesto_id'], metadatos['sesion_id'],
+                 metadatos['nombre_gesto'], metadatos['fecha'],
+                 metadatos['fs'])
+        cursor.executemany(f"""INSERT INTO {tabla} (gesto_id, sesion_id,
+                               nombre_gesto, fecha, fs, onset,
+                               {', '.join(columnas_raw(canales))})
+                               VALUES ({', '.join(['?'] * (len(canales) + 6))})""",
+                           (fijos + tuple(fila) for fila in muestras.tolist()))
+        acumular_estadisticas(cursor, metadatos['gesto_id'],
+                              metadatos['sesion_id'],
+                              metadatos['nombre_gesto'], muestras[:, 0],
+                              muestras[:, 1:], canales, tabla_raw=tabla)
+        n_muestras = len(muestras)
+        # En la misma transacción que las muestras
+        cursor.execute(f"INSERT INTO {tabla_wal} VALUES (?, ?, ?, ?)",
+                       (archivo, metadatos['gesto_id'], n_muestras,
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conexion.commit()
+    os.remove(ruta)
+    return n_muestras
+
+
+def segmentos_pendientes(directorio):
+    """Archivos de segmento sin compactar, en el orden en que se escribieron"""
+    if not os.path.isdir(directorio):
+        return []
+    return [os.path.join(directorio, nombre)
+            for nombre in sorted(os.listdir(directorio))
+            if nombre.endswith('.wal')]
+
+
+def recuperar_segmentos(ruta_db, directorio='Datos/wal'):
+    """
+    Compacta los segmentos que quedaron en disco de una captura que no
+    terminó bien.
+
+    Return
+    ------
+        int: Cantidad de muestras recuperadas
+    """
+    pendientes = segmentos_pendientes(directorio)
+    if not pendientes:
+        return 0
+    conexion = sqlite3.connect(ruta_db)
+    n_muestras = sum(compactar_segmento(conexion, ruta) for ruta in pendientes)
+    conexion.close()
+    return n_muestras
+
+
+#%% Buffer
+class BufferCaptura:
+    """
+    Buffer de muestras de un gesto, escrito en segmentos en disco y compactado
+    en SQLite en segundo plano.
+
+    Parameters
+    ----------
+        ruta_db (str): Ruta a la base de datos
+        gesto_id, sesion_id, nombre_gesto, fecha, fs: Datos del gesto
+        canales (list): Números de los canales de cada muestra
+        directorio (str): Carpeta de los segmentos
+        max_perdida_ms (float): Máximo de datos que se pueden perder si el
+                                proceso se cae, en milisegundos
+        duracion_segmento (float): Segundos de captura por segmento
+        nombre_tabla (str): Tabla donde se compactan las muestras
+    """
+    def __init__(self, ruta_db, gesto_id, sesion_id, nombre_gesto, fecha, fs,
+                 canales=[1, 2, 3], directorio='Datos/wal', max_perdida_ms=50,
+                 duracion_segmento=1.0, nombre_tabla='raw'):
+        self.ruta_db = ruta_db
+        self.directorio = directorio
+        self.max_perdida_ms = max_perdida_ms
+        self.duracion_segmento = duracion_segmento
+        self.metadatos = {
+            'gesto_id': gesto_id,
+            'sesion_id': sesion_id,
+            'nombre_gesto': nombre_gesto,
+            'fecha': fecha,
+            'fs': fs,
+            'canales': list(canales),
+            'tabla': nombre_tabla,
+        }
+        self.formato = struct.Struct('<' + 'i' * (1 + len(canales)))
+        os.makedirs(directorio, exist_ok=True)
+
+        self.n_muestras = 0
+        self.n_compactadas = 0
+        # Latencias en milisegundos: de la muestra más antigua sin escribir
+        # hasta el fsync, y de cerrar un segmento hasta compactarlo
+        self.latencia_escritura_ms = 0.0
+        self.latencia_escritura_max_ms = 0.0
+        self.latencia_compactacion_ms = 0.0
+        self.latencia_compactacion_max_ms = 0.0
+        self._pendiente = bytearray()
+        self._inicio_pendiente = None
+        self._candado = threading.Lock()
+        self._archivo = None
+        self._n_segmento = 0
+        self._inicio_segmento = 0.0
+        self._cerrados = queue.Queue()
+        self._detener = threading.Event()
+
+        self._escritor = threading.Thread(target=self._ciclo_escritor,
+                                          name='escritor_wal', daemon=True)
+        self._compactador = threading.Thread(target=self._ciclo_compactador,
+                                             name='compactador_wal',
+                                             daemon=True)
+        self._escritor.start()
+        self._compactador.start()
+
+    def agregar(self, valores):
+        """Agrega una muestra (onset, CH1, ..., CHN)"""
+        datos = self.formato.pack(*valores)
+        with self._candado:
+            if not self._pendiente:
+                self._inicio_pendiente = time.monotonic()
+            self._pendiente += datos
+        self.n_muestras += 1
+
+    def estado_cola(self):
+        """
+        Profundidad y latencia de la escritura en segundo plano.
+
+        Return
+        ------
+            dict: Con las entradas
+                muestras_pendientes (int): Muestras aún sin escribir a disco
+                segmentos_en_cola (int): Segmentos cerrados sin compactar
+                latencia_escritura_ms, latencia_escritura_max_ms (float):
+                    Última y máxima demora hasta el fsync
+                latencia_compactacion_ms, latencia_compactacion_max_ms
+                (float): Última y máxima demora hasta quedar en SQLite
+        """
+        return {
+            'muestras_pendientes': len(self._pendiente) // self.formato.size,
+            'segmentos_en_cola': self._cerrados.qsize(),
+            'latencia_escritura_ms': self.latencia_escritura_ms,
+            'latencia_escritura_max_ms': self.latencia_escritura_max_ms,
+            'latencia_compactacion_ms': self.latencia_compactacion_ms,
+            'latencia_compactacion_max_ms': self.latencia_compactacion_max_ms,
+        }
+
+    #%% Escritura de segmentos
+    def _abrir_segmento(self):
+        nombre = (f"{self.metadatos['gesto_id']:08d}_"
+                  f"{self._n_segmento:06d}.wal")
+        self._archivo = open(os.path.join(self.directorio, nombre), 'ab')
+        self._archivo.write(json.dumps(self.metadatos).encode() + b'\n')
+        self._inicio_segmento = time.monotonic()
+        self._n_segmento += 1
+
+    def _cerrar_segmento(self):
+        self._archivo.close()
+        self._cerrados.put((self._archivo.name, time.monotonic()))
+        self._archivo = None
+
+    def _escribir(self):
+        """Escribe lo pendiente en el segmento actual y hace fsync"""
+        with self._candado:
+            datos, self._pendiente = self._pendiente, bytearray()
+            inicio = self._inicio_pendiente
+        if datos:
+            if self._archivo is None:
+                self._abrir_segmento()
+            self._archivo.write(datos)
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self.latencia_escritura_ms = (time.monotonic() - inicio) * 1e3
+            self.latencia_escritura_max_ms = max(
+                self.latencia_escritura_max_ms, self.latencia_escritura_ms)
+        if (self._archivo is not None and time.monotonic()
+                - self._inicio_segmento >= self.duracion_segmento):
+            self._cerrar_segmento()
+
+    def _ciclo_escritor(self):
+        while not self._detener.wait(self.max_perdida_ms / 1000):
+            self._escribir()
+
+    #%% Compactación
+    def _ciclo_compactador(self):
+        # Conexión propia, porque las conexiones de sqlite3 son por hilo
+        conexion = sqlite3.connect(self.ruta_db)
+        while (cerrado := self._cerrados.get()) is not None:
+            ruta, cierre = cerrado
+            self.n_compactadas += compactar_segmento(conexion, ruta)
+            self.latencia_compactacion_ms = (time.monotonic() - cierre) * 1e3
+            self.latencia_compactacion_max_ms = max(
+                self.latencia_compactacion_max_ms,
+                self.latencia_compactacion_ms)
+        conexion.close()
+
+    def cerrar(self):
+        """
+        Escribe lo pendiente, cierra el último segmento y espera a que todo
+        quede compactado en la base de datos.
+        """
+        self._detener.set()
+        self._escritor.join()
+        self._escribir()
+        if self._archivo is not None:
+            self._cerrar_segmento()
+        self._cerrados.put(None)
+        self._compactador.join()
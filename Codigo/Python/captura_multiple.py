@@ -0,0 +1,428 @@
+''' Captura desde varios dispositivos
+
+Script en Python para registrar al mismo tiempo los datos de EMG de dos o más
+placas (por ejemplo, una en cada antebrazo), cada una en su propio puerto
+serial. Cada placa envía líneas con el formato <onset>,<CH1>,...,<CHN>, igual
+que para lectura_3ch_rawEMG.py.
+
+Funcionamiento
+--------------
+    - Cada puerto se lee en su propio hilo ('LectorSerial'), que lee todo lo
+      que haya en el buffer de una vez y marca cada bloque de líneas con el
+      tiempo monotónico del computador al recibirlo. El hilo solo convierte
+      las líneas y las deja en una cola, para no perder muestras a 1 kHz.
+    - Con las marcas de tiempo de los bloques se estima el reloj de cada placa
+      ('EstimadorDeriva'): un ajuste lineal de tiempo = t0 + índice / fs_real.
+      La diferencia entre fs_real y la fs nominal es la deriva del reloj de la
+      placa, en partes por millón (ppm).
+    - Al terminar, los registros se alinean en una sola grilla de tiempo a la
+      fs nominal ('alinear_registros') y se guardan como un solo gesto en la
+      tabla 'raw'. Los canales de cada placa se numeran a continuación de los
+      de la anterior: con dos placas de 3 canales, la segunda queda como
+      CH4, CH5 y CH6. El onset es 1 si está activo en cualquiera de las placas.
+    - Si una placa no envía datos, el gesto se registra igual con las demás.
+      Los canales de esa placa mantienen su numeración y quedan en NULL, y su
+      fila en 'dispositivos' queda con n_muestras = 0.
+
+Estructura de la base de datos
+------------------------------
+La tabla 'raw' es la misma de lectura_3ch_rawEMG.py, con una columna más:
+      tiempo: Tiempo de la muestra en segundos desde el inicio del registro,
+              común para todas las placas
+
+Tabla 'dispositivos', con una fila por placa de cada gesto:
+       gesto_id: ID del gesto
+    dispositivo: Número de la placa dentro del gesto (0, 1, ...)
+         puerto: Puerto serial de la placa
+   canal_inicio: Número del primer canal de la placa en la tabla 'raw'
+      n_canales: Cantidad de canales de la placa
+     fs_nominal: Frecuencia de muestreo configurada en Hertz
+    fs_estimada: Frecuencia de muestreo estimada desde el reloj del computador
+     deriva_ppm: Deriva del reloj de la placa respecto al del computador
+     desfase_ms: Desfase del inicio del registro de la placa respecto a la
+                 primera placa con datos
+                 (fs_estimada, deriva_ppm y desfase_ms son NULL si la placa
+                 no envió datos)
+      n_muestras: Muestras recibidas desde la placa
+    incompletas: Líneas descartadas por no tener n_canales + 1 valores
+        errores: Líneas descartadas por no poder convertirse a enteros
+
+Uso
+---
+    - Configurar 'dispositivos' con el puerto y la cantidad de canales de cada
+      placa
+    - Ejecutar e ingresar el número de la sesión y el nombre del gesto
+    - Mantener pulsado el botón en la placa mientras se hace el gesto
+    - Al terminar la toma de datos pulsar Ctrl+C
+
+Bastián Rivas
+'''
+import sqlite3
+import threading
+import queue
+import time
+import os
+from datetime import datetime
+
+import numpy as np
+
+# Lectura de líneas y columnas para N canales
+from esquema_canales import (parsear_linea, crear_tabla_raw, columnas_raw,
+                             agregar_columnas)
+# Segmentos de onset precalculados al momento de la captura
+from segmentos_onset import registrar_segmentos
+# Estadísticas por gesto, canal y onset acumuladas al insertar
+from estadisticas_raw import acumular_estadisticas
+# Parámetros desde el perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli
+
+
+#%% Reloj de cada placa
+class EstimadorDeriva:
+    """
+    Estima el reloj de una placa a partir de los bloques recibidos, con un
+    ajuste lineal en línea de t_host = t0 + índice / fs_real.
+
+    Cada bloque aporta un punto: el índice de su última muestra y el tiempo en
+    que se recibió. Las medias y covarianzas se actualizan en cada punto, sin
+    guardar el historial, y relativas al primer punto para no perder
+    precisión con tiempos e índices grandes.
+    """
+    def __init__(self, fs):
+        self.fs = fs
+        self.n = 0
+        self._origen = None
+        self._media_x = 0.0
+        self._media_y = 0.0
+        self._cov_xy = 0.0
+        self._var_x = 0.0
+
+    def agregar(self, indice, t_host):
+        """Agrega la marca de tiempo 't_host' de la muestra 'indice'"""
+        if self._origen is None:
+            self._origen = (indice, t_host)
+        x = indice - self._origen[0]
+        y = t_host - self._origen[1]
+        self.n += 1
+        dx = x - self._media_x
+        self._media_x += dx / self.n
+        self._media_y += (y - self._media_y) / self.n
+        self._var_x += dx * (x - self._media_x)
+        self._cov_xy += dx * (y - self._media_y)
+
+    @property
+    def periodo(self):
+        """Periodo de muestreo estimado en segundos"""
+        if self.n < 2 or self._var_x == 0:
+            return 1.0 / self.fs
+        return self._cov_xy / self._var_x
+
+    @property
+    def fs_real(self):
+        return 1.0 / self.periodo
+
+    @property
+    def deriva_ppm(self):
+        return (self.fs_real / self.fs - 1) * 1e6
+
+    @property
+    def t0(self):
+        """Tiempo estimado de la muestra 0, en el reloj del computador"""
+        if self._origen is None:
+            return None
+        indice, t_host = self._origen
+        return (t_host + self._media_y
+                - (self._media_x + indice) * self.periodo)
+
+    def tiempos(self, n_muestras):
+        """Tiempo en el reloj del computador de cada muestra recibida"""
+        return self.t0 + np.arange(n_muestras) * self.periodo
+
+
+#%% Lectura de un puerto
+class LectorSerial(threading.Thread):
+    """
+    Hilo que lee un puerto serial y deja en 'cola' los bloques de muestras
+    recibidos como (dispositivo, t_host, filas), con 'filas' una lista de
+    tuplas (onset, CH1, ..., CHN).
+    """
+    def __init__(self, dispositivo, puerto, n_canales, fs, cola,
+                 baud_rate=115200):
+        super().__init__(name=f"lector_{puerto}", daemon=True)
+        self.dispositivo = dispositivo
+        self.puerto = puerto
+        self.n_canales = n_canales
+        self.baud_rate = baud_rate
+        self.cola = cola
+        self.deriva = EstimadorDeriva(fs)
+        self.detener = threading.Event()
+        self.error = None
+
+        self.n_muestras = 0
+        self.incompletas = 0
+        self.errores = 0
+        self._resto = b''
+
+    def run(self):
+        # pyserial solo se necesita para leer desde las placas
+        import serial
+        try:
+            with serial.Serial(self.puerto, self.baud_rate, timeout=0.01) as ser:
+                ser.reset_input_buffer()
+                while not self.detener.is_set():
+                    # Leer todo lo que haya llegado de una vez
+                    datos = ser.read(max(1, ser.in_waiting))
+                    if datos:
+                        self.procesar(datos, time.monotonic())
+        except serial.SerialException as e:
+            self.error = e
+
+    def procesar(self, datos, t_host):
+        """
+        Convierte los bytes recibidos en filas y las deja en la cola como un
+        solo bloque. La última línea, si está incompleta, se guarda para el
+        siguiente bloque.
+        """
+        *lineas, self._resto = (self._resto + datos).split(b'\n')
+        filas = []
+        for linea in lineas:
+            try:
+                valores = parsear_linea(linea.decode('ascii').rstrip(),
+                                        self.n_canales)
+            except (UnicodeDecodeError, ValueError):
+                self.errores += 1
+                continue
+            if valores is None:
+                self.incompletas += 1
+                continue
+            filas.append(valores)
+
+        if filas:
+            self.n_muestras += len(filas)
+            self.deriva.agregar(self.n_muestras - 1, t_host)
+            self.cola.put((self.dispositivo, t_host, filas))
+
+
+#%% Alineación
+def alinear_registros(registros, tiempos, fs):
+    """
+    Alinea los registros de varias placas en una sola grilla de tiempo.
+
+    La grilla va a la fs nominal, desde que todas las placas están
+    registrando hasta que la primera deja de hacerlo. Cada placa aporta la
+    muestra más cercana a cada punto de la grilla según su reloj estimado,
+    por lo que el error de alineación es de a lo más media muestra.
+
+    Parameters
+    ----------
+        registros (list): Arreglos de (n_muestras, 1 + n_canales) de cada
+                          placa, con el onset en la primera columna
+        tiempos (list): Tiempo de cada muestra de cada placa, en el reloj del
+                        computador
+        fs (float): Frecuencia de muestreo de la grilla en Hertz
+
+    Return
+    ------
+        tiempo (np.array): Tiempo de la grilla en segundos desde su inicio
+        onset (np.array): 1 si el onset está activo en cualquiera de las placas
+        datos (np.array): Canales de todas las placas, de
+                          (n_muestras, total de canales)
+    """
+    t_inicio = max(t[0] for t in tiempos)
+    t_fin = min(t[-1] for t in tiempos)
+    grilla = t_inicio + np.arange(int(np.floor((t_fin - t_inicio) * fs)) + 1) / fs
+
+    alineados = []
+    for registro, t in zip(registros, tiempos):
+        # Muestra más cercana: la siguiente o la anterior a cada punto
+        siguiente = np.clip(np.searchsorted(t, grilla), 1, len(t) - 1)
+        anterior = siguiente - 1
+        cercana = np.where(grilla - t[anterior] <= t[siguiente] - grilla,
+                           anterior, siguiente)
+        alineados.append(registro[cercana])
+
+    onset = np.max([a[:, 0] for a in alineados], axis=0)
+    datos = np.concatenate([a[:, 1:] for a in alineados], axis=1)
+    return grilla - t_inicio, onset, datos
+
+
+#%% Registro
+def crear_tabla_dispositivos(cursor, tabla_disp='dispositivos'):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_disp} (
+        gesto_id INTEGER,
+        dispositivo INTEGER,
+        puerto TEXT,
+        canal_inicio INTEGER,
+        n_canales INTEGER,
+        fs_nominal INTEGER,
+        fs_estimada REAL,
+        deriva_ppm REAL,
+        desfase_ms REAL,
+        n_muestras INTEGER,
+        incompletas INTEGER,
+        errores INTEGER,
+        PRIMARY KEY (gesto_id, dispositivo)
+    );
+    """)
+
+
+def registrar_captura(conexion, lectores, bloques, gesto_id, sesion_id,
+                      nombre_gesto, fecha, fs, nombre_tabla='raw',
+                      tabla_disp='dispositivos'):
+    """
+    Alinea los registros de todas las placas y los guarda como un solo gesto.
+    Las placas que no enviaron datos se informan por consola y sus canales
+    quedan en NULL; el gesto solo se descarta si ninguna placa envió datos.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        lectores (list): Lectores de cada placa, en orden
+        bloques (dict): Filas recibidas por cada placa, {dispositivo: [filas]}
+        gesto_id, sesion_id, nombre_gesto, fecha, fs: Datos del gesto
+
+    Return
+    ------
+        int: Cantidad de muestras registradas
+    """
+    registros = [np.array(bloques[lector.dispositivo], dtype=np.int64)
+                 .reshape(-1, 1 + lector.n_canales) for lector in lectores]
+    # Número del primer canal de cada placa, tenga o no datos
+    inicios = np.cumsum([1] + [lector.n_canales for lector in lectores])
+    con_datos = [i for i, registro in enumerate(registros)
+                 if len(registro) >= 2]
+    for i in sorted(set(range(len(lectores))) - set(con_datos)):
+        print(f"La placa {lectores[i].dispositivo} ({lectores[i].puerto}) no "
+              f"envió datos: sus canales CH{inicios[i]} a "
+              f"CH{inicios[i + 1] - 1} quedan vacíos")
+    if not con_datos:
+        print("Ninguna placa envió datos, no se registra el gesto")
+        return 0
+
+    tiempos = [lectores[i].deriva.tiempos(len(registros[i]))
+               for i in con_datos]
+    tiempo, onset, datos = alinear_registros(
+        [registros[i] for i in con_datos], tiempos, fs)
+    canales = [canal for i in con_datos
+               for canal in range(inicios[i], inicios[i + 1])]
+
+    cursor = conexion.cursor()
+    crear_tabla_raw(cursor, nombre_tabla, list(range(1, inicios[-1])))
+    agregar_columnas(cursor, nombre_tabla, ['tiempo'], 'REAL')
+    crear_tabla_dispositivos(cursor, tabla_disp)
+
+    fijos = (gesto_id, sesion_id, nombre_gesto, fecha, fs)
+    filas = np.column_stack((tiempo, onset, datos)).tolist()
+    cursor.executemany(f"""INSERT INTO {nombre_tabla} (gesto_id, sesion_id,
+                           nombre_gesto, fecha, fs, tiempo, onset,
+                           {', '.join(columnas_raw(canales))})
+                           VALUES ({', '.join(['?'] * (len(canales) + 7))})""",
+                       (fijos + (t, int(o), *map(int, ch))
+                        for t, o, *ch in filas))
+    acumular_estadisticas(cursor, gesto_id, sesion_id, nombre_gesto, onset,
+                          datos, canales, tabla_raw=nombre_tabla)
+
+    t0_referencia = lectores[con_datos[0]].deriva.t0
+    for i, (lector, registro) in enumerate(zip(lectores, registros)):
+        reloj = ((lector.deriva.fs_real, lector.deriva.deriva_ppm,
+                  (lector.deriva.t0 - t0_referencia) * 1e3)
+                 if i in con_datos else (None, None, None))
+        cursor.execute(f"""INSERT OR REPLACE INTO {tabla_disp} VALUES
+                           (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                       (gesto_id, lector.dispositivo, lector.puerto,
+                        int(inicios[i]), lector.n_canales, fs, *reloj,
+                        len(registro) if i in con_datos else 0,
+                        lector.incompletas, lector.errores))
+    conexion.commit()
+
+    registrar_segmentos(conexion, gesto_id, onset)
+    return len(tiempo)
+
+
+#%%
+if __name__ == '__main__':
+    # Puerto serial y cantidad de canales de cada placa
+    dispositivos = [
+        ('COM4', 3),
+        ('COM5', 3),
+    ]
+    # Perfil con la frecuencia de muestreo nominal de las placas, la 
+    # velocidad de los puertos y la base de datos
+    perfil = cargar_perfil_cli("Capturar desde varias placas a la vez")
+    baud_rate = perfil.baud_rate
+    fs = perfil.fs
+
+    # Conectar o crear la base de datos SQLite
+    db_path = perfil.ruta_db
+    nombre_tabla = perfil.tabla_raw
+    conexion = sqlite3.connect(db_path)
+    cursor = conexion.cursor()
+    print(f"Usando base de datos en: {os.path.abspath(db_path)}")
+
+    total_canales = sum(n_canales for _, n_canales in dispositivos)
+    crear_tabla_raw(cursor, nombre_tabla, list(range(1, total_canales + 1)))
+
+    # Obtener el último gesto_id y sesion_id registrados en la base de datos
+    cursor.execute(f"""SELECT MAX(gesto_id), nombre_gesto, sesion_id
+                        FROM {nombre_tabla}""")
+    ultimo_registro = cursor.fetchone()
+    ultimo_gesto_id = ultimo_registro[0] if ultimo_registro[0] is not None else 0
+    ultimo_sesion_id = ultimo_registro[2] if ultimo_registro[2] is not None else 1
+    gesto_id = ultimo_gesto_id + 1
+
+    print(f"Última sesión registrada con ID = {ultimo_sesion_id}")
+    sesion_id = input("Por favor, ingrese el número de sesión: ")
+    sesion_id = int(sesion_id) if sesion_id else ultimo_sesion_id
+    nombre_gesto = input("Por favor, ingrese el nombre del gesto: ")
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Un hilo por puerto. El hilo principal solo junta los bloques recibidos
+    cola = queue.Queue()
+    lectores = [LectorSerial(i, puerto, n_canales, fs, cola, baud_rate)
+                for i, (puerto, n_canales) in enumerate(dispositivos)]
+    bloques = {lector.dispositivo: [] for lector in lectores}
+    for lector in lectores:
+        lector.start()
+
+    print(f"Leyendo desde {', '.join(p for p, _ in dispositivos)} a "
+          f"{baud_rate} baud...\nFinalizar con Ctrl+C")
+    try:
+        siguiente_estado = time.monotonic() + 1.0
+        while any(lector.is_alive() for lector in lectores):
+            try:
+                dispositivo, _, filas = cola.get(timeout=0.1)
+                bloques[dispositivo].extend(filas)
+            except queue.Empty:
+                pass
+
+            # Línea de estado una vez por segundo en lugar de una por muestra
+            if time.monotonic() >= siguiente_estado:
+                siguiente_estado += 1.0
+                print(" | ".join(
+                    f"{lector.puerto}: {lector.n_muestras} muestras, "
+                    f"{lector.deriva.fs_real:.1f} Hz "
+                    f"({lector.deriva.deriva_ppm:+.0f} ppm)"
+                    for lector in lectores))
+
+        for lector in lectores:
+            if lector.error is not None:
+                print(f"Error al acceder al puerto {lector.puerto}: "
+                      f"{lector.error}")
+    except KeyboardInterrupt:
+        print("\nLectura interrumpida")
+    finally:
+        for lector in lectores:
+            lector.detener.set()
+            lector.join()
+        # Vaciar los bloques que quedaron en la cola
+        while not cola.empty():
+            dispositivo, _, filas = cola.get()
+            bloques[dispositivo].extend(filas)
+
+        n_muestras = registrar_captura(conexion, lectores, bloques, gesto_id,
+                                       sesion_id, nombre_gesto, fecha, fs,
+                                       nombre_tabla)
+        print(f"Registradas {n_muestras} muestras alineadas de "
+              f"{len(lectores)} placas en {db_path}")
+        conexion.close()
@@ -0,0 +1,496 @@
+""" Coherencia entre canales
+Script para analizar la relación entre los canales de cada gesto, que están
+sobre músculos distintos (flexor radial del carpo, extensor de los dedos y
+flexores de los dedos en 'detectar_3ch.py'), en lugar de analizar cada canal
+por separado. Para cada gesto y cada par de canales calcula:
+
+    - Coherencia (magnitude-squared coherence) de la señal bruta de las
+      regiones activas, con los mismos segmentos de Welch que la PSD: la FFT
+      de cada segmento se calcula una sola vez por canal y se reutiliza en la
+      PSD de ese canal y en todos sus pares, en lugar de una FFT por par como
+      con scipy.signal.coherence
+    - Retardo y valor del máximo de la correlación cruzada normalizada de las
+      envolventes (en % de la CVM), calculada con una sola FFT por canal
+    - Índices de co-activación de las envolventes en las regiones activas:
+      área común, 2 * sum(min(a, b)) / sum(a + b), y simultaneidad, la
+      fracción del tiempo con algún canal sobre 'umbral' en que ambos lo están
+
+Todos los pares se calculan a la vez, vectorizados sobre un eje de pares. La
+envolvente y la CVM se obtienen igual que en 'normalizar_3ch_sql', así que
+solo se necesita la tabla de datos brutos y la referencia de la sesión.
+
+Los resultados quedan en la tabla 'coherencia' del perfil, una fila por gesto
+y par, para comparar gestos con una consulta ('comparar_gestos') sin volver a
+leer las muestras.
+
+    Estructura de la base de datos
+    ------------------------------
+        gesto_id (int)          : ID del gesto
+        canal_a, canal_b (int)  : Par de canales, con canal_a < canal_b
+        sesion_id (int)         : ID de la sesión
+        nombre_gesto (string)   : Nombre del gesto hecho
+        fs (int)                : Frecuencia de muestreo en Hertz
+        nperseg (int)           : Muestras por segmento de Welch
+        n_segmentos (int)       : Segmentos de Welch promediados
+        df (float)              : Resolución en frecuencia, en Hertz
+        coherencia_media (float): Coherencia media en la banda de análisis
+        coherencia_pico (float) : Coherencia máxima en la banda
+        frecuencia_pico (float) : Frecuencia de la coherencia máxima, en Hz
+        retardo_ms (float)      : Retardo del máximo de la correlación cruzada
+                                  de las envolventes. Positivo si canal_b se
+                                  activa después que canal_a
+        correlacion_max (float) : Correlación normalizada en ese retardo
+        coactivacion (float)    : Índice de área común, entre 0 y 1
+        simultaneidad (float)   : Fracción del tiempo activo con ambos canales
+                                  sobre el umbral, entre 0 y 1
+        coherencia (blob)       : Coherencia de 0 a fs/2, como arreglo float32.
+                                  Leer con 'leer_coherencia'
+        fecha (string)          : Fecha del cálculo, YYYY-MM-DD HH:MM:SS
+
+
+Bastián Rivas
+"""
+import sqlite3
+import os
+from datetime import datetime
+import numpy as np
+
+# Gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG
+# Regiones activas desde los segmentos de onset
+from segmentos_onset import calcular_segmentos
+# Referencia de CVM y reposo calculada una vez por sesión
+from referencia_sesion import obtener_referencia
+# Largo rápido de la FFT
+from espectro_emg import largo_fft
+# Parámetros y tablas de resultados desde un perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli, registrar_perfil
+
+
+# Columnas de la tabla, después de la llave (gesto_id, canal_a, canal_b)
+COLUMNAS = ('sesion_id', 'nombre_gesto', 'fs', 'nperseg', 'n_segmentos', 'df',
+            'coherencia_media', 'coherencia_pico', 'frecuencia_pico',
+            'retardo_ms', 'correlacion_max', 'coactivacion', 'simultaneidad',
+            'coherencia', 'fecha')
+
+# Métricas que se pueden comparar entre gestos
+METRICAS = ('coherencia_media', 'coherencia_pico', 'frecuencia_pico',
+            'retardo_ms', 'correlacion_max', 'coactivacion', 'simultaneidad')
+
+
+#%% Segmentos de Welch
+def pares_canales(n_canales):
+    """Índices (a, b) de todos los pares de canales, con a < b"""
+    return np.triu_indices(n_canales, 1)
+
+
+def segmentos_welch(regiones, fs, nperseg=256):
+    """
+    FFT de los segmentos de Welch de todos los canales: ventana de Hann,
+    50 % de solapamiento y media de cada segmento eliminada, como en
+    scipy.signal.welch. Los segmentos no cruzan de una región a otra; si
+    ninguna región alcanza 'nperseg' muestras se usa un solo segmento con la
+    región más larga.
+
+    Los espectros quedan escalados de modo que la PSD de un lado de cada canal
+    sea la media de |X|^2 sobre los segmentos, y la densidad espectral cruzada
+    de dos canales la media de conj(Xa) * Xb.
+
+    Parameters
+    ----------
+        regiones (list): Regiones de la señal, de (n_muestras, canales)
+        fs (float): Frecuencia de muestreo en Hertz
+        nperseg (int): Muestras por segmento
+
+    Return
+    ------
+        frecuencias (np.array): Eje de frecuencias, de (nperseg // 2 + 1,)
+        espectros (np.array): Arreglo complejo de
+                              (n_segmentos, n_frecuencias, canales)
+    """
+    from scipy.fft import rfft
+    regiones = [np.asarray(region, dtype=float) for region in regiones]
+    largo_max = max(len(region) for region in regiones)
+    nperseg = int(min(nperseg, largo_max))
+    paso = nperseg - nperseg // 2
+
+    # Vistas de los segmentos de cada región, sin copiar las muestras
+    segmentos = [np.lib.stride_tricks.sliding_window_view(
+                     region, nperseg, axis=0)[::paso]
+                 for region in regiones if len(region) >= nperseg]
+    segmentos = np.concatenate(segmentos)      # (n_seg, canales, nperseg)
+
+    ventana = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+    segmentos = segmentos - segmentos.mean(axis=2, keepdims=True)
+    espectros = rfft(segmentos * ventana, axis=2)
+    espectros = np.moveaxis(espectros, 2, 1)   # (n_seg, n_frec, canales)
+
+    # Densidad de un lado: las frecuencias sin pareja negativa no se duplican
+    escala = np.full(espectros.shape[1], 2.0 / (fs * np.sum(ventana ** 2)))
+    escala[0] /= 2
+    if nperseg % 2 == 0:
+        escala[-1] /= 2
+    espectros *= np.sqrt(escala)[:, None]
+    return np.arange(espectros.shape[1]) * (fs / nperseg), espectros
+
+
+def psd_segmentos(espectros):
+    """PSD de Welch de cada canal, de (n_frecuencias, canales)"""
+    return np.mean(np.abs(espectros) ** 2, axis=0)
+
+
+def coherencia_pares(espectros, pares):
+    """
+    Coherencia de todos los pares de canales a partir de los mismos
+    segmentos, igual que scipy.signal.coherence par por par.
+
+    Parameters
+    ----------
+        espectros (np.array): Salida de 'segmentos_welch'
+        pares (tuple): Índices (a, b) de los canales de cada par
+
+    Return
+    ------
+        np.array: Coherencia entre 0 y 1, de (n_frecuencias, n_pares). Cero
+                  donde algún canal no tiene potencia
+    """
+    a, b = pares
+    cruzada = np.einsum('sfp,sfp->fp', np.conj(espectros[:, :, a]),
+                        espectros[:, :, b]) / len(espectros)
+    psd = psd_segmentos(espectros)
+    potencia = psd[:, a] * psd[:, b]
+    coherencia = np.zeros(potencia.shape)
+    np.divide(np.abs(cruzada) ** 2, potencia, out=coherencia,
+              where=potencia > 0)
+    return coherencia
+
+
+#%% Correlación y co-activación
+def correlacion_cruzada(envolventes, fs, pares, max_retardo=0.2):
+    """
+    Máximo de la correlación cruzada normalizada de las envolventes de todos
+    los pares, con una FFT por canal (no por par).
+
+    Parameters
+    ----------
+        envolventes (np.array): Envolventes de (n_muestras, canales)
+        fs (float): Frecuencia de muestreo en Hertz
+        pares (tuple): Índices (a, b) de los canales de cada par
+        max_retardo (float): Retardo máximo a buscar, en segundos
+
+    Return
+    ------
+        retardos (np.array): Retardo del máximo de cada par, en segundos.
+                             Positivo si el canal b va después que el a
+        maximos (np.array): Correlación normalizada en ese retardo, entre -1
+                            y 1. NaN si algún canal es constante
+    """
+    from scipy.fft import rfft, irfft
+    a, b = pares
+    x = envolventes - envolventes.mean(axis=0)
+    n_muestras = len(x)
+    # Relleno hasta 2N - 1 para que la correlación sea lineal y no circular
+    n_fft = largo_fft(2 * n_muestras - 1)
+    espectro = rfft(x, n=n_fft, axis=0)
+    correlacion = irfft(np.conj(espectro[:, a]) * espectro[:, b], n=n_fft,
+                        axis=0)
+
+    limite = int(min(max_retardo * fs, n_muestras - 1))
+    desplazamientos = np.arange(-limite, limite + 1)
+    correlacion = correlacion[desplazamientos % n_fft]
+    energia = np.sum(x ** 2, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlacion /= np.sqrt(energia[a] * energia[b])
+    indices = np.argmax(np.nan_to_num(correlacion, nan=-np.inf), axis=0)
+    columnas = np.arange(len(a))
+    return desplazamientos[indices] / fs, correlacion[indices, columnas]
+
+
+def indices_coactivacion(envolventes, pares, umbral=10.0):
+    """
+    Índices de co-activación de todos los pares.
+
+    Parameters
+    ----------
+        envolventes (np.array): Envolventes no negativas, de
+                                (n_muestras, canales), en % de la CVM
+        pares (tuple): Índices (a, b) de los canales de cada par
+        umbral (float): Nivel sobre el que un canal se considera activo
+
+    Return
+    ------
+        coactivacion (np.array): 2 * sum(min(a, b)) / sum(a + b) de cada par
+        simultaneidad (np.array): Muestras con ambos canales sobre el umbral,
+                                  sobre las muestras con alguno sobre él
+    """
+    a, b = pares
+    ea, eb = envolventes[:, a], envolventes[:, b]
+    total = np.sum(ea + eb, axis=0)
+    activos = envolventes > umbral
+    alguno = np.sum(activos[:, a] | activos[:, b], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coactivacion = 2 * np.sum(np.minimum(ea, eb), axis=0) / total
+        simultaneidad = np.sum(activos[:, a] & activos[:, b], axis=0) / alguno
+    return coactivacion, np.where(alguno > 0, simultaneidad, 0.0)
+
+
+#%% Análisis de un gesto
+def calcular_coherencia(gesto_id, ruta_db='Datos/datos_gestos_3ch.db',
+                        tabla_raw='raw', fs=1000, fc=150, forden=2,
+                        reescalado=5.0/1023, nperseg=256, mapa_cvm=None,
+                        canales=None, banda=(20, 450), max_retardo=0.2,
+                        umbral=10.0):
+    """
+    Coherencia, correlación cruzada y co-activación de todos los pares de
+    canales de un gesto.
+
+    Parameters
+    ----------
+    - "gesto_id": Número identificador del gesto
+    - "ruta_db": La ruta a la base de datos SQLite
+    - "tabla_raw", "fs", "fc", "forden", "reescalado", "mapa_cvm": Tabla de
+      datos brutos y parámetros de procesamiento, igual que en
+      'normalizar_3ch_sql'
+    - "nperseg": Muestras por segmento de Welch
+    - "canales": Canales a analizar. Por defecto, todos los de 'tabla_raw'
+    - "banda": (mínima, máxima) frecuencia en Hertz para la coherencia media y
+      el pico. Se recorta a fs/2
+    - "max_retardo": Retardo máximo de la correlación cruzada, en segundos
+    - "umbral": Nivel de activación para la simultaneidad, en % de la CVM
+
+    Return
+    ------
+        datos_coh: dict
+            Datos del gesto ('gesto_id', 'sesion_id', 'nombre_gesto', 'fs',
+            'canales', 'nperseg', 'n_segmentos', 'df'), los pares de números de
+            canal en 'pares', la coherencia completa de (n_frecuencias,
+            n_pares) y un arreglo por par de cada métrica de 'METRICAS'
+    """
+    conexion = sqlite3.connect(ruta_db)
+    registro = RegistroEMG.desde_db(conexion, gesto_id, tabla_raw, canales,
+                                    reescalado,
+                                    tabla_raw=tabla_raw).remuestrear(fs)
+    if registro.n_canales < 2:
+        conexion.close()
+        raise ValueError(f"El gesto {gesto_id} tiene un solo canal")
+    # Máximo de la envolvente de cada CVM, desde la referencia de la sesión
+    referencia = obtener_referencia(conexion, registro.sesion_id, tabla_raw,
+                                    fs, fc, forden, reescalado,
+                                    registro.canales, mapa_cvm=mapa_cvm,
+                                    nperseg=nperseg)
+    conexion.close()
+
+    segmentos = registro.segmentos
+    if segmentos is None or len(segmentos) == 0:
+        segmentos = calcular_segmentos(registro.onset)
+    if len(segmentos) == 0:
+        raise ValueError(f"El gesto {gesto_id} no tiene regiones activas")
+    pares = pares_canales(registro.n_canales)
+
+    # Coherencia de la señal bruta, con los segmentos de Welch de cada región
+    frecuencias, espectros = segmentos_welch(
+        [registro.datos[inicio:fin] for inicio, fin in segmentos], fs, nperseg)
+    coherencia = coherencia_pares(espectros, pares)
+    en_banda = ((frecuencias >= banda[0])
+                & (frecuencias <= min(banda[1], fs / 2)))
+    if not en_banda.any():
+        en_banda[:] = True
+    pico = np.argmax(np.where(en_banda[:, None], coherencia, -1), axis=0)
+
+    # Envolventes en % de la CVM, como en 'normalizar_3ch_sql'
+    envolventes = registro.envolvente(fc, forden) / referencia['cvm_max'] * 100
+    retardos, maximos = correlacion_cruzada(envolventes, fs, pares,
+                                            max_retardo)
+    activas = np.concatenate([envolventes[inicio:fin]
+                              for inicio, fin in segmentos])
+    coactivacion, simultaneidad = indices_coactivacion(activas, pares, umbral)
+
+    numeros = np.asarray(registro.canales)
+    # 'segmentos_welch' acorta los segmentos si todas las regiones son cortas
+    nperseg = int(min(nperseg, max(fin - inicio for inicio, fin in segmentos)))
+    return {
+        'gesto_id': gesto_id,
+        'sesion_id': registro.sesion_id,
+        'nombre_gesto': registro.nombre_gesto,
+        'fs': fs,
+        'canales': registro.canales,
+        'nperseg': nperseg,
+        'n_segmentos': len(espectros),
+        'df': fs / nperseg,
+        'pares': np.column_stack((numeros[pares[0]], numeros[pares[1]])),
+        'coherencia': coherencia,
+        'coherencia_media': coherencia[en_banda].mean(axis=0),
+        'coherencia_pico': coherencia[pico, np.arange(len(pico))],
+        'frecuencia_pico': frecuencias[pico],
+        'retardo_ms': retardos * 1e3,
+        'correlacion_max': maximos,
+        'coactivacion': coactivacion,
+        'simultaneidad': simultaneidad,
+    }
+
+
+#%% Registro y lectura
+def crear_tabla_coherencia(cursor, tabla_coh='coherencia'):
+    """Crea la tabla de coherencia y su índice por nombre de gesto y par"""
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_coh} (
+        gesto_id INTEGER,
+        canal_a INTEGER,
+        canal_b INTEGER,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        fs INTEGER,
+        nperseg INTEGER,
+        n_segmentos INTEGER,
+        df REAL,
+        coherencia_media REAL,
+        coherencia_pico REAL,
+        frecuencia_pico REAL,
+        retardo_ms REAL,
+        correlacion_max REAL,
+        coactivacion REAL,
+        simultaneidad REAL,
+        coherencia BLOB,
+        fecha TEXT,
+        PRIMARY KEY (gesto_id, canal_a, canal_b)
+    );
+    """)
+    cursor.execute(f"""CREATE INDEX IF NOT EXISTS idx_{tabla_coh}_gesto
+                       ON {tabla_coh} (nombre_gesto, canal_a, canal_b)""")
+
+
+def registrar_coherencia(datos_coh, ruta_db='Datos/datos_gestos_3ch.db',
+                         tabla_coh='coherencia'):
+    """
+    Registra los resultados de 'calcular_coherencia'. Si el gesto ya estaba
+    registrado, se reemplaza.
+    """
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    crear_tabla_coherencia(cursor, tabla_coh)
+    cursor.execute(f"DELETE FROM {tabla_coh} WHERE gesto_id = ?",
+                   (datos_coh['gesto_id'],))
+
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    filas = []
+    for n, (canal_a, canal_b) in enumerate(datos_coh['pares']):
+        filas.append((datos_coh['gesto_id'], int(canal_a), int(canal_b),
+                      datos_coh['sesion_id'], datos_coh['nombre_gesto'],
+                      datos_coh['fs'], datos_coh['nperseg'],
+                      datos_coh['n_segmentos'], datos_coh['df'],
+                      *(float(datos_coh[metrica][n]) for metrica in METRICAS),
+                      datos_coh['coherencia'][:, n].astype(np.float32)
+                      .tobytes(),
+                      fecha))
+    cursor.executemany(f"""
+        INSERT INTO {tabla_coh} (gesto_id, canal_a, canal_b,
+                                 {', '.join(COLUMNAS)})
+        VALUES ({', '.join('?' * (3 + len(COLUMNAS)))})""", filas)
+    conexion.commit()
+    conexion.close()
+
+    print(f"Registrados {len(filas)} pares de '{datos_coh['nombre_gesto']}' "
+          f"con ID {datos_coh['gesto_id']} en la tabla '{tabla_coh}'.")
+
+
+def leer_coherencia(blob, df):
+    """
+    Convierte la coherencia guardada en la tabla en arreglos.
+
+    Return
+    ------
+        frecuencias (np.array): Eje de frecuencias en Hertz
+        coherencia (np.array): Coherencia entre 0 y 1
+    """
+    coherencia = np.frombuffer(blob, dtype=np.float32)
+    return np.arange(len(coherencia)) * df, coherencia
+
+
+def matriz_gesto(conexion, gesto_id, metrica='coherencia_media',
+                 tabla_coh='coherencia'):
+    """
+    Métrica de todos los pares de un gesto como matriz simétrica.
+
+    Return
+    ------
+        canales (list): Números de canal de las filas y columnas
+        matriz (np.array): Arreglo de (n_canales, n_canales), con NaN en la
+                           diagonal
+    """
+    if metrica not in METRICAS:
+        raise ValueError(f"Métrica desconocida: '{metrica}'")
+    cursor = conexion.cursor()
+    cursor.execute(f"""SELECT canal_a, canal_b, {metrica} FROM {tabla_coh}
+                       WHERE gesto_id = ?""", (gesto_id,))
+    filas = cursor.fetchall()
+    canales = sorted({c for fila in filas for c in fila[:2]})
+    posicion = {canal: i for i, canal in enumerate(canales)}
+    matriz = np.full((len(canales), len(canales)), np.nan)
+    for canal_a, canal_b, valor in filas:
+        matriz[posicion[canal_a], posicion[canal_b]] = valor
+        matriz[posicion[canal_b], posicion[canal_a]] = valor
+    return canales, matriz
+
+
+def comparar_gestos(conexion, metrica='coherencia_media', sesion_id=None,
+                    tabla_coh='coherencia'):
+    """
+    Media y desviación estándar de una métrica por nombre de gesto y par de
+    canales, calculadas en SQLite sin leer las muestras ni la coherencia.
+
+    Return
+    ------
+        list: Tuplas (nombre_gesto, canal_a, canal_b, n_gestos, media,
+              desviacion)
+    """
+    if metrica not in METRICAS:
+        raise ValueError(f"Métrica desconocida: '{metrica}'")
+    filtro = "WHERE sesion_id = ?" if sesion_id is not None else ""
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+        SELECT nombre_gesto, canal_a, canal_b, COUNT(*), AVG({metrica}),
+               AVG({metrica} * {metrica}) - AVG({metrica}) * AVG({metrica})
+        FROM {tabla_coh}
+        {filtro}
+        GROUP BY nombre_gesto, canal_a, canal_b
+        ORDER BY nombre_gesto, canal_a, canal_b
+    """, () if sesion_id is None else (sesion_id,))
+    return [(nombre, canal_a, canal_b, n, media,
+             float(np.sqrt(max(varianza or 0.0, 0.0))))
+            for nombre, canal_a, canal_b, n, media, varianza
+            in cursor.fetchall()]
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Calcular la coherencia entre canales de TODOS los gestos de la tabla de
+    datos brutos, salvo los registros de referencia, y mostrar la comparación
+    entre gestos
+    '''
+    perfil = cargar_perfil_cli("Coherencia y co-activación entre canales")
+    ruta_db = perfil.ruta_db
+    tabla_coh = perfil.tabla('coherencia')
+
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"""SELECT DISTINCT gesto_id FROM {perfil.tabla_raw}
+                       WHERE nombre_gesto NOT LIKE '%CVM%'
+                       AND nombre_gesto NOT LIKE '%Reposo%'""")
+    gestos_a_procesar = [fila[0] for fila in cursor.fetchall()]
+
+    for gesto in gestos_a_procesar:
+        datos_coh = calcular_coherencia(gesto, ruta_db, perfil.tabla_raw,
+                                        perfil.fs, perfil.fc, perfil.forden,
+                                        perfil.reescalado, perfil.nperseg,
+                                        perfil.mapa_cvm)
+        registrar_coherencia(datos_coh, ruta_db, tabla_coh)
+    registrar_perfil(conexion, perfil)
+
+    print("\nGesto\tPar\tGestos\tCoherencia media")
+    for nombre, canal_a, canal_b, n, media, desviacion in comparar_gestos(
+            conexion, tabla_coh=tabla_coh):
+        print(f"{nombre}\tCH{canal_a}-CH{canal_b}\t{n}\t"
+              f"{media:.3f} ± {desviacion:.3f}")
+    conexion.close()
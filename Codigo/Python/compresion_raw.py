@@ -0,0 +1,343 @@
+''' Compresión de datos brutos
+
+Almacenamiento comprimido sin pérdida de la tabla 'raw'. Los canales son
+enteros de un ADC de 10 bits, pero en SQLite cada uno ocupa un INTEGER y cada
+fila repite el nombre del gesto, la fecha, etc.
+
+Cada gesto se divide en bloques de 'muestras_por_bloque' muestras. En cada
+bloque:
+    1. Se guardan el onset y los canales como columnas (un canal después del
+       otro), codificados con deltas: la primera muestra tal cual y luego la
+       diferencia con la anterior. Las deltas de una señal EMG son pequeñas y
+       el onset queda casi todo en cero, por lo que se comprimen mucho mejor.
+    2. Las deltas se guardan como int16 (o int32 si no caben) y se comprimen
+       con 'zlib' o 'lzma' de la biblioteca estándar, o con 'zstd' o 'blosc'
+       si están instalados.
+
+Como cada bloque se comprime por separado, se puede leer un gesto o un rango
+de muestras decodificando solo los bloques que lo cubren, sin descomprimir la
+sesión completa.
+
+Cada gesto guarda solo los canales que tiene: en una tabla con más canales
+que el gesto, las columnas de los canales que no capturó son NULL y no se
+comprimen (la columna 'canales' indica cuáles se guardaron). Un canal con
+NULL solo en parte de las muestras no se puede representar sin pérdida, así
+que el gesto no se comprime.
+
+Estructura de la base de datos
+------------------------------
+Tabla 'raw_comprimido_gestos', con los datos de cada gesto:
+        gesto_id: ID del gesto
+       sesion_id: ID de la sesión
+    nombre_gesto: Nombre del gesto
+           fecha: Fecha de la captura, YYYY-MM-DD HH:MM:SS
+              fs: Frecuencia de muestreo en Hertz
+         canales: Números de los canales guardados del gesto, separados por
+                  coma, por ejemplo '1,2,3'
+      n_muestras: Cantidad de muestras del gesto
+
+Tabla 'raw_comprimido', con un bloque por fila:
+        gesto_id: ID del gesto
+          bloque: Número del bloque dentro del gesto (0, 1, ...)
+          inicio: Índice de la primera muestra del bloque dentro del gesto
+      n_muestras: Muestras del bloque
+           codec: Compresor usado ('zlib', 'lzma', 'zstd' o 'blosc')
+           ancho: Bytes por delta (2 para int16, 4 para int32)
+           datos: Deltas comprimidas
+
+Uso
+---
+    python compresion_raw.py [codec]
+
+Comprime todos los gestos de la tabla 'raw' y muestra la razón de compresión
+y la velocidad de decodificación de cada codec disponible.
+
+Bastián Rivas
+'''
+import sqlite3
+import zlib
+import lzma
+import os
+import sys
+import time
+import numpy as np
+
+# Columnas de la tabla 'raw' para N canales
+from esquema_canales import columnas_raw
+from registro_emg import detectar_canales, leer_muestras
+
+# Compresores opcionales
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+
+#%% Compresores
+# (comprimir(datos, ancho), descomprimir(datos)) de cada codec. 'ancho' son
+# los bytes por delta, que blosc usa para su filtro de bytes
+CODECS = {
+    'zlib': (lambda datos, ancho: zlib.compress(datos, 6), zlib.decompress),
+    'lzma': (lambda datos, ancho: lzma.compress(datos, preset=6),
+             lzma.decompress),
+}
+if zstandard is not None:
+    _zstd = zstandard.ZstdCompressor(level=9)
+    CODECS['zstd'] = (lambda datos, ancho: _zstd.compress(datos),
+                      zstandard.ZstdDecompressor().decompress)
+if blosc is not None:
+    CODECS['blosc'] = (lambda datos, ancho: blosc.compress(
+                           datos, typesize=ancho, cname='zstd'),
+                       blosc.decompress)
+
+
+#%% Codificación de un bloque
+def codificar_bloque(muestras, codec='zlib'):
+    """
+    Codifica un bloque de muestras con deltas por columna y lo comprime.
+
+    Parameters
+    ----------
+        muestras (np.array): Enteros de (n_muestras, 1 + canales), con el onset
+                             en la primera columna
+        codec (str): Compresor a usar
+
+    Return
+    ------
+        datos (bytes): Bloque comprimido
+        ancho (int): Bytes por delta
+    """
+    deltas = np.diff(np.asarray(muestras, dtype=np.int64), axis=0,
+                     prepend=0)
+    ancho = 2 if np.abs(deltas).max(initial=0) < 2**15 else 4
+    # Una columna después de la otra, para que las deltas de cada canal queden
+    # juntas
+    columnas = np.ascontiguousarray(deltas.T, dtype=f'<i{ancho}')
+    return CODECS[codec][0](columnas.tobytes(), ancho), ancho
+
+
+def decodificar_bloque(datos, n_columnas, codec='zlib', ancho=2):
+    """
+    Descomprime un bloque y deshace las deltas.
+
+    Return
+    ------
+        np.array: Enteros de (n_muestras, n_columnas)
+    """
+    deltas = np.frombuffer(CODECS[codec][1](datos), dtype=f'<i{ancho}')
+    return np.cumsum(deltas.reshape(n_columnas, -1), axis=1,
+                     dtype=np.int64).T
+
+
+#%% Tablas
+def crear_tablas_comprimidas(cursor, tabla='raw_comprimido'):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla}_gestos (
+        gesto_id INTEGER PRIMARY KEY,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        fecha TEXT,
+        fs INTEGER,
+        canales TEXT,
+        n_muestras INTEGER
+    );
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        gesto_id INTEGER,
+        bloque INTEGER,
+        inicio INTEGER,
+        n_muestras INTEGER,
+        codec TEXT,
+        ancho INTEGER,
+        datos BLOB,
+        PRIMARY KEY (gesto_id, bloque)
+    );
+    """)
+
+
+def comprimir_gesto(conexion, gesto_id, tabla_raw='raw',
+                    tabla='raw_comprimido', codec='zlib',
+                    muestras_por_bloque=4096, canales=None):
+    """
+    Comprime un gesto de la tabla 'raw', reemplazando su versión comprimida
+    anterior si existía. Solo se guardan los canales que el gesto tiene.
+
+    Return
+    ------
+        int: Bytes comprimidos del gesto
+
+    Raises
+    ------
+        ValueError: Si el gesto no existe o si algún canal tiene NULL solo en
+                    parte de las muestras
+    """
+    if canales is None:
+        canales = detectar_canales(conexion, tabla_raw)
+    cursor = conexion.cursor()
+    crear_tablas_comprimidas(cursor, tabla)
+
+    cursor.execute(f"""
+        SELECT MIN(sesion_id), MIN(nombre_gesto), MIN(fecha), MIN(fs),
+               COUNT(*), {', '.join(f'COUNT({c})' for c in columnas_raw(canales))}
+        FROM {tabla_raw}
+        WHERE gesto_id = ?
+    """, (gesto_id,))
+    fila = cursor.fetchone()
+    metadatos, n_filas = fila[:4], fila[4]
+    if n_filas == 0:
+        raise ValueError(f"No existe el gesto con ID {gesto_id} en la tabla "
+                         f"'{tabla_raw}'")
+    # Canales del gesto: sin ningún NULL. Los que son NULL en todas las
+    # muestras no se guardan
+    no_nulos = dict(zip(canales, fila[5:]))
+    incompletos = [c for c, n in no_nulos.items() if 0 < n < n_filas]
+    if incompletos:
+        raise ValueError(f"El gesto {gesto_id} tiene valores NULL en parte "
+                         f"de las muestras de los canales {incompletos}, que "
+                         f"no se pueden comprimir sin pérdida")
+    canales = [c for c, n in no_nulos.items() if n == n_filas]
+    muestras = leer_muestras(cursor, f"""
+        SELECT onset, {', '.join(columnas_raw(canales))}
+        FROM {tabla_raw}
+        WHERE gesto_id = ?
+        ORDER BY id
+    """, (gesto_id,), np.int64)
+
+    cursor.execute(f"DELETE FROM {tabla} WHERE gesto_id = ?", (gesto_id,))
+    cursor.execute(f"""INSERT OR REPLACE INTO {tabla}_gestos
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                   (gesto_id, *metadatos, ",".join(map(str, canales)),
+                    len(muestras)))
+    filas = []
+    for bloque, inicio in enumerate(range(0, len(muestras),
+                                          muestras_por_bloque)):
+        parte = muestras[inicio:inicio + muestras_por_bloque]
+        datos, ancho = codificar_bloque(parte, codec)
+        filas.append((gesto_id, bloque, inicio, len(parte), codec, ancho,
+                      datos))
+    cursor.executemany(f"INSERT INTO {tabla} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       filas)
+    conexion.commit()
+    return sum(len(fila[-1]) for fila in filas)
+
+
+def leer_comprimido(conexion, gesto_id, inicio=0, fin=None,
+                    tabla='raw_comprimido'):
+    """
+    Lee un gesto comprimido, o solo las muestras [inicio, fin), decodificando
+    únicamente los bloques que las contienen.
+
+    Return
+    ------
+        onset (np.array): Onset de las muestras pedidas
+        datos (np.array): Canales, de (n_muestras, canales)
+        canales (list): Número de canal de cada columna de 'datos'
+    """
+    cursor = conexion.cursor()
+    cursor.execute(f"""SELECT canales, n_muestras FROM {tabla}_gestos
+                       WHERE gesto_id = ?""", (gesto_id,))
+    texto_canales, n_muestras = cursor.fetchone()
+    canales = [int(c) for c in texto_canales.split(',')]
+    fin = n_muestras if fin is None else min(fin, n_muestras)
+
+    # Solo los bloques que se cruzan con [inicio, fin)
+    cursor.execute(f"""
+        SELECT inicio, codec, ancho, datos
+        FROM {tabla}
+        WHERE gesto_id = ? AND inicio < ? AND inicio + n_muestras > ?
+        ORDER BY bloque
+    """, (gesto_id, fin, inicio))
+    bloques = cursor.fetchall()
+    if not bloques:
+        return (np.zeros(0, dtype=np.int64),
+                np.zeros((0, len(canales)), dtype=np.int64), canales)
+    muestras = np.concatenate([
+        decodificar_bloque(datos, 1 + len(canales), codec, ancho)
+        for _, codec, ancho, datos in bloques])
+    primera = bloques[0][0]
+    muestras = muestras[inicio - primera:fin - primera]
+    return muestras[:, 0], muestras[:, 1:], canales
+
+
+def comprimir_db(ruta_db, tabla_raw='raw', tabla='raw_comprimido',
+                 codec='zlib', muestras_por_bloque=4096):
+    """
+    Comprime todos los gestos de la tabla de datos brutos.
+
+    Return
+    ------
+        int: Bytes comprimidos en total
+    """
+    conexion = sqlite3.connect(ruta_db)
+    canales = detectar_canales(conexion, tabla_raw)
+    cursor = conexion.cursor()
+    cursor.execute(f"SELECT DISTINCT gesto_id FROM {tabla_raw}")
+    gestos = [fila[0] for fila in cursor.fetchall()]
+    total = sum(comprimir_gesto(conexion, gesto_id, tabla_raw, tabla, codec,
+                                muestras_por_bloque, canales)
+                for gesto_id in gestos)
+    conexion.close()
+    return total
+
+
+def tamano_tabla(conexion, tabla):
+    """Bytes que ocupa una tabla, si SQLite tiene la tabla virtual 'dbstat'"""
+    try:
+        cursor = conexion.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (tabla,))
+        return cursor.fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Comprimir la tabla 'raw' con cada codec disponible y comparar la razón de
+    compresión y la velocidad de decodificación
+    '''
+    ruta_db = 'Datos/datos_gestos_3ch.db'
+    tabla_raw = 'raw'
+    codecs = sys.argv[1:] or list(CODECS)
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+
+    conexion = sqlite3.connect(ruta_db)
+    canales = detectar_canales(conexion, tabla_raw)
+    n_filas = conexion.execute(f"SELECT COUNT(*) FROM {tabla_raw}").fetchone()[0]
+    bytes_sqlite = tamano_tabla(conexion, tabla_raw)
+    # Referencia: onset + canales como int16, sin metadatos
+    bytes_int16 = n_filas * (1 + len(canales)) * 2
+    conexion.close()
+
+    print(f"{n_filas} muestras de {len(canales)} canales")
+    if bytes_sqlite:
+        print(f"Tabla '{tabla_raw}' en SQLite: {bytes_sqlite / 1e6:.2f} MB")
+    print(f"Muestras como int16: {bytes_int16 / 1e6:.2f} MB\n")
+    print("Codec\tComprimido [MB]\tRazón SQLite\tRazón int16\t"
+          "Decodificación [Mmuestras/s]")
+
+    for codec in codecs:
+        tabla = f"raw_comprimido_{codec}"
+        bytes_codec = comprimir_db(ruta_db, tabla_raw, tabla, codec)
+
+        conexion = sqlite3.connect(ruta_db)
+        bloques = conexion.execute(f"""
+            SELECT b.codec, b.ancho, b.datos, g.canales
+            FROM {tabla} AS b JOIN {tabla}_gestos AS g USING (gesto_id)
+        """).fetchall()
+        conexion.close()
+        inicio = time.perf_counter()
+        for codec_bloque, ancho, datos, canales_gesto in bloques:
+            decodificar_bloque(datos, 1 + len(canales_gesto.split(',')),
+                               codec_bloque, ancho)
+        duracion = time.perf_counter() - inicio
+
+        razon_sqlite = f"{bytes_sqlite / bytes_codec:.1f}" if bytes_sqlite else "-"
+        print(f"{codec}\t{bytes_codec / 1e6:.3f}\t\t{razon_sqlite}\t\t"
+              f"{bytes_int16 / bytes_codec:.1f}\t\t"
+              f"{n_filas / duracion / 1e6:.1f}")
@@ -5,34 +5,20 @@ Tras ejecutarlo retorna por consola la ID única, fecha de captura y el nombre d
 cada gesto registrado.
 Bastián Rivas
 '''
-import sqlite3
 import os
 
+# Acceso a la base de datos
+from acceso_datos import BaseDatos
+# Parámetros desde el perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli
+
 # Conectar a la base de datos SQLite
-db_path = 'Datos/datos_gestos_3ch.db'
-nombre_tabla = 'raw'
-conexion = sqlite3.connect(db_path)
-cursor = conexion.cursor()
+perfil = cargar_perfil_cli("Consultar los gestos registrados")
+db_path = perfil.ruta_db
+bd = BaseDatos.desde_perfil(perfil)
 
 # Mostrar la ubicación de la base de datos en consola
 print(f"Usando base de datos en: {os.path.abspath(db_path)}")
 
-# Consultar los datos de gesto_id, fecha y gesto, omitiendo gesto_id repetidos
-cursor.execute(f"""
-    SELECT gesto_id, MIN(fecha), nombre_gesto, sesion_id 
-    FROM {nombre_tabla} 
-    GROUP BY gesto_id
-""")
-datos = cursor.fetchall()
-
-# Imprimir los datos obtenidos por consola
-print(f"""--- Gestos registrados ---
-ID  \tFecha              \tSesión\tNombre del gesto
-----\t-------------------\t------\t----------------
-""")
-for fila in datos:
-    gesto_id, fecha, gesto, sesion_id = fila
-    print(f"{gesto_id}\t{fecha}\t{sesion_id}\t{gesto}")
-
-# Cerrar la conexión a la base de datos
-conexion.close()
+# Imprimir por consola los gestos registrados, omitiendo gesto_id repetidos
+bd.imprimir_gestos()
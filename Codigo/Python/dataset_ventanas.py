@@ -0,0 +1,343 @@
+""" Dataset de ventanas
+Arma un dataset de entrenamiento desde las tablas 'raw' o 'norm' de un perfil:
+todas las ventanas de los gestos en un arreglo float32 de
+(n_ventanas, ventana, canales), con la etiqueta ('nombre_gesto'), la sesión,
+el gesto y la muestra de inicio de cada ventana.
+
+    - Fuentes: 'norm' (% de la CVM, chX_norm), 'envolvente' (volts,
+      chX_env_fil) o 'raw' (volts)
+    - Las ventanas se toman con vistas de sliding_window_view sobre cada región
+      activa (o sobre todo el gesto con 'solo_activos=False'), sin cruzar de
+      una región a otra y sin copiar las muestras hasta escribirlas en float32
+    - Los gestos se ordenan por sesión, así que las ventanas de una sesión son
+      un bloque contiguo y las divisiones por sesión son cortes del arreglo
+      ('DatasetVentanas.dividir_por_sesion', 'DatasetVentanas.por_sesion')
+
+Caché
+-----
+El dataset se guarda en 'cache_dataset/<clave>/' junto a la base de datos, con
+la clave calculada desde los parámetros, la huella del perfil y una huella de
+las filas de la tabla de origen (cantidad de filas e ID máximo de cada gesto).
+Volver a pedir el mismo dataset lo abre con np.load(mmap_mode='r') sin leer la
+base de datos: las ventanas se leen del disco recién al usarlas. Si se
+agregan o se rehacen gestos la clave cambia y el dataset se vuelve a armar.
+
+    Estructura de la carpeta
+    ------------------------
+        ventanas.npy  : float32 de (n_ventanas, ventana, canales)
+        etiquetas.npy : int16, índice en 'clases' de cada ventana
+        sesiones.npy  : int32, sesión de cada ventana
+        gesto_ids.npy : int32, gesto de cada ventana
+        inicios.npy   : int32, muestra de inicio de la ventana en el gesto
+        meta.json     : parámetros, clases y canales
+
+
+Bastián Rivas
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Lecturas con caché y una conexión por proceso
+from acceso_datos import BaseDatos
+# Regiones activas si los segmentos aún no están registrados
+from segmentos_onset import calcular_segmentos
+# Parámetros y tablas de resultados desde un perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli
+
+
+# Fuentes de las ventanas
+FUENTES = ('norm', 'envolvente', 'raw')
+
+# Arreglos por ventana guardados en la caché, con su tipo
+ARREGLOS = {'etiquetas': np.int16, 'sesiones': np.int32,
+            'gesto_ids': np.int32, 'inicios': np.int32}
+
+
+#%% Dataset
+@dataclass
+class DatasetVentanas:
+    """
+    Ventanas etiquetadas de varios gestos.
+
+    Attributes
+    ----------
+        ventanas (np.array): float32 de (n_ventanas, ventana, canales). Un
+                             np.memmap si se abrió desde la caché
+        etiquetas (np.array): Índice en 'clases' de cada ventana
+        clases (list): Nombres de los gestos, en orden alfabético
+        sesiones, gesto_ids, inicios (np.array): Sesión, gesto y muestra de
+                                                 inicio de cada ventana
+        parametros (dict): Parámetros con que se armó, incluidos los canales
+    """
+    ventanas: np.ndarray
+    etiquetas: np.ndarray
+    clases: list
+    sesiones: np.ndarray
+    gesto_ids: np.ndarray
+    inicios: np.ndarray
+    parametros: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.ventanas)
+
+    def subconjunto(self, indices):
+        """
+        Dataset con las ventanas 'indices'. Si los índices son un bloque
+        contiguo se usa un corte, que con la caché sigue siendo un memmap sin
+        leer las ventanas.
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        if len(indices) and np.array_equal(
+                indices, np.arange(indices[0], indices[0] + len(indices))):
+            indices = slice(indices[0], indices[0] + len(indices))
+        return DatasetVentanas(self.ventanas[indices], self.etiquetas[indices],
+                               self.clases, self.sesiones[indices],
+                               self.gesto_ids[indices], self.inicios[indices],
+                               self.parametros)
+
+    def dividir_por_sesion(self, sesiones_prueba):
+        """
+        Divide las ventanas en entrenamiento y prueba según su sesión, para
+        que las ventanas de un mismo gesto (que se solapan) no queden a los dos
+        lados.
+
+        Return
+        ------
+            entrenamiento, prueba (DatasetVentanas)
+        """
+        prueba = np.isin(self.sesiones, list(sesiones_prueba))
+        return self.subconjunto(~prueba), self.subconjunto(prueba)
+
+    def por_sesion(self):
+        """Divisiones dejando fuera una sesión a la vez: (sesión, entrenamiento,
+        prueba)"""
+        for sesion in np.unique(self.sesiones):
+            yield (int(sesion),) + self.dividir_por_sesion([sesion])
+
+    def resumen(self):
+        """Ventanas por clase y por sesión, como texto"""
+        lineas = [f"{len(self)} ventanas de {self.ventanas.shape[1:]} "
+                  f"(muestras, canales), canales "
+                  f"{self.parametros.get('canales')}"]
+        for i, clase in enumerate(self.clases):
+            por_sesion = {int(s): int(n) for s, n in zip(*np.unique(
+                self.sesiones[self.etiquetas == i], return_counts=True))}
+            lineas.append(f"  {clase}: {sum(por_sesion.values())} "
+                          f"(por sesión: {por_sesion})")
+        return "\n".join(lineas)
+
+
+#%% Ventanas
+def ventanas_region(region, ventana, paso):
+    """
+    Vista de las ventanas de una región, de (n, ventana, canales), sin copiar
+    las muestras. Vacía si la región es más corta que la ventana.
+    """
+    if len(region) < ventana:
+        return np.empty((0, ventana, region.shape[1]), dtype=region.dtype)
+    vistas = np.lib.stride_tricks.sliding_window_view(region, ventana, axis=0)
+    return vistas[::paso].swapaxes(1, 2)
+
+
+def _leer_gesto(bd, gesto_id, fuente, canales, solo_activos):
+    """Señal del gesto y las regiones [inicio, fin) de donde tomar ventanas"""
+    if fuente == 'raw':
+        registro = bd.obtener_raw(gesto_id, canales)
+    else:
+        envolvente, normalizada = bd.obtener_norm(gesto_id, canales)
+        registro = normalizada if fuente == 'norm' else envolvente
+    if solo_activos:
+        regiones = registro.segmentos
+        if regiones is None:
+            regiones = calcular_segmentos(registro.onset)
+    else:
+        regiones = np.array([[0, registro.n_muestras]])
+    return registro, regiones
+
+
+def _seleccion(bd, tabla, sesiones, gesto, incluir_referencias):
+    """Gestos a usar, ordenados por sesión y gesto_id"""
+    gestos = bd.listar_gestos(tabla, nombre_gesto=gesto)
+    if sesiones is not None:
+        gestos = [g for g in gestos if g[2] in set(sesiones)]
+    if not incluir_referencias:
+        gestos = [g for g in gestos
+                  if 'CVM' not in g[3] and 'Reposo' not in g[3]]
+    return sorted(gestos, key=lambda g: (g[2], g[0]))
+
+
+def clave_dataset(bd, tabla, gestos, parametros):
+    """
+    Clave de la caché: hash de los parámetros y de la cantidad de filas y el
+    ID máximo de cada gesto en la tabla de origen.
+    """
+    ids = [gesto[0] for gesto in gestos]
+    marcas = []
+    for inicio in range(0, len(ids), 500):
+        bloque = ids[inicio:inicio + 500]
+        cursor = bd.conexion.execute(f"""
+            SELECT gesto_id, COUNT(*), MAX(id)
+            FROM {tabla}
+            WHERE gesto_id IN ({', '.join('?' * len(bloque))})
+            GROUP BY gesto_id
+            ORDER BY gesto_id""", bloque)
+        marcas += cursor.fetchall()
+    texto = json.dumps([parametros, marcas], sort_keys=True)
+    return hashlib.sha1(texto.encode()).hexdigest()[:12]
+
+
+def construir_dataset(perfil, fuente='norm', ventana=200, paso=50,
+                      solo_activos=True, sesiones=None, gesto=None,
+                      canales=None, incluir_referencias=False,
+                      cache=True, directorio_cache=None):
+    """
+    Dataset de ventanas etiquetadas de los gestos de un perfil.
+
+    Parameters
+    ----------
+    - "perfil": Perfil de procesamiento (base de datos, tablas y reescalado)
+    - "fuente": 'norm', 'envolvente' o 'raw'
+    - "ventana", "paso": Largo de las ventanas y paso entre ventanas, en
+      muestras
+    - "solo_activos": Tomar ventanas solo de las regiones con onset = 1
+    - "sesiones", "gesto": Filtrar por sesiones (lista) y por nombre (LIKE)
+    - "canales": Canales a usar. Por defecto todos los de la tabla
+    - "incluir_referencias": Incluir los registros de CVM y reposo
+    - "cache": Guardar el dataset en disco y abrirlo desde ahí si ya existe
+    - "directorio_cache": Carpeta de la caché. Por defecto 'cache_dataset'
+      junto a la base de datos
+
+    Return
+    ------
+        dataset: DatasetVentanas
+    """
+    if fuente not in FUENTES:
+        raise ValueError(f"Fuente desconocida: '{fuente}'. Opciones: "
+                         f"{', '.join(FUENTES)}")
+    if ventana < 1 or paso < 1:
+        raise ValueError("La ventana y el paso deben ser de al menos una "
+                         "muestra")
+
+    bd = BaseDatos.desde_perfil(perfil, tamano_cache=1)
+    tabla = bd.tabla_raw if fuente == 'raw' else bd.tabla_norm
+    if canales is None:
+        canales = (bd.canales() if fuente == 'raw'
+                   else bd.canales(tabla, 'ch{}_env_fil'))
+    gestos = _seleccion(bd, tabla, sesiones, gesto, incluir_referencias)
+    if not gestos:
+        raise ValueError(f"No hay gestos que cumplan el filtro en '{tabla}'")
+
+    parametros = dict(huella=perfil.huella, tabla=tabla, fuente=fuente,
+                      ventana=int(ventana), paso=int(paso),
+                      solo_activos=bool(solo_activos),
+                      canales=[int(c) for c in canales])
+    if cache:
+        if directorio_cache is None:
+            directorio_cache = os.path.join(
+                os.path.dirname(os.path.abspath(perfil.ruta_db)),
+                'cache_dataset')
+        carpeta = os.path.join(directorio_cache,
+                               clave_dataset(bd, tabla, gestos, parametros))
+        if os.path.exists(os.path.join(carpeta, 'meta.json')):
+            return abrir_dataset(carpeta)
+
+    # Primera pasada: leer los gestos y contar sus ventanas
+    clases = sorted({g[3] for g in gestos})
+    leidos, total = [], 0
+    for gesto_id, _, sesion_id, nombre in gestos:
+        registro, regiones = _leer_gesto(bd, gesto_id, fuente, canales,
+                                         solo_activos)
+        cuentas = [max(0, (fin - inicio - ventana) // paso + 1)
+                   for inicio, fin in regiones]
+        leidos.append((registro, regiones, clases.index(nombre), sesion_id))
+        total += int(sum(cuentas))
+    bd.limpiar_cache()
+
+    # Segunda pasada: escribir las ventanas en float32, en disco o en memoria
+    forma = (total, ventana, len(canales))
+    if cache:
+        temporal = f"{carpeta}.{os.getpid()}.tmp"
+        os.makedirs(temporal, exist_ok=True)
+        ventanas = np.lib.format.open_memmap(
+            os.path.join(temporal, 'ventanas.npy'), mode='w+',
+            dtype=np.float32, shape=forma)
+    else:
+        ventanas = np.empty(forma, dtype=np.float32)
+    arreglos = {nombre: np.empty(total, dtype=tipo)
+                for nombre, tipo in ARREGLOS.items()}
+    fila = 0
+    for registro, regiones, etiqueta, sesion_id in leidos:
+        for inicio, fin in regiones:
+            vistas = ventanas_region(registro.datos[inicio:fin], ventana,
+                                     paso)
+            siguiente = fila + len(vistas)
+            ventanas[fila:siguiente] = vistas
+            arreglos['etiquetas'][fila:siguiente] = etiqueta
+            arreglos['sesiones'][fila:siguiente] = sesion_id
+            arreglos['gesto_ids'][fila:siguiente] = registro.gesto_id
+            arreglos['inicios'][fila:siguiente] = (
+                inicio + np.arange(len(vistas)) * paso)
+            fila = siguiente
+
+    dataset = DatasetVentanas(ventanas, clases=clases, parametros=parametros,
+                              **arreglos)
+    if cache:
+        ventanas.flush()
+        del ventanas, dataset
+        guardar_dataset_meta(temporal, arreglos, clases, parametros)
+        # Si otro proceso armó el mismo dataset, se usa el suyo
+        try:
+            os.rename(temporal, carpeta)
+        except OSError:
+            shutil.rmtree(temporal, ignore_errors=True)
+        return abrir_dataset(carpeta)
+    return dataset
+
+
+#%% Caché en disco
+def guardar_dataset_meta(carpeta, arreglos, clases, parametros):
+    """Guarda los arreglos por ventana y 'meta.json' en la carpeta"""
+    for nombre, arreglo in arreglos.items():
+        np.save(os.path.join(carpeta, f"{nombre}.npy"), arreglo)
+    with open(os.path.join(carpeta, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'clases': clases, 'parametros': parametros,
+                   'fecha': time.strftime('%Y-%m-%d %H:%M:%S')}, f,
+                  ensure_ascii=False, indent=2)
+
+
+def abrir_dataset(carpeta):
+    """Abre un dataset de la caché, con las ventanas como memmap"""
+    with open(os.path.join(carpeta, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    arreglos = {nombre: np.load(os.path.join(carpeta, f"{nombre}.npy"))
+                for nombre in ARREGLOS}
+    ventanas = np.load(os.path.join(carpeta, 'ventanas.npy'), mmap_mode='r')
+    return DatasetVentanas(ventanas, clases=meta['clases'],
+                           parametros=meta['parametros'], **arreglos)
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Armar (o abrir desde la caché) el dataset de la señal normalizada y
+    dividirlo dejando la última sesión como prueba
+    '''
+    perfil = cargar_perfil_cli("Dataset de ventanas de los gestos")
+    for intento in ("Armado", "Desde la caché"):
+        inicio = time.perf_counter()
+        dataset = construir_dataset(perfil, 'norm', ventana=200, paso=50)
+        print(f"{intento}: {(time.perf_counter() - inicio) * 1e3:.1f} ms")
+    print(dataset.resumen())
+
+    ultima = int(dataset.sesiones.max())
+    entrenamiento, prueba = dataset.dividir_por_sesion([ultima])
+    print(f"Entrenamiento: {len(entrenamiento)} ventanas, prueba (sesión "
+          f"{ultima}): {len(prueba)} ventanas")
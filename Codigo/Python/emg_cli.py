@@ -0,0 +1,994 @@
+''' Línea de comandos unificada
+Un solo punto de entrada para todas las etapas, sin preguntas por consola,
+para poder ejecutarlas desde cron, en pipelines o en paralelo:
+
+    python emg_cli.py listar --sesion 2
+    python emg_cli.py normalizar --ids 1-40,52 --procesos 4
+    python emg_cli.py fft --perfil perfiles/fc_100.toml --sesion 3
+    python emg_cli.py graficar --tipo fft --ids 10-20 --salida figuras/fft
+
+Subcomandos (entre paréntesis, el alias en inglés):
+    capturar (capture)    Captura un gesto desde el puerto serial
+    listar (list)         Lista los gestos de una tabla
+    normalizar (normalize) Envolvente y normalización por CVM -> 'norm'
+    fft                   FFT, RMS y SNR de los gestos normalizados -> 'fft'
+    coherencia (coherence) Coherencia, retardos y co-activación entre canales
+                          -> 'coherencia'
+    similares (similar)   Gestos más parecidos según su firma -> 'similitud'
+    welch                 Figuras de la PSD de Welch de las regiones activas
+    graficar (plot)       Figuras de la señal bruta o de su FFT
+    detectar (detect)     Detección de gestos en vivo (Demo/detectar_3ch.py),
+                          o reproducida desde la base de datos
+    exportar (export)     Exporta las tablas a Parquet
+    dataset               Ventanas etiquetadas para entrenar, con caché en
+                          disco
+    bench                 Benchmarks de canales, kernels, FFT y arranque
+
+Todos los subcomandos que usan la base de datos aceptan las opciones del
+perfil de procesamiento ('--perfil', '--db', '--fc', ...). Los gestos se
+eligen con '--ids' (por ejemplo '1-5,8,10-12'), '--sesion' y '--gesto'.
+
+Los cálculos se reparten en un pool de procesos ('--procesos'): los procesos
+solo leen la base de datos y este proceso escribe los resultados a medida que
+llegan. Los gestos que ya están en la tabla de resultados del perfil se
+omiten, salvo con '--rehacer'. El avance se imprime por gesto como
+'[k/n] Gesto <id> ...'.
+
+Códigos de salida
+-----------------
+    0: Todo terminó bien
+    1: Algún gesto falló, o hubo un error con la base de datos o el puerto
+    2: Argumentos inválidos
+  130: Interrumpido con Ctrl+C
+
+Bastián Rivas
+'''
+import sqlite3
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Perfil de procesamiento y tablas de resultados
+from perfil_procesamiento import (agregar_argumentos, perfil_desde_argumentos,
+                                  registrar_perfil)
+# Lecturas con conexión por proceso
+from acceso_datos import BaseDatos
+from segmentos_onset import obtener_segmentos
+from referencia_sesion import obtener_referencia
+# Tiempos por etapa y perfiladores
+import instrumentacion
+# Métricas de la tabla de coherencia, para validar '--comparar'
+from coherencia_canales import METRICAS as METRICAS_COHERENCIA
+
+
+# Códigos de salida
+SALIDA_OK = 0
+SALIDA_FALLOS = 1
+SALIDA_ARGUMENTOS = 2
+SALIDA_INTERRUMPIDA = 130
+
+# Carpeta de la demo de detección
+DIRECTORIO_DEMO = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               os.pardir, 'Demo')
+
+
+#%% Selección de gestos
+def parsear_ids(texto):
+    """
+    Lista de IDs a partir de rangos como '1-5,8,10-12'.
+
+    Return
+    ------
+        list: IDs ordenados y sin repetir
+    """
+    ids = set()
+    for parte in texto.split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        inicio, _, fin = parte.partition('-')
+        try:
+            inicio = int(inicio)
+            fin = int(fin) if fin else inicio
+        except ValueError:
+            raise ValueError(f"Rango de IDs inválido: '{parte}'")
+        if fin < inicio:
+            raise ValueError(f"Rango de IDs inválido: '{parte}'")
+        ids.update(range(inicio, fin + 1))
+    if not ids:
+        raise ValueError("No se indicó ningún ID")
+    return sorted(ids)
+
+
+def _tipo_ids(texto):
+    """Tipo de argparse para '--ids'"""
+    try:
+        return parsear_ids(texto)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def seleccionar_gestos(bd, tabla, ids=None, sesion_id=None, nombre_gesto=None):
+    """
+    Gestos de una tabla que cumplen los filtros.
+
+    Parameters
+    ----------
+        bd (BaseDatos): Acceso a la base de datos
+        tabla (str): Tabla donde buscar los gestos
+        ids (list): IDs pedidos. Por defecto, todos
+        sesion_id (int): Filtrar por sesión
+        nombre_gesto (str): Filtrar por nombre, con comodines de LIKE
+
+    Return
+    ------
+        tuple: (gestos, faltantes). 'gestos' es una lista de
+               (gesto_id, fecha, sesion_id, nombre_gesto) y 'faltantes' los
+               IDs pedidos que no están en la tabla
+    """
+    gestos = bd.listar_gestos(tabla, sesion_id, nombre_gesto)
+    if ids is None:
+        return gestos, []
+    pedidos = set(ids)
+    encontrados = {gesto[0] for gesto in gestos}
+    return ([gesto for gesto in gestos if gesto[0] in pedidos],
+            sorted(pedidos - encontrados))
+
+
+def gestos_registrados(conexion, tabla):
+    """IDs de los gestos que ya están en una tabla de resultados"""
+    try:
+        cursor = conexion.execute(f"SELECT DISTINCT gesto_id FROM {tabla}")
+    except sqlite3.OperationalError:
+        # La tabla aún no existe
+        return set()
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def borrar_gesto(conexion, tabla, gesto_id):
+    """Borra las filas de un gesto en una tabla de resultados"""
+    conexion.execute(f"DELETE FROM {tabla} WHERE gesto_id = ?", (gesto_id,))
+    conexion.commit()
+
+
+#%% Ejecución de tareas con avance
+def _cronometrar(funcion, argumentos, instrumentar=False):
+    """
+    Ejecuta 'funcion(**argumentos)' y retorna (resultado, segundos,
+    mediciones). Con 'instrumentar', las mediciones son los tiempos por etapa
+    de esta llamada, para enviarlos desde el pool al proceso principal
+    """
+    if instrumentar:
+        instrumentacion.reiniciar()
+        instrumentacion.activar()
+    inicio = time.perf_counter()
+    resultado = funcion(**argumentos)
+    segundos = time.perf_counter() - inicio
+    return (resultado, segundos,
+            instrumentacion.exportar() if instrumentar else None)
+
+
+def ejecutar_tareas(funcion, tareas, guardar=None, procesos=None):
+    """
+    Ejecuta una función por gesto, en un pool de procesos o en este mismo
+    proceso, e imprime el avance a medida que termina cada gesto.
+
+    Parameters
+    ----------
+        funcion (callable): Función a nivel de módulo, para poder enviarla al
+                            pool. Recibe los argumentos de cada tarea
+        tareas (list): Pares (gesto_id, argumentos como dict)
+        guardar (callable): Recibe (gesto_id, resultado) en este proceso, por
+                            ejemplo para escribir en la base de datos. Puede
+                            retornar un texto para la línea de avance
+        procesos (int): Procesos del pool. Por defecto uno por núcleo; con 1
+                        se calcula en este mismo proceso
+
+    Return
+    ------
+        int: Cantidad de gestos que fallaron
+    """
+    n_tareas = len(tareas)
+    fallidos = 0
+
+    def terminar(n, gesto_id, obtener):
+        nonlocal fallidos
+        try:
+            resultado, segundos, mediciones = obtener()
+            if mediciones:
+                instrumentacion.combinar(mediciones)
+            detalle = guardar(gesto_id, resultado) if guardar else None
+        except Exception as error:
+            fallidos += 1
+            print(f"[{n}/{n_tareas}] Gesto {gesto_id}: error: {error}",
+                  file=sys.stderr, flush=True)
+            return
+        print(f"[{n}/{n_tareas}] Gesto {gesto_id}: {segundos:.2f} s"
+              + (f"  {detalle}" if detalle else ""), flush=True)
+
+    if procesos == 1 or n_tareas <= 1:
+        for n, (gesto_id, argumentos) in enumerate(tareas, 1):
+            terminar(n, gesto_id,
+                     lambda: _cronometrar(funcion, argumentos))
+    else:
+        # Los tiempos por etapa de cada proceso del pool vuelven con el 
+        # resultado
+        instrumentar = instrumentacion.activa()
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = {pool.submit(_cronometrar, funcion, argumentos,
+                                   instrumentar): gesto_id
+                       for gesto_id, argumentos in tareas}
+            for n, futuro in enumerate(as_completed(futuros), 1):
+                terminar(n, futuros[futuro], futuro.result)
+    return fallidos
+
+
+def preparar_sesiones(conexion, perfil, gestos, canales):
+    """
+    Calcula en este proceso las referencias de cada sesión y los segmentos de
+    onset que falten, para que los procesos del pool solo lean la base de
+    datos.
+
+    Return
+    ------
+        set: Sesiones cuya referencia no se pudo calcular (por ejemplo, sin
+             registro 'Reposo' o sin CVM)
+    """
+    fallidas = set()
+    for sesion_id in sorted({gesto[2] for gesto in gestos}):
+        try:
+            obtener_referencia(conexion, sesion_id, perfil.tabla_raw,
+                               perfil.fs, perfil.fc, perfil.forden,
+                               perfil.reescalado, canales,
+                               mapa_cvm=perfil.mapa_cvm,
+                               nperseg=perfil.nperseg)
+        except Exception as error:
+            print(f"Sesión {sesion_id}: sin referencia: {error}",
+                  file=sys.stderr)
+            fallidas.add(sesion_id)
+    for gesto in gestos:
+        obtener_segmentos(conexion, gesto[0], tabla_raw=perfil.tabla_raw)
+    return fallidas
+
+
+def _informar_faltantes(faltantes, tabla):
+    if faltantes:
+        print(f"IDs sin registros en '{tabla}': "
+              f"{', '.join(map(str, faltantes))}", file=sys.stderr)
+    return len(faltantes)
+
+
+def _pendientes(conexion, tabla, gestos, rehacer):
+    """Gestos a calcular: sin los que ya están en 'tabla', salvo al rehacer"""
+    if rehacer:
+        return gestos
+    registrados = gestos_registrados(conexion, tabla)
+    pendientes = [gesto for gesto in gestos if gesto[0] not in registrados]
+    if len(pendientes) < len(gestos):
+        print(f"Omitiendo {len(gestos) - len(pendientes)} gestos ya "
+              f"registrados en '{tabla}' (usar --rehacer para recalcular)")
+    return pendientes
+
+
+#%% Subcomandos
+def comando_listar(args, perfil):
+    bd = BaseDatos.desde_perfil(perfil)
+    tabla = (perfil.tabla_raw if args.tabla == 'raw' 
+             else perfil.tabla(args.tabla))
+    gestos, faltantes = seleccionar_gestos(bd, tabla, args.ids, args.sesion,
+                                           args.gesto)
+    print("ID\tFecha\tSesión\tNombre del gesto")
+    for gesto_id, fecha, sesion_id, nombre_gesto in gestos:
+        print(f"{gesto_id}\t{fecha}\t{sesion_id}\t{nombre_gesto}")
+    return SALIDA_FALLOS if _informar_faltantes(faltantes, tabla) else SALIDA_OK
+
+
+def comando_normalizar(args, perfil):
+    from emg_cvm_norm_sql import normalizar_3ch_sql, registrar_datos_norm
+
+    bd = BaseDatos.desde_perfil(perfil)
+    tabla_norm = perfil.tabla('norm')
+    gestos, faltantes = seleccionar_gestos(bd, perfil.tabla_raw, args.ids,
+                                           args.sesion, args.gesto)
+    fallidos = _informar_faltantes(faltantes, perfil.tabla_raw)
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    gestos = _pendientes(conexion, tabla_norm, gestos, args.rehacer)
+    print(f"Perfil '{perfil.nombre}' ({perfil.huella}): {len(gestos)} gestos "
+          f"a normalizar en '{tabla_norm}'", flush=True)
+    sin_referencia = preparar_sesiones(conexion, perfil, gestos, bd.canales())
+    fallidos += sum(gesto[2] in sin_referencia for gesto in gestos)
+
+    tareas = [(gesto[0], dict(gesto_id=gesto[0], ruta_db=perfil.ruta_db,
+                              tabla_raw=perfil.tabla_raw, fs=perfil.fs,
+                              fc=perfil.fc, forden=perfil.forden,
+                              reescalado=perfil.reescalado,
+                              mapa_cvm=perfil.mapa_cvm,
+                              fs_norm=perfil.fs_norm,
+                              solo_envolvente=perfil.solo_envolvente,
+                              nperseg=perfil.nperseg))
+              for gesto in gestos if gesto[2] not in sin_referencia]
+
+    normalizados = []
+
+    def guardar(gesto_id, datos_norm):
+        if args.rehacer:
+            borrar_gesto(conexion, tabla_norm, gesto_id)
+        registrar_datos_norm(datos_norm, perfil.ruta_db, tabla_norm)
+        normalizados.append(gesto_id)
+
+    fallidos += ejecutar_tareas(normalizar_3ch_sql, tareas, guardar,
+                                args.procesos)
+    registrar_perfil(conexion, perfil)
+    conexion.close()
+
+    # Firmas de los gestos recién normalizados en el índice de similitud
+    nombres = {gesto[0]: gesto[3] for gesto in gestos}
+    normalizados = [gesto_id for gesto_id in normalizados
+                    if 'CVM' not in nombres[gesto_id]
+                    and 'Reposo' not in nombres[gesto_id]]
+    if normalizados and not args.sin_indice:
+        from indice_similitud import actualizar_indice
+        agregados, sin_firma = actualizar_indice(perfil, normalizados,
+                                                 rehacer=True)
+        print(f"{len(agregados)} firmas en '{perfil.tabla('similitud')}'")
+        for gesto_id, error in sin_firma.items():
+            print(f"Gesto {gesto_id}: sin firma ({error})")
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def comando_fft(args, perfil):
+    from generar_tabla_fft_gestos import calcular_fft_snr, registrar_datos_fft
+
+    bd = BaseDatos.desde_perfil(perfil)
+    tabla_norm, tabla_fft = perfil.tabla('norm'), perfil.tabla('fft')
+    gestos, faltantes = seleccionar_gestos(bd, tabla_norm, args.ids,
+                                           args.sesion, args.gesto)
+    fallidos = _informar_faltantes(faltantes, tabla_norm)
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    gestos = _pendientes(conexion, tabla_fft, gestos, args.rehacer)
+    print(f"Perfil '{perfil.nombre}' ({perfil.huella}): {len(gestos)} gestos "
+          f"de '{tabla_norm}' a '{tabla_fft}'", flush=True)
+    sin_referencia = preparar_sesiones(conexion, perfil, gestos,
+                                       bd.canales(tabla_norm, 'ch{}_env_fil'))
+    fallidos += sum(gesto[2] in sin_referencia for gesto in gestos)
+
+    tareas = [(gesto[0], dict(gesto_id=gesto[0], ruta_db=perfil.ruta_db,
+                              tabla_norm=tabla_norm, fs=perfil.fs,
+                              tabla_raw=perfil.tabla_raw,
+                              forden=perfil.forden,
+                              reescalado=perfil.reescalado,
+                              mapa_cvm=perfil.mapa_cvm,
+                              modo_fft=args.largo_fft,
+                              workers=args.hilos_fft,
+                              nperseg=perfil.nperseg))
+              for gesto in gestos if gesto[2] not in sin_referencia]
+
+    def guardar(gesto_id, datos_fft):
+        if args.rehacer:
+            borrar_gesto(conexion, tabla_fft, gesto_id)
+        registrar_datos_fft(datos_fft, perfil.ruta_db, tabla_fft)
+
+    fallidos += ejecutar_tareas(calcular_fft_snr, tareas, guardar,
+                                args.procesos)
+    registrar_perfil(conexion, perfil)
+    conexion.close()
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def _graficar_gesto(perfil, tipo, gesto_id, directorio):
+    """Grafica un gesto sin ventanas y retorna la ruta de la figura"""
+    import matplotlib
+    matplotlib.use('Agg')
+    bd = BaseDatos.desde_perfil(perfil)
+    if tipo == 'raw':
+        from graficar_datos_3ch import graficar_raw
+        return graficar_raw(bd.obtener_raw(gesto_id), directorio)
+    registro = bd.obtener_raw(gesto_id, activos=True)
+    if tipo == 'fft':
+        from fft_datos_3ch import graficar_fft_activos
+        return graficar_fft_activos(registro, directorio)
+    from welch_datos_3ch import graficar_welch_activos
+    return graficar_welch_activos(registro, perfil.nperseg, directorio)
+
+
+def _comando_figuras(args, perfil, tipo):
+    bd = BaseDatos.desde_perfil(perfil)
+    gestos, faltantes = seleccionar_gestos(bd, perfil.tabla_raw, args.ids,
+                                           args.sesion, args.gesto)
+    fallidos = _informar_faltantes(faltantes, perfil.tabla_raw)
+    directorio = args.salida or os.path.join('fig_3ch', tipo)
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    for gesto in gestos:
+        obtener_segmentos(conexion, gesto[0], tabla_raw=perfil.tabla_raw)
+    conexion.close()
+
+    tareas = [(gesto[0], dict(perfil=perfil, tipo=tipo, gesto_id=gesto[0],
+                              directorio=directorio))
+              for gesto in gestos]
+    fallidos += ejecutar_tareas(_graficar_gesto, tareas,
+                                lambda gesto_id, ruta: ruta, args.procesos)
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def comando_coherencia(args, perfil):
+    from coherencia_canales import (calcular_coherencia, registrar_coherencia,
+                                    comparar_gestos)
+
+    bd = BaseDatos.desde_perfil(perfil)
+    tabla_coh = perfil.tabla('coherencia')
+    gestos, faltantes = seleccionar_gestos(bd, perfil.tabla_raw, args.ids,
+                                           args.sesion, args.gesto)
+    fallidos = _informar_faltantes(faltantes, perfil.tabla_raw)
+    # Los registros de referencia no son gestos
+    gestos = [gesto for gesto in gestos
+              if 'CVM' not in gesto[3] and 'Reposo' not in gesto[3]]
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    gestos = _pendientes(conexion, tabla_coh, gestos, args.rehacer)
+    print(f"Perfil '{perfil.nombre}' ({perfil.huella}): {len(gestos)} gestos "
+          f"a analizar en '{tabla_coh}'", flush=True)
+    sin_referencia = preparar_sesiones(conexion, perfil, gestos, bd.canales())
+    fallidos += sum(gesto[2] in sin_referencia for gesto in gestos)
+
+    tareas = [(gesto[0], dict(gesto_id=gesto[0], ruta_db=perfil.ruta_db,
+                              tabla_raw=perfil.tabla_raw, fs=perfil.fs,
+                              fc=perfil.fc, forden=perfil.forden,
+                              reescalado=perfil.reescalado,
+                              nperseg=perfil.nperseg,
+                              mapa_cvm=perfil.mapa_cvm,
+                              banda=tuple(args.banda),
+                              max_retardo=args.max_retardo / 1e3,
+                              umbral=args.umbral))
+              for gesto in gestos if gesto[2] not in sin_referencia]
+
+    def guardar(gesto_id, datos_coh):
+        registrar_coherencia(datos_coh, perfil.ruta_db, tabla_coh)
+        return "  ".join(f"CH{a}-CH{b} {c:.2f}" for (a, b), c
+                         in zip(datos_coh['pares'],
+                                datos_coh['coherencia_media']))
+
+    fallidos += ejecutar_tareas(calcular_coherencia, tareas, guardar,
+                                args.procesos)
+    registrar_perfil(conexion, perfil)
+
+    if args.comparar and gestos_registrados(conexion, tabla_coh):
+        print(f"\nGesto\tPar\tGestos\t{args.comparar}")
+        for nombre, canal_a, canal_b, n, media, desviacion in comparar_gestos(
+                conexion, args.comparar, args.sesion, tabla_coh):
+            print(f"{nombre}\tCH{canal_a}-CH{canal_b}\t{n}\t"
+                  f"{media:.3f} ± {desviacion:.3f}")
+    conexion.close()
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def comando_similares(args, perfil):
+    from indice_similitud import (IndiceSimilitud, actualizar_indice,
+                                  calcular_firma)
+
+    tabla_sim = perfil.tabla('similitud')
+    if args.actualizar:
+        agregados, _ = actualizar_indice(perfil)
+        print(f"{len(agregados)} firmas nuevas en '{tabla_sim}'")
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    indice = IndiceSimilitud.desde_db(conexion, tabla_sim,
+                                      peso_envolvente=args.peso_envolvente,
+                                      peso_bandas=args.peso_bandas)
+    conexion.close()
+    if len(indice) < 2:
+        print(f"La tabla '{tabla_sim}' tiene {len(indice)} firmas. Normalizar "
+              f"los gestos o usar --actualizar", file=sys.stderr)
+        return SALIDA_FALLOS
+
+    if args.revisar:
+        print("ID\tGesto\tVecinos\tAcuerdo\tAtípico")
+        for fila in indice.revisar_etiquetas(args.k):
+            print(f"{fila['gesto_id']}\t{fila['nombre_gesto']}\t"
+                  f"{fila['etiqueta_vecinos']}\t{fila['acuerdo']:.2f}\t"
+                  f"{fila['atipico']:.2f}"
+                  + ("\t<- revisar" if fila['sospechoso'] else ""))
+        return SALIDA_OK
+
+    fallidos = 0
+    firmas = {firma['gesto_id']: firma for firma in indice.firmas}
+    for gesto_id in args.ids or []:
+        firma = firmas.get(gesto_id)
+        if firma is None:
+            # Gesto normalizado que aún no está en el índice
+            try:
+                firma = calcular_firma(gesto_id, perfil.ruta_db,
+                                       perfil.tabla('norm'), perfil.tabla_raw,
+                                       perfil.fs, perfil.reescalado,
+                                       perfil.nperseg)
+            except ValueError as error:
+                print(f"Gesto {gesto_id}: {error}", file=sys.stderr)
+                fallidos += 1
+                continue
+        inicio = time.perf_counter()
+        vecinos, n_dtw = indice.vecinos(firma, args.k, args.dtw, args.radio)
+        tiempo = (time.perf_counter() - inicio) * 1e3
+        print(f"\nGesto {gesto_id} ({firma['nombre_gesto']}), {tiempo:.1f} ms"
+              + (f", DTW en {n_dtw}/{len(indice) - 1} candidatos"
+                 if args.dtw else ""))
+        for vecino_id, nombre, distancia in vecinos:
+            print(f"  {vecino_id}\t{nombre}\t{distancia:.3f}")
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def comando_graficar(args, perfil):
+    return _comando_figuras(args, perfil, args.tipo)
+
+
+def comando_welch(args, perfil):
+    return _comando_figuras(args, perfil, 'welch')
+
+
+def comando_capturar(args, perfil):
+    import serial
+    from lectura_3ch_rawEMG import capturar
+
+    try:
+        gesto_id, telemetria = capturar(
+            perfil, args.nombre, args.sesion, args.puerto, args.canales,
+            args.duracion, args.wal, args.max_perdida_ms,
+            mostrar_muestras=not args.silencioso,
+            intervalo_estado=args.intervalo_estado,
+            ajustar_fs=not args.fs_nominal)
+    except serial.SerialException as error:
+        print(f"Error al acceder al puerto serial: {error}", file=sys.stderr)
+        return SALIDA_FALLOS
+    print(f"Gesto {gesto_id}: {telemetria.n_muestras} muestras, fs medida "
+          f"{telemetria.fs_medida:.1f} Hz")
+    return SALIDA_OK if telemetria.n_muestras else SALIDA_FALLOS
+
+
+def _config_deteccion(args):
+    from maquina_gestos import ConfigDeteccion
+
+    if args.legado:
+        return ConfigDeteccion.legado(args.umbrales, args.ventana or 100)
+    opciones = dict(ventana=args.ventana, salto=args.salto, votos=args.votos,
+                    histeresis=args.histeresis, permanencia=args.permanencia,
+                    prioridad=args.prioridad)
+    return ConfigDeteccion(umbrales=tuple(args.umbrales),
+                           **{clave: valor for clave, valor in opciones.items()
+                              if valor is not None})
+
+
+def _reproducir_deteccion(args, perfil, config):
+    from dataclasses import replace
+    from maquina_gestos import (ConfigDeteccion, reproducir,
+                                metricas_reproduccion, resumir_metricas)
+    from registro_emg import RegistroEMG
+
+    bd = BaseDatos.desde_perfil(perfil)
+    gestos, faltantes = seleccionar_gestos(bd, perfil.tabla_raw, args.ids,
+                                           args.sesion, args.gesto)
+    fallidos = _informar_faltantes(faltantes, perfil.tabla_raw)
+    if not gestos:
+        print("No hay gestos que reproducir", file=sys.stderr)
+        return SALIDA_FALLOS
+
+    # La configuración elegida, la detección anterior (ventanas de 100
+    # muestras) y la ventana elegida sin histéresis, votación ni permanencia
+    configuraciones = [
+        ("Elegida", config),
+        ("Anterior", ConfigDeteccion.legado(config.umbrales)),
+        ("Ventana sin filtrar", ConfigDeteccion.legado(config.umbrales,
+                                                       config.ventana)),
+    ]
+    metricas = {nombre: [] for nombre, _ in configuraciones}
+    conexion = sqlite3.connect(perfil.ruta_db)
+    for gesto_id, _, _, nombre_gesto in gestos:
+        # Los umbrales están en unidades del ADC, así que no se reescala
+        registro = RegistroEMG.desde_db(conexion, gesto_id, perfil.tabla_raw,
+                                        reescalado=1.0)
+        if registro.n_canales != len(config.umbrales):
+            print(f"Gesto {gesto_id}: tiene {registro.n_canales} canales y "
+                  f"hay {len(config.umbrales)} umbrales", file=sys.stderr)
+            fallidos += 1
+            continue
+        for nombre, configuracion in configuraciones:
+            configuracion = replace(configuracion, fs=round(registro.fs))
+            eventos = reproducir(registro.datos, configuracion)
+            metricas[nombre].append(metricas_reproduccion(
+                eventos, registro.onset, registro.fs, args.tolerancia))
+        if args.eventos:
+            for evento in reproducir(registro.datos,
+                                     replace(config, fs=round(registro.fs))):
+                print(f"{gesto_id}\t{nombre_gesto}\t{evento.tiempo:8.3f}\t"
+                      f"{evento.gesto}")
+    conexion.close()
+
+    print("Configuración      \tFlancos\tDetectados\tFalsas\tFalsas/min"
+          "\tInicio p50/p95 [ms]\tFin p50/p95 [ms]")
+    for nombre, _ in configuraciones:
+        resumen = resumir_metricas(metricas[nombre])
+        print(f"{nombre:<19}\t{resumen['flancos']:7d}\t"
+              f"{resumen['detectados']:10d}\t{resumen['falsas']:6d}\t"
+              f"{resumen['falsas_por_min']:10.1f}\t"
+              f"{resumen['inicio_p50_ms']:7.0f} / "
+              f"{resumen['inicio_p95_ms']:<9.0f}\t"
+              f"{resumen['fin_p50_ms']:5.0f} / {resumen['fin_p95_ms']:.0f}")
+    return SALIDA_FALLOS if fallidos else SALIDA_OK
+
+
+def comando_detectar(args, perfil):
+    sys.path.insert(0, DIRECTORIO_DEMO)
+    try:
+        config = _config_deteccion(args)
+    except ValueError as error:
+        print(f"Configuración inválida: {error}", file=sys.stderr)
+        return SALIDA_ARGUMENTOS
+    if args.reproducir:
+        return _reproducir_deteccion(args, perfil, config)
+
+    import serial
+    from detectar_3ch import detectar
+
+    inicio = time.monotonic()
+
+    def al_evento(evento):
+        print(f"{evento.tiempo - inicio:8.3f}\t{evento.gesto}", flush=True)
+
+    try:
+        detectar(args.puerto, perfil.baud_rate, config.umbrales,
+                 al_detectar=lambda gesto: None, duracion=args.duracion,
+                 config=config, eventos=al_evento)
+    except serial.SerialException as error:
+        print(f"Error al acceder al puerto serial: {error}", file=sys.stderr)
+        return SALIDA_FALLOS
+    except KeyboardInterrupt:
+        # Ctrl+C es la forma normal de terminar la detección
+        print("\nLectura interrumpida")
+    return SALIDA_OK
+
+
+def comando_exportar(args, perfil):
+    from exportar_parquet import exportar_db
+
+    inicio = time.perf_counter()
+    filas = exportar_db(perfil.ruta_db, args.salida, args.tablas,
+                        args.tamano_lote)
+    for tabla, n_filas in filas.items():
+        print(f"{tabla}\t{n_filas} filas", flush=True)
+    print(f"Exportado a {os.path.abspath(args.salida)} en "
+          f"{time.perf_counter() - inicio:.1f} s")
+    return SALIDA_OK
+
+
+def comando_dataset(args, perfil):
+    from dataset_ventanas import construir_dataset
+
+    inicio = time.perf_counter()
+    try:
+        dataset = construir_dataset(perfil, args.fuente, args.ventana,
+                                    args.paso, not args.todo, args.sesiones,
+                                    args.gesto, cache=not args.sin_cache,
+                                    directorio_cache=args.cache)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return SALIDA_FALLOS
+    print(dataset.resumen())
+    # Desde la caché las ventanas son un memmap con la ruta del archivo
+    archivo = getattr(dataset.ventanas, 'filename', None)
+    print(f"Listo en {(time.perf_counter() - inicio) * 1e3:.0f} ms"
+          + (f" ({os.path.dirname(archivo)})" if archivo else ""))
+    if args.prueba:
+        entrenamiento, prueba = dataset.dividir_por_sesion(args.prueba)
+        print(f"Entrenamiento: {len(entrenamiento)} ventanas, prueba "
+              f"(sesiones {args.prueba}): {len(prueba)} ventanas")
+    return SALIDA_OK
+
+
+def comando_bench(args, perfil):
+    if args.cual == 'canales':
+        from bench_canales import ejecutar_benchmark
+        ejecutar_benchmark(args.segundos)
+    elif args.cual == 'fft':
+        from bench_fft import ejecutar_benchmark
+        ejecutar_benchmark(args.canales)
+    elif args.cual == 'arranque':
+        from bench_arranque import ejecutar_benchmark
+        ejecutar_benchmark(args.repeticiones, perfil.ruta_db)
+    else:
+        from bench_kernels import ejecutar_benchmark
+        ejecutar_benchmark(args.muestras, args.canales)
+    return SALIDA_OK
+
+
+#%% Parser
+def crear_parser():
+    """ArgumentParser con todos los subcomandos"""
+    parser = argparse.ArgumentParser(
+        description="Etapas de captura y procesamiento de EMG",
+        epilog="Códigos de salida: 0 ok, 1 algún gesto falló, 2 argumentos "
+               "inválidos, 130 interrumpido")
+    subcomandos = parser.add_subparsers(dest='subcomando', required=True)
+
+    # Opciones comunes
+    con_perfil = agregar_argumentos(argparse.ArgumentParser(add_help=False))
+    seleccion = argparse.ArgumentParser(add_help=False)
+    grupo = seleccion.add_argument_group('selección de gestos')
+    grupo.add_argument('--ids', type=_tipo_ids,
+                       help="IDs o rangos de gestos, por ejemplo '1-5,8'")
+    grupo.add_argument('--sesion', type=int, help="solo una sesión")
+    grupo.add_argument('--gesto',
+                       help="nombre del gesto, con comodines de LIKE ('%%')")
+    paralelo = argparse.ArgumentParser(add_help=False)
+    paralelo.add_argument('--procesos', type=int,
+                          help="procesos del pool (por defecto, uno por "
+                               "núcleo; 1 para no usar pool)")
+    calculo = argparse.ArgumentParser(add_help=False,
+                                      parents=[con_perfil, seleccion,
+                                               paralelo])
+    calculo.add_argument('--rehacer', action='store_true',
+                         help="recalcular los gestos ya registrados")
+    grupo = calculo.add_argument_group('instrumentación')
+    grupo.add_argument('--instrumentar', action='store_true',
+                       help="mostrar el tiempo de cada etapa y gesto")
+    grupo.add_argument('--json', metavar='RUTA',
+                       help="agregar los tiempos como una línea de JSON a "
+                            "RUTA (implica --instrumentar)")
+    grupo.add_argument('--perfilador', choices=['cprofile', 'pyinstrument'],
+                       help="capturar un perfil (usa un solo proceso)")
+    grupo.add_argument('--salida-perfilador', metavar='RUTA',
+                       help="guardar el perfil en RUTA en vez de imprimirlo")
+
+    # capturar
+    sub = subcomandos.add_parser('capturar', aliases=['capture'],
+                                 parents=[con_perfil],
+                                 help="capturar un gesto desde la placa")
+    sub.add_argument('nombre', help="nombre del gesto")
+    sub.add_argument('--sesion', type=int,
+                     help="sesión (por defecto, la última registrada)")
+    sub.add_argument('--puerto', default='COM4', help="puerto serial")
+    sub.add_argument('--canales', type=int, default=3,
+                     help="canales enviados por la placa")
+    sub.add_argument('--duracion', type=float,
+                     help="segundos a capturar (por defecto, hasta Ctrl+C)")
+    sub.add_argument('--wal', default='Datos/wal',
+                     help="carpeta de los segmentos en disco")
+    sub.add_argument('--max-perdida-ms', type=int, default=50,
+                     help="máximo de datos a perder si se corta la captura")
+    sub.add_argument('--silencioso', action='store_true',
+                     help="solo la línea de estado, sin cada muestra")
+    sub.add_argument('--intervalo-estado', type=float, default=1.0,
+                     help="segundos entre líneas de estado")
+    sub.add_argument('--fs-nominal', action='store_true',
+                     help="guardar la fs del perfil en vez de la medida")
+    sub.set_defaults(comando=comando_capturar)
+
+    # listar
+    sub = subcomandos.add_parser('listar', aliases=['list'],
+                                 parents=[con_perfil, seleccion],
+                                 help="listar gestos registrados")
+    sub.add_argument('--tabla', choices=['raw', 'norm', 'fft'], default='raw',
+                     help="tabla del perfil a listar")
+    sub.set_defaults(comando=comando_listar)
+
+    # normalizar y fft
+    sub = subcomandos.add_parser('normalizar', aliases=['normalize'],
+                                 parents=[calculo],
+                                 help="normalizar gestos respecto a la CVM")
+    sub.add_argument('--sin-indice', action='store_true',
+                     help="no agregar las firmas al índice de similitud")
+    sub.set_defaults(comando=comando_normalizar)
+    sub = subcomandos.add_parser('fft', parents=[calculo],
+                                 help="FFT y SNR de los gestos normalizados")
+    sub.add_argument('--largo-fft', choices=['rapido', 'exacto'],
+                     default='rapido',
+                     help="rellenar hasta un largo rápido de la FFT (evita "
+                          "los largos primos) o usar las muestras tal cual")
+    sub.add_argument('--hilos-fft', type=int, default=1,
+                     help="hilos de scipy.fft por proceso (-1: todos los "
+                          "núcleos, conviene con --procesos 1)")
+    sub.set_defaults(comando=comando_fft)
+
+    # coherencia
+    sub = subcomandos.add_parser('coherencia', aliases=['coherence'],
+                                 parents=[calculo],
+                                 help="coherencia, retardos y co-activación "
+                                      "entre canales")
+    sub.add_argument('--banda', type=float, nargs=2, default=[20, 450],
+                     metavar=('MIN', 'MAX'),
+                     help="banda de la coherencia media, en Hz")
+    sub.add_argument('--max-retardo', type=float, default=200,
+                     help="retardo máximo de la correlación cruzada, en ms")
+    sub.add_argument('--umbral', type=float, default=10,
+                     help="activación para la simultaneidad, en %% de la CVM")
+    sub.add_argument('--comparar', nargs='?', const='coherencia_media',
+                     choices=METRICAS_COHERENCIA, metavar='METRICA',
+                     help="imprimir la métrica por gesto y par al terminar "
+                          "(por defecto coherencia_media; opciones: "
+                          f"{', '.join(METRICAS_COHERENCIA)})")
+    sub.set_defaults(comando=comando_coherencia)
+
+    # similares
+    sub = subcomandos.add_parser('similares', aliases=['similar'],
+                                 parents=[con_perfil],
+                                 help="gestos más parecidos y revisión de "
+                                      "etiquetas")
+    sub.add_argument('--ids', type=_tipo_ids,
+                     help="gestos a consultar, por ejemplo '5,12-14'")
+    sub.add_argument('-k', type=int, default=5, help="vecinos por consulta")
+    sub.add_argument('--dtw', action='store_true',
+                     help="comparar las envolventes con DTW")
+    sub.add_argument('--radio', type=float, default=0.1,
+                     help="radio de la banda del DTW, como fracción del largo")
+    sub.add_argument('--peso-envolvente', type=float, default=1.0,
+                     help="peso de la envolvente en la distancia")
+    sub.add_argument('--peso-bandas', type=float, default=1.0,
+                     help="peso de las bandas de la PSD en la distancia")
+    sub.add_argument('--revisar', action='store_true',
+                     help="revisar todos los gestos: etiqueta de los vecinos "
+                          "y qué tan atípico es cada uno")
+    sub.add_argument('--actualizar', action='store_true',
+                     help="agregar antes las firmas que falten")
+    sub.set_defaults(comando=comando_similares)
+
+    # Figuras
+    sub = subcomandos.add_parser('welch', parents=[con_perfil, seleccion,
+                                                   paralelo],
+                                 help="figuras de la PSD de Welch")
+    sub.add_argument('--salida', help="carpeta (por defecto fig_3ch/welch)")
+    sub.set_defaults(comando=comando_welch)
+    sub = subcomandos.add_parser('graficar', aliases=['plot'],
+                                 parents=[con_perfil, seleccion, paralelo],
+                                 help="figuras de la señal bruta o su FFT")
+    sub.add_argument('--tipo', choices=['raw', 'fft'], default='raw',
+                     help="señal bruta o FFT de las regiones activas")
+    sub.add_argument('--salida', help="carpeta (por defecto fig_3ch/<tipo>)")
+    sub.set_defaults(comando=comando_graficar)
+
+    # detectar
+    sub = subcomandos.add_parser('detectar', aliases=['detect'],
+                                 parents=[con_perfil, seleccion],
+                                 help="detección de gestos en vivo")
+    sub.add_argument('--puerto', default='COM4', help="puerto serial")
+    sub.add_argument('--umbrales', type=float, nargs=3, default=[15, 26, 25],
+                     metavar=('CH1', 'CH2', 'CH3'),
+                     help="umbral de activación de cada canal")
+    sub.add_argument('--duracion', type=float,
+                     help="segundos a leer (por defecto, hasta Ctrl+C)")
+    grupo = sub.add_argument_group('máquina de estados (ver '
+                                   'Demo/maquina_gestos.py)')
+    grupo.add_argument('--ventana', '--tamano-buffer', type=int,
+                       help="muestras por ventana (por defecto 40)")
+    grupo.add_argument('--salto', type=int,
+                       help="muestras entre decisiones (por defecto 10)")
+    grupo.add_argument('--votos', type=int,
+                       help="saltos de la votación por mayoría (por defecto "
+                            "3)")
+    grupo.add_argument('--histeresis', type=float,
+                       help="fracción del umbral para desactivar un canal "
+                            "(por defecto 0.7)")
+    grupo.add_argument('--permanencia', type=float,
+                       help="segundos mínimos en un gesto (por defecto 0.15)")
+    grupo.add_argument('--prioridad', choices=['relativa', 'orden'],
+                       help="canal que gana si hay varios activos")
+    grupo.add_argument('--legado', action='store_true',
+                       help="detección anterior: ventanas de 100 muestras "
+                            "sin traslape y CH1 por sobre CH3")
+    grupo = sub.add_argument_group('reproducción')
+    grupo.add_argument('--reproducir', action='store_true',
+                       help="pasar los gestos elegidos de la base de datos "
+                            "por la detección y medir latencia y "
+                            "transiciones falsas contra el onset")
+    grupo.add_argument('--tolerancia', type=float, default=0.5,
+                       help="segundos tras un flanco del onset en que aún "
+                            "se acepta el evento")
+    grupo.add_argument('--eventos', action='store_true',
+                       help="imprimir los eventos de cada gesto")
+    sub.set_defaults(comando=comando_detectar)
+
+    # exportar
+    sub = subcomandos.add_parser('exportar', aliases=['export'],
+                                 parents=[con_perfil],
+                                 help="exportar tablas a Parquet")
+    sub.add_argument('--salida', default='Datos/parquet',
+                     help="carpeta de destino")
+    sub.add_argument('--tablas', nargs='+',
+                     help="tablas a exportar (por defecto, todas)")
+    sub.add_argument('--tamano-lote', type=int, default=100_000,
+                     help="filas por lote")
+    sub.set_defaults(comando=comando_exportar)
+
+    # dataset
+    sub = subcomandos.add_parser('dataset', parents=[con_perfil],
+                                 help="ventanas etiquetadas para entrenar")
+    sub.add_argument('--fuente', choices=['norm', 'envolvente', 'raw'],
+                     default='norm', help="señal de las ventanas")
+    sub.add_argument('--ventana', type=int, default=200,
+                     help="muestras por ventana")
+    sub.add_argument('--paso', type=int, default=50,
+                     help="muestras entre ventanas")
+    sub.add_argument('--todo', action='store_true',
+                     help="tomar ventanas de todo el gesto y no solo de las "
+                          "regiones activas")
+    sub.add_argument('--sesiones', type=_tipo_ids,
+                     help="sesiones a incluir, por ejemplo '1-3'")
+    sub.add_argument('--gesto',
+                     help="nombre del gesto, con comodines de LIKE ('%%')")
+    sub.add_argument('--prueba', type=_tipo_ids,
+                     help="sesiones de prueba, para mostrar la división")
+    sub.add_argument('--cache',
+                     help="carpeta de la caché (por defecto, cache_dataset "
+                          "junto a la base de datos)")
+    sub.add_argument('--sin-cache', action='store_true',
+                     help="armar el dataset en memoria, sin guardarlo")
+    sub.set_defaults(comando=comando_dataset)
+
+    # bench
+    sub = subcomandos.add_parser('bench', parents=[con_perfil],
+                                 help="benchmarks de canales, kernels, FFT "
+                                      "y arranque")
+    sub.add_argument('cual', choices=['canales', 'kernels', 'fft', 'arranque'])
+    sub.add_argument('--segundos', type=float, default=10.0,
+                     help="segundos de captura por prueba (canales)")
+    sub.add_argument('--muestras', type=int, default=60_000,
+                     help="muestras por canal (kernels)")
+    sub.add_argument('--canales', type=int, default=3,
+                     help="cantidad de canales (kernels y fft)")
+    sub.add_argument('--repeticiones', type=int, default=5,
+                     help="procesos por medición; se usa el más rápido "
+                          "(arranque)")
+    sub.set_defaults(comando=comando_bench)
+    return parser
+
+
+def main(argv=None):
+    """Ejecuta un subcomando y retorna su código de salida"""
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    perfil = None
+    if hasattr(args, 'perfil'):
+        try:
+            perfil = perfil_desde_argumentos(args)
+        except (ValueError, OSError) as error:
+            parser.error(str(error))
+
+    instrumentar = getattr(args, 'instrumentar', False) or getattr(
+        args, 'json', None)
+    perfilador = getattr(args, 'perfilador', None)
+    if instrumentar:
+        instrumentacion.activar()
+    if perfilador and args.procesos != 1:
+        # El perfilador solo ve este proceso
+        print("Con --perfilador se usa un solo proceso", file=sys.stderr)
+        args.procesos = 1
+
+    try:
+        if perfilador:
+            with instrumentacion.perfilar(perfilador, args.salida_perfilador):
+                salida = args.comando(args, perfil)
+        else:
+            salida = args.comando(args, perfil)
+        if instrumentar:
+            instrumentacion.imprimir_resumen(por_gesto=True)
+            if args.json:
+                instrumentacion.guardar_json(
+                    args.json, comando=args.subcomando, perfil=perfil.nombre,
+                    huella=perfil.huella, procesos=args.procesos)
+            # Ya se mostraron; no repetirlos con EMG_INSTRUMENTAR
+            instrumentacion.reiniciar()
+        return salida
+    except KeyboardInterrupt:
+        print("\nInterrumpido", file=sys.stderr)
+        return SALIDA_INTERRUMPIDA
+    except ImportError as error:
+        print(f"Falta una dependencia: {error}", file=sys.stderr)
+        return SALIDA_FALLOS
+    except (sqlite3.Error, OSError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return SALIDA_FALLOS
+
+
+#%%
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,18 +35,61 @@ Changelog:
     modularidad
 24-12:
     - Agregado un ejemplo con el que se grafica a partir de la base de datos
+19-10:
+    - Los segmentos de onset se registran al guardar los datos normalizados
+    - El máximo de cada CVM se lee desde la referencia de la sesión
+    - 'normalizar_3ch_sql' procesa todos los canales como un solo arreglo y 
+    respeta la lista de canales recibida
+    - Soporte para N canales: por defecto se procesan todos los canales de la 
+    tabla de datos brutos y la tabla 'norm' agrega las columnas que le falten.
+    La CVM de cada canal se puede asignar con 'mapa_cvm'
+    - El ejemplo lee los datos con 'BaseDatos' de acceso_datos.py
+    - Los parámetros de 'norm_db_sql' y del ejemplo vienen de un perfil de 
+    procesamiento, y cada perfil guarda sus resultados en su propia tabla
+    - Cada gesto se lee con su 'fs' registrada y se remuestrea a la 'fs' del
+    perfil. Con 'fs_norm' la envolvente se guarda decimada a esa frecuencia y
+    los segmentos de onset de 'norm' van en su propia tabla
+    - El máximo de la CVM de cada sesión se guarda junto a 'norm'. Con
+    'solo_envolvente' no se guardan las columnas chX_norm y el % de la CVM se
+    calcula al leer (ver 'escala_cvm.py')
 """
 # Importar librerias
 import numpy as np
-from scipy.signal import butter, filtfilt
-import matplotlib.pyplot as plt
+# scipy.signal y matplotlib se importan en las funciones que los usan, para
+# que importar este módulo (por ejemplo desde emg_cli.py) sea rápido
 
 # Nuevo: para trabajar con sqlite
 import sqlite3
 import os
 
-# Nuevo: para cambiar el tipo de fuente de los gráficos
-import matplotlib as mpl
+# Nuevo: segmentos de onset precalculados
+from segmentos_onset import registrar_segmentos, tabla_segmentos
+
+# Nuevo: gestos capturados a otra frecuencia y envolventes decimadas
+from remuestreo import remuestrear, remuestrear_onset
+
+# Nuevo: referencia de CVM y reposo calculada una vez por sesión
+from referencia_sesion import obtener_referencia
+
+# Nuevo: consultas comunes a la base de datos
+from acceso_datos import BaseDatos
+
+# Nuevo: parámetros de procesamiento desde un perfil
+from perfil_procesamiento import (cargar_perfil, cargar_perfil_cli, 
+                                  registrar_perfil)
+
+# Nuevo: gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG
+
+# Nuevo: columnas para una cantidad cualquiera de canales
+from esquema_canales import (columnas_norm, canales_en_datos, 
+                             agregar_columnas, es_cvm_de_canal)
+
+# Nuevo: máximo de la CVM con que se normalizó cada sesión
+from escala_cvm import registrar_escala
+
+# Tiempos por etapa, sin costo si está desactivada
+from instrumentacion import medir, contar
 
 
 def ajusta_emg_func(emg_fun, emg_cvm, fs, fc, forden):
@@ -85,6 +128,7 @@ def ajusta_emg_func(emg_fun, emg_cvm, fs, fc, forden):
     emg_cvm_env = abs(emg_cvm - np.mean(emg_cvm))
 
     # Filtrado pasa-bajo de las señales
+    from scipy.signal import butter, filtfilt
     b, a = butter(int(forden), (int(fc)/(fs/2)), btype = 'low')
     emg_fun_env_f = filtfilt(b, a, emg_fun_env)
     emg_cvm_env_f = filtfilt(b, a, emg_cvm_env)
@@ -100,7 +144,7 @@ def ajusta_emg_func(emg_fun, emg_cvm, fs, fc, forden):
 
 def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
               fs, f_c, f_orden,
-              nombre):
+              nombre, fs_env=None, fs_cvm=None):
     """Grafica señales de EMG funcional y CVM.
 
     Parameters
@@ -113,14 +157,21 @@ def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
         EMG funcional normalizada según CVM.
     emg_cvm : array_like
         EMG contracción voluntaria máxima.
+    emg_cvm_env : array_like
+        Envolvente del EMG de la CVM.
     fs : float
-        Frecuencia de muestreo, en hertz.
+        Frecuencia de muestreo del EMG funcional, en hertz.
     f_c : float
         Frecuencia de corte del filtro pasa-bajo, en hertz.
     f_orden : int
         Orden del filtro.
     nombre : str
         Nombre del gesto. 
+    fs_env : float
+        Frecuencia de las envolventes y de la señal normalizada, que es menor 
+        si se guardaron con 'fs_norm'. Por defecto, fs
+    fs_cvm : float
+        Frecuencia del EMG de la CVM. Por defecto, fs
 
     Notes
     -----
@@ -128,13 +179,21 @@ def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
     comentadas
 
     """
+    import matplotlib.pyplot as plt
+
     # Tamaños de fuente
     titulo_size = 15
     label_size = 12
     
     # Vectores de tiempo
-    t1 = np.arange(0, len(emg_fun) / fs, 1 / fs)
-    t2 = np.arange(0, len(emg_cvm) / fs, 1 / fs)
+    # Nuevo: uno por arreglo, porque las envolventes de 'norm' pueden estar 
+    # decimadas ('fs_norm') y la CVM capturada a otra frecuencia
+    fs_env = fs if fs_env is None else fs_env
+    fs_cvm = fs if fs_cvm is None else fs_cvm
+    t1 = np.arange(len(emg_fun)) / fs
+    t1_env = np.arange(len(emg_fun_env)) / fs_env
+    t2 = np.arange(len(emg_cvm)) / fs_cvm
+    t2_env = np.arange(len(emg_cvm_env)) / fs_env
 
     #fig, (ax1, ax2, ax3) = plt.subplots(3, 1,figsize = (8, 7))
     fig, (ax1, ax2, ax3) = plt.subplots(3, 1,figsize=(4, 5))
@@ -143,10 +202,10 @@ def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
     ax1.plot(t1, emg_fun, 'b', label='Señal bruta')
     #ax1.set_title(f'Músculo: {nombre};\nfiltro aplicado: f_c={f_c} [Hz] de 
     # 'f'orden {f_orden}')
-    ax1.set_title(f'Gesto: {nombre};\nFiltro aplicado: f_c={f_c} [Hz] de\norden 
-                  {f_orden}', fontsize = titulo_size)
+    ax1.set_title(f'Gesto: {nombre};\nFiltro aplicado: f_c={f_c} [Hz] de\n'
+                  f'orden {f_orden}', fontsize = titulo_size)
 
-    ax1.plot(t1, emg_fun_env, 'r', lw=2, label='Señal filtrada')
+    ax1.plot(t1_env, emg_fun_env, 'r', lw=2, label='Señal filtrada')
     ax1.set_ylabel(f'{nombre} Funcional\nAmplitud [V]',fontsize=label_size)
     #ax1.set_ylim(emg_fun.min() - 0.1, emg_fun.max() + 0.1)
     ax1.set_ylim(0, emg_fun.max() + 0.1)
@@ -155,9 +214,9 @@ def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
     ax1.legend(loc='upper center', fontsize='x-small', borderpad=None)
 
     ax2.plot(t2, emg_cvm, 'b', label='Señal bruta')
-    ax2.plot(t2, emg_cvm_env, 'r', lw=2, label='Señal filtrada')
+    ax2.plot(t2_env, emg_cvm_env, 'r', lw=2, label='Señal filtrada')
     ax2.set_ylabel(f'{nombre} CVM\nAmplitud [V]',fontsize=label_size)
-    ax2.axvline((np.argmax(emg_cvm_env) / fs), color='maroon')
+    ax2.axvline((np.argmax(emg_cvm_env) / fs_env), color='maroon')
     ax2.text(0.85, 0.95 ,f'Max = {emg_cvm_env.max():.2f}',
              transform=ax2.transAxes, ha="left", va="top")
     #ax2.set_ylim(emg_cvm.min() - 0.1, emg_cvm.max() + 0.1)
@@ -166,9 +225,9 @@ def plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
     ax2.grid()
     ax2.legend(loc='upper center', fontsize='x-small', borderpad=None)
 
-    ax3.plot(t1, emg_fun_norm, 'g',label='Señal ajustada según CVM')
+    ax3.plot(t1_env, emg_fun_norm, 'g',label='Señal ajustada según CVM')
     ax3.set_ylim(emg_fun_norm.min(), emg_fun_norm.max() + 2)
-    ax3.set_xlim(0, t1.max())
+    ax3.set_xlim(0, t1_env.max())
     ax3.set_xlabel('Tiempo [s]', fontsize=label_size)
     ax3.set_ylabel('% EMG CVM')
     ax3.grid()
@@ -194,8 +253,6 @@ def get_rms(values):
     return rms
 
 #%% Nuevo: Función para calcular la SNR
-import numpy as np
-
 def get_SNR(signal_rms, noise_rms):
     """
     Calcula la relación señal a ruido (SNR) a partir de los valores RMS de la 
@@ -218,14 +275,17 @@ def get_SNR(signal_rms, noise_rms):
 
 def normalizar_3ch_sql(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db', 
                        tabla_raw = 'raw', fs = 1000, fc = 150, forden = 2, 
-                       reescalado = 5.0/1023, canales = [1, 2, 3]):
+                       reescalado = 5.0/1023, canales = None, 
+                       mapa_cvm = None, fs_norm = None, 
+                       solo_envolvente = False, nperseg = 256):
     """
-    Script para normalizar señales de hasta tres canales de un gesto específico 
+    Script para normalizar señales de N canales de un gesto específico 
     a partir de su ID, almacenado en una base de datos en SQLite.
-    Requiere que en la base de datos existan hasta 3 canales de registros del 
+    Requiere que en la base de datos existan los canales de registros del 
     gesto a usar, un registro llamado 'Reposo' y otros llamados 'CVM CH1', 
-    'CVM CH2' y 'CVM CH3, todos correspondiendo a la misma sesión en la que se 
-    tomaron los registros
+    'CVM CH2', ..., 'CVM CHN', todos correspondiendo a la misma sesión en la 
+    que se tomaron los registros. Con "mapa_cvm" se puede indicar otro 
+    registro de CVM para cada canal
 
     Parameters
     ----------
@@ -241,15 +301,28 @@ def normalizar_3ch_sql(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
         "reescalado": Factor para reescalar los datos, cuyo valor por defecto es 
                       de 5.0/1023 para una tarjeta que recibe hasta 5 volts en 
                       un ADC de 10 bits
-        "canales": Lista de canales a analizar, que por defecto es [1, 2, 3]
+        "canales": Lista de canales a analizar. Por defecto, todos los 
+                   canales de la tabla de datos brutos
+        "mapa_cvm": Diccionario opcional {canal: nombre_gesto} con el registro 
+                    de CVM de cada canal. Los canales que no estén usan 
+                    'CVM CHX'
+        "fs_norm": Frecuencia a la que se entrega la envolvente. Por defecto 
+                   'fs'. Debe ser mayor que 2 * fc (ver 'remuestreo.py')
+        "solo_envolvente": No calcular las señales normalizadas chX_norm, 
+                           que se pueden obtener al leer a partir de la 
+                           envolvente y 'cvm_max' (ver 'escala_cvm.py')
+        "nperseg": Muestras por segmento de la PSD del reposo en la 
+                   referencia de la sesión (ver 'referencia_sesion.py')
 
 
     Este script realiza las siguientes operaciones:
     1. Conectar a la base de datos SQLite especificada.
-    2. Obtener los datos de la señal para el "gesto_id" proporcionado.
+    2. Obtener los datos de la señal para el "gesto_id" proporcionado y 
+       remuestrearlos a "fs" si se capturaron a otra frecuencia.
     3. Filtrar las señales con la frecuencia y el orden especificado
-    4. Calcular las envolventes de los 3 canales
+    4. Calcular las envolventes de todos los canales
     5. Normalizar las señales a partir de su contracción voluntaria máxima (CVM)
+    6. Decimar la envolvente a "fs_norm", si se indica
 
 
     Return
@@ -271,6 +344,8 @@ def normalizar_3ch_sql(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
                 fc (int)                  : Frecuencia de corte del filtro 
                 fecha (string)            : Fecha en la que se hizo la captura, 
                                             -MM-DD HH:MM:SS
+                cvm_max (np.array)        : Máximo de la envolvente de la CVM 
+                                            de cada canal, en volts
                 ch1_env_fil (list, float) :  Valores de la envolvente post 
                                              filtrado del canal 1
                 ch1_norm (list,float)     :  Valores del canal 1 normalizado 
@@ -283,104 +358,74 @@ def normalizar_3ch_sql(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
                                              filtrado del canal 3
                 ch3_norm (list,float)     :  Valores del canal 3 normalizado 
                                              respecto a la CVM correspondiente
+                ...                       :  Y así para cada canal procesado.
+                                             Con "solo_envolvente" no se 
+                                             entregan las entradas chX_norm
 
 
 """
     # Conectarse a la base de datos
     conexion = sqlite3.connect(ruta_db)
-    cursor = conexion.cursor()
 
-    # Obtener datos del gesto funcional
-    cursor.execute(f"""
-            SELECT fs, fecha, onset, sesion_id, CH1, CH2, CH3, nombre_gesto 
-            FROM {tabla_raw} 
-            WHERE gesto_id = ?
-            """, (gesto_id,))
-    
-    datos_gesto_funcional = cursor.fetchall()
-
-    # Nuevo: ahora lee los 3 canales sin tener que ingresarlos manualmente
-    canales = [1, 2, 3] 
-
-    # Diccionario para ir registrando los datos que corresponden a cada canal
-    df_funcional = {
-        1: [],
-        2: [],
-        3: []
-    }
-    for num_canal in canales:
-        # df_funcional[i] corresponde al canal i
-        df_funcional[num_canal] = [dato[3 + num_canal] * reescalado 
-                                   for dato in datos_gesto_funcional] 
-        # Formato: [fs, fecha, onset, sesion_id, CH1, CH2, CH3, nombre_gesto ]
-    
-    # Clonar vector de onset del gesto. Este vector aplica para los 3 canales
-    onset_funcional = [dato[2] for dato in datos_gesto_funcional] 
-    
-    # Estos datos son los mismos para los 3 canales a través de todo el tiempo
-    fecha_captura = datos_gesto_funcional[0][1]
-    sesion_id_gesto = datos_gesto_funcional[0][3]   
-    nombre_gesto_funcional = datos_gesto_funcional[0][-1] 
-
-    # Filtrar datos de CVM según el canal en uso y el número de sesión
-    # Nuevo: ahora lee los 3 canales en lugar de solo uno
-    datos_cvm = {1: [],2: [],3: []}
-    df_cvm = {1: [],2: [],3: []}
-    emg_funcional = {1: [],2: [],3: []}
-    emg_cvm = {1: [],2: [],3: []}
-    emg_f_n = {1: [],2: [],3: []}
-    emg_f_env = {1: [],2: [],3: []}
-    emg_cvm_env = {1: [],2: [],3: []}
-    for num_canal in canales: 
-        canal_string = "CH" + str(num_canal)
-        # Este query retorna una lista con la ID del CVM, la fecha, su nombre, 
-        # la sesión en la que se grabó y los valores del canal correspondiente
-        cursor.execute(f"""
-            SELECT gesto_id, fs, fecha, onset, sesion_id, {canal_string}, 
-            nombre_gesto
-            FROM {tabla_raw} 
-            WHERE nombre_gesto LIKE '%CVM {canal_string}%'
-            AND sesion_id = ?
-        """,(sesion_id_gesto,))
-        datos_cvm[num_canal] = cursor.fetchall()
-        df_cvm[num_canal] = [dato[-2] * reescalado 
-                             for dato in datos_cvm[num_canal]] 
-        
-        emg_funcional[num_canal] = np.array(df_funcional[num_canal])
-        emg_cvm[num_canal] = np.array(df_cvm[num_canal])
-        
-
-
-        # Línea para invocar la función de ajuste
-        emg_f_n[num_canal], 
-        emg_f_env[num_canal], 
-        emg_cvm_env[num_canal] = ajusta_emg_func(emg_funcional[num_canal],
-                                                 emg_cvm[num_canal], fs, fc, 
-                                                 forden)
-
-        # emg_f_n: Señal emg normalizada respecto a la CVM
-        # emg_f_env: Envolvente de la señal luego de ser filtrada 
-        # emg_cvm_env: Envolvente de la señal CVM normalizada y filtrada
+    # Nuevo: los canales del gesto se leen en un solo arreglo de 
+    # (n_muestras, n_canales) en lugar de un diccionario con una lista por canal
+    # (la lectura incluye la consulta y la conversión a arreglo)
+    with medir('norm.lectura', gesto_id):
+        registro = RegistroEMG.desde_db(conexion, gesto_id, tabla_raw, canales,
+                                        reescalado, tabla_raw=tabla_raw)
+    contar('norm.muestras_leidas', registro.n_muestras)
+
+    # Nuevo: los gestos capturados a otra frecuencia (por ejemplo 500 Hz) se 
+    # llevan a la frecuencia de análisis antes de filtrar
+    with medir('norm.remuestreo', gesto_id):
+        registro = registro.remuestrear(fs)
+
+    # Nuevo: el máximo de la envolvente de cada CVM se obtiene de la 
+    # referencia de la sesión, que se calcula una sola vez y queda guardada en
+    # la base de datos en vez de volver a filtrar la CVM en cada gesto
+    with medir('norm.referencia', gesto_id):
+        referencia = obtener_referencia(conexion, registro.sesion_id, 
+                                        tabla_raw, fs, fc, forden, reescalado,
+                                        registro.canales, mapa_cvm=mapa_cvm,
+                                        nperseg=nperseg)
+    conexion.close()
 
-        # Valores a retornar:
-        resultado_normalizado = {
+    # Envolvente filtrada de todos los canales a la vez, igual que en 
+    # ajusta_emg_func, y señal ajustada según el máximo de la CVM de cada canal
+    with medir('norm.filtro', gesto_id):
+        emg_f_env = registro.envolvente(fc, forden)
+    onset = registro.onset
+
+    # Nuevo: la envolvente está limitada a fc, así que se puede guardar a una 
+    # frecuencia menor. Se normaliza después de decimar, sobre menos muestras
+    if fs_norm is not None and fs_norm != fs:
+        with medir('norm.decimacion', gesto_id):
+            emg_f_env = remuestrear(emg_f_env, fs, fs_norm, tolerancia=0)
+            onset = remuestrear_onset(onset, len(emg_f_env), fs, fs_norm)
+    if not solo_envolvente:
+        with medir('norm.normalizacion', gesto_id):
+            emg_f_n = (emg_f_env / referencia['cvm_max']) * 100
+
+    # emg_f_n: Señal emg normalizada respecto a la CVM
+    # emg_f_env: Envolvente de la señal luego de ser filtrada 
+
+    # Valores a retornar:
+    resultado_normalizado = {
         'gesto_id': gesto_id,
-        'sesion_id': sesion_id_gesto,
-        'fecha': fecha_captura,
-        'nombre_gesto': nombre_gesto_funcional,
-        'fs': fs,
+        'sesion_id': registro.sesion_id,
+        'fecha': registro.fecha,
+        'nombre_gesto': registro.nombre_gesto,
+        'fs': fs if fs_norm is None else fs_norm,
         'fc': fc,
-        'onset': onset_funcional,
-        # Canal 1
-        'ch1_env_fil'   : emg_f_env[1],# Envolvente después de filtrar señal EMG
-        'ch1_norm'      : emg_f_n[1],  # Señal EMG normalizada respecto a la CVM
-        # Canal 2
-        'ch2_env_fil'   : emg_f_env[2],# Envolvente después de filtrar señal EMG
-        'ch2_norm'      : emg_f_n[2],  # Señal EMG normalizada respecto a la CVM
-        # Canal 3
-        'ch3_env_fil'   : emg_f_env[3],# Envolvente después de filtrar señal EMG
-        'ch3_norm'      : emg_f_n[3],  # Señal EMG normalizada respecto a la CVM
+        'onset': onset,
+        'cvm_max': referencia['cvm_max'],
     }
+    for i, num_canal in enumerate(registro.canales):
+        # Envolvente después de filtrar señal EMG
+        resultado_normalizado[f'ch{num_canal}_env_fil'] = emg_f_env[:, i]
+        # Señal EMG normalizada respecto a la CVM
+        if not solo_envolvente:
+            resultado_normalizado[f'ch{num_canal}_norm'] = emg_f_n[:, i]
 
     return resultado_normalizado
 
@@ -404,15 +449,24 @@ nombre_gesto: Nombre del gesto hecho
           fc: Frecuencia de corte del filtro de 2do grado (default: 150)
        onset: Indicador de si se está ejecutando el gesto. 1 para indicar que 
               está en ejecución
-    chX_norm: Valor del canal X normalizado respecto a la CVM correspondiente
+    chX_norm: Valor del canal X normalizado respecto a la CVM correspondiente.
+              No se registra si los datos no lo traen ("solo_envolvente")
  chX_env_fil: Valor de la envolvente post filtrado del canal X
 
+    El máximo de la CVM de cada canal ('cvm_max') se registra en la tabla 
+    'cvm_<tabla_norm>' (ver 'escala_cvm.py')
+
     """
+    gesto_id = datos_normalizados['gesto_id']
     conexion = sqlite3.connect(ruta_db)
     cursor = conexion.cursor()
 
-    # Crear la tabla "norm" y ejecutar la consulta para crearla
+    # Nuevo: las columnas de canal dependen de los canales normalizados
+    canales = canales_en_datos(datos_normalizados, 'env_fil')
+    columnas_canal = columnas_norm(
+        canales, normalizada=f'ch{canales[0]}_norm' in datos_normalizados)
 
+    # Crear la tabla "norm" y ejecutar la consulta para crearla
     cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS {tabla_norm} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -423,49 +477,55 @@ nombre_gesto: Nombre del gesto hecho
         fs INTEGER,
         fc INTEGER,
         onset INTEGER,
-        ch1_norm REAL,
-        ch1_env_fil REAL,
-        ch2_norm REAL,
-        ch2_env_fil REAL,
-        ch3_norm REAL,
-        ch3_env_fil REAL
+        {', '.join(f'{columna} REAL' for columna in columnas_canal)}
     );
     """)
+    # Si la tabla ya existía con menos canales, agregar los que falten
+    agregar_columnas(cursor, tabla_norm, columnas_canal, 'REAL')
 
     # Descomponer y registrar los valores de cada canal
+    # Nuevo: las columnas se arman como un solo arreglo y se insertan en un 
+    # solo executemany en lugar de un INSERT por muestra
     n_registros = len(datos_normalizados['onset'])
-
-    for i in range(n_registros):
-        insertar_query = f"""
+    with medir('norm.escritura.conversion', gesto_id):
+        valores_canal = np.column_stack([datos_normalizados[columna] 
+                                         for columna in columnas_canal]).tolist()
+        onset = np.asarray(datos_normalizados['onset']).tolist()
+    fijos = (
+        datos_normalizados['gesto_id'],
+        datos_normalizados['sesion_id'],
+        datos_normalizados['fecha'],
+        datos_normalizados['nombre_gesto'],
+        datos_normalizados['fs'],
+        datos_normalizados['fc'],
+    )
+    insertar_query = f"""
        INSERT INTO {tabla_norm} (gesto_id, sesion_id, fecha, nombre_gesto, fs, 
-                                 fc, onset, ch1_env_fil, ch1_norm,
-                                 ch2_env_fil, ch2_norm, ch3_env_fil, ch3_norm)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                 fc, onset, {', '.join(columnas_canal)})
+        VALUES ({', '.join(['?'] * (7 + len(columnas_canal)))})
         """
-        valores = (
-            datos_normalizados['gesto_id'],
-            datos_normalizados['sesion_id'],
-            datos_normalizados['fecha'],
-            datos_normalizados['nombre_gesto'],
-            datos_normalizados['fs'],
-            datos_normalizados['fc'],
-            datos_normalizados['onset'][i],
-            datos_normalizados['ch1_env_fil'][i],
-            datos_normalizados['ch1_norm'][i],
-            datos_normalizados['ch2_env_fil'][i],
-            datos_normalizados['ch2_norm'][i],
-            datos_normalizados['ch3_env_fil'][i],
-            datos_normalizados['ch3_norm'][i],
-
-        )
-        cursor.execute(insertar_query, valores)
+    with medir('norm.escritura.insert', gesto_id):
+        cursor.executemany(insertar_query, 
+                           (fijos + (onset[i], *valores_canal[i]) 
+                            for i in range(n_registros)))
 
     
-    conexion.commit()
+    if 'cvm_max' in datos_normalizados:
+        registrar_escala(conexion, datos_normalizados['sesion_id'], canales,
+                         datos_normalizados['cvm_max'], tabla_norm)
+    with medir('norm.escritura.commit', gesto_id):
+        conexion.commit()
+    contar('norm.filas_escritas', n_registros)
+
+    # Nuevo: precalcular los segmentos de onset para no tener que filtrar 
+    # muestra a muestra con "onset = 1" en los análisis posteriores
+    with medir('norm.escritura.segmentos', gesto_id):
+        registrar_segmentos(conexion, gesto_id, datos_normalizados['onset'],
+                            tabla_segmentos(tabla_norm))
     conexion.close()
 
-    print(f"Registrado '{datos_normalizados['nombre_gesto']}' con ID 
-          {datos_normalizados['gesto_id']} en la tabla '{tabla_norm}'.")
+    print(f"Registrado '{datos_normalizados['nombre_gesto']}' con ID "
+          f"{datos_normalizados['gesto_id']} en la tabla '{tabla_norm}'.")
 
 
 
@@ -474,22 +534,36 @@ nombre_gesto: Nombre del gesto hecho
     Ejemplo de uso: Normalizar todos los registros en la base de datos 
 '''
 #if __name__ == '__main__':
-def norm_db_sql():
-    # Parámetros de frecuencia y orden de filtro
-    tabla_raw = "raw"
-    fs = 1e3    # Frecuencia de muestreo
-    fc, forden = 150, 2 # Frecuencia de corte y orden del filtro pasabajos
-
-    # Desplegar los gestos disponibles
-    ruta_db = 'Datos/datos_gestos_3ch.db'
-    # Factor de reescalado en caso de capturar con un ADC de otra resolución
-    # 5.0/1023 es para un ADC de 10 bits que recibe hasta 5 volts
-    reescalado = (5.0/1023) 
+def norm_db_sql(perfil=None, confirmar=True):
+    """
+    Normaliza todos los gestos de la tabla de datos brutos del perfil.
+
+    Parameters
+    ----------
+        perfil (Perfil): Parámetros y tablas. Por defecto, el perfil base
+        confirmar (bool): Pedir confirmación por consola antes de empezar.
+                          Con False se puede ejecutar sin interacción
+
+    Return
+    ------
+        int: Cantidad de gestos registrados. 0 si se canceló
+    """
+    # Parámetros de procesamiento desde el perfil (ver perfil_procesamiento.py)
+    # Por defecto: fs = 1000 Hz, fc = 150 Hz, filtro de orden 2 y reescalado 
+    # de 5.0/1023 para un ADC de 10 bits que recibe hasta 5 volts
+    if perfil is None:
+        perfil = cargar_perfil()
+    tabla_raw = perfil.tabla_raw
+    ruta_db = perfil.ruta_db
+    # Cada perfil guarda sus resultados en su propia tabla
+    tabla_norm = perfil.tabla('norm')
     conexion = sqlite3.connect(ruta_db)
     cursor = conexion.cursor()
 
     # Mostrar la ubicación de la base de datos
     print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+    print(f"Perfil '{perfil.nombre}' ({perfil.huella}): fc = {perfil.fc} Hz, "
+          f"orden {perfil.forden}. Resultados en la tabla '{tabla_norm}'")
 
     # Inicio de interacción con usuario
     # Mostrar los gestos almacenados 
@@ -511,20 +585,26 @@ ID  \tFecha              \tSesión\tNombre del gesto
         gestos_a_registrar.append(gesto_id)
     
     n_gestos = len(gestos_a_registrar)
-    rpta = []
+    rpta = "y" if not confirmar else []
     while rpta not in ["y", "n"]:
         rpta = input(f"¿Normalizar los {n_gestos} gestos? [Y/n]: ").lower()
 
     # Fin de interacción con el usuario
     if rpta == "n":
         print("Cancelando...")
-        quit()
+        conexion.close()
+        return 0
     else:
         for gesto in gestos_a_registrar:
             # Normalizar todos los gestos 
-            datos_norm = normalizar_3ch_sql(gesto, ruta_db, tabla_raw, fs, fc, 
-                                            forden, reescalado, [1,2,3])
-            registrar_datos_norm(datos_norm, ruta_db, 'norm')
+            datos_norm = normalizar_3ch_sql(
+                gesto, ruta_db, tabla_raw, perfil.fs, perfil.fc, 
+                perfil.forden, perfil.reescalado, mapa_cvm=perfil.mapa_cvm,
+                fs_norm=perfil.fs_norm, 
+                solo_envolvente=perfil.solo_envolvente,
+                nperseg=perfil.nperseg)
+            registrar_datos_norm(datos_norm, ruta_db, tabla_norm)
+        registrar_perfil(conexion, perfil)
     
     print(f"Finalizado. {n_gestos} gestos registrados.")
 
@@ -532,6 +612,7 @@ ID  \tFecha              \tSesión\tNombre del gesto
 
    # Cerrar la conexión a la base de datos
     conexion.close()
+    return n_gestos
 
 #%%
 if __name__ == '__main__':
@@ -542,133 +623,76 @@ if __name__ == '__main__':
     También sirve como un ejemplo de cómo hacerle una query a la base de datos y
     cómo reescalar los datos brutos
     '''
+    import matplotlib.pyplot as plt
+    # Para cambiar el tipo de fuente de los gráficos
+    import matplotlib as mpl
+
     ### Consultar gestos
-    # Conectar a la base de datos SQLite
-    db_path = 'Datos/datos_gestos_3ch.db'
-    conexion = sqlite3.connect(db_path)
-    tabla_raw = 'raw'
-    tabla_norm = 'norm'
-    cursor = conexion.cursor()
-    reescalado = 5.0/1023
-    fs = 1000   # Frecuencia de sampling en Hz
-    f_c = 150   # Frecuencia de corte del filtro pasabajos en Hz
-    f_orden = 2 # Orden del filtro pasabajos en Hz
+    # Parámetros desde el perfil de procesamiento. Por ejemplo:
+    #   python emg_cvm_norm_sql.py --perfil perfiles/base.toml --fc 100
+    perfil = cargar_perfil_cli("Graficar la normalización de un gesto")
+    db_path = perfil.ruta_db
+    tabla_raw = perfil.tabla_raw
+    tabla_norm = perfil.tabla('norm')
+    f_c = perfil.fc         # Frecuencia de corte del filtro pasabajos en Hz
+    f_orden = perfil.forden # Orden del filtro pasabajos
+    # Acceso a la base de datos SQLite, con las tablas del perfil
+    bd = BaseDatos.desde_perfil(perfil)
 
     # Mostrar la ubicación de la base de datos en consola
     print(f"Usando base de datos en: {os.path.abspath(db_path)}")
 
-    # Consultar los datos de gesto_id, fecha y gesto, omitiendo los gesto_id 
-    # repetidos
-    cursor.execute(f"""
-        SELECT gesto_id, MIN(fecha), nombre_gesto, sesion_id 
-        FROM {tabla_raw} 
-        GROUP BY gesto_id
-    """)
-    datos = cursor.fetchall()
-
-    # Imprimir los datos obtenidos por consola
-    print(f"""--- Gestos registrados ---
-ID  \tFecha              \tSesión\tNombre del gesto
-----\t-------------------\t------\t----------------
-    """)
-    for fila in datos:
-        gesto_id, fecha, gesto, sesion_id = fila
-        print(f"{gesto_id}\t{fecha}\t{sesion_id}\t{gesto}")
+    # Imprimir los gestos registrados por consola
+    bd.imprimir_gestos()
 
     gesto_id = int(input("Por favor, introduce la ID del gesto a graficar: "))
 
     # Escoger el canal a graficar
-    nro_canal = []
-    canales = [1, 2, 3] 
-    int(input("Por favor, introduce el canal a analizar [1, 2 o 3]: "))
+    canales = bd.canales()
+    nro_canal = int(input(f"Por favor, introduce el canal a analizar "
+                          f"{canales}: "))
     
         
-    ### Obtener datos del gesto funcional bruto
-    cursor.execute(f"""
-            SELECT CH1 * {reescalado}, CH2 * {reescalado}, CH3 * {reescalado}, 
-            nombre_gesto, sesion_id
-            FROM {tabla_raw} 
-            WHERE gesto_id = ?
-            """, (gesto_id,))
-    # datos_db es una variable auxiliar donde dejo lo que se retorna del query
-    datos_db = cursor.fetchall() 
+    ### Obtener datos del gesto funcional bruto, ya reescalados
+    registro = bd.obtener_raw(gesto_id)
     
     # Nombre para el despliegue
-    nombre = datos_db[0][-2]   
+    nombre = registro.nombre_gesto
 
     # ID de sesión para obtener la CVM correspondiente
-    sesion_id = datos_db[0][-1] 
+    sesion_id = registro.sesion_id
 
     # Registrar los datos brutos a usar
-    emg_fun_list = [dato[nro_canal - 1] for dato in datos_db] 
-    emg_fun = np.array(emg_fun_list)
+    emg_fun = registro.canal(nro_canal)
 
-    
 
-    ### Obtener la envolvente de la señal
-    cursor.execute(f"""
-        SELECT ch1_env_fil, ch2_env_fil, ch3_env_fil, sesion_id, nombre_gesto 
-        FROM {tabla_norm} 
-        WHERE gesto_id = ?
-        """, (gesto_id,))
-    datos_db = cursor.fetchall()
+    ### Obtener la envolvente y la señal normalizada en una sola consulta
+    envolvente, normalizada = bd.obtener_norm(gesto_id)
+    emg_fun_env = envolvente.canal(nro_canal)
+    emg_fun_norm = normalizada.canal(nro_canal)
 
-    # Registrar los datos de la envolvente del gesto a usar
-    emg_fun_env_list = [dato[nro_canal - 1] for dato in datos_db] 
-    emg_fun_env = np.array(emg_fun_env_list)
 
-
-    ### Obtener la señal normalizada
-    cursor.execute(f"""
-        SELECT ch1_norm, ch2_norm, ch3_norm
-        FROM {tabla_norm} 
-        WHERE gesto_id = ?
-        """, (gesto_id,))
-    datos_db = cursor.fetchall()
-
-    # Registrar los datos de la señal normalizada a usar
-    emg_fun_norm_list = [dato[nro_canal - 1]for dato in datos_db] 
-    emg_fun_norm = np.array(emg_fun_norm_list)
-
-
-    ### Obtener la CVM bruta correspondiente
+    ### Obtener la CVM bruta correspondiente y su envolvente
     # Para que quede en formato "CHX" como las columnas de la base de datos
     canal_string = str("CH" + str(nro_canal))    
-    
-    cursor.execute(f"""
-        SELECT {canal_string} * {reescalado}
-        FROM {tabla_raw} 
-        WHERE nombre_gesto LIKE '%CVM {canal_string}%'
-        AND sesion_id = ?
-    """,(sesion_id,))
-
-    # Registrar los datos de la CVM bruta
-    emg_cvm_list = cursor.fetchall()
-    emg_cvm = np.array(emg_cvm_list)
-    #datos_db = cursor.fetchall()
-    #emg_cvm = [dato[0] for dato in datos_db[nro_canal]] 
-
+    emg_cvm = bd.obtener_cvm(sesion_id, nro_canal, mapa_cvm=perfil.mapa_cvm)
+    emg_cvm_env = bd.obtener_cvm(sesion_id, nro_canal, tabla=tabla_norm,
+                                 mapa_cvm=perfil.mapa_cvm)
 
-    ### Obtener la envolvente de la CVM
-    cursor.execute(f"""
-        SELECT ch1_env_fil, ch2_env_fil, ch3_env_fil
-        FROM {tabla_norm} 
-        WHERE nombre_gesto LIKE '%CVM {canal_string}%'
-        AND sesion_id = ?
-        """, (sesion_id,))
-    
-    datos_db = cursor.fetchall()
-
-    # Registrar los datos de la envolvente del CVM correcto
-    emg_cvm_env_list = [dato[nro_canal - 1] for dato in datos_db] 
-    emg_cvm_env = np.array(emg_cvm_env_list)
+    # Nuevo: la señal bruta y la CVM se grafican a la frecuencia con que se 
+    # capturaron y las envolventes a la de 'norm' ('fs_norm' si se decimó)
+    ids_cvm = [g[0] for g in bd.listar_gestos(tabla_raw, sesion_id)
+               if es_cvm_de_canal(g[3], nro_canal, perfil.mapa_cvm)]
+    fs_cvm = bd.conexion.execute(f"SELECT fs FROM {tabla_raw} WHERE "
+                                 f"gesto_id = ? LIMIT 1", 
+                                 (ids_cvm[0],)).fetchone()[0]
 
 
     # Graficar
     mpl.rc('font',family='Times New Roman')
     plot_emgs(emg_fun, emg_fun_env, emg_fun_norm, emg_cvm, emg_cvm_env,
-              fs, f_c, f_orden,
-              nombre)
+              registro.fs, f_c, f_orden,
+              nombre, fs_env=envolvente.fs, fs_cvm=fs_cvm)
     
     # Guardar gráfico generado
     directorio = 'fig_3ch/cvm'
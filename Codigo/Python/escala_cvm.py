@@ -0,0 +1,132 @@
+""" Escala de la CVM
+La señal normalizada de un gesto es su envolvente filtrada dividida por el
+máximo de la CVM de su sesión, canal por canal:
+
+    chX_norm = chX_env_fil / cvm_max[X] * 100
+
+Guardar ambas columnas en la tabla 'norm' duplica la tabla sin aportar
+información. Con la opción 'solo_envolvente' del perfil la tabla guarda solo
+chX_env_fil (normalmente decimada con 'fs_norm') y el % de la CVM se calcula
+al leer, multiplicando todo el arreglo por el factor de escala de cada canal.
+
+El máximo de la CVM con que se normalizó cada sesión se guarda junto a la
+tabla 'norm' en ambos modos, porque la referencia de la sesión
+('referencia_sesion.py') se recalcula al cambiar los registros CVM y no
+necesariamente corresponde a la de los datos guardados.
+
+Estructura de la base de datos
+------------------------------
+Tabla 'cvm_<tabla_norm>' (por ejemplo 'cvm_norm' o 'cvm_norm_3f2a9c1b07'),
+con una fila por sesión y canal:
+    sesion_id (int) : ID de la sesión
+    canal (int)     : Número del canal
+    cvm_max (float) : Máximo de la envolvente filtrada de la CVM, en volts,
+                      con el que se normalizaron los gestos de la sesión
+
+Bastián Rivas
+"""
+import sqlite3
+import numpy as np
+
+# Lectura de un gesto y de los canales de una tabla
+from registro_emg import RegistroEMG, detectar_canales
+
+
+#%% Tabla de escalas
+def tabla_escala(tabla_norm='norm'):
+    """Nombre de la tabla con los máximos de CVM de 'tabla_norm'"""
+    return f"cvm_{tabla_norm}"
+
+
+def guarda_normalizada(conexion, tabla_norm='norm'):
+    """True si 'tabla_norm' tiene las columnas chX_norm"""
+    return bool(detectar_canales(conexion, tabla_norm, 'ch{}_norm'))
+
+
+def registrar_escala(conexion, sesion_id, canales, cvm_max,
+                     tabla_norm='norm'):
+    """
+    Guarda el máximo de la CVM de cada canal de una sesión, reemplazando el
+    anterior. No hace commit, para ir en la misma transacción que los datos.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        sesion_id (int): ID de la sesión
+        canales (list): Números de canal
+        cvm_max (array_like): Máximo de la CVM de cada canal, en volts
+        tabla_norm (str): Tabla de datos normalizados
+    """
+    tabla = tabla_escala(tabla_norm)
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        sesion_id INTEGER,
+        canal INTEGER,
+        cvm_max REAL,
+        PRIMARY KEY (sesion_id, canal)
+    );
+    """)
+    cursor.executemany(f"INSERT OR REPLACE INTO {tabla} VALUES (?, ?, ?)",
+                       [(sesion_id, int(canal), float(maximo)) for
+                        canal, maximo in zip(canales, np.ravel(cvm_max))])
+
+
+def obtener_escala(conexion, sesion_id, canales, tabla_norm='norm'):
+    """
+    Factor para pasar la envolvente de una sesión a % de la CVM.
+
+    Return
+    ------
+        np.array: 100 / cvm_max de cada canal, en el orden de 'canales'
+
+    Raises
+    ------
+        ValueError: Si falta la escala de algún canal
+    """
+    try:
+        filas = conexion.execute(f"""
+            SELECT canal, cvm_max FROM {tabla_escala(tabla_norm)}
+            WHERE sesion_id = ?
+        """, (sesion_id,)).fetchall()
+    except sqlite3.OperationalError:
+        filas = []
+    cvm_max = dict(filas)
+    faltantes = [canal for canal in canales if canal not in cvm_max]
+    if faltantes:
+        raise ValueError(f"No hay máximo de CVM para los canales {faltantes} "
+                         f"de la sesión {sesion_id} en "
+                         f"'{tabla_escala(tabla_norm)}'. Volver a normalizar "
+                         f"la sesión")
+    return 100 / np.array([cvm_max[canal] for canal in canales])
+
+
+#%% Lectura
+def a_porcentaje(envolvente, conexion, tabla_norm='norm'):
+    """
+    Envolvente filtrada (RegistroEMG en volts) llevada a % de la CVM, con un
+    solo producto por todo el arreglo.
+    """
+    escala = obtener_escala(conexion, envolvente.sesion_id,
+                            envolvente.canales, tabla_norm)
+    return envolvente.con_datos(envolvente.datos * escala)
+
+
+def leer_normalizada(conexion, gesto_id, tabla_norm='norm', canales=None,
+                     tabla_raw='raw'):
+    """
+    Señal de un gesto en % de la CVM, desde las columnas chX_norm si la tabla
+    las tiene o desde la envolvente y la escala de la sesión si no.
+
+    Return
+    ------
+        RegistroEMG
+    """
+    if guarda_normalizada(conexion, tabla_norm):
+        return RegistroEMG.desde_db(conexion, gesto_id, tabla_norm, canales,
+                                    reescalado=1.0, columna='ch{}_norm',
+                                    tabla_raw=tabla_raw)
+    envolvente = RegistroEMG.desde_db(conexion, gesto_id, tabla_norm, canales,
+                                      reescalado=1.0, columna='ch{}_env_fil',
+                                      tabla_raw=tabla_raw)
+    return a_porcentaje(envolvente, conexion, tabla_norm)
@@ -0,0 +1,150 @@
+""" Espectro EMG
+Motor espectral para la FFT de los gestos, con la FFT real de scipy.fft en
+lugar de la FFT compleja de scipy.fftpack, que calculaba todo el espectro para
+después descartar las frecuencias negativas.
+
+    - largo_fft: largo de la FFT para n muestras, rápido (next_fast_len) o
+      exacto
+    - frecuencias_fft: eje de frecuencias del lado derecho de la FFT
+    - magnitud_fft: lado derecho de la FFT de todos los canales de un gesto,
+      en una sola transformada
+    - a_decibeles: 20 * log10(magnitud) con un piso explícito para los ceros
+
+Largo de la FFT
+---------------
+Los segmentos de onset tienen largos arbitrarios y con un largo primo la FFT
+es mucho más lenta que con uno compuesto por factores chicos. En el modo
+'rapido' (por defecto) la señal se rellena con ceros hasta el siguiente largo
+rápido (next_fast_len), que es a lo más unos pocos por ciento más largo. El
+relleno solo interpola el espectro: la resolución sigue siendo fs / N. En el
+modo 'exacto' la FFT usa las N muestras, igual que antes.
+
+scipy.fft guarda los planes de los últimos largos usados, y el relleno junta
+muchos largos distintos en unos pocos largos rápidos, así que al procesar
+muchos gestos los planes se reutilizan. Por eso no hay una FFT por lote de
+varios gestos: apilarlos obliga a copiar cada señal a un arreglo relleno y
+resulta más lento que transformarlos de a uno (ver 'bench_fft.py').
+
+Escala
+------
+La magnitud es la amplitud de un lado: 2/N * |FFT| con N las muestras reales
+(sin el relleno), de modo que una sinusoide de amplitud A da un pico de altura
+A. La componente continua y la de Nyquist no tienen pareja negativa y se
+escalan por 1/N.
+
+Para comparar tiempos con la FFT anterior ver 'bench_fft.py'.
+
+Bastián Rivas
+"""
+import numpy as np
+# scipy.fft se importa dentro de las funciones, para no cargarlo al arrancar
+
+
+# Modos de largo de la FFT
+MODOS_LARGO = ('rapido', 'exacto')
+
+# Piso de 'a_decibeles' para las magnitudes nulas, en dB. Muy por debajo de
+# cualquier magnitud real de una señal de 10 bits
+PISO_DB = -200.0
+
+
+#%% Largos y ejes
+def largo_fft(n_muestras, modo='rapido'):
+    """
+    Largo de la FFT para una señal de 'n_muestras'.
+
+    Parameters
+    ----------
+        n_muestras (int): Muestras de la señal
+        modo (str): 'rapido' para rellenar hasta next_fast_len o 'exacto'
+                    para usar las muestras tal cual
+
+    Return
+    ------
+        int: Largo de la FFT, >= n_muestras
+    """
+    if modo not in MODOS_LARGO:
+        raise ValueError(f"Modo de largo desconocido: '{modo}'. Opciones: "
+                         f"{', '.join(MODOS_LARGO)}")
+    if n_muestras < 1:
+        raise ValueError("La señal no tiene muestras")
+    if modo == 'exacto':
+        return int(n_muestras)
+    from scipy.fft import next_fast_len
+    return next_fast_len(int(n_muestras), real=True)
+
+
+def frecuencias_fft(n_fft, fs):
+    """
+    Eje de frecuencias del lado derecho de una FFT de largo 'n_fft': los
+    n_fft // 2 + 1 valores k * fs / n_fft, desde 0 hasta fs / 2 (incluida si
+    n_fft es par).
+    """
+    return np.arange(n_fft // 2 + 1) * (fs / n_fft)
+
+
+def _escalar(espectro, n_muestras, n_fft, eje):
+    """Amplitud de un lado de un espectro de 'rfft', sobre el eje 'eje'"""
+    magnitud = np.abs(espectro)
+    magnitud *= 2.0 / n_muestras
+    # La continua y Nyquist (n_fft par) aparecen una sola vez
+    bordes = [0, -1] if n_fft % 2 == 0 else [0]
+    indice = [slice(None)] * magnitud.ndim
+    indice[eje] = bordes
+    magnitud[tuple(indice)] /= 2
+    return magnitud
+
+
+#%% Espectros
+def magnitud_fft(datos, fs, modo='rapido', workers=1):
+    """
+    Lado derecho de la FFT de todos los canales de una señal, en una sola
+    transformada sobre el eje 0.
+
+    Parameters
+    ----------
+        datos (np.array): Señal, de (n_muestras,) o (n_muestras, canales)
+        fs (float): Frecuencia de muestreo en Hertz
+        modo (str): Largo de la FFT, 'rapido' o 'exacto' (ver 'largo_fft')
+        workers (int): Hilos de scipy.fft. -1 para usar todos los núcleos
+
+    Return
+    ------
+        frecuencias (np.array): Eje de frecuencias en Hertz, de
+                                (n_fft // 2 + 1,)
+        magnitud (np.array): Amplitud de un lado, de (n_fft // 2 + 1,) o
+                             (n_fft // 2 + 1, canales)
+        n_fft (int): Largo de la FFT usado
+    """
+    from scipy.fft import rfft
+    datos = np.asarray(datos, dtype=float)
+    n_muestras = datos.shape[0]
+    n_fft = largo_fft(n_muestras, modo)
+    espectro = rfft(datos, n=n_fft, axis=0, workers=workers)
+    return (frecuencias_fft(n_fft, fs),
+            _escalar(espectro, n_muestras, n_fft, 0), n_fft)
+
+
+def a_decibeles(magnitud, piso_db=PISO_DB):
+    """
+    20 * log10(magnitud), con las magnitudes nulas (un canal plano o una
+    señal de puros ceros) en 'piso_db' en lugar de -inf y sin la advertencia
+    de división por cero de NumPy.
+    """
+    magnitud = np.asarray(magnitud, dtype=float)
+    piso = 10.0 ** (piso_db / 20)
+    return 20 * np.log10(np.maximum(magnitud, piso))
+
+
+#%%
+if __name__ == '__main__':
+    # Sinusoide de 50 Hz y amplitud 1 con un largo primo (1009 muestras)
+    fs = 1000
+    t = np.arange(1009) / fs
+    senal = np.column_stack([np.sin(2 * np.pi * 50 * t), np.zeros_like(t)])
+    for modo in MODOS_LARGO:
+        frecuencias, magnitud, n_fft = magnitud_fft(senal, fs, modo)
+        pico = np.argmax(magnitud[:, 0])
+        print(f"{modo:>7}: n_fft = {n_fft}, pico de {magnitud[pico, 0]:.3f} "
+              f"en {frecuencias[pico]:.1f} Hz, canal plano en "
+              f"{a_decibeles(magnitud[:, 1]).max():.0f} dB")
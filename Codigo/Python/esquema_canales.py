@@ -0,0 +1,143 @@
+""" Esquema de canales
+Funciones para trabajar con una cantidad cualquiera de canales en la captura y
+en las tablas de la base de datos, en lugar de las columnas fijas CH1, CH2 y
+CH3.
+
+Las tablas mantienen una columna por canal (CH1 ... CHN en 'raw',
+chX_env_fil y chX_norm en 'norm', etc.). Al registrar datos con más canales de
+los que tiene una tabla, las columnas que faltan se agregan con ALTER TABLE,
+por lo que las bases de datos existentes de 3 canales siguen funcionando y los
+registros antiguos quedan con NULL en los canales nuevos.
+
+Bastián Rivas
+"""
+import re
+
+
+#%% Lectura desde el puerto serial
+def parsear_linea(linea, n_canales):
+    """
+    Convierte una línea recibida por el puerto serial con el formato
+    <onset>,<CH1>,...,<CHN> en enteros.
+
+    Parameters
+    ----------
+        linea (str): Línea recibida, sin el salto de línea
+        n_canales (int): Cantidad de canales esperada
+
+    Return
+    ------
+        tuple: (onset, CH1, ..., CHN), o None si la línea no tiene
+               n_canales + 1 valores
+
+    Raises
+    ------
+        ValueError: Si algún valor no se puede convertir a entero
+    """
+    valores = linea.split(',')
+    if len(valores) != n_canales + 1:
+        return None
+    return tuple(map(int, valores))
+
+
+#%% Columnas y tablas
+def columnas_raw(canales):
+    """Nombres de las columnas de la tabla 'raw' para los canales dados"""
+    return [f"CH{num_canal}" for num_canal in canales]
+
+
+def columnas_norm(canales, normalizada=True):
+    """
+    Nombres de las columnas de la tabla 'norm' para los canales dados. Con
+    normalizada=False, solo las de la envolvente (ver 'escala_cvm.py')
+    """
+    tipos = ('env_fil', 'norm') if normalizada else ('env_fil',)
+    return [f"ch{num_canal}_{tipo}" for num_canal in canales
+            for tipo in tipos]
+
+
+def columnas_existentes(cursor, tabla):
+    """Nombres de las columnas de una tabla"""
+    cursor.execute(f"PRAGMA table_info({tabla})")
+    return [fila[1] for fila in cursor.fetchall()]
+
+
+def agregar_columnas(cursor, tabla, columnas, tipo):
+    """
+    Agrega a una tabla existente las columnas que le falten.
+
+    Parameters
+    ----------
+        cursor (sqlite3.Cursor): Cursor de la base de datos
+        tabla (str): Nombre de la tabla
+        columnas (list): Columnas que debe tener la tabla
+        tipo (str): Tipo SQLite de las columnas nuevas
+    """
+    existentes = {c.lower() for c in columnas_existentes(cursor, tabla)}
+    for columna in columnas:
+        if columna.lower() not in existentes:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
+
+
+def crear_tabla_raw(cursor, nombre_tabla='raw', canales=[1, 2, 3]):
+    """
+    Crea la tabla de datos brutos con una columna por canal. Si ya existe, le
+    agrega las columnas de los canales que falten.
+    """
+    columnas = ",\n                    ".join(
+        f"{columna} INTEGER" for columna in columnas_raw(canales))
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {nombre_tabla} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    gesto_id INTEGER,
+                    sesion_id INTEGER,
+                    onset INTEGER,
+                    nombre_gesto TEXT,
+                    fs INTEGER,
+                    fecha TEXT,
+                    {columnas}
+                )''')
+    agregar_columnas(cursor, nombre_tabla, columnas_raw(canales), 'INTEGER')
+
+
+def canales_en_datos(datos, sufijo):
+    """
+    Obtiene los números de canal presentes en un diccionario de resultados a
+    partir de sus llaves, por ejemplo 'ch1_env_fil', 'ch2_env_fil', ...
+
+    Parameters
+    ----------
+        datos (dict): Diccionario con llaves 'chX_<sufijo>'
+        sufijo (str): Sufijo de las llaves a buscar
+
+    Return
+    ------
+        list: Números de canal ordenados
+    """
+    patron = re.compile(rf"ch(\d+)_{re.escape(sufijo)}$")
+    return sorted(int(m.group(1)) for llave in datos
+                  if (m := patron.match(llave)))
+
+
+def es_cvm_de_canal(nombre_gesto, num_canal, mapa_cvm=None):
+    """
+    Indica si un registro corresponde a la CVM de un canal.
+
+    Por defecto la CVM del canal X es el registro cuyo nombre contiene
+    'CVM CHX', igual que la consulta LIKE '%CVM CHX%' usada antes, pero sin
+    que 'CVM CH1' coincida con 'CVM CH10', 'CVM CH11', etc. cuando hay más de
+    9 canales. Con 'mapa_cvm' se puede asignar a cada canal otro registro,
+    por ejemplo una misma CVM para varios canales de un brazalete.
+
+    Parameters
+    ----------
+        nombre_gesto (str): Nombre del registro
+        num_canal (int): Número del canal
+        mapa_cvm (dict): Diccionario opcional {canal: nombre del registro CVM}
+
+    Return
+    ------
+        bool
+    """
+    if mapa_cvm and num_canal in mapa_cvm:
+        return nombre_gesto == mapa_cvm[num_canal]
+    return re.search(rf"CVM CH{num_canal}(?!\d)", nombre_gesto.upper()) is not None
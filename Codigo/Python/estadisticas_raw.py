@@ -0,0 +1,338 @@
+''' Estadísticas de datos brutos
+Estadísticas de cada gesto calculadas al capturar, para responder consultas
+sobre muchos gestos (por ejemplo, "el RMS de todos los gestos de la sesión 3")
+sin leer las filas de muestras de la tabla 'raw'.
+
+Por cada gesto, canal y estado del onset se guardan la cantidad de muestras,
+la suma, la suma de cuadrados, el mínimo y el máximo, en unidades del ADC
+(enteros, por lo que las sumas son exactas). Con eso se obtienen la media,
+el RMS y la desviación estándar de cualquier combinación de estados o gestos:
+las sumas se pueden sumar, los promedios no.
+
+Las estadísticas se acumulan al insertar cada bloque de muestras
+(buffer_captura.py y captura_multiple.py). Para bases de datos capturadas
+antes de que existiera la tabla, 'reconstruir_estadisticas' las calcula con
+una sola consulta de agregación sobre 'raw'.
+
+Las filas de 'raw' que se insertan, modifican o borran por otro camino (por
+ejemplo 'exportar_parquet.importar_tabla' o una captura con código anterior)
+dejan su gesto marcado como pendiente, mediante triggers de SQLite.
+'resumen_gestos' vuelve a calcular las estadísticas de los gestos pendientes
+antes de responder, así que nunca entrega estadísticas incompletas o
+antiguas.
+
+Estructura de la base de datos
+------------------------------
+Tabla 'estadisticas_raw', una fila por gesto, canal y estado del onset:
+        gesto_id: ID del gesto
+       sesion_id: ID de la sesión
+    nombre_gesto: Nombre del gesto
+           canal: Número del canal
+           onset: Estado del onset (0 o 1)
+               n: Cantidad de muestras
+            suma: Suma de las muestras
+       suma_cuad: Suma de los cuadrados de las muestras
+          minimo: Valor mínimo
+          maximo: Valor máximo
+
+Tabla 'estadisticas_raw_pendientes', con los gestos cuyas estadísticas hay
+que volver a calcular:
+        gesto_id: ID del gesto
+
+Ejemplo
+-------
+    conexion = sqlite3.connect('Datos/datos_gestos_3ch.db')
+    for gesto in resumen_gestos(conexion, sesion_id=3, onset=1):
+        print(gesto['gesto_id'], gesto['nombre_gesto'], gesto['rms'])
+
+Bastián Rivas
+'''
+import sqlite3
+import os
+import sys
+import time
+import numpy as np
+
+# Columnas de la tabla 'raw' para N canales
+from esquema_canales import columnas_raw
+from registro_emg import detectar_canales
+
+
+#%% Tabla
+def crear_tabla_estadisticas(cursor, tabla='estadisticas_raw',
+                             tabla_raw='raw'):
+    """
+    Crea la tabla de estadísticas, la de gestos pendientes y los triggers de
+    'tabla_raw' que marcan como pendiente un gesto cuyas filas cambian. La
+    primera vez marca todos los gestos que ya estén en 'tabla_raw', porque
+    pueden no tener estadísticas o tenerlas desactualizadas
+    """
+    pendientes = f"{tabla}_pendientes"
+    nueva = not existe_tabla(cursor.connection, pendientes)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        gesto_id INTEGER,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        canal INTEGER,
+        onset INTEGER,
+        n INTEGER,
+        suma INTEGER,
+        suma_cuad INTEGER,
+        minimo INTEGER,
+        maximo INTEGER,
+        PRIMARY KEY (gesto_id, canal, onset)
+    );
+    """)
+    cursor.execute(f"""CREATE INDEX IF NOT EXISTS idx_{tabla}_sesion
+                       ON {tabla} (sesion_id)""")
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS {pendientes} (
+                       gesto_id INTEGER PRIMARY KEY)""")
+    if not existe_tabla(cursor.connection, tabla_raw):
+        return
+    if nueva:
+        cursor.execute(f"""INSERT OR IGNORE INTO {pendientes}
+                           SELECT DISTINCT gesto_id FROM {tabla_raw}""")
+    for evento, filas in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")),
+                          ("DELETE", ("OLD",))):
+        marcar = "".join(f"""
+            INSERT OR IGNORE INTO {pendientes} VALUES ({fila}.gesto_id);"""
+                         for fila in filas)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS pendiente_{tabla}_{evento.lower()}
+        AFTER {evento} ON {tabla_raw}
+        BEGIN{marcar}
+        END;
+        """)
+
+
+def existe_tabla(conexion, tabla='estadisticas_raw'):
+    cursor = conexion.execute("""SELECT 1 FROM sqlite_master
+                                 WHERE type = 'table' AND name = ?""",
+                              (tabla,))
+    return cursor.fetchone() is not None
+
+
+#%% Acumulación al capturar
+def acumular_estadisticas(cursor, gesto_id, sesion_id, nombre_gesto, onset,
+                          datos, canales, tabla='estadisticas_raw',
+                          tabla_raw='raw'):
+    """
+    Suma las estadísticas de un bloque de muestras a las del gesto. Se llama
+    una vez por bloque insertado, después de insertarlo y en la misma
+    transacción, y quita la marca de pendiente que dejó el trigger.
+
+    Parameters
+    ----------
+        cursor (sqlite3.Cursor): Cursor de la base de datos
+        gesto_id, sesion_id, nombre_gesto: Datos del gesto
+        onset (np.array): Onset de cada muestra, de (n_muestras,)
+        datos (np.array): Valores enteros del ADC, de (n_muestras, canales)
+        canales (list): Número de canal de cada columna de 'datos'
+        tabla (str): Tabla de estadísticas
+        tabla_raw (str): Tabla donde se insertaron las muestras
+    """
+    onset = np.asarray(onset).astype(np.int64)
+    datos = np.asarray(datos).astype(np.int64).reshape(len(onset), -1)
+    if len(onset) == 0:
+        return
+    crear_tabla_estadisticas(cursor, tabla, tabla_raw)
+
+    filas = []
+    for estado in np.unique(onset):
+        parte = datos[onset == estado]
+        filas.extend(zip(
+            [gesto_id] * len(canales), [sesion_id] * len(canales),
+            [nombre_gesto] * len(canales), canales,
+            [int(estado)] * len(canales), [len(parte)] * len(canales),
+            parte.sum(axis=0).tolist(),
+            np.square(parte).sum(axis=0).tolist(),
+            parte.min(axis=0).tolist(), parte.max(axis=0).tolist()))
+    cursor.executemany(f"""
+        INSERT INTO {tabla} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (gesto_id, canal, onset) DO UPDATE SET
+            n = n + excluded.n,
+            suma = suma + excluded.suma,
+            suma_cuad = suma_cuad + excluded.suma_cuad,
+            minimo = MIN(minimo, excluded.minimo),
+            maximo = MAX(maximo, excluded.maximo)
+    """, filas)
+    cursor.execute(f"DELETE FROM {tabla}_pendientes WHERE gesto_id = ?",
+                   (gesto_id,))
+
+
+def reconstruir_estadisticas(conexion, tabla_raw='raw',
+                             tabla='estadisticas_raw', solo_pendientes=False):
+    """
+    Recalcula la tabla de estadísticas desde la tabla de datos brutos, con
+    una consulta de agregación por canal. Reemplaza lo que hubiera.
+
+    Parameters
+    ----------
+        solo_pendientes (bool): Recalcular solo los gestos marcados como
+                                pendientes por los triggers
+
+    Return
+    ------
+        int: Cantidad de filas de estadísticas registradas
+    """
+    cursor = conexion.cursor()
+    crear_tabla_estadisticas(cursor, tabla, tabla_raw)
+    pendientes = f"{tabla}_pendientes"
+    filtro = "1"
+    if solo_pendientes:
+        filtro = f"gesto_id IN (SELECT gesto_id FROM {pendientes})"
+        cursor.execute(f"SELECT COUNT(*) FROM {pendientes}")
+        if cursor.fetchone()[0] == 0:
+            conexion.commit()
+            return conexion.execute(
+                f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+
+    canales = detectar_canales(conexion, tabla_raw)
+    cursor.execute(f"DELETE FROM {tabla} WHERE {filtro}")
+    for num_canal, columna in zip(canales, columnas_raw(canales)):
+        # COUNT de la columna, para no contar los NULL de canales que el
+        # gesto no tiene
+        cursor.execute(f"""
+            INSERT INTO {tabla}
+            SELECT gesto_id, MIN(sesion_id), MIN(nombre_gesto), ?, onset,
+                   COUNT({columna}), SUM({columna}),
+                   SUM({columna} * {columna}), MIN({columna}), MAX({columna})
+            FROM {tabla_raw}
+            WHERE {columna} IS NOT NULL AND {filtro}
+            GROUP BY gesto_id, onset
+        """, (num_canal,))
+    cursor.execute(f"DELETE FROM {pendientes}")
+    conexion.commit()
+    return conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+
+
+#%% Consultas
+def resumen_gestos(conexion, sesion_id=None, onset=None,
+                   reescalado=5.0/1023, tabla='estadisticas_raw',
+                   tabla_raw='raw'):
+    """
+    Media, RMS, desviación estándar, mínimo y máximo por canal de cada gesto,
+    leídos solo desde la tabla de estadísticas.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        sesion_id (int): Sesión a consultar. Por defecto todas
+        onset (int): Estado del onset a considerar (0 o 1). Por defecto todas
+                     las muestras del gesto
+        reescalado (float): Factor para pasar los valores del ADC a volts
+        tabla (str): Tabla de estadísticas. Si no existe, se construye una vez
+                     desde 'tabla_raw'. Los gestos pendientes se recalculan
+                     antes de responder
+
+    Return
+    ------
+        list: Un diccionario por gesto, ordenados por ID, con las llaves
+              'gesto_id', 'sesion_id', 'nombre_gesto', 'canales', 'n' y los
+              arreglos por canal 'media', 'rms', 'desviacion', 'minimo' y
+              'maximo', en volts
+    """
+    reconstruir_estadisticas(conexion, tabla_raw, tabla,
+                             solo_pendientes=existe_tabla(conexion, tabla))
+
+    condiciones, parametros = [], []
+    if sesion_id is not None:
+        condiciones.append("sesion_id = ?")
+        parametros.append(sesion_id)
+    if onset is not None:
+        condiciones.append("onset = ?")
+        parametros.append(onset)
+    donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+        SELECT gesto_id, MIN(sesion_id), MIN(nombre_gesto), canal, SUM(n),
+               SUM(suma), SUM(suma_cuad), MIN(minimo), MAX(maximo)
+        FROM {tabla}
+        {donde}
+        GROUP BY gesto_id, canal
+        ORDER BY gesto_id, canal
+    """, parametros)
+    filas = cursor.fetchall()
+    if not filas:
+        return []
+
+    gesto_ids = np.array([fila[0] for fila in filas])
+    # Las sumas de cuadrados pueden superar int64 en gestos muy largos
+    valores = np.array([fila[4:] for fila in filas], dtype=float)
+    n = valores[:, 0]
+    media = valores[:, 1] / n
+    rms = np.sqrt(valores[:, 2] / n)
+    # Varianza desde las sumas; el máximo con 0 evita negativos por redondeo
+    desviacion = np.sqrt(np.maximum(valores[:, 2] / n - media ** 2, 0))
+
+    resumen = []
+    _, inicios = np.unique(gesto_ids, return_index=True)
+    limites = np.append(inicios, len(filas))
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        resumen.append({
+            'gesto_id': filas[inicio][0],
+            'sesion_id': filas[inicio][1],
+            'nombre_gesto': filas[inicio][2],
+            'canales': [fila[3] for fila in filas[inicio:fin]],
+            'n': int(n[inicio:fin].max()),
+            'media': media[inicio:fin] * reescalado,
+            'rms': rms[inicio:fin] * reescalado,
+            'desviacion': desviacion[inicio:fin] * reescalado,
+            'minimo': valores[inicio:fin, 3] * reescalado,
+            'maximo': valores[inicio:fin, 4] * reescalado,
+        })
+    return resumen
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    RMS de los segmentos activos de cada gesto de una sesión, desde la tabla
+    de estadísticas y leyendo todas las muestras, para comparar tiempos
+
+    Uso: python estadisticas_raw.py [sesion_id]
+    '''
+    ruta_db = 'Datos/datos_gestos_3ch.db'
+    tabla_raw = 'raw'
+    reescalado = 5.0/1023
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+
+    conexion = sqlite3.connect(ruta_db)
+    if not existe_tabla(conexion):
+        inicio = time.perf_counter()
+        n_filas = reconstruir_estadisticas(conexion, tabla_raw)
+        print(f"Tabla de estadísticas construida ({n_filas} filas) en "
+              f"{time.perf_counter() - inicio:.2f} s")
+    sesion_id = (int(sys.argv[1]) if len(sys.argv) > 1 else conexion.execute(
+        f"SELECT MAX(sesion_id) FROM {tabla_raw}").fetchone()[0])
+
+    inicio = time.perf_counter()
+    resumen = resumen_gestos(conexion, sesion_id, onset=1,
+                             reescalado=reescalado)
+    t_estadisticas = time.perf_counter() - inicio
+
+    print(f"\nRMS de los segmentos activos, sesión {sesion_id} [V]")
+    for gesto in resumen:
+        valores = ", ".join(f"CH{c}={v:.3f}"
+                            for c, v in zip(gesto['canales'], gesto['rms']))
+        print(f"{gesto['gesto_id']}\t{gesto['nombre_gesto']:<16}\t{valores}")
+
+    # Lo mismo leyendo todas las muestras de la sesión
+    canales = detectar_canales(conexion, tabla_raw)
+    inicio = time.perf_counter()
+    cursor = conexion.execute(f"""
+        SELECT gesto_id, {', '.join(columnas_raw(canales))}
+        FROM {tabla_raw}
+        WHERE sesion_id = ? AND onset = 1
+    """, (sesion_id,))
+    filas = np.array(cursor.fetchall(), dtype=float)
+    for gesto_id in np.unique(filas[:, 0]):
+        np.sqrt(np.mean(np.square(filas[filas[:, 0] == gesto_id, 1:]
+                                  * reescalado), axis=0))
+    t_muestras = time.perf_counter() - inicio
+    conexion.close()
+
+    print(f"\nDesde estadísticas: {t_estadisticas * 1e3:.1f} ms; "
+          f"leyendo las muestras: {t_muestras * 1e3:.1f} ms")
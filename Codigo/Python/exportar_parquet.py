@@ -0,0 +1,257 @@
+''' Exportar a Parquet
+
+Exporta las tablas de la base de datos ('raw', 'norm', 'fft' y las derivadas,
+como 'repeticiones' o 'referencia_sesion') a archivos Parquet particionados
+por sesión y gesto, y los vuelve a importar a SQLite. Cargar una sesión desde
+Parquet con pandas o polars es mucho más rápido y usa mucha menos memoria que
+'read_sql' sobre las tablas con una fila por muestra.
+
+    - Las filas se leen de SQLite en lotes de 'tamano_lote' y se escriben de a
+      un lote, por lo que la memoria usada no depende del tamaño de la tabla.
+    - Las columnas tienen tipos fijos: los canales brutos (CHX) como int16, el
+      onset como int8, las envolventes, señales normalizadas, FFT y demás
+      valores REAL como float32 y los nombres de gesto codificados como
+      diccionario (cada nombre distinto se guarda una sola vez).
+    - Las carpetas siguen el formato 'sesion_id=X/gesto_id=Y', que pandas,
+      polars y pyarrow reconocen como particiones. Leer una sesión solo abre
+      los archivos de esa sesión.
+
+Requiere pyarrow.
+
+Ejemplo
+-------
+    exportar_db('Datos/datos_gestos_3ch.db', 'Datos/parquet')
+    norm = leer_parquet('Datos/parquet', 'norm', sesion_id=2).to_pandas()
+
+Bastián Rivas
+'''
+import sqlite3
+import os
+import re
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+# Columnas por las que se particionan las tablas, si las tienen
+PARTICIONES = ['sesion_id', 'gesto_id']
+
+
+#%% Tipos de columnas
+def tipo_arrow(columna, tipo_sqlite):
+    """
+    Tipo de Arrow de una columna según su nombre y su tipo en SQLite.
+    """
+    tipo_sqlite = tipo_sqlite.upper()
+    if re.fullmatch(r'CH\d+', columna):
+        return pa.int16()                   # ADC de 10 bits
+    if columna == 'onset':
+        return pa.int8()
+    if columna == 'nombre_gesto':
+        return pa.dictionary(pa.int32(), pa.string())
+    if 'INT' in tipo_sqlite:
+        return pa.int32() if columna != 'id' else pa.int64()
+    if 'REAL' in tipo_sqlite or 'FLOA' in tipo_sqlite:
+        return pa.float32()
+    if 'BLOB' in tipo_sqlite:
+        return pa.binary()
+    return pa.string()
+
+
+def tipo_sqlite(tipo):
+    """Tipo de SQLite de una columna de Arrow, para importar"""
+    if pa.types.is_dictionary(tipo):
+        tipo = tipo.value_type
+    if pa.types.is_integer(tipo):
+        return 'INTEGER'
+    if pa.types.is_floating(tipo):
+        return 'REAL'
+    if pa.types.is_binary(tipo):
+        return 'BLOB'
+    return 'TEXT'
+
+
+def esquema_tabla(conexion, tabla):
+    """Esquema de Arrow de una tabla de SQLite"""
+    cursor = conexion.execute(f"PRAGMA table_info({tabla})")
+    return pa.schema([(fila[1], tipo_arrow(fila[1], fila[2]))
+                      for fila in cursor.fetchall()])
+
+
+#%% Exportar
+def lotes_tabla(ruta_db, tabla, esquema, tamano_lote=100_000):
+    """
+    Lee una tabla de SQLite en lotes y los entrega como RecordBatch de Arrow.
+    La conexión se abre dentro del generador porque pyarrow lo recorre desde
+    otro hilo.
+    """
+    particiones = [c for c in PARTICIONES if c in esquema.names]
+    orden = ", ".join(particiones + (['id'] if 'id' in esquema.names else []))
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"SELECT {', '.join(esquema.names)} FROM {tabla}"
+                   + (f" ORDER BY {orden}" if orden else ""))
+    while filas := cursor.fetchmany(tamano_lote):
+        columnas = list(zip(*filas))
+        arreglos = []
+        for campo, valores in zip(esquema, columnas):
+            if pa.types.is_dictionary(campo.type):
+                arreglos.append(pa.array(valores, pa.string())
+                                .dictionary_encode())
+            else:
+                arreglos.append(pa.array(valores, campo.type))
+        yield pa.RecordBatch.from_arrays(arreglos, schema=esquema)
+    conexion.close()
+
+
+def exportar_tabla(ruta_db, tabla, directorio, tamano_lote=100_000):
+    """
+    Exporta una tabla a Parquet en 'directorio/tabla', particionada por
+    sesión y gesto. Reemplaza las particiones que ya existían.
+
+    Return
+    ------
+        int: Cantidad de filas exportadas
+    """
+    conexion = sqlite3.connect(ruta_db)
+    esquema = esquema_tabla(conexion, tabla)
+    particiones = [c for c in PARTICIONES if c in esquema.names]
+    n_filas = conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+    conexion.close()
+
+    ds.write_dataset(
+        lotes_tabla(ruta_db, tabla, esquema, tamano_lote),
+        os.path.join(directorio, tabla),
+        schema=esquema,
+        format='parquet',
+        partitioning=particiones or None,
+        partitioning_flavor='hive' if particiones else None,
+        existing_data_behavior='delete_matching',
+        max_rows_per_group=tamano_lote,
+    )
+    return n_filas
+
+
+def exportar_db(ruta_db, directorio, tablas=None, tamano_lote=100_000):
+    """
+    Exporta varias tablas. Por defecto, todas las de la base de datos.
+
+    Return
+    ------
+        dict: Filas exportadas por tabla
+    """
+    if tablas is None:
+        conexion = sqlite3.connect(ruta_db)
+        cursor = conexion.execute("""SELECT name FROM sqlite_master
+                                     WHERE type = 'table'
+                                     AND name NOT LIKE 'sqlite_%'""")
+        tablas = [fila[0] for fila in cursor.fetchall()]
+        conexion.close()
+    return {tabla: exportar_tabla(ruta_db, tabla, directorio, tamano_lote)
+            for tabla in tablas}
+
+
+#%% Leer e importar
+def abrir_parquet(directorio, tabla):
+    """Dataset de Arrow de una tabla exportada"""
+    return ds.dataset(os.path.join(directorio, tabla), format='parquet',
+                      partitioning='hive')
+
+
+def leer_parquet(directorio, tabla, sesion_id=None, gesto_id=None,
+                 columnas=None):
+    """
+    Lee una tabla exportada, filtrando por sesión y/o gesto. Solo se abren
+    los archivos de las particiones pedidas.
+
+    Return
+    ------
+        pyarrow.Table: Usar .to_pandas() o polars.from_arrow() para convertir
+    """
+    dataset = abrir_parquet(directorio, tabla)
+    filtro = None
+    for columna, valor in (('sesion_id', sesion_id), ('gesto_id', gesto_id)):
+        if valor is not None:
+            condicion = ds.field(columna) == valor
+            filtro = condicion if filtro is None else filtro & condicion
+    tabla_arrow = dataset.to_table(columns=columnas, filter=filtro)
+    if 'id' in tabla_arrow.column_names:
+        tabla_arrow = tabla_arrow.sort_by('id')
+    return tabla_arrow
+
+
+def importar_tabla(directorio, tabla, ruta_db, tabla_destino=None,
+                   tamano_lote=100_000):
+    """
+    Importa a SQLite una tabla exportada, de a un lote. Si la tabla de
+    destino no existe se crea con los tipos de SQLite equivalentes.
+
+    Return
+    ------
+        int: Cantidad de filas importadas
+    """
+    tabla_destino = tabla_destino or tabla
+    dataset = abrir_parquet(directorio, tabla)
+    columnas = dataset.schema.names
+
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    definiciones = ", ".join(
+        f"{campo.name} {tipo_sqlite(campo.type)}"
+        + (" PRIMARY KEY" if campo.name == 'id' else "")
+        for campo in dataset.schema)
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {tabla_destino} "
+                   f"({definiciones})")
+    consulta = (f"INSERT INTO {tabla_destino} ({', '.join(columnas)}) "
+                f"VALUES ({', '.join(['?'] * len(columnas))})")
+
+    n_filas = 0
+    for lote in dataset.to_batches(columns=columnas, batch_size=tamano_lote):
+        valores = [lote.column(c).to_pylist() for c in columnas]
+        cursor.executemany(consulta, zip(*valores))
+        n_filas += lote.num_rows
+    conexion.commit()
+    conexion.close()
+    return n_filas
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Exportar todas las tablas y medir cuánto toma cargar los datos normalizados
+    de una sesión, comparado con pandas.read_sql
+    '''
+    ruta_db = 'Datos/datos_gestos_3ch.db'
+    directorio = 'Datos/parquet'
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+
+    inicio = time.perf_counter()
+    filas = exportar_db(ruta_db, directorio)
+    print(f"Exportado a {os.path.abspath(directorio)} en "
+          f"{time.perf_counter() - inicio:.1f} s")
+    for tabla, n_filas in filas.items():
+        print(f"  {tabla}: {n_filas} filas")
+
+    if 'norm' in filas:
+        conexion = sqlite3.connect(ruta_db)
+        sesion_id = conexion.execute(
+            "SELECT MIN(sesion_id) FROM norm").fetchone()[0]
+
+        inicio = time.perf_counter()
+        norm = leer_parquet(directorio, 'norm', sesion_id=sesion_id)
+        try:
+            import pandas as pd
+            norm = norm.to_pandas()
+        except ImportError:
+            pd = None
+        t_parquet = time.perf_counter() - inicio
+        print(f"Sesión {sesion_id} de 'norm' desde Parquet: {len(norm)} filas "
+              f"en {t_parquet * 1e3:.0f} ms")
+        if pd is not None:
+            inicio = time.perf_counter()
+            pd.read_sql("SELECT * FROM norm WHERE sesion_id = ?", conexion,
+                        params=(sesion_id,))
+            print(f"Misma sesión con pandas.read_sql: "
+                  f"{(time.perf_counter() - inicio) * 1e3:.0f} ms")
+        conexion.close()
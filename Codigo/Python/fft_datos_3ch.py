@@ -1,135 +1,112 @@
-import sqlite3
 import matplotlib.pyplot as plt
 import matplotlib as mpl  
 import numpy as np
-from scipy.fftpack import fft
 import os
 
-# Conectar a la base de datos SQLite
-db_path = 'Datos/datos_gestos_3ch.db'
-nombre_tabla = 'raw'
-# Factor de reescalado. En este caso se usa un ADC de 10 bits con 5 volts máx.
-reescalado = 5.0/1023 
-conexion = sqlite3.connect(db_path)
-# Mostrar la ubicación de la base de datos en consola
-print(f"Usando base de datos en {os.path.abspath(db_path)}\n")
-cursor = conexion.cursor()
-
-
-
-# Consultar los datos de gesto_id, fecha y gesto, omitiendo gesto_id repetidos
-cursor.execute(f"""
-    SELECT gesto_id, MIN(fecha), nombre_gesto 
-    FROM {nombre_tabla} 
-    GROUP BY gesto_id
-""")
-datos = cursor.fetchall()
-
-# Imprimir los datos obtenidos por consola
-print("---Gestos registrados---")
-for fila in datos:
-    gesto_id, fecha, gesto = fila
-    print(f"ID: {gesto_id}    \tFecha: {fecha}\tGesto: {gesto}")
-
-# Pedir el gesto_id del gesto a graficar
-gesto_id = int(input("Por favor, introduce la ID del gesto a graficar: "))
-
-
-# Obtener los datos del gesto
-nombre_tabla = 'raw' 
-
-cursor.execute(f"""SELECT fs, onset, abs(CH1) * {reescalado},
-               abs(CH2) * {reescalado}, abs(CH3) *{reescalado}, nombre_gesto 
-            FROM {nombre_tabla} 
-            WHERE gesto_id = ?
-            AND onset = 1"""
-            , (gesto_id,))
-datos = cursor.fetchall()
-nombre_gesto = datos[0][-1]  # Obtener el nombre del gesto
-
-
-# Separar los datos en listas para graficar y análisis, filtrando por onset = 1
-fs = datos[0][0]  # La frecuencia de muestreo es igual para todos los datos
-
-CH1_values = [dato[2] for dato in datos if dato[1] == 1]
-CH2_values = [dato[3] for dato in datos if dato[1] == 1]
-CH3_values = [dato[4] for dato in datos if dato[1] == 1]
-
-# Generar el vector de tiempo
-N = len(CH1_values)
-T = 1.0 / fs  # Periodo de muestreo en segundos
-time_vector = np.linspace(0.0, N * T, N)
-
-# Eliminar la componente de DC (valor medio)
-CH1_values = CH1_values - np.mean(CH1_values)
-CH2_values = CH2_values - np.mean(CH2_values)
-CH3_values = CH3_values - np.mean(CH3_values)
-
-
-
-# Calcular la FFT de las señales filtradas
-yf_CH1 = fft(CH1_values)
-yf_CH2 = fft(CH2_values)
-yf_CH3 = fft(CH3_values)
-xf = np.linspace(0.0, 1.0 / (2.0 * T), N // 2)
-
-# Graficar los datos
-mpl.rc('font',family='Times New Roman')
-fig, axs = plt.subplots(3, 1, figsize=(2, 2))
-
-# Límites eje Y
-yinf = 0
-ysup = 0.1
-
-# Tamaños de fuente
-titulo_size = 12
-tick_size = 8
-label_size = 10
-
-# Ticks de ejes
-yticks = [0, 0.05, 0.1]
-xticks = [0, 200, 400]
-
-# Gráficos de la FFT
-plt.subplots_adjust(left=None, bottom=None, right=None, top=None, wspace=None, 
-                    hspace=None)
-axs[0].plot(xf, 2.0 / N * np.abs(yf_CH1[:N // 2]), label='FFT de CH1')
-axs[0].set_ylabel('CH1', fontsize = label_size)
-axs[0].set_ylim(yinf, ysup)
-axs[0].set_title(f'FFT de {nombre_gesto}', fontsize = titulo_size)  
-axs[0].tick_params(labelbottom=False) # Omite los números del eje X
-axs[0].set_xticks(xticks) 
-axs[0].set_yticks(yticks) 
-axs[0].grid()
-
-axs[1].plot(xf, 2.0 / N * np.abs(yf_CH2[:N // 2]), label='FFT de CH2')
-axs[1].set_ylabel('CH2', fontsize = label_size)
-axs[1].set_ylim(yinf, ysup)
-axs[1].tick_params(labelbottom=False) # Omite los números del eje X
-axs[1].set_xticks(xticks) 
-axs[1].set_yticks(yticks) 
-axs[1].grid()
-
-axs[2].plot(xf, 2.0 / N * np.abs(yf_CH3[:N // 2]), label='FFT de CH3')
-axs[2].set_ylabel('CH3', fontsize = label_size)
-axs[2].set_ylim(yinf, ysup)
-axs[2].set_xlabel('Frecuencia [Hz]', fontsize = label_size)
-axs[2].set_xticks(xticks) 
-axs[2].set_yticks(yticks) 
-axs[2].grid()
-plt.tight_layout()
-fig.subplots_adjust(hspace=0.5, left=0.35)
-
-# Guardar gráfico generado
-directorio = 'fig_3ch/fft'
-if not os.path.exists(directorio):
-    os.makedirs(directorio)
-nombre_archivo = f"{gesto_id}_{nombre_gesto}.png"
-ruta_archivo = os.path.join(directorio, nombre_archivo)
-plt.savefig(ruta_archivo)
-print(f"Guardando gráfico en {ruta_archivo}")
-#plt.show()
-
-
-# Cerrar la conexión a la base de datos
-conexion.close()
+# Acceso a la base de datos
+from acceso_datos import BaseDatos
+# Parámetros desde el perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli
+# FFT real con largos rápidos
+from espectro_emg import magnitud_fft
+
+
+#%%
+def graficar_fft_activos(registro, directorio='fig_3ch/fft', modo='rapido'):
+    """
+    Grafica la FFT de las regiones con onset = 1 de un gesto, un canal por
+    fila, y guarda la figura.
+
+    Parameters
+    ----------
+        registro (RegistroEMG): Regiones activas del gesto, como las entrega
+                                'BaseDatos.obtener_raw(gesto_id, activos=True)'
+        directorio (str): Carpeta donde guardar la figura
+        modo (str): Largo de la FFT, 'rapido' o 'exacto' (ver espectro_emg.py)
+
+    Return
+    ------
+        str: Ruta del archivo guardado, '<gesto_id>_<nombre_gesto>.png'
+    """
+    fs, nombre_gesto = registro.fs, registro.nombre_gesto
+    datos = registro.datos
+
+    # Eliminar la componente de DC (valor medio) de todos los canales
+    datos = datos - np.mean(datos, axis=0)
+
+    # Calcular la FFT real de todos los canales, con su eje de frecuencias
+    xf, yf, _ = magnitud_fft(datos, fs, modo)
+
+    # Graficar los datos
+    mpl.rc('font',family='Times New Roman')
+    n_canales = registro.n_canales
+    fig, axs = plt.subplots(n_canales, 1, figsize=(2, 2 * n_canales / 3),
+                            squeeze=False)
+    axs = axs[:, 0]
+
+    # Límites eje Y
+    yinf = 0
+    ysup = 0.1
+
+    # Tamaños de fuente
+    titulo_size = 12
+    tick_size = 8
+    label_size = 10
+
+    # Ticks de ejes
+    yticks = [0, 0.05, 0.1]
+    xticks = [0, 200, 400]
+
+    # Gráficos de la FFT
+    plt.subplots_adjust(left=None, bottom=None, right=None, top=None, 
+                        wspace=None, hspace=None)
+    for i, (ax, num_canal) in enumerate(zip(axs, registro.canales)):
+        ax.plot(xf, yf[:, i], 
+                label=f'FFT de CH{num_canal}')
+        ax.set_ylabel(f'CH{num_canal}', fontsize = label_size)
+        ax.set_ylim(yinf, ysup)
+        ax.tick_params(labelbottom=False) # Omite los números del eje X
+        ax.set_xticks(xticks) 
+        ax.set_yticks(yticks) 
+        ax.grid()
+    axs[0].set_title(f'FFT de {nombre_gesto}', fontsize = titulo_size)  
+    axs[-1].tick_params(labelbottom=True)
+    axs[-1].set_xlabel('Frecuencia [Hz]', fontsize = label_size)
+    plt.tight_layout()
+    fig.subplots_adjust(hspace=0.5, left=0.35)
+
+    # Guardar gráfico generado
+    if not os.path.exists(directorio):
+        os.makedirs(directorio)
+    nombre_archivo = f"{registro.gesto_id}_{nombre_gesto}.png"
+    ruta_archivo = os.path.join(directorio, nombre_archivo)
+    fig.savefig(ruta_archivo)
+    # Cerrar la figura para poder graficar muchos gestos seguidos
+    plt.close(fig)
+    return ruta_archivo
+
+
+#%%
+if __name__ == '__main__':
+    # Conectar a la base de datos SQLite. El perfil indica la ruta y el factor
+    # de reescalado (por defecto, un ADC de 10 bits con 5 volts máx.)
+    perfil = cargar_perfil_cli()
+    db_path = perfil.ruta_db
+    bd = BaseDatos.desde_perfil(perfil)
+    # Mostrar la ubicación de la base de datos en consola
+    print(f"Usando base de datos en {os.path.abspath(db_path)}\n")
+
+    # Mostrar los gestos registrados
+    bd.imprimir_gestos()
+
+    # Pedir el gesto_id del gesto a graficar
+    gesto_id = int(input("Por favor, introduce la ID del gesto a graficar: "))
+
+
+    ### Obtener las regiones con onset = 1 del gesto, recortadas a partir de 
+    # los segmentos precalculados
+    registro = bd.obtener_raw(gesto_id, activos=True)
+    ruta_archivo = graficar_fft_activos(registro)
+    print(f"Guardando gráfico en {ruta_archivo}")
+    #plt.show()
+
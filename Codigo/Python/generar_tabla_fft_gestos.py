@@ -10,6 +10,7 @@ como también un ejemplo en el que se calcula con todas las entradas de una tabl
         fecha (string)       : Fecha en la que se hizo la captura, YYYY-MM-DD HH:MM:SS
         fs (int)             : Frecuencia de muestreo en Hertz
         fc (int)             : Frecuencia de corte del filtro 
+        n_fft (int)          : Largo de la FFT. Las frecuencias son k * fs / n_fft
         chX_fft (float)      : FFT de la señal en el canal X
         chX_rms_senal (float): RMS de la señal en el canal X
         chX_rms_ruido (float): RMS del ruido en el canal X
@@ -19,13 +20,30 @@ como también un ejemplo en el que se calcula con todas las entradas de una tabl
 Bastián Rivas
 """
 import sqlite3
-from scipy.fftpack import fft
 import os
-import matplotlib.pyplot as plt
+import numpy as np
+
+# Gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG
+
+# Referencia de CVM y reposo calculada una vez por sesión
+from referencia_sesion import obtener_referencia
+
+# Columnas para una cantidad cualquiera de canales
+from esquema_canales import canales_en_datos, agregar_columnas
+
+# Magnitudes en dB con piso explícito para log10(0)
+from espectro_emg import a_decibeles
+
+# Tiempos por etapa, sin costo si está desactivada
+from instrumentacion import medir, contar
+
+# Parámetros y tablas de resultados desde un perfil de procesamiento
+from perfil_procesamiento import (cargar_perfil, cargar_perfil_cli, 
+                                   registrar_perfil)
 
 
 #%% Función para calcular RMS
-import numpy as np
 def get_rms(values):
     """
     Calcula el valor RMS de una lista de valores.
@@ -43,8 +61,6 @@ def get_rms(values):
     return rms
 
 #%% Función para calcular la SNR
-import numpy as np
-
 def get_SNR(signal_rms, noise_rms):
     """
     Calcula la relación señal a ruido (SNR) a partir de los valores RMS de la señal y del ruido.
@@ -64,12 +80,14 @@ def get_SNR(signal_rms, noise_rms):
 #%%
 
 def calcular_fft_snr(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db', 
-                     tabla_norm = 'norm', fs = 1000, fc = 150, 
-                     canales = [1, 2, 3]):
+                     tabla_norm = 'norm', fs = None, fc = 150, 
+                     canales = None, tabla_raw = 'raw', forden = 2, 
+                     reescalado = 5.0/1023, mapa_cvm = None, 
+                     modo_fft = 'rapido', workers = 1, nperseg = 256):
     """
-    Script para calcular la FFT de hasta tres canales de un gesto específico a 
+    Script para calcular la FFT de N canales de un gesto específico a 
     partir de su ID, almacenado en una base de datos en SQLite.
-    Requiere que en la base de datos existan hasta 3 canales de registros del 
+    Requiere que en la base de datos existan los canales de registros del 
     gesto a usar y un registro llamado 'Reposo' correspondiente a la sesión en 
     la que se capturaron los datos
     Ojo: retorna el lado derecho de la FFT (aka:mlas frecuencias positivas)
@@ -81,10 +99,21 @@ def calcular_fft_snr(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
     'Datos/datos_gestos_3ch.db'.
     - "tabla_norm": El nombre de la tabla dentro de la base de datos donde se 
     registran los datos previamente filtrados
-    - "fs": La frecuencia de muestreo, cuyo valor por defecto es 1000 Hz.
+    - "fs": La frecuencia de análisis del perfil, con la que se calculó la 
+    referencia de la sesión. Por defecto la registrada en 'tabla_norm'. La FFT 
+    usa siempre la de 'tabla_norm', que es menor si se guardó con 'fs_norm'
     - "fc": La frecuencia de corte para el filtrado, cuyo valor por defecto es 
     150 Hz.
-    - "canales": Lista de canales a analizar, que por defecto es [1, 2, 3]
+    - "canales": Lista de canales a analizar. Por defecto, todos los canales 
+    de 'tabla_norm'
+    - "tabla_raw", "forden", "reescalado", "mapa_cvm": Tabla de datos brutos y 
+    parámetros con los que se calculó 'tabla_norm'. Se usan para obtener el RMS 
+    del ruido desde la referencia de la sesión
+    - "modo_fft": 'rapido' para rellenar con ceros hasta un largo rápido de la 
+    FFT (evita los largos primos) o 'exacto'. Ver 'espectro_emg.py'
+    - "workers": Hilos de scipy.fft
+    - "nperseg": Muestras por segmento de la PSD del reposo en la referencia 
+    de la sesión, el 'nperseg' del perfil
 
 
     Este script realiza las siguientes operaciones:
@@ -105,6 +134,7 @@ def calcular_fft_snr(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
                - fecha (string)       : Fecha en la que se hizo la captura, YYYY-MM-DD HH:MM:SS
                - fs (int)             : Frecuencia de muestreo en Hertz
                - fc (int)             : Frecuencia de corte del filtro 
+               - n_fft (int)          : Largo de la FFT. Las frecuencias son k * fs / n_fft
                - ch1_fft (float)      : FFT de la señal en el canal 1
                - ch1_rms_senal (float): RMS de la señal en el canal 1
                - ch1_rms_ruido (float): RMS del ruido en el canal 1
@@ -126,93 +156,60 @@ def calcular_fft_snr(gesto_id, ruta_db = 'Datos/datos_gestos_3ch.db',
     cursor = conexion.cursor()
 
     # Obtener valores de la señal funcional. De acá interesan los valores cuyo onset sea 1, fs, fc, fecha y su nombre
-    cursor.execute(f"""
-            SELECT sesion_id, fecha, fs, fc, ch1_env_fil, ch2_env_fil, ch3_env_fil, nombre_gesto
-            FROM {tabla_norm} 
-            WHERE gesto_id = ?
-            AND onset = 1
-        """,(gesto_id,))
-    datos = cursor.fetchall()
-
-    # Formato: [sesion_id, fs, fc, ch1_env_fil, ch2_env_fil, ch3_env_fil, nombre_gesto]
-
-    # Diccionario para ir registrando los datos que corresponden a cada canal
-    canales = [1, 2, 3]
-    emg_env_fil = {1: [],2: [],3: []}
-    for num_canal in canales:
-        # emg_env_fil[i] corresponde al canal i
-        emg_env_fil[num_canal] = [dato[3 + num_canal] for dato in datos] 
-
-    # Estos datos son los mismos para los 3 canales a través de todo el tiempo
-    sesion_id_gesto = datos[0][0]
-    fecha_gesto = datos [0][1]
-    fs = datos[0][2] 
-    fc = datos[0][3] 
-    nombre_gesto_funcional = datos[0][-1] 
-
-    # Obtener los registros de ruido (Reposo) correspondientes a la sesión
-    cursor.execute(f"""
-        SELECT ch1_env_fil, ch2_env_fil, ch3_env_fil
-        FROM {tabla_norm} 
-        WHERE nombre_gesto LIKE '%Reposo%'
-        AND sesion_id = ?
-    """,(sesion_id_gesto,))
+    # Nuevo: los canales se leen como un solo arreglo de (n_muestras, n_canales)
+    # y las regiones activas se recortan desde los segmentos de onset
+    with medir('fft.lectura', gesto_id):
+        registro = RegistroEMG.desde_db(conexion, gesto_id, tabla_norm, 
+                                        canales, reescalado=1.0, 
+                                        columna='ch{}_env_fil', 
+                                        tabla_raw=tabla_raw).activos()
+        if fs is None:
+            fs = registro.fs
+        cursor.execute(f"""SELECT fc FROM {tabla_norm} WHERE gesto_id = ? 
+                           LIMIT 1""", (gesto_id,))
+        fc = cursor.fetchone()[0]
+    contar('fft.muestras_leidas', registro.n_muestras)
+
+    # Obtener el RMS del ruido (Reposo) desde la referencia de la sesión, que 
+    # se calcula una sola vez en lugar de consultar el reposo en cada gesto
+    with medir('fft.referencia', gesto_id):
+        referencia = obtener_referencia(conexion, registro.sesion_id, 
+                                        tabla_raw, fs, fc, forden, reescalado,
+                                        registro.canales, mapa_cvm=mapa_cvm,
+                                        nperseg=nperseg)
+    conexion.close()
 
-    datos = cursor.fetchall() 
-    
-    ruido_env_fil = {1: [],2: [],3: []}
-    rms_senal = {1: [],2: [],3: []}
-    rms_ruido = {1: [],2: [],3: []}
-    SNR = {1: [],2: [],3: []}
-    fft_emg = {1: [],2: [],3: []}
-    fft_emg_magnitude = {1: [],2: [],3: []}
-    
-    for num_canal in canales:
-        # ruido_env_fil[i] corresponde al canal i
-        ruido_env_fil[num_canal] = [dato[num_canal - 1] for dato in datos] 
-    
-        # Calcular RMS de gesto y de ruido
-        rms_senal[num_canal] = get_rms(emg_env_fil[num_canal]) # RMS del gesto postprocesado
-        rms_ruido[num_canal] = get_rms(ruido_env_fil[num_canal])    # RMS del ruido postprocesado
+    # Calcular RMS de gesto y de ruido de todos los canales a la vez
+    with medir('fft.rms_snr', gesto_id):
+        rms_senal = registro.rms()              # RMS del gesto postprocesado
+        rms_ruido = referencia['rms_reposo']    # RMS del ruido postprocesado
 
         # Obtener SNR con SNR = 20 * log10(RMS_Señal / RMS_Ruido)
-        SNR[num_canal] = get_SNR(rms_senal[num_canal], rms_ruido[num_canal])
+        SNR = get_SNR(rms_senal, rms_ruido)
 
-        ### Obtener FFT de la señal
-        fft_emg[num_canal] = fft(emg_env_fil[num_canal])
+    ### Obtener el lado derecho de la FFT de todos los canales y pasarlo a dB
+    # Nuevo: FFT real con relleno hasta un largo rápido. Las magnitudes nulas 
+    # quedan en el piso de 'a_decibeles' en lugar de -inf
+    with medir('fft.fft', gesto_id):
+        _, fft_emg_magnitude, n_fft = registro.fft_magnitud(modo_fft, workers)
+        fft_emg_magnitude = a_decibeles(fft_emg_magnitude)
 
-        # Obtener el lado derecho de la FFT
-        N = len(fft_emg[num_canal])
-        fft_emg_magnitude[num_canal] = 2.0 / N * np.abs(fft_emg[num_canal][:N//2])
-
-        # Convertir a dB
-        fft_emg_magnitude[num_canal] = 20 * np.log10(fft_emg_magnitude[num_canal])
-
-
-        # Valores a retornar:
-        resultado_fft = {
+    # Valores a retornar:
+    resultado_fft = {
         'gesto_id': gesto_id,
-        'sesion_id': sesion_id_gesto,
-        'nombre_gesto': nombre_gesto_funcional,
-        'fecha': fecha_gesto,
-        'fs': fs,
+        'sesion_id': registro.sesion_id,
+        'nombre_gesto': registro.nombre_gesto,
+        'fecha': registro.fecha,
+        'fs': registro.fs,
         'fc': fc,
-        # Canal 1
-        'ch1_fft'       : fft_emg_magnitude[1], # FFT de la señal en dB
-        'ch1_rms_senal' : rms_senal[1],         # RMS de la señal del gesto
-        'ch1_rms_ruido' : rms_ruido[1],         # RMS del ruido del canal
-        'ch1_SNR'       : SNR[1],               # SNR obtenido a partir del RMS 
-        # Canal 2
-        'ch2_fft'       : fft_emg_magnitude[2], # FFT de la señal en dB
-        'ch2_rms_senal' : rms_senal[2],         # RMS de la señal del gesto
-        'ch2_rms_ruido' : rms_ruido[2],         # RMS del ruido del canal
-        'ch2_SNR'       : SNR[2],               # SNR obtenido a partir del RMS 
-        # Canal 3
-        'ch3_fft'       : fft_emg_magnitude[3], # FFT de la señal en dB
-        'ch3_rms_senal' : rms_senal[3],         # RMS de la señal del gesto
-        'ch3_rms_ruido' : rms_ruido[3],         # RMS del ruido del canal
-        'ch3_SNR'       : SNR[3],               # SNR obtenido a partir del RMS 
+        'n_fft': n_fft,
     }
+    for i, num_canal in enumerate(registro.canales):
+        canal = f'ch{num_canal}'
+        resultado_fft[f'{canal}_fft'] = fft_emg_magnitude[:, i] # FFT en dB
+        resultado_fft[f'{canal}_rms_senal'] = rms_senal[i]      # RMS del gesto
+        resultado_fft[f'{canal}_rms_ruido'] = rms_ruido[i]      # RMS del ruido
+        resultado_fft[f'{canal}_SNR'] = SNR[i]                  # SNR por RMS
 
     return resultado_fft
 
@@ -244,6 +241,8 @@ def registrar_datos_fft(datos_fft, ruta_db='Datos/datos_gestos_3ch.db',
                                YYYY-MM-DD HH:MM:SS
         fs (int)             : Frecuencia de muestreo en Hertz
         fc (int)             : Frecuencia de corte del filtro 
+        n_fft (int)          : Largo de la FFT. La fila k del gesto es la 
+                               frecuencia k * fs / n_fft
         chX_fft (float)      : FFT de la señal en el canal X
         chX_rms_senal (float): RMS de la señal en el canal X
         chX_rms_ruido (float): RMS del ruido en el canal X
@@ -253,6 +252,11 @@ def registrar_datos_fft(datos_fft, ruta_db='Datos/datos_gestos_3ch.db',
     conexion = sqlite3.connect(ruta_db)
     cursor = conexion.cursor()
 
+    # Nuevo: las columnas de canal dependen de los canales calculados
+    canales = canales_en_datos(datos_fft, 'fft')
+    columnas_canal = [f"ch{num_canal}_{tipo}" for num_canal in canales
+                      for tipo in ('fft', 'rms_ruido', 'rms_senal', 'SNR')]
+
     # Crear la tabla "fft" y ejecutar la consulta para crearla
     cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS {tabla_fft} (
@@ -263,90 +267,83 @@ def registrar_datos_fft(datos_fft, ruta_db='Datos/datos_gestos_3ch.db',
         fecha TEXT,
         fs INTEGER,
         fc INTEGER,
-        ch1_fft REAL,
-        ch1_rms_ruido REAL,
-        ch1_rms_senal REAL,
-        ch1_SNR REAL,
-        ch2_fft REAL,
-        ch2_rms_ruido REAL,
-        ch2_rms_senal REAL,
-        ch2_SNR REAL,
-        ch3_fft REAL,
-        ch3_rms_ruido REAL,
-        ch3_rms_senal REAL,
-        ch3_SNR REAL
-
+        n_fft INTEGER,
+        {', '.join(f'{columna} REAL' for columna in columnas_canal)}
     );
     """)
-
+    # Si la tabla ya existía con menos canales, agregar los que falten
+    agregar_columnas(cursor, tabla_fft, columnas_canal, 'REAL')
+    # Tablas de antes del largo de la FFT
+    agregar_columnas(cursor, tabla_fft, ['n_fft'], 'INTEGER')
 
     # Anotar todos los registros correspondientes al gesto especificado
-    # Los 3 canales tienen el mismo largo así que se puede usar cualquiera
-    n_registros = len(datos_fft['ch1_fft']) 
-
-    
-    for i in range(n_registros):
-        insertar_query = f"""
+    # Todos los canales tienen el mismo largo así que se puede usar cualquiera
+    # Nuevo: las FFT van en columnas de un solo arreglo y los valores por 
+    # canal (RMS y SNR) se repiten en cada fila; se inserta todo con un solo 
+    # executemany
+    gesto_id = datos_fft['gesto_id']
+    n_registros = len(datos_fft[f'ch{canales[0]}_fft'])
+    with medir('fft.escritura.conversion', gesto_id):
+        valores_canal = np.column_stack([
+            datos_fft[columna] if columna.endswith('_fft')
+            else np.full(n_registros, float(datos_fft[columna]))
+            for columna in columnas_canal]).tolist()
+    fijos = (
+        datos_fft['gesto_id'],
+        datos_fft['sesion_id'],
+        datos_fft['nombre_gesto'],
+        datos_fft['fecha'],
+        datos_fft['fs'],
+        datos_fft['fc'],
+        datos_fft.get('n_fft'),
+    )
+    insertar_query = f"""
        INSERT INTO {tabla_fft}(gesto_id, sesion_id, nombre_gesto, fecha, fs, fc, 
-                                 ch1_fft, ch1_rms_ruido, ch1_rms_senal, ch1_SNR, 
-                                 ch2_fft, ch2_rms_ruido, ch2_rms_senal, ch2_SNR, 
-                                 ch3_fft, ch3_rms_ruido, ch3_rms_senal, ch3_SNR)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                 n_fft, {', '.join(columnas_canal)})
+        VALUES ({', '.join(['?'] * (7 + len(columnas_canal)))})
         """
-        valores = (
-            datos_fft['gesto_id'],
-            datos_fft['sesion_id'],
-            datos_fft['nombre_gesto'],
-            datos_fft['fecha'],
-            datos_fft['fs'],
-            datos_fft['fc'],
-            datos_fft['ch1_fft'][i],
-            datos_fft['ch1_rms_ruido'],
-            datos_fft['ch1_rms_senal'],
-            datos_fft['ch1_SNR'],
-            datos_fft['ch2_fft'][i],
-            datos_fft['ch2_rms_ruido'],
-            datos_fft['ch2_rms_senal'],
-            datos_fft['ch2_SNR'],
-            datos_fft['ch3_fft'][i],
-            datos_fft['ch3_rms_ruido'],
-            datos_fft['ch3_rms_senal'],
-            datos_fft['ch3_SNR'],
-
-        )
-        cursor.execute(insertar_query, valores)
+    with medir('fft.escritura.insert', gesto_id):
+        cursor.executemany(insertar_query, 
+                           (fijos + tuple(fila) for fila in valores_canal))
 
     
-    conexion.commit()
+    with medir('fft.escritura.commit', gesto_id):
+        conexion.commit()
+    contar('fft.filas_escritas', n_registros)
     conexion.close()
 
-    print(f"Registrado '{datos_fft['nombre_gesto']}' con ID 
-          {datos_fft['gesto_id']} en la tabla '{tabla_norm}'.")
+    print(f"Registrado '{datos_fft['nombre_gesto']}' con ID "
+          f"{datos_fft['gesto_id']} en la tabla '{tabla_fft}'.")
 
 
 #%% 
-if __name__ == '__main__':
-    '''
-    Generar una tabla con la FFT de TODOS los datos normailzados registrados en 
-    tabla_norm.
-    Se appoya en las funciones de registrar_datos_fft y calcular_fft_snr.
-    También sirve como ejemplo de uso para las funciones anteriormente 
-    mencionadas
-    '''
-    ruta_db = '3ch_gestos_testing.db'
-    tabla_norm = 'norm'
-    tabla_fft = 'fft'
-  
+def fft_db_sql(perfil=None, confirmar=True):
+    """
+    Genera una tabla con la FFT de TODOS los datos normalizados registrados 
+    en la tabla 'norm' del perfil.
 
-    # Conectarse a la base de datos
-    conexion = sqlite3.connect(ruta_db)
-    cursor = conexion.cursor()
+    Parameters
+    ----------
+        perfil (Perfil): Parámetros y tablas. Por defecto, el perfil base
+        confirmar (bool): Pedir confirmación por consola antes de empezar.
+                          Con False se puede ejecutar sin interacción
+
+    Return
+    ------
+        int: Cantidad de gestos registrados. 0 si se canceló
+    """
+    # Parámetros y tablas del perfil de procesamiento
+    if perfil is None:
+        perfil = cargar_perfil()
+    ruta_db = perfil.ruta_db
+    tabla_norm = perfil.tabla('norm')
+    tabla_fft = perfil.tabla('fft')
 
 
     # Mostrar la ubicación de la base de datos en consola
     print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
-    print(f"Los gestos normalizados se leerán en la tabla '{tabla_norm}' y las 
-            FFT se guardarán en '{tabla_fft}'")
+    print(f"Los gestos normalizados se leerán en la tabla '{tabla_norm}' y las "
+          f"FFT se guardarán en '{tabla_fft}'")
 
     conexion = sqlite3.connect(ruta_db)
     cursor = conexion.cursor()
@@ -370,25 +367,45 @@ ID  \tFecha              \tSesión\tNombre del gesto
         gestos_a_procesar.append(gesto_id)
     
     n_gestos = len(gestos_a_procesar)
-    rpta = []
+    rpta = "y" if not confirmar else []
     
     # Confirmación porque puede tomar un rato
     while rpta not in ["y", "n"]:
-        rpta = input(f"¿Calcular la FFT de los {n_gestos} gestos? 
-                     [Y/n]: ").lower()
+        rpta = input(f"¿Calcular la FFT de los {n_gestos} gestos? "
+                     "[Y/n]: ").lower()
 
     # Empezar con procesamiento si se recibió una Y
     if rpta == "n":
         print("Cancelando...")
-        quit()
+        conexion.close()
+        return 0
     else:
         for gesto in gestos_a_procesar:
             # Obtener FFT de todos los gestos
-            datos_fft = calcular_fft_snr(gesto, ruta_db, tabla_norm)
-            registrar_datos_fft(datos_fft, ruta_db, 'fft')
+            datos_fft = calcular_fft_snr(gesto, ruta_db, tabla_norm, 
+                                         fs=perfil.fs,
+                                         tabla_raw=perfil.tabla_raw,
+                                         forden=perfil.forden,
+                                         reescalado=perfil.reescalado,
+                                         mapa_cvm=perfil.mapa_cvm,
+                                         nperseg=perfil.nperseg)
+            registrar_datos_fft(datos_fft, ruta_db, tabla_fft)
+        registrar_perfil(conexion, perfil)
             
     
     print(f"Finalizado. {n_gestos} gestos registrados.")
 
     conexion.close()
+    return n_gestos
 
+
+#%%
+if __name__ == '__main__':
+    '''
+    Generar una tabla con la FFT de TODOS los datos normailzados registrados en 
+    tabla_norm.
+    Se appoya en las funciones de registrar_datos_fft y calcular_fft_snr.
+    También sirve como ejemplo de uso para las funciones anteriormente 
+    mencionadas
+    '''
+    fft_db_sql(cargar_perfil_cli("Calcular la FFT de los gestos normalizados"))
@@ -0,0 +1,638 @@
+""" Índice de similitud de gestos
+Índice para encontrar los registros más parecidos a un gesto (para detectar
+registros atípicos o mal etiquetados) sin cargar todos los gestos desde
+SQLite ni compararlos a mano.
+
+Cada gesto se resume en una firma de largo fijo:
+
+    - Envolvente: la señal normalizada (% de la CVM, columnas chX_norm de la
+      tabla 'norm') de las regiones activas, remuestreada a 'LARGO' puntos
+      por canal
+    - Bandas: potencia relativa de la PSD de Welch de la señal bruta activa
+      en las bandas de 'BANDAS', en dB respecto a la potencia total, con los
+      segmentos de 'coherencia_canales.segmentos_welch'
+
+Las firmas se guardan en la tabla 'similitud' del perfil y se actualizan de
+a un gesto ('actualizar_indice'): 'emg_cli.py normalizar' agrega las firmas de
+los gestos que normaliza.
+
+Consultas
+---------
+'IndiceSimilitud' carga las firmas en dos matrices por cada conjunto de
+canales y estandariza cada columna. Solo se comparan gestos con los mismos
+canales (la distancia a los demás es NaN). La distancia combina el error cuadrático medio de la envolvente y el
+de las bandas, con pesos 'peso_envolvente' y 'peso_bandas':
+
+    - Euclidiana: la distancia a todos los gestos en un solo cálculo
+      vectorizado, y para 'revisar_etiquetas' la matriz completa con un
+      producto de matrices
+    - DTW (opcional): alinea las envolventes en el tiempo dentro de una banda
+      de Sakoe-Chiba. Los candidatos se ordenan por la cota inferior LB_Keogh
+      y el DTW se calcula por lotes vectorizados solo hasta que la cota del
+      siguiente supera la k-ésima mejor distancia
+
+    Estructura de la base de datos
+    ------------------------------
+        gesto_id (int)       : ID del gesto
+        sesion_id (int)      : ID de la sesión
+        nombre_gesto (string): Nombre del gesto hecho
+        canales (string)     : Números de canal de la firma, '1,2,3'
+        largo (int)          : Puntos de la envolvente por canal
+        bandas (string)      : Bordes de las bandas en Hertz, '20,40,...'
+        envolvente (blob)    : Envolvente remuestreada, float32 de
+                               (largo, canales)
+        potencia (blob)      : Potencia relativa por banda en dB, float32 de
+                               (n_bandas, canales)
+        fecha (string)       : Fecha del cálculo, YYYY-MM-DD HH:MM:SS
+
+
+Bastián Rivas
+"""
+import sqlite3
+from datetime import datetime
+import numpy as np
+
+# Gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG
+# Señal en % de la CVM, también de tablas guardadas solo con la envolvente
+from escala_cvm import leer_normalizada
+# Regiones activas desde los segmentos de onset
+from segmentos_onset import calcular_segmentos
+# Segmentos de Welch compartidos entre canales
+from coherencia_canales import segmentos_welch, psd_segmentos
+# Parámetros y tablas de resultados desde un perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli, registrar_perfil
+
+
+# Puntos de la envolvente remuestreada, por canal
+LARGO = 64
+
+# Bordes de las bandas de la PSD, en Hertz
+BANDAS = (20, 40, 60, 80, 110, 150, 200, 300, 450)
+
+# Piso de la potencia relativa, para no tomar log10(0)
+PISO_POTENCIA = 1e-12
+
+
+#%% Firmas
+def remuestrear(datos, largo=LARGO):
+    """
+    Remuestrea linealmente todos los canales a 'largo' puntos.
+
+    Parameters
+    ----------
+        datos (np.array): Señal de (n_muestras, canales)
+        largo (int): Puntos de salida
+
+    Return
+    ------
+        np.array: Arreglo de (largo, canales)
+    """
+    datos = np.asarray(datos, dtype=float)
+    posiciones = np.linspace(0, len(datos) - 1, largo)
+    izquierda = np.floor(posiciones).astype(int)
+    derecha = np.minimum(izquierda + 1, len(datos) - 1)
+    fraccion = (posiciones - izquierda)[:, None]
+    return datos[izquierda] * (1 - fraccion) + datos[derecha] * fraccion
+
+
+def potencia_bandas(frecuencias, psd, bandas=BANDAS):
+    """
+    Potencia relativa de cada banda respecto a la de todas las bandas, en dB.
+
+    Parameters
+    ----------
+        frecuencias (np.array): Eje de frecuencias de la PSD
+        psd (np.array): PSD de (n_frecuencias, canales)
+        bandas (tuple): Bordes de las bandas en Hertz
+
+    Return
+    ------
+        np.array: Arreglo de (len(bandas) - 1, canales)
+    """
+    banda = np.searchsorted(bandas, frecuencias, side='right') - 1
+    validas = (banda >= 0) & (banda < len(bandas) - 1)
+    potencia = np.zeros((len(bandas) - 1, psd.shape[1]))
+    np.add.at(potencia, banda[validas], psd[validas])
+    total = potencia.sum(axis=0)
+    relativa = potencia / np.where(total > 0, total, 1.0)
+    return 10 * np.log10(np.maximum(relativa, PISO_POTENCIA))
+
+
+def calcular_firma(gesto_id, ruta_db='Datos/datos_gestos_3ch.db',
+                   tabla_norm='norm', tabla_raw='raw', fs=1000,
+                   reescalado=5.0/1023, nperseg=256, largo=LARGO,
+                   bandas=BANDAS):
+    """
+    Firma de un gesto ya normalizado.
+
+    Parameters
+    ----------
+    - "gesto_id": Número identificador del gesto
+    - "ruta_db": La ruta a la base de datos SQLite
+    - "tabla_norm": Tabla con la señal normalizada (chX_norm), o solo con la
+      envolvente si se guardó con 'solo_envolvente'
+    - "tabla_raw", "fs", "reescalado", "nperseg": Tabla de datos brutos y
+      parámetros para la PSD de Welch, como en el perfil
+    - "largo", "bandas": Puntos de la envolvente y bordes de las bandas
+
+    Return
+    ------
+        firma: dict
+            'gesto_id', 'sesion_id', 'nombre_gesto', 'canales', 'largo',
+            'bandas', 'envolvente' de (largo, canales) y 'potencia' de
+            (n_bandas, canales)
+    """
+    conexion = sqlite3.connect(ruta_db)
+    normalizada = leer_normalizada(conexion, gesto_id, tabla_norm,
+                                   tabla_raw=tabla_raw)
+    bruta = RegistroEMG.desde_db(conexion, gesto_id, tabla_raw,
+                                 normalizada.canales, reescalado,
+                                 tabla_raw=tabla_raw).remuestrear(fs)
+    conexion.close()
+
+    # La tabla 'norm' puede estar a otra frecuencia ('fs_norm'), así que cada
+    # señal se recorta con sus propios segmentos
+    regiones = []
+    for registro in (normalizada, bruta):
+        segmentos = registro.segmentos
+        if segmentos is None or len(segmentos) == 0:
+            segmentos = calcular_segmentos(registro.onset)
+        if len(segmentos) == 0:
+            raise ValueError(f"El gesto {gesto_id} no tiene regiones activas")
+        regiones.append([registro.datos[inicio:fin]
+                         for inicio, fin in segmentos])
+
+    activas = np.concatenate(regiones[0])
+    frecuencias, espectros = segmentos_welch(regiones[1], fs, nperseg)
+    return {
+        'gesto_id': gesto_id,
+        'sesion_id': normalizada.sesion_id,
+        'nombre_gesto': normalizada.nombre_gesto,
+        'canales': list(normalizada.canales),
+        'largo': largo,
+        'bandas': tuple(bandas),
+        'envolvente': remuestrear(activas, largo),
+        'potencia': potencia_bandas(frecuencias, psd_segmentos(espectros),
+                                    bandas),
+    }
+
+
+#%% Tabla de firmas
+def crear_tabla_similitud(cursor, tabla_sim='similitud'):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_sim} (
+        gesto_id INTEGER PRIMARY KEY,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        canales TEXT,
+        largo INTEGER,
+        bandas TEXT,
+        envolvente BLOB,
+        potencia BLOB,
+        fecha TEXT
+    );
+    """)
+
+
+def _texto(valores):
+    return ','.join(str(valor) for valor in valores)
+
+
+def registrar_firma(conexion, firma, tabla_sim='similitud'):
+    """Guarda (o reemplaza) la firma de un gesto"""
+    cursor = conexion.cursor()
+    crear_tabla_similitud(cursor, tabla_sim)
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO {tabla_sim} (gesto_id, sesion_id, nombre_gesto,
+                                            canales, largo, bandas,
+                                            envolvente, potencia, fecha)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+        firma['gesto_id'], firma['sesion_id'], firma['nombre_gesto'],
+        _texto(firma['canales']), firma['largo'], _texto(firma['bandas']),
+        firma['envolvente'].astype(np.float32).tobytes(),
+        firma['potencia'].astype(np.float32).tobytes(),
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    conexion.commit()
+
+
+def leer_firmas(conexion, tabla_sim='similitud', largo=LARGO, bandas=BANDAS):
+    """
+    Firmas guardadas con el largo y las bandas indicadas. Las calculadas con
+    otros parámetros se ignoran.
+
+    Return
+    ------
+        list: Firmas con el mismo formato que 'calcular_firma'
+    """
+    try:
+        cursor = conexion.execute(f"""
+            SELECT gesto_id, sesion_id, nombre_gesto, canales, envolvente,
+                   potencia
+            FROM {tabla_sim}
+            WHERE largo = ? AND bandas = ?
+            ORDER BY gesto_id""", (largo, _texto(bandas)))
+    except sqlite3.OperationalError:
+        # La tabla aún no existe
+        return []
+    firmas = []
+    for gesto_id, sesion_id, nombre, canales, envolvente, potencia in cursor:
+        canales = [int(c) for c in canales.split(',')]
+        firmas.append({
+            'gesto_id': gesto_id,
+            'sesion_id': sesion_id,
+            'nombre_gesto': nombre,
+            'canales': canales,
+            'largo': largo,
+            'bandas': tuple(bandas),
+            'envolvente': np.frombuffer(envolvente, dtype=np.float32)
+                          .reshape(largo, len(canales)),
+            'potencia': np.frombuffer(potencia, dtype=np.float32)
+                        .reshape(len(bandas) - 1, len(canales)),
+        })
+    return firmas
+
+
+def actualizar_indice(perfil, gestos=None, rehacer=False, largo=LARGO,
+                      bandas=BANDAS):
+    """
+    Calcula y guarda las firmas que faltan en la tabla 'similitud' del
+    perfil, a partir de su tabla 'norm'.
+
+    Parameters
+    ----------
+        perfil (Perfil): Parámetros y tablas
+        gestos (list): IDs a revisar. Por defecto, todos los de 'norm' salvo
+                       los registros de CVM y reposo
+        rehacer (bool): Recalcular también las firmas ya guardadas
+
+    Return
+    ------
+        agregados (list): IDs con firma nueva
+        fallidos (dict): {gesto_id: error} de los que no se pudieron calcular
+    """
+    tabla_norm, tabla_sim = perfil.tabla('norm'), perfil.tabla('similitud')
+    conexion = sqlite3.connect(perfil.ruta_db)
+    if gestos is None:
+        # Los registros de referencia no son gestos
+        cursor = conexion.execute(f"""
+            SELECT DISTINCT gesto_id
+            FROM {tabla_norm}
+            WHERE nombre_gesto NOT LIKE '%CVM%'
+              AND nombre_gesto NOT LIKE '%Reposo%'""")
+        gestos = [fila[0] for fila in cursor.fetchall()]
+    if not rehacer:
+        guardados = {firma['gesto_id'] for firma
+                     in leer_firmas(conexion, tabla_sim, largo, bandas)}
+        gestos = [gesto_id for gesto_id in gestos if gesto_id not in guardados]
+
+    agregados, fallidos = [], {}
+    for gesto_id in gestos:
+        try:
+            firma = calcular_firma(gesto_id, perfil.ruta_db, tabla_norm,
+                                   perfil.tabla_raw, perfil.fs,
+                                   perfil.reescalado, perfil.nperseg, largo,
+                                   bandas)
+        except ValueError as error:
+            fallidos[gesto_id] = error
+            continue
+        registrar_firma(conexion, firma, tabla_sim)
+        agregados.append(gesto_id)
+    if agregados:
+        registrar_perfil(conexion, perfil)
+    conexion.close()
+    return agregados, fallidos
+
+
+#%% DTW
+def _envolvente_keogh(consulta, radio):
+    """Máximo y mínimo de la consulta en una ventana de +-radio puntos"""
+    largo = len(consulta)
+    vistas = np.lib.stride_tricks.sliding_window_view(
+        np.pad(consulta, ((radio, radio), (0, 0)), mode='edge'),
+        2 * radio + 1, axis=0)
+    return vistas.max(axis=2)[:largo], vistas.min(axis=2)[:largo]
+
+
+def cota_keogh(consulta, candidatos, radio):
+    """
+    Cota inferior LB_Keogh del DTW (suma de errores cuadráticos) entre la
+    consulta y cada candidato, vectorizada sobre los candidatos.
+
+    Parameters
+    ----------
+        consulta (np.array): Arreglo de (largo, canales)
+        candidatos (np.array): Arreglo de (n, largo, canales)
+        radio (int): Radio de la banda de Sakoe-Chiba, en puntos
+
+    Return
+    ------
+        np.array: Cota de cada candidato, de (n,)
+    """
+    superior, inferior = _envolvente_keogh(consulta, radio)
+    exceso = (np.maximum(candidatos - superior, 0)
+              + np.maximum(inferior - candidatos, 0))
+    return np.sum(exceso ** 2, axis=(1, 2))
+
+
+def dtw_lote(consulta, candidatos, radio):
+    """
+    DTW con costo cuadrático y banda de Sakoe-Chiba entre la consulta y
+    varios candidatos a la vez: la recurrencia recorre la matriz una sola
+    vez y cada celda se calcula para todos los candidatos juntos.
+
+    Return
+    ------
+        np.array: Suma de los costos del mejor camino de cada candidato
+    """
+    largo = len(consulta)
+    costo = np.sum((consulta[None, :, None, :]
+                    - candidatos[:, None, :, :]) ** 2, axis=3)
+    acumulado = np.full((len(candidatos), largo + 1, largo + 1), np.inf)
+    acumulado[:, 0, 0] = 0
+    for i in range(1, largo + 1):
+        for j in range(max(1, i - radio), min(largo, i + radio) + 1):
+            acumulado[:, i, j] = costo[:, i - 1, j - 1] + np.minimum(
+                np.minimum(acumulado[:, i - 1, j - 1], acumulado[:, i - 1, j]),
+                acumulado[:, i, j - 1])
+    return acumulado[:, largo, largo]
+
+
+#%% Índice
+class IndiceSimilitud:
+    """
+    Firmas de todos los gestos en memoria, para consultas de vecinos más
+    cercanos.
+
+    Attributes
+    ----------
+        firmas (list): Firmas cargadas, como las entrega 'calcular_firma'
+        peso_envolvente, peso_bandas (float): Pesos de cada parte de la firma
+                                              en la distancia
+    """
+
+    def __init__(self, firmas=(), peso_envolvente=1.0, peso_bandas=1.0):
+        self.firmas = []
+        self.peso_envolvente = peso_envolvente
+        self.peso_bandas = peso_bandas
+        self._matrices = None
+        for firma in firmas:
+            self.agregar(firma)
+
+    @classmethod
+    def desde_db(cls, conexion, tabla_sim='similitud', **opciones):
+        """Índice con todas las firmas de la tabla"""
+        return cls(leer_firmas(conexion, tabla_sim), **opciones)
+
+    def __len__(self):
+        return len(self.firmas)
+
+    def agregar(self, firma):
+        """Agrega o reemplaza la firma de un gesto, sin recargar las demás"""
+        self.firmas = [f for f in self.firmas
+                       if f['gesto_id'] != firma['gesto_id']]
+        self.firmas.append(firma)
+        # Las matrices y la estandarización se recalculan en la próxima
+        # consulta
+        self._matrices = None
+
+    @property
+    def ids(self):
+        return np.array([firma['gesto_id'] for firma in self.firmas])
+
+    @property
+    def nombres(self):
+        return np.array([firma['nombre_gesto'] for firma in self.firmas])
+
+    def _preparar(self):
+        """
+        Matrices de firmas estandarizadas, separadas por conjunto de canales:
+        {canales: grupo}. Cada grupo tiene las posiciones de sus firmas en
+        'self.firmas' ('indices'), sus matrices y la media y desviación de
+        cada columna, calculadas solo con las firmas del grupo
+        """
+        if self._matrices is None:
+            posiciones = {}
+            for i, firma in enumerate(self.firmas):
+                posiciones.setdefault(tuple(firma['canales']), []).append(i)
+            self._matrices = {canales: self._preparar_grupo(indices)
+                              for canales, indices in posiciones.items()}
+        return self._matrices
+
+    def _preparar_grupo(self, indices):
+        envolventes = np.stack([self.firmas[i]['envolvente']
+                                for i in indices]).astype(float)
+        potencias = np.stack([self.firmas[i]['potencia'].reshape(-1)
+                              for i in indices]).astype(float)
+        estadisticas = []
+        for matriz in (envolventes, potencias):
+            desviacion = matriz.std(axis=0)
+            estadisticas.append((matriz.mean(axis=0),
+                                 np.where(desviacion > 0, desviacion, 1.0)))
+        (media_e, desv_e), (media_p, desv_p) = estadisticas
+        return {
+            'indices': np.array(indices),
+            'envolventes': (envolventes - media_e) / desv_e,
+            'potencias': (potencias - media_p) / desv_p,
+            'estandarizar': lambda firma: (
+                (firma['envolvente'] - media_e) / desv_e,
+                (firma['potencia'].reshape(-1) - media_p) / desv_p),
+        }
+
+    def _grupo(self, firma):
+        """Grupo con los mismos canales que la firma, o None si no hay"""
+        return self._preparar().get(tuple(firma['canales']))
+
+    def _distancia_bandas(self, potencia, grupo):
+        return np.mean((grupo['potencias'] - potencia) ** 2, axis=1)
+
+    def distancias(self, firma):
+        """
+        Distancia euclidiana (error cuadrático medio ponderado) entre una
+        firma y todas las del índice, vectorizada. NaN para los gestos con
+        otros canales.
+        """
+        distancias = np.full(len(self.firmas), np.nan)
+        grupo = self._grupo(firma)
+        if grupo is None:
+            return distancias
+        envolvente, potencia = grupo['estandarizar'](firma)
+        d2 = (self.peso_envolvente
+              * np.mean((grupo['envolventes'] - envolvente) ** 2,
+                        axis=(1, 2))
+              + self.peso_bandas * self._distancia_bandas(potencia, grupo))
+        distancias[grupo['indices']] = np.sqrt(d2)
+        return distancias
+
+    def vecinos(self, firma, k=5, dtw=False, radio=0.1, excluir=None,
+                lote=32):
+        """
+        Los k gestos más parecidos a una firma, entre los que tienen sus
+        mismos canales.
+
+        Parameters
+        ----------
+            firma (dict): Firma a consultar, guardada o recién calculada
+            k (int): Cantidad de vecinos
+            dtw (bool): Comparar las envolventes con DTW en lugar de punto a
+                        punto
+            radio (float): Radio de la banda del DTW, como fracción del largo
+            excluir (set): IDs a excluir. Por defecto, el mismo gesto
+            lote (int): Candidatos por lote de DTW
+
+        Return
+        ------
+            vecinos (list): Tuplas (gesto_id, nombre_gesto, distancia), de la
+                            más cercana a la más lejana
+            n_dtw (int): Candidatos en que se calculó el DTW (0 sin DTW)
+        """
+        grupo = self._grupo(firma) if self.firmas else None
+        if grupo is None:
+            return [], 0
+        excluir = {firma['gesto_id']} if excluir is None else set(excluir)
+        # Posiciones de los candidatos dentro del grupo
+        candidatos = np.flatnonzero([gesto_id not in excluir for gesto_id
+                                     in self.ids[grupo['indices']]])
+
+        if not dtw:
+            distancias = self.distancias(firma)[grupo['indices'][candidatos]]
+            orden = np.argsort(distancias)[:k]
+            elegidos, valores, n_dtw = candidatos[orden], distancias[orden], 0
+        else:
+            elegidos, valores, n_dtw = self._vecinos_dtw(
+                firma, candidatos, k, radio, lote, grupo)
+
+        elegidos = grupo['indices'][elegidos]
+        return ([(int(self.ids[i]), self.firmas[i]['nombre_gesto'], float(d))
+                 for i, d in zip(elegidos, valores)], n_dtw)
+
+    def _vecinos_dtw(self, firma, candidatos, k, radio, lote, grupo):
+        envolvente, potencia = grupo['estandarizar'](firma)
+        largo, n_canales = envolvente.shape
+        radio = max(1, int(round(radio * largo)))
+        escala = self.peso_envolvente / (largo * n_canales)
+        bandas = (self.peso_bandas
+                  * self._distancia_bandas(potencia, grupo)[candidatos])
+        envolventes = grupo['envolventes'][candidatos]
+
+        # Candidatos ordenados por su cota inferior
+        cotas = escala * cota_keogh(envolvente, envolventes, radio) + bandas
+        orden = np.argsort(cotas)
+        mejores = np.zeros(0, dtype=int)
+        distancias = np.zeros(0)
+        n_dtw = 0
+        for inicio in range(0, len(orden), lote):
+            bloque = orden[inicio:inicio + lote]
+            if len(distancias) == k:
+                # Ningún candidato con cota mayor que la k-ésima distancia
+                # puede entrar
+                bloque = bloque[cotas[bloque] < distancias[-1]]
+                if len(bloque) == 0:
+                    break
+            d2 = (escala * dtw_lote(envolvente, envolventes[bloque], radio)
+                  + bandas[bloque])
+            n_dtw += len(bloque)
+            mejores = np.concatenate((mejores, bloque))
+            distancias = np.concatenate((distancias, d2))
+            orden_k = np.argsort(distancias)[:k]
+            mejores, distancias = mejores[orden_k], distancias[orden_k]
+        return candidatos[mejores], np.sqrt(distancias), n_dtw
+
+    def _matriz_grupo(self, grupo):
+        """Distancias entre las firmas de un grupo, con productos de matrices"""
+        n = len(grupo['indices'])
+        partes = [(self.peso_envolvente, grupo['envolventes'].reshape(n, -1)),
+                  (self.peso_bandas, grupo['potencias'])]
+        d2 = np.zeros((n, n))
+        for peso, matriz in partes:
+            normas = np.sum(matriz ** 2, axis=1)
+            d2 += peso * (normas[:, None] + normas[None, :]
+                          - 2 * matriz @ matriz.T) / matriz.shape[1]
+        return np.sqrt(np.maximum(d2, 0))
+
+    def matriz_distancias(self):
+        """
+        Distancias euclidianas entre todos los gestos del índice, con un
+        producto de matrices por conjunto de canales. NaN entre gestos con
+        distintos canales.
+        """
+        d = np.full((len(self.firmas), len(self.firmas)), np.nan)
+        for grupo in self._preparar().values():
+            d[np.ix_(grupo['indices'], grupo['indices'])] = \
+                self._matriz_grupo(grupo)
+        return d
+
+    def revisar_etiquetas(self, k=5):
+        """
+        Revisa todos los gestos con sus k vecinos más cercanos, entre los que
+        tienen sus mismos canales. Los gestos sin otro gesto con sus mismos
+        canales no se revisan.
+
+        Return
+        ------
+            list: Un diccionario por gesto, ordenados de más a menos
+                  sospechoso, con las entradas
+                gesto_id, nombre_gesto : Gesto revisado
+                etiqueta_vecinos (str) : Nombre más común entre los vecinos
+                acuerdo (float)        : Fracción de vecinos con el mismo
+                                         nombre que el gesto
+                distancia_media (float): Distancia media a los vecinos
+                atipico (float)        : distancia_media dividida por la
+                                         mediana de las de su mismo nombre
+                                         y canales
+                sospechoso (bool)      : True si la mayoría de los vecinos
+                                         tiene otro nombre
+        """
+        revision = []
+        for grupo in self._preparar().values():
+            if len(grupo['indices']) < 2:
+                continue
+            distancias = self._matriz_grupo(grupo)
+            np.fill_diagonal(distancias, np.inf)
+            k_grupo = min(k, len(grupo['indices']) - 1)
+            vecinos = np.argsort(distancias, axis=1)[:, :k_grupo]
+            medias = np.take_along_axis(distancias, vecinos, axis=1).mean(
+                axis=1)
+
+            nombres = self.nombres[grupo['indices']]
+            for i, posicion in enumerate(grupo['indices']):
+                firma = self.firmas[posicion]
+                etiquetas, cuentas = np.unique(nombres[vecinos[i]],
+                                               return_counts=True)
+                mediana = np.median(medias[nombres == firma['nombre_gesto']])
+                revision.append({
+                    'gesto_id': firma['gesto_id'],
+                    'nombre_gesto': firma['nombre_gesto'],
+                    'etiqueta_vecinos': etiquetas[np.argmax(cuentas)],
+                    'acuerdo': float(np.mean(nombres[vecinos[i]]
+                                             == firma['nombre_gesto'])),
+                    'distancia_media': float(medias[i]),
+                    'atipico': (float(medias[i] / mediana) if mediana
+                                else np.nan),
+                })
+                revision[-1]['sospechoso'] = revision[-1]['acuerdo'] < 0.5
+        return sorted(revision, key=lambda r: (r['acuerdo'], -r['atipico']))
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Actualizar el índice con los gestos normalizados que falten y revisar las
+    etiquetas de todos los gestos
+    '''
+    perfil = cargar_perfil_cli("Índice de similitud de gestos")
+    agregados, fallidos = actualizar_indice(perfil)
+    print(f"{len(agregados)} firmas nuevas en '{perfil.tabla('similitud')}'")
+    for gesto_id, error in fallidos.items():
+        print(f"Gesto {gesto_id}: {error}")
+
+    conexion = sqlite3.connect(perfil.ruta_db)
+    indice = IndiceSimilitud.desde_db(conexion, perfil.tabla('similitud'))
+    conexion.close()
+
+    print("\nID\tGesto\tVecinos\tAcuerdo\tAtípico")
+    for fila in indice.revisar_etiquetas():
+        print(f"{fila['gesto_id']}\t{fila['nombre_gesto']}\t"
+              f"{fila['etiqueta_vecinos']}\t{fila['acuerdo']:.2f}\t"
+              f"{fila['atipico']:.2f}" + ("\t<- revisar" if fila['sospechoso']
+                                          else ""))
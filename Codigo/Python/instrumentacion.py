@@ -0,0 +1,296 @@
+''' Instrumentación del procesamiento
+Tiempos y contadores por etapa (lectura, referencia, filtro, FFT, escritura,
+...) de 'normalizar_3ch_sql', 'registrar_datos_norm', 'calcular_fft_snr' y
+'registrar_datos_fft', para saber en qué se va el tiempo cuando el
+procesamiento de la base de datos está lento.
+
+Desactivada no mide nada: 'medir' retorna siempre el mismo contexto vacío y
+'contar' retorna de inmediato, así que dejarla en el código cuesta menos de
+un microsegundo por etapa.
+
+Uso
+---
+    import instrumentacion
+    instrumentacion.activar()
+    norm_db_sql(perfil, confirmar=False)
+    instrumentacion.imprimir_resumen()
+    instrumentacion.guardar_json('Datos/tiempos.jsonl', perfil=perfil.huella)
+
+También se activa sin tocar el código con la variable de entorno
+'EMG_INSTRUMENTAR': con '1' imprime el resumen al terminar el proceso y con
+una ruta además agrega el resumen como una línea de JSON a ese archivo, para
+seguir la evolución de los tiempos entre versiones:
+
+    EMG_INSTRUMENTAR=Datos/tiempos.jsonl python emg_cvm_norm_sql.py
+
+En 'emg_cli.py' se activa con '--instrumentar' y '--json'. Con '--perfilador'
+se captura además un perfil de cProfile o de pyinstrument (opcional) con
+'perfilar'.
+
+Bastián Rivas
+'''
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Estado de la instrumentación en este proceso
+_activa = False
+# {etapa: [segundos, llamadas]}
+_etapas = {}
+# {gesto_id: {etapa: segundos}}
+_gestos = {}
+# {contador: total}
+_contadores = {}
+
+
+class _ContextoVacio:
+    """Contexto que no hace nada, compartido cuando está desactivada"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        return False
+
+
+_VACIO = _ContextoVacio()
+
+
+class _Medicion:
+    """Contexto que suma el tiempo transcurrido a una etapa"""
+    __slots__ = ('etapa', 'gesto_id', 'inicio')
+
+    def __init__(self, etapa, gesto_id):
+        self.etapa = etapa
+        self.gesto_id = gesto_id
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        _sumar(self.etapa, self.gesto_id, time.perf_counter() - self.inicio)
+        return False
+
+
+def _sumar(etapa, gesto_id, segundos, llamadas=1):
+    total = _etapas.setdefault(etapa, [0.0, 0])
+    total[0] += segundos
+    total[1] += llamadas
+    if gesto_id is not None:
+        por_gesto = _gestos.setdefault(gesto_id, {})
+        por_gesto[etapa] = por_gesto.get(etapa, 0.0) + segundos
+
+
+#%% Medición
+def activar():
+    """Empieza a medir, sin borrar lo ya medido"""
+    global _activa
+    _activa = True
+
+
+def desactivar():
+    global _activa
+    _activa = False
+
+
+def activa():
+    """True si se está midiendo"""
+    return _activa
+
+
+def reiniciar():
+    """Borra los tiempos y contadores medidos"""
+    _etapas.clear()
+    _gestos.clear()
+    _contadores.clear()
+
+
+def medir(etapa, gesto_id=None):
+    """
+    Contexto que mide el tiempo de una etapa:
+
+        with medir('norm.filtro', gesto_id):
+            emg_f_env = registro.envolvente(fc, forden)
+
+    Parameters
+    ----------
+        etapa (str): Nombre de la etapa, '<proceso>.<etapa>'
+        gesto_id (int): Gesto al que se atribuye el tiempo. None para contarlo
+                        solo en el total
+    """
+    if not _activa:
+        return _VACIO
+    return _Medicion(etapa, gesto_id)
+
+
+def contar(contador, cantidad=1):
+    """Suma 'cantidad' a un contador, por ejemplo filas escritas"""
+    if not _activa:
+        return
+    _contadores[contador] = _contadores.get(contador, 0) + cantidad
+
+
+#%% Resultados
+def exportar():
+    """
+    Mediciones de este proceso como diccionario, para enviarlas desde un
+    proceso del pool y juntarlas con 'combinar'.
+    """
+    return {
+        'etapas': {etapa: list(total) for etapa, total in _etapas.items()},
+        'gestos': {gesto_id: dict(etapas)
+                   for gesto_id, etapas in _gestos.items()},
+        'contadores': dict(_contadores),
+    }
+
+
+def combinar(mediciones):
+    """Suma a este proceso las mediciones entregadas por 'exportar'"""
+    for etapa, (segundos, llamadas) in mediciones['etapas'].items():
+        _sumar(etapa, None, segundos, llamadas)
+    for gesto_id, etapas in mediciones['gestos'].items():
+        por_gesto = _gestos.setdefault(gesto_id, {})
+        for etapa, segundos in etapas.items():
+            por_gesto[etapa] = por_gesto.get(etapa, 0.0) + segundos
+    for contador, cantidad in mediciones['contadores'].items():
+        _contadores[contador] = _contadores.get(contador, 0) + cantidad
+
+
+def resumen():
+    """
+    Desglose de los tiempos medidos.
+
+    Return
+    ------
+        dict: Con las entradas
+            etapas (dict)     : {etapa: {'segundos', 'llamadas', 'ms_media'}}
+            gestos (dict)     : {gesto_id: {etapa: segundos, 'total': s}}
+            contadores (dict) : {contador: total}
+            total (float)     : Suma de los segundos de todas las etapas
+    """
+    etapas = {etapa: {'segundos': segundos, 'llamadas': llamadas,
+                      'ms_media': segundos / llamadas * 1e3}
+              for etapa, (segundos, llamadas) in sorted(_etapas.items())}
+    gestos = {}
+    for gesto_id in sorted(_gestos):
+        gestos[gesto_id] = dict(sorted(_gestos[gesto_id].items()))
+        gestos[gesto_id]['total'] = sum(_gestos[gesto_id].values())
+    return {
+        'etapas': etapas,
+        'gestos': gestos,
+        'contadores': dict(sorted(_contadores.items())),
+        'total': sum(datos['segundos'] for datos in etapas.values()),
+    }
+
+
+def imprimir_resumen(por_gesto=False, archivo=None):
+    """
+    Imprime el tiempo de cada etapa y, con 'por_gesto', el de cada gesto.
+    Por defecto en la salida de errores, para no mezclarse con los datos.
+    """
+    archivo = archivo or sys.stderr
+    datos = resumen()
+    total = datos['total'] or 1.0
+    print("Etapa                       \tLlamadas\tTotal [s]\tMedia [ms]\t%",
+          file=archivo)
+    for etapa, valores in datos['etapas'].items():
+        print(f"{etapa:<28}\t{valores['llamadas']:8d}\t"
+              f"{valores['segundos']:9.3f}\t{valores['ms_media']:10.2f}\t"
+              f"{100 * valores['segundos'] / total:5.1f}", file=archivo)
+    for contador, cantidad in datos['contadores'].items():
+        print(f"{contador:<28}\t{cantidad}", file=archivo)
+    if por_gesto:
+        print("\nGesto\tTotal [s]\tEtapa más lenta", file=archivo)
+        for gesto_id, etapas in datos['gestos'].items():
+            lenta = max((etapa for etapa in etapas if etapa != 'total'),
+                        key=etapas.get)
+            print(f"{gesto_id}\t{etapas['total']:9.3f}\t{lenta} "
+                  f"({etapas[lenta]:.3f} s)", file=archivo)
+
+
+def guardar_json(ruta, **metadatos):
+    """
+    Agrega el resumen como una línea de JSON al final de 'ruta', con la fecha
+    y los metadatos indicados (perfil, comando, versión, ...).
+    """
+    registro = {'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                **metadatos, **resumen()}
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta, 'a', encoding='utf-8') as archivo:
+        archivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+
+
+#%% Perfiladores
+@contextmanager
+def perfilar(herramienta='cprofile', salida=None, lineas=25):
+    """
+    Captura un perfil de todo lo que se ejecute dentro del contexto. Solo ve
+    este proceso, no los procesos de un pool.
+
+    Parameters
+    ----------
+        herramienta (str): 'cprofile' o 'pyinstrument'
+        salida (str): Archivo donde guardar el perfil ('.prof' para cProfile,
+                      '.html' para pyinstrument). Sin archivo, se imprime
+        lineas (int): Funciones a imprimir con cProfile
+    """
+    if herramienta == 'pyinstrument':
+        # Importación diferida, para no cargar pyinstrument al arrancar
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ImportError("El perfilador 'pyinstrument' no está "
+                              "instalado") from None
+        perfilador = pyinstrument.Profiler()
+        perfilador.start()
+        try:
+            yield perfilador
+        finally:
+            perfilador.stop()
+            if salida:
+                with open(salida, 'w', encoding='utf-8') as archivo:
+                    archivo.write(perfilador.output_html())
+            else:
+                print(perfilador.output_text(), file=sys.stderr)
+    elif herramienta == 'cprofile':
+        import cProfile
+        import pstats
+        perfilador = cProfile.Profile()
+        perfilador.enable()
+        try:
+            yield perfilador
+        finally:
+            perfilador.disable()
+            if salida:
+                perfilador.dump_stats(salida)
+            else:
+                pstats.Stats(perfilador, stream=sys.stderr).sort_stats(
+                    'cumulative').print_stats(lineas)
+    else:
+        raise ValueError(f"Perfilador desconocido: '{herramienta}'")
+
+
+#%% Activación por variable de entorno
+def _resumen_al_salir(ruta):
+    # Los procesos de un pool entregan sus mediciones al proceso principal
+    if not _etapas or multiprocessing.parent_process() is not None:
+        return
+    imprimir_resumen(por_gesto=True)
+    if ruta:
+        guardar_json(ruta, comando=' '.join(sys.argv))
+
+
+_variable = os.environ.get('EMG_INSTRUMENTAR', '')
+if _variable and _variable != '0':
+    activar()
+    atexit.register(_resumen_al_salir, None if _variable == '1' else _variable)
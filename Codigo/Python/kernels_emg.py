@@ -0,0 +1,318 @@
+""" Kernels EMG
+Funciones de bajo nivel para procesar señales EMG de varios canales a la vez.
+Todas reciben arreglos de (n_muestras, canales) y procesan todos los canales
+en una sola pasada por el eje 0, en lugar de ir canal por canal con listas.
+
+    - rectificar: centraliza y rectifica (abs(emg - media))
+    - calcular_envolvente: rectificación + pasabajos Butterworth con filtfilt,
+      igual que 'ajusta_emg_func'
+    - filtrar_envolvente: solo el pasabajos, para filtrar una señal ya
+      rectificada con varias frecuencias de corte sin volver a rectificarla
+    - filtrar_iir: filtro IIR causal (como en el microcontrolador)
+    - rms_movil / mav_movil: RMS y valor absoluto medio en una ventana móvil,
+      igual que 'getEnvelop' del sketch EnvolventeEMG
+    - cruces_por_cero: cantidad de cruces por cero de la señal centrada
+
+Si Numba está instalado, los ciclos internos se compilan con JIT. Si no, se
+usan las versiones vectorizadas de NumPy/SciPy, que entregan los mismos
+resultados. Se puede forzar una u otra con el parámetro 'usar_numba'.
+
+Para comparar tiempos con el procesamiento anterior ver 'bench_kernels.py'.
+
+Bastián Rivas
+"""
+import importlib.util
+
+import numpy as np
+# scipy.signal se importa dentro de las funciones que lo usan: cargarlo toma
+# cerca de un segundo y la captura o la consulta de gestos no lo necesitan
+
+# Numba es opcional. Aquí solo se revisa que esté instalado: importarlo toma
+# un cuarto de segundo, así que se importa al compilar los ciclos la primera
+# vez que se usan
+NUMBA_DISPONIBLE = importlib.util.find_spec('numba') is not None
+
+
+#%% Ciclos internos. Se compilan con Numba si está disponible
+def _lfilter_ciclo(b, a, x, zi):
+    """
+    Filtro IIR en forma directa II transpuesta sobre el eje 0 de x, con
+    a[0] = 1 y len(b) == len(a). 'zi' es el estado inicial, de (orden, canales)
+    """
+    n_muestras, n_canales = x.shape
+    orden = len(a) - 1
+    y = np.empty_like(x)
+    z = zi.copy()
+    for k in range(n_canales):
+        for i in range(n_muestras):
+            xi = x[i, k]
+            yi = b[0] * xi + z[0, k]
+            for j in range(1, orden):
+                z[j - 1, k] = b[j] * xi + z[j, k] - a[j] * yi
+            z[orden - 1, k] = b[orden] * xi - a[orden] * yi
+            y[i, k] = yi
+    return y
+
+
+def _suma_movil_ciclo(x, ventana):
+    """
+    Suma de las últimas 'ventana' muestras de cada canal, con historia inicial
+    en cero (igual que el buffer circular del microcontrolador)
+    """
+    n_muestras, n_canales = x.shape
+    y = np.empty_like(x)
+    for k in range(n_canales):
+        suma = 0.0
+        for i in range(n_muestras):
+            suma += x[i, k]
+            if i >= ventana:
+                suma -= x[i - ventana, k]
+            y[i, k] = suma
+    return y
+
+
+def _cruces_ciclo(x, umbral):
+    """
+    Cuenta los cruces por cero de cada canal cuyo salto supere 'umbral'
+    """
+    n_muestras, n_canales = x.shape
+    cruces = np.zeros(n_canales, dtype=np.int64)
+    for k in range(n_canales):
+        for i in range(1, n_muestras):
+            if (x[i - 1, k] * x[i, k] < 0
+                    and abs(x[i, k] - x[i - 1, k]) >= umbral):
+                cruces[k] += 1
+    return cruces
+
+
+_compilados = False
+
+
+def _compilar_ciclos():
+    """Reemplaza los ciclos por sus versiones compiladas con Numba"""
+    global _lfilter_ciclo, _suma_movil_ciclo, _cruces_ciclo, _compilados
+    if _compilados:
+        return
+    from numba import njit
+    _lfilter_ciclo = njit(cache=True)(_lfilter_ciclo)
+    _suma_movil_ciclo = njit(cache=True)(_suma_movil_ciclo)
+    _cruces_ciclo = njit(cache=True)(_cruces_ciclo)
+    _compilados = True
+
+
+def _como_2d(emg):
+    """
+    Convierte la señal a un arreglo float64 contiguo de (n_muestras, canales).
+    Retorna también si la entrada era de 1 dimensión para devolverla igual.
+    """
+    emg = np.asarray(emg, dtype=float)
+    es_1d = emg.ndim == 1
+    if es_1d:
+        emg = emg[:, None]
+    return np.ascontiguousarray(emg), es_1d
+
+
+def _usar_numba(usar_numba):
+    if usar_numba is None:
+        usar_numba = NUMBA_DISPONIBLE
+    if usar_numba and not NUMBA_DISPONIBLE:
+        raise ImportError("Numba no está instalado")
+    if usar_numba:
+        _compilar_ciclos()
+    return usar_numba
+
+
+#%% Kernels
+def rectificar(emg):
+    """
+    Centraliza (elimina el "offset") y rectifica la señal de cada canal.
+
+    Parameters
+    ----------
+        emg (np.array): Señal EMG, de (n_muestras,) o (n_muestras, canales)
+
+    Return
+    ------
+        np.array: abs(emg - media), de la misma forma que 'emg'
+    """
+    emg = np.asarray(emg, dtype=float)
+    return np.abs(emg - emg.mean(axis=0))
+
+
+def filtrar_iir(emg, b, a, zi=None, usar_numba=None):
+    """
+    Aplica un filtro IIR causal a todos los canales.
+
+    Parameters
+    ----------
+        emg (np.array): Señal, de (n_muestras,) o (n_muestras, canales)
+        b, a (np.array): Coeficientes del filtro
+        zi (np.array): Estado inicial, de (orden, canales). Por defecto cero
+        usar_numba (bool): Forzar el uso (o no) de Numba. Por defecto se usa
+                           si está disponible
+
+    Return
+    ------
+        np.array: Señal filtrada, de la misma forma que 'emg'
+    """
+    x, es_1d = _como_2d(emg)
+    # Normalizar para que a[0] = 1 y dejar b y a del mismo largo
+    b = np.asarray(b, dtype=float) / a[0]
+    a = np.asarray(a, dtype=float) / a[0]
+    largo = max(len(a), len(b))
+    b = np.pad(b, (0, largo - len(b)))
+    a = np.pad(a, (0, largo - len(a)))
+    if zi is None:
+        zi = np.zeros((len(a) - 1, x.shape[1]))
+
+    if _usar_numba(usar_numba):
+        y = _lfilter_ciclo(b, a, x, np.ascontiguousarray(zi, dtype=float))
+    else:
+        from scipy.signal import lfilter
+        y, _ = lfilter(b, a, x, axis=0, zi=zi)
+    return y[:, 0] if es_1d else y
+
+
+def _filtfilt(b, a, x, usar_numba):
+    """
+    Filtro de fase cero equivalente a scipy.signal.filtfilt con relleno impar
+    """
+    from scipy.signal import filtfilt, lfilter_zi
+    if not _usar_numba(usar_numba):
+        return filtfilt(b, a, x, axis=0)
+
+    relleno = 3 * max(len(a), len(b))
+    # Mismo error que filtfilt, en lugar de entregar un arreglo vacío
+    if len(x) <= relleno:
+        raise ValueError(f"The length of the input vector x must be greater "
+                         f"than padlen, which is {relleno}.")
+    extendida = np.concatenate((2 * x[:1] - x[relleno:0:-1],
+                                x,
+                                2 * x[-1:] - x[-2:-relleno - 2:-1]))
+    zi = lfilter_zi(b, a)[:, None]
+    y = _lfilter_ciclo(b, a, extendida, zi * extendida[0])
+    y = _lfilter_ciclo(b, a, np.ascontiguousarray(y[::-1]), zi * y[-1])
+    return y[::-1][relleno:-relleno]
+
+
+def calcular_envolvente(emg, fs, fc, forden, usar_numba=None):
+    """
+    Centraliza, rectifica y filtra con un pasabajos (filtfilt) una señal EMG,
+    igual que 'ajusta_emg_func'. Procesa todos los canales en el eje 0.
+
+    Parameters
+    ----------
+        emg (np.array): Señal EMG, de (n_muestras,) o (n_muestras, canales)
+        fs (float): Frecuencia de muestreo en Hertz
+        fc (float): Frecuencia de corte del filtro pasabajos en Hertz
+        forden (int): Orden del filtro pasabajos
+        usar_numba (bool): Forzar el uso (o no) de Numba
+
+    Return
+    ------
+        np.array: Envolvente filtrada, de la misma forma que 'emg'
+    """
+    x, es_1d = _como_2d(emg)
+    y = filtrar_envolvente(rectificar(x), fs, fc, forden, usar_numba)
+    return y[:, 0] if es_1d else y
+
+
+def filtrar_envolvente(rectificada, fs, fc, forden, usar_numba=None):
+    """
+    Pasabajos Butterworth de fase cero (filtfilt) de una señal ya rectificada.
+    'calcular_envolvente' es rectificar + filtrar_envolvente.
+
+    Parameters
+    ----------
+        rectificada (np.array): Salida de 'rectificar', de (n_muestras,) o
+                                (n_muestras, canales)
+        fs, fc, forden: Igual que en 'calcular_envolvente'
+
+    Return
+    ------
+        np.array: Envolvente filtrada, de la misma forma que 'rectificada'
+    """
+    from scipy.signal import butter
+    x, es_1d = _como_2d(rectificada)
+    b, a = butter(int(forden), (int(fc)/(fs/2)), btype = 'low')
+    y = _filtfilt(b, a, x, usar_numba)
+    return y[:, 0] if es_1d else y
+
+
+def mav_movil(emg, ventana, usar_numba=None):
+    """
+    Valor absoluto medio (MAV) de la señal centrada en una ventana móvil de
+    'ventana' muestras. Las primeras muestras se promedian con historia en
+    cero, igual que 'getEnvelop' en el sketch EnvolventeEMG.
+
+    Parameters
+    ----------
+        emg (np.array): Señal EMG, de (n_muestras,) o (n_muestras, canales)
+        ventana (int): Largo de la ventana en muestras
+        usar_numba (bool): Forzar el uso (o no) de Numba
+
+    Return
+    ------
+        np.array: MAV móvil, de la misma forma que 'emg'
+    """
+    x, es_1d = _como_2d(emg)
+    y = _suma_movil(rectificar(x), ventana, usar_numba) / ventana
+    return y[:, 0] if es_1d else y
+
+
+def rms_movil(emg, ventana, usar_numba=None):
+    """
+    RMS de la señal centrada en una ventana móvil de 'ventana' muestras, con
+    historia inicial en cero.
+
+    Parameters
+    ----------
+        emg (np.array): Señal EMG, de (n_muestras,) o (n_muestras, canales)
+        ventana (int): Largo de la ventana en muestras
+        usar_numba (bool): Forzar el uso (o no) de Numba
+
+    Return
+    ------
+        np.array: RMS móvil, de la misma forma que 'emg'
+    """
+    x, es_1d = _como_2d(emg)
+    centrada = x - x.mean(axis=0)
+    y = np.sqrt(np.maximum(
+        _suma_movil(centrada ** 2, ventana, usar_numba) / ventana, 0))
+    return y[:, 0] if es_1d else y
+
+
+def _suma_movil(x, ventana, usar_numba):
+    if _usar_numba(usar_numba):
+        return _suma_movil_ciclo(np.ascontiguousarray(x), int(ventana))
+    suma = np.cumsum(x, axis=0)
+    suma[ventana:] -= suma[:-ventana].copy()
+    return suma
+
+
+def cruces_por_cero(emg, umbral=0.0, usar_numba=None):
+    """
+    Cuenta los cruces por cero de la señal centrada de cada canal. Solo se
+    cuentan los cruces cuyo salto entre muestras sea de al menos 'umbral',
+    para no contar el ruido alrededor de cero.
+
+    Parameters
+    ----------
+        emg (np.array): Señal EMG, de (n_muestras,) o (n_muestras, canales)
+        umbral (float): Salto mínimo entre muestras consecutivas
+        usar_numba (bool): Forzar el uso (o no) de Numba
+
+    Return
+    ------
+        np.array: Cantidad de cruces por canal (un entero si 'emg' es de 1
+                  dimensión)
+    """
+    x, es_1d = _como_2d(emg)
+    x = x - x.mean(axis=0)
+    if _usar_numba(usar_numba):
+        cruces = _cruces_ciclo(np.ascontiguousarray(x), float(umbral))
+    else:
+        cambio = (x[:-1] * x[1:]) < 0
+        salto = np.abs(np.diff(x, axis=0)) >= umbral
+        cruces = np.count_nonzero(cambio & salto, axis=0)
+    return cruces[0] if es_1d else cruces
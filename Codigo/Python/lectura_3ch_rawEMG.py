@@ -2,7 +2,8 @@
 
 Script en Python para registrar los datos de EMG recibidos desde el puerto 
 tserial
-Espera recibirlos con el formato <onset>,<CH1>,<CH2>,<CH3>,...
+Espera recibirlos con el formato <onset>,<CH1>,<CH2>,...,<CHN>, con N igual a
+'n_canales'
 
 Estructura de la base de datos
 ------------------------------
@@ -15,7 +16,12 @@ Estructura de la base de datos
 nombre_gesto: Nombre del gesto hecho
           fs: Frecuencia de muestreo en Hertz
        fecha: Fecha en la que se hizo la captura, YYYY-MM-DD HH:MM:SS
-         CHX: Valor recibido para el canal X sin pasar por filtros
+         CHX: Valor recibido para el canal X sin pasar por filtros. Hay una 
+              columna por canal; si se captura con más canales que los de la 
+              tabla, las columnas que faltan se agregan al iniciar
+
+La captura está en la función 'capturar', que también usa la línea de 
+comandos unificada ('emg_cli.py capturar').
 
 Uso
 ---
@@ -25,6 +31,18 @@ Uso
     - Hacer 1 repetición de 1 gesto por vez
     - Al terminar la toma de datos pulsar Ctrl+C
 
+Durante la captura se mide la frecuencia de muestreo real, el jitter, los 
+errores de lectura y la cola de escritura ('telemetria_captura.py'), y se 
+muestran en una línea de estado. Al terminar se guardan en la tabla 
+'telemetria_captura' y la columna 'fs' del gesto queda con la frecuencia 
+medida.
+
+Las muestras se guardan primero en segmentos en disco ('buffer_captura.py') y
+se pasan a la base de datos en segundo plano. Si la captura se corta por un 
+error, una desconexión o al cerrar el proceso, se pierden a lo más 
+'max_perdida_ms' milisegundos, y los segmentos pendientes se recuperan 
+automáticamente al volver a ejecutar el script.
+
 Bastián Rivas
 '''
 
@@ -34,125 +52,226 @@ import time
 from datetime import datetime
 import os
 
-# Función para insertar datos en la base de datos en lotes
-def insertar_datos_lote(datos):
-    cursor.executemany("""INSERT INTO datos (gesto_id, sesion_id, nombre_gesto,
-                          onset, CH1, CH2, CH3, fecha, fs) 
-                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", datos)
-    conexion.commit()
-
-# Configurar el puerto serial
-puerto_serial = 'COM4'
-baud_rate = 115200
-
-# Frecuencia de muestreo en Hz
-fs = 1000
-
-# Conectar o crear la base de datos SQLite
-db_path = 'Datos/datos_gestos_3ch.db'
-nombre_tabla = 'raw'
-conexion = sqlite3.connect(db_path)
-cursor = conexion.cursor()
-
-# Mostrar la ubicación de la base de datos en consola
-print(f"Usando base de datos en: {os.path.abspath(db_path)}")
-
-# Crear la tabla si no existe
-cursor.execute('''CREATE TABLE IF NOT EXISTS datos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    gesto_id INTEGER,
-                    sesion_id INTEGER,
-                    onset INTEGER,
-                    nombre_gesto TEXT,
-                    fs INTEGER,
-                    fecha TEXT,
-                    CH1 INTEGER,
-                    CH2 INTEGER,
-                    CH3 INTEGER
-                )''')
-
-# Obtener el último gesto_id y sesion_id registrados en la base de datos
-
-cursor.execute(f"""SELECT MAX(gesto_id), nombre_gesto, sesion_id 
-                    FROM {nombre_tabla}""")
-ultimo_registro = cursor.fetchone()
-ultimo_gesto_id = ultimo_registro[0] if ultimo_registro[0] is not None else 0
-if ultimo_registro[1] is not None:
-    ultimo_nombre_gesto = ultimo_registro[1] 
-else:
-    ultimo_nombre_gesto ="N/A" 
-
-ultimo_sesion_id = ultimo_registro[2] if ultimo_registro[2] is not None else 1
-gesto_id = (ultimo_gesto_id + 1) if ultimo_gesto_id is not None else 1
-
-# Solicitar el sesion_id al usuario
-print(f"Última sesión registrada con ID = {ultimo_sesion_id}")
-sesion_id = input("Por favor, ingrese el número de sesión: ")
-sesion_id = int(sesion_id) if sesion_id else ultimo_sesion_id
-
-# Solicitar el nombre del gesto al usuario
-print(f"Último gesto registrado fue '{ultimo_nombre_gesto}' con 
-ID = {ultimo_gesto_id}")
-nombre_gesto = input("Por favor, ingrese el nombre del gesto: ")
-fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-# Lista para almacenar los datos leídos
-# Uso un lote acá porque escribir directamente en la base de datos es demasiado 
-# lento
-datos_lote = []  
-
-# Abrir el puerto serial y comenzar a leer datos
-try:
-    with serial.Serial(puerto_serial, baud_rate, timeout=1) as ser:
-        print(f"Leyendo desde {puerto_serial} a {baud_rate} baud...
-              \nFinalizar con Ctrl+C")
-        while True:
-            # Leer línea desde el puerto serial
-            if ser.in_waiting > 0:
-                try:
-                    data = ser.readline().decode('ascii').rstrip()
-                    valores = data.split(',')
-
-                    # Asegurarse de que hay cuatro valores
-                    # Formato: onset, ch1, ch2, ch3
-                    if len(valores) == 4:
+# Segmentos de onset precalculados al momento de la captura
+from segmentos_onset import registrar_segmentos
+# Columnas de la tabla y lectura de líneas para N canales
+from esquema_canales import crear_tabla_raw, columnas_raw, parsear_linea
+# Buffer en disco con pérdida acotada ante cortes de la captura
+from buffer_captura import BufferCaptura, recuperar_segmentos
+# Frecuencia medida, jitter, errores y cola de escritura
+from telemetria_captura import (TelemetriaCaptura, registrar_telemetria, 
+                                actualizar_fs)
+# Parámetros desde el perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli
+
+# Valores por defecto de la placa
+PUERTO_SERIAL = 'COM4'
+N_CANALES = 3
+
+
+#%%
+def ultimo_registro(cursor, nombre_tabla='raw'):
+    """
+    Último gesto capturado, para continuar la numeración.
+
+    Return
+    ------
+        tuple: (gesto_id, nombre_gesto, sesion_id) del último gesto. Con la 
+               tabla vacía, (0, 'N/A', 1)
+    """
+    cursor.execute(f"""SELECT MAX(gesto_id), nombre_gesto, sesion_id 
+                        FROM {nombre_tabla}""")
+    ultimo_gesto_id, ultimo_nombre_gesto, ultimo_sesion_id = cursor.fetchone()
+    return (ultimo_gesto_id if ultimo_gesto_id is not None else 0,
+            ultimo_nombre_gesto if ultimo_nombre_gesto is not None else "N/A",
+            ultimo_sesion_id if ultimo_sesion_id is not None else 1)
+
+
+def capturar(perfil, nombre_gesto, sesion_id=None, puerto_serial=PUERTO_SERIAL,
+             n_canales=N_CANALES, duracion=None, directorio_wal='Datos/wal',
+             max_perdida_ms=50, mostrar_muestras=True, intervalo_estado=1.0,
+             ajustar_fs=True):
+    """
+    Captura un gesto desde el puerto serial y lo guarda en la tabla de datos 
+    brutos del perfil. Termina con Ctrl+C o al cumplirse 'duracion'.
+
+    Parameters
+    ----------
+        perfil (Perfil): Frecuencia de muestreo, velocidad del puerto, base de 
+                         datos y tabla de datos brutos
+        nombre_gesto (str): Nombre del gesto a capturar
+        sesion_id (int): Sesión del gesto. Por defecto, la última registrada
+        puerto_serial (str): Puerto de la placa
+        n_canales (int): Cantidad de canales enviados por la placa
+        duracion (float): Segundos a capturar. None para capturar hasta Ctrl+C
+        directorio_wal (str): Carpeta de los segmentos en disco
+        max_perdida_ms (int): Máximo de datos a perder si se corta la captura
+        mostrar_muestras (bool): Imprimir cada muestra recibida. Con False se 
+                                 imprime solo la línea de estado
+        intervalo_estado (float): Segundos entre líneas de estado con la 
+                                  telemetría de la captura
+        ajustar_fs (bool): Guardar como 'fs' del gesto la frecuencia medida en
+                           vez de la nominal del perfil
+
+    Return
+    ------
+        tuple: (gesto_id, telemetria) del gesto capturado, con la telemetría 
+               como 'TelemetriaCaptura'
+
+    Se pasa a la base de datos lo capturado hasta el momento aunque se corte
+    el puerto; en ese caso se relanza la excepción 'serial.SerialException'.
+    """
+    # Configurar el puerto serial
+    baud_rate = perfil.baud_rate
+
+    # Frecuencia de muestreo en Hz
+    fs = perfil.fs
+
+    # Cantidad de canales enviados por la placa
+    canales = list(range(1, n_canales + 1))
+
+    # Conectar o crear la base de datos SQLite
+    db_path = perfil.ruta_db
+    nombre_tabla = perfil.tabla_raw
+
+    conexion = sqlite3.connect(db_path)
+    cursor = conexion.cursor()
+
+    # Mostrar la ubicación de la base de datos en consola
+    print(f"Usando base de datos en: {os.path.abspath(db_path)}")
+
+    # Crear la tabla si no existe, o agregarle los canales que falten
+    crear_tabla_raw(cursor, nombre_tabla, canales)
+    columnas_canales = columnas_raw(canales)
+
+    # Recuperar los datos de una captura anterior que no terminó bien
+    n_recuperadas = recuperar_segmentos(db_path, directorio_wal)
+    if n_recuperadas:
+        print(f"Recuperadas {n_recuperadas} muestras de una captura anterior")
+
+    # Obtener el último gesto_id y sesion_id registrados en la base de datos
+    ultimo_gesto_id, _, ultimo_sesion_id = ultimo_registro(cursor, 
+                                                           nombre_tabla)
+    gesto_id = ultimo_gesto_id + 1
+    if sesion_id is None:
+        sesion_id = ultimo_sesion_id
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Buffer para almacenar los datos leídos
+    # Uso un buffer acá porque escribir directamente en la base de datos es 
+    # demasiado lento. Se escribe a disco cada 'max_perdida_ms' y se pasa a la
+    # base de datos en segundo plano
+    buffer = BufferCaptura(db_path, gesto_id, sesion_id, nombre_gesto, fecha, 
+                           fs, canales, directorio_wal, max_perdida_ms, 
+                           nombre_tabla=nombre_tabla)
+
+    # Onset de todo el gesto, para registrar sus segmentos al terminar la 
+    # captura
+    onset_gesto = []
+
+    # Frecuencia de muestreo medida, jitter y errores, con una línea de estado
+    # cada 'intervalo_estado' segundos
+    telemetria = TelemetriaCaptura(fs)
+
+    # Abrir el puerto serial y comenzar a leer datos
+    inicio = time.monotonic()
+    ultimo_estado = inicio
+    try:
+        with serial.Serial(puerto_serial, baud_rate, timeout=1) as ser:
+            print(f"Leyendo '{nombre_gesto}' (ID = {gesto_id}, sesión "
+                  f"{sesion_id}) desde {puerto_serial} a {baud_rate} baud..."
+                  "\nFinalizar con Ctrl+C")
+            while duracion is None or time.monotonic() - inicio < duracion:
+                # Línea de estado periódica
+                if time.monotonic() - ultimo_estado >= intervalo_estado:
+                    ultimo_estado = time.monotonic()
+                    telemetria.registrar_cola(buffer.estado_cola())
+                    print(telemetria.linea_estado(), flush=True)
+
+                # Leer línea desde el puerto serial
+                if ser.in_waiting > 0:
+                    try:
+                        data = ser.readline().decode('ascii').rstrip()
+
+                        # Formato: onset, ch1, ..., chN
                         try:
-                            onset = int(valores[0])
-                            ch1 = int(valores[1])
-                            ch2 = int(valores[2])
-                            ch3 = int(valores[3])
-                            datos_lote.append((gesto_id, sesion_id, 
-                                               nombre_gesto, onset, ch1, ch2, 
-                                               ch3, fecha, fs))
-                            print(f"Registrado Onset: {onset}\t CH1: {ch1}\t 
-                                    CH2: {ch2}\t CH3: {ch3}")
-
-                            # Insertar en la base de datos en lotes de 
-                            # 100 registros
-                            if len(datos_lote) >= 100:
-                                insertar_datos_lote(datos_lote)
-                                # Limpiar la lista después de insertar
-                                datos_lote = []  
+                            valores = parsear_linea(data, n_canales)
                         except ValueError:
-                            print(f"Error al convertir los datos a enteros: 
-                            {data}")
-                    else:
-                        print(f"Datos incompletos recibidos: {data}")
-
-                except UnicodeDecodeError:
-                    # Suele caer acá cuando registra datos incompletos desde el 
-                    # puerto serial. Típicamente pasa si empieza a leer cuando 
-                    # se está recibiendo una línea
-                    pass
-
-except serial.SerialException as e:
-    print(f"Error al acceder al puerto serial: {e}")
-except KeyboardInterrupt:
-    print(f"\nLectura interrumpida. Datos guardados en {db_path}")
-    # Insertar cualquier dato restante en la base de datos
-    if datos_lote:
-        insertar_datos_lote(datos_lote)
-
-# Cerrar la conexión a la base de datos
-finally:
+                            telemetria.registrar_error('parseo')
+                            print("Error al convertir los datos a enteros: "
+                                  f"{data}")
+                            continue
+
+                        # Asegurarse de que hay n_canales + 1 valores
+                        if valores is None:
+                            telemetria.registrar_error('incompletas')
+                            print(f"Datos incompletos recibidos: {data}")
+                            continue
+
+                        buffer.agregar(valores)
+                        telemetria.registrar_muestra()
+                        onset_gesto.append(valores[0])
+                        if mostrar_muestras:
+                            print(f"Registrado Onset: {valores[0]}\t " 
+                                  + "\t ".join(
+                                      f"{col}: {val}" for col, val 
+                                      in zip(columnas_canales, valores[1:])))
+
+                    except UnicodeDecodeError:
+                        # Suele caer acá cuando registra datos incompletos 
+                        # desde el puerto serial. Típicamente pasa si empieza 
+                        # a leer cuando se está recibiendo una línea
+                        telemetria.registrar_error('decodificacion')
+
+    except KeyboardInterrupt:
+        print("\nLectura interrumpida")
+
+    # Con cualquier forma de terminar, pasar a la base de datos lo que quede en
+    # el buffer y cerrar la conexión
+    finally:
+        buffer.cerrar()
+        print(f"Datos guardados en {db_path}")
+        # Registrar los intervalos de onset del gesto capturado
+        if onset_gesto:
+            registrar_segmentos(conexion, gesto_id, onset_gesto)
+            # Telemetría del gesto, y la frecuencia medida como su 'fs'
+            telemetria.registrar_cola(buffer.estado_cola())
+            registrar_telemetria(conexion, gesto_id, sesion_id, telemetria)
+            if ajustar_fs and telemetria.n_muestras > 1:
+                actualizar_fs(conexion, gesto_id, telemetria.fs_medida, 
+                              nombre_tabla)
+            print(telemetria.linea_estado())
+        conexion.close()
+
+    return gesto_id, telemetria
+
+
+#%%
+if __name__ == '__main__':
+    # Perfil con la frecuencia de muestreo, la velocidad del puerto y la base 
+    # de datos. Por ejemplo: 
+    #   python lectura_3ch_rawEMG.py --perfil perfiles/base.toml
+    perfil = cargar_perfil_cli("Capturar gestos desde el puerto serial")
+
+    # Mostrar el último gesto registrado para elegir la sesión y el nombre
+    conexion = sqlite3.connect(perfil.ruta_db)
+    cursor = conexion.cursor()
+    crear_tabla_raw(cursor, perfil.tabla_raw, list(range(1, N_CANALES + 1)))
+    ultimo_gesto_id, ultimo_nombre_gesto, ultimo_sesion_id = ultimo_registro(
+        cursor, perfil.tabla_raw)
     conexion.close()
+
+    # Solicitar el sesion_id al usuario
+    print(f"Última sesión registrada con ID = {ultimo_sesion_id}")
+    sesion_id = input("Por favor, ingrese el número de sesión: ")
+    sesion_id = int(sesion_id) if sesion_id else ultimo_sesion_id
+
+    # Solicitar el nombre del gesto al usuario
+    print(f"Último gesto registrado fue '{ultimo_nombre_gesto}' con "
+          f"ID = {ultimo_gesto_id}")
+    nombre_gesto = input("Por favor, ingrese el nombre del gesto: ")
+
+    try:
+        capturar(perfil, nombre_gesto, sesion_id)
+    except serial.SerialException as e:
+        print(f"Error al acceder al puerto serial: {e}")
@@ -0,0 +1,355 @@
+''' Perfiles de procesamiento
+Parámetros de procesamiento reunidos en un solo lugar, en lugar de declarar
+'fs', 'fc', 'forden', 'reescalado', la ruta de la base de datos, etc. en cada
+script. Un perfil se lee de un archivo TOML o JSON y se puede modificar desde
+la línea de comandos:
+
+    python emg_cvm_norm_sql.py --perfil perfiles/base.toml --fc 100
+
+Los resultados dependen del perfil con que se calcularon, así que cada perfil
+tiene una huella (un hash de sus parámetros de procesamiento). Las tablas de
+resultados ('norm', 'fft', 'repeticiones', ...) de un perfil llevan la huella
+en el nombre, por ejemplo 'norm_3f2a9c1b07', de modo que varios perfiles se
+pueden calcular y guardar lado a lado y compararse sin recalcular. El perfil
+por defecto usa los nombres de siempre ('norm', 'fft', ...), para seguir
+leyendo las bases de datos ya procesadas.
+
+La huella de cada tabla solo considera los parámetros que la afectan: por
+ejemplo 'nperseg' solo lo usan las tablas calculadas con Welch, así que
+cambiarlo no cambia 'norm' ni 'fft' y no obliga a volver a normalizar.
+
+Formato del archivo
+-------------------
+Las mismas llaves que los campos de 'Perfil'; las que falten quedan con su
+valor por defecto. Por ejemplo, en TOML:
+
+    nombre = "fc_100"
+    fc = 100
+    forden = 4
+
+    [mapa_cvm]
+    4 = "CVM flexor"
+
+Estructura de la base de datos
+------------------------------
+Tabla 'perfiles', con los perfiles con que se han calculado resultados:
+        huella: Hash de los parámetros de procesamiento
+        nombre: Nombre del perfil
+    parametros: Parámetros de procesamiento, como JSON
+         fecha: Última vez que se usó, YYYY-MM-DD HH:MM:SS
+
+Bastián Rivas
+'''
+import sqlite3
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field, fields, asdict, replace
+from datetime import datetime
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+# Campos que cambian los resultados y por lo tanto la huella. La ruta de la
+# base de datos, el puerto o el nombre del perfil no cambian los resultados
+PARAMETROS_PROCESAMIENTO = ('tabla_raw', 'fs', 'fc', 'forden', 'reescalado',
+                            'nperseg', 'mapa_cvm', 'fs_norm',
+                            'solo_envolvente')
+
+# Parámetros que solo entran en la huella si tienen un valor (no None ni
+# False), para que los perfiles que no los usan mantengan la huella (y las
+# tablas) de antes
+PARAMETROS_OPCIONALES = ('fs_norm', 'solo_envolvente')
+
+# Parámetros que solo afectan a algunas tablas de resultados. En la huella de
+# las demás tablas quedan con su valor por defecto
+TABLAS_POR_PARAMETRO = {'nperseg': ('coherencia', 'similitud')}
+
+# Tablas de resultados que se nombran con 'Perfil.tabla'
+TABLAS_RESULTADOS = ('norm', 'fft', 'repeticiones', 'coherencia', 'similitud')
+
+
+#%% Perfil
+@dataclass(frozen=True)
+class Perfil:
+    """
+    Parámetros de procesamiento de un flujo completo: captura,
+    normalización, FFT y gráficos.
+
+    Attributes
+    ----------
+        nombre (str): Nombre para identificar el perfil
+        ruta_db (str): Ruta a la base de datos
+        tabla_raw (str): Tabla de datos brutos
+        fs (int): Frecuencia de muestreo en Hertz. Los gestos capturados a
+                  otra frecuencia se remuestrean a esta
+        fc (float): Frecuencia de corte del filtro pasabajos en Hertz
+        forden (int): Orden del filtro pasabajos
+        reescalado (float): Factor para pasar los valores del ADC a volts
+        nperseg (int): Muestras por segmento de Welch
+        mapa_cvm (dict): Registro CVM de cada canal, {canal: nombre_gesto}
+        fs_norm (int): Frecuencia a la que se guarda la envolvente en 'norm'.
+                       None para guardarla a 'fs'
+        solo_envolvente (bool): Guardar en 'norm' solo la envolvente y
+                                calcular el % de la CVM al leer (ver
+                                'escala_cvm.py')
+        tamano_buffer (int): Muestras de los buffers de la captura
+        baud_rate (int): Velocidad del puerto serial
+    """
+    nombre: str = 'base'
+    ruta_db: str = 'Datos/datos_gestos_3ch.db'
+    tabla_raw: str = 'raw'
+    fs: int = 1000
+    fc: float = 150
+    forden: int = 2
+    reescalado: float = 5.0/1023
+    nperseg: int = 256
+    mapa_cvm: dict = field(default_factory=dict)
+    fs_norm: int = None
+    solo_envolvente: bool = False
+    tamano_buffer: int = 100
+    baud_rate: int = 115200
+
+    def __post_init__(self):
+        # Los tipos se fijan aquí para que 1e3 y 1000, o "150" y 150, den el
+        # mismo perfil y la misma huella
+        for campo in ('fs', 'forden', 'nperseg', 'tamano_buffer',
+                      'baud_rate'):
+            valor = getattr(self, campo)
+            if float(valor) != int(float(valor)):
+                raise ValueError(f"'{campo}' debe ser un entero, se recibió "
+                                 f"{valor}")
+            object.__setattr__(self, campo, int(float(valor)))
+        fc = float(self.fc)
+        object.__setattr__(self, 'fc', int(fc) if fc.is_integer() else fc)
+        object.__setattr__(self, 'reescalado', float(self.reescalado))
+        object.__setattr__(self, 'solo_envolvente', bool(self.solo_envolvente))
+        # Las llaves de TOML y JSON son texto
+        object.__setattr__(self, 'mapa_cvm', {int(canal): str(nombre)
+                                              for canal, nombre
+                                              in self.mapa_cvm.items()})
+        if not 0 < self.fc < self.fs / 2:
+            raise ValueError(f"La frecuencia de corte ({self.fc} Hz) debe "
+                             f"estar entre 0 y fs/2 ({self.fs / 2} Hz)")
+        if self.fs_norm is not None:
+            fs_norm = float(self.fs_norm)
+            if fs_norm != int(fs_norm):
+                raise ValueError(f"'fs_norm' debe ser un entero, se recibió "
+                                 f"{self.fs_norm}")
+            object.__setattr__(self, 'fs_norm', int(fs_norm))
+            if not 2 * self.fc < self.fs_norm <= self.fs:
+                raise ValueError(f"'fs_norm' ({self.fs_norm} Hz) debe ser "
+                                 f"mayor que 2*fc ({2 * self.fc} Hz) y no "
+                                 f"mayor que fs ({self.fs} Hz)")
+
+    def parametros(self, tabla=None):
+        """
+        Parámetros que definen los resultados, con tipos fijos. Con 'tabla',
+        los parámetros que no la afectan quedan con su valor por defecto
+        """
+        parametros = {campo: getattr(self, campo)
+                      for campo in PARAMETROS_PROCESAMIENTO}
+        if tabla is not None:
+            por_defecto = {campo.name: campo.default for campo in fields(self)}
+            for campo, tablas in TABLAS_POR_PARAMETRO.items():
+                if tabla not in tablas:
+                    parametros[campo] = por_defecto[campo]
+        parametros['fc'] = float(parametros['fc'])
+        parametros['mapa_cvm'] = {str(canal): nombre for canal, nombre
+                                  in sorted(self.mapa_cvm.items())}
+        for campo in PARAMETROS_OPCIONALES:
+            if parametros[campo] is None or parametros[campo] is False:
+                del parametros[campo]
+        return parametros
+
+    @property
+    def huella(self):
+        """Hash corto de los parámetros de procesamiento"""
+        return self.huella_tabla()
+
+    def huella_tabla(self, tabla=None):
+        """Hash corto de los parámetros que afectan a una tabla"""
+        texto = json.dumps(self.parametros(tabla), sort_keys=True)
+        return hashlib.sha1(texto.encode()).hexdigest()[:10]
+
+    @property
+    def es_base(self):
+        """True si procesa igual que el perfil por defecto"""
+        return self.huella == Perfil().huella
+
+    def tabla(self, base):
+        """
+        Nombre de una tabla de resultados para este perfil: 'base' si la
+        tabla sale igual que con el perfil por defecto y 'base_<huella>' si
+        no, con la huella de los parámetros que afectan a 'base'
+        """
+        huella = self.huella_tabla(base)
+        if huella == Perfil().huella_tabla(base):
+            return base
+        return f"{base}_{huella}"
+
+    def con_cambios(self, **cambios):
+        """Copia del perfil con algunos parámetros cambiados"""
+        return replace(self, **{clave: valor for clave, valor
+                                in cambios.items() if valor is not None})
+
+
+#%% Lectura y escritura
+def cargar_perfil(ruta=None, **cambios):
+    """
+    Lee un perfil desde un archivo TOML o JSON y le aplica cambios.
+
+    Parameters
+    ----------
+        ruta (str): Archivo .toml o .json. Sin archivo, el perfil por defecto
+        **cambios: Parámetros a reemplazar. Los valores None se ignoran
+
+    Return
+    ------
+        Perfil
+    """
+    valores = {}
+    if ruta is not None:
+        if ruta.endswith('.toml'):
+            if tomllib is None:
+                raise ImportError("Leer perfiles TOML requiere Python 3.11 o "
+                                  "el paquete 'tomli'")
+            with open(ruta, 'rb') as archivo:
+                valores = tomllib.load(archivo)
+        else:
+            with open(ruta, encoding='utf-8') as archivo:
+                valores = json.load(archivo)
+        valores.setdefault('nombre', os.path.splitext(
+            os.path.basename(ruta))[0])
+
+    conocidos = {campo.name for campo in fields(Perfil)}
+    desconocidos = set(valores) - conocidos
+    if desconocidos:
+        raise ValueError(f"Parámetros desconocidos en '{ruta}': "
+                         f"{', '.join(sorted(desconocidos))}")
+    return Perfil(**valores).con_cambios(**cambios)
+
+
+def guardar_perfil(perfil, ruta):
+    """Guarda un perfil como JSON, para repetir un procesamiento"""
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(asdict(perfil), archivo, indent=4, ensure_ascii=False)
+
+
+#%% Línea de comandos
+def agregar_argumentos(parser):
+    """Agrega a un ArgumentParser las opciones para elegir y ajustar el perfil"""
+    grupo = parser.add_argument_group('perfil de procesamiento')
+    grupo.add_argument('--perfil', help="archivo .toml o .json del perfil")
+    grupo.add_argument('--db', dest='ruta_db', help="ruta a la base de datos")
+    grupo.add_argument('--tabla-raw', dest='tabla_raw',
+                       help="tabla de datos brutos")
+    grupo.add_argument('--fs', type=int, help="frecuencia de muestreo [Hz]")
+    grupo.add_argument('--fc', type=float,
+                       help="frecuencia de corte del pasabajos [Hz]")
+    grupo.add_argument('--forden', type=int, help="orden del pasabajos")
+    grupo.add_argument('--reescalado', type=float,
+                       help="factor de ADC a volts")
+    grupo.add_argument('--nperseg', type=int,
+                       help="muestras por segmento de Welch")
+    grupo.add_argument('--fs-norm', type=int,
+                       help="frecuencia de la envolvente guardada en 'norm' "
+                            "[Hz] (por defecto, fs)")
+    grupo.add_argument('--solo-envolvente', action='store_true', default=None,
+                       help="guardar en 'norm' solo la envolvente; el %% de "
+                            "la CVM se calcula al leer")
+    return parser
+
+
+def perfil_desde_argumentos(args):
+    """Perfil a partir de las opciones de 'agregar_argumentos'"""
+    return cargar_perfil(args.perfil, ruta_db=args.ruta_db,
+                         tabla_raw=args.tabla_raw, fs=args.fs, fc=args.fc,
+                         forden=args.forden, reescalado=args.reescalado,
+                         nperseg=args.nperseg, fs_norm=args.fs_norm,
+                         solo_envolvente=args.solo_envolvente)
+
+
+def cargar_perfil_cli(descripcion=None, argv=None):
+    """
+    Perfil para los scripts: lee '--perfil' y los cambios desde la línea de
+    comandos. Sin opciones entrega el perfil por defecto.
+    """
+    parser = agregar_argumentos(argparse.ArgumentParser(
+        description=descripcion))
+    return perfil_desde_argumentos(parser.parse_args(argv))
+
+
+#%% Registro en la base de datos
+def registrar_perfil(conexion, perfil, tabla='perfiles'):
+    """
+    Guarda el perfil en la base de datos, para saber con qué parámetros se
+    calcularon las tablas '<tabla>_<huella>'.
+    """
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        huella TEXT PRIMARY KEY,
+        nombre TEXT,
+        parametros TEXT,
+        fecha TEXT
+    );
+    """)
+    cursor.execute(f"INSERT OR REPLACE INTO {tabla} VALUES (?, ?, ?, ?)",
+                   (perfil.huella, perfil.nombre,
+                    json.dumps(perfil.parametros(), sort_keys=True),
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    conexion.commit()
+
+
+def listar_perfiles(conexion, tabla='perfiles'):
+    """
+    Perfiles registrados en la base de datos.
+
+    Return
+    ------
+        list: (huella, nombre, parámetros (dict), fecha) de cada perfil
+    """
+    try:
+        cursor = conexion.execute(f"""SELECT huella, nombre, parametros, fecha
+                                      FROM {tabla} ORDER BY fecha""")
+    except sqlite3.OperationalError:
+        return []
+    return [(huella, nombre, json.loads(parametros), fecha)
+            for huella, nombre, parametros, fecha in cursor.fetchall()]
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Mostrar el perfil elegido y los perfiles ya calculados en la base de
+    datos, con las tablas de resultados de cada uno
+
+    Uso: python perfil_procesamiento.py [--perfil archivo] [--fc 100] ...
+    '''
+    perfil = cargar_perfil_cli(__doc__.splitlines()[0].strip())
+    print(f"Perfil '{perfil.nombre}' ({perfil.huella}):")
+    for clave, valor in asdict(perfil).items():
+        print(f"  {clave} = {valor}")
+
+    if os.path.exists(perfil.ruta_db):
+        conexion = sqlite3.connect(perfil.ruta_db)
+        tablas = [fila[0] for fila in conexion.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        print(f"\nPerfiles calculados en {os.path.abspath(perfil.ruta_db)}:")
+        for huella, nombre, parametros, fecha in listar_perfiles(conexion):
+            guardado = Perfil(**parametros)
+            propias = [guardado.tabla(t) for t in TABLAS_RESULTADOS
+                       if guardado.tabla(t) in tablas]
+            print(f"  {huella}  {nombre:<12} fc={parametros['fc']:g} "
+                  f"forden={parametros['forden']}  {fecha}  "
+                  f"{', '.join(propias)}")
+        conexion.close()
@@ -0,0 +1,477 @@
+""" Referencia de sesión
+Script para calcular una sola vez por sesión los valores de referencia que
+usan todos los procesamientos: el máximo de la envolvente de cada CVM, el RMS
+del reposo y la PSD del reposo por canal. Se guardan en una tabla junto a los
+parámetros de procesamiento con los que se calcularon, para que
+'normalizar_3ch_sql', 'calcular_fft_snr' y 'calcular_repeticiones' no vuelvan
+a consultar y filtrar los registros 'CVM CHX' y 'Reposo' por cada gesto.
+
+Por defecto la CVM del canal X es el registro 'CVM CHX' de la sesión. Con
+'mapa_cvm' ({canal: nombre del registro}) se puede usar otro registro por
+canal, por ejemplo cuando se capturan más canales que contracciones.
+
+Cada referencia se guarda con una llave de sus parámetros (fs, fc, forden,
+reescalado, nperseg y el registro CVM del canal), así que las referencias de varios
+perfiles quedan lado a lado en la misma tabla: pedir la de un perfil no
+reemplaza la de otro, y dos procesos con perfiles distintos escriben filas
+distintas.
+
+La referencia se invalida sola al insertar, modificar o borrar registros
+'CVM' o 'Reposo' de una sesión en la tabla de datos brutos (mediante
+triggers de SQLite), para todos los parámetros a la vez.
+
+    Estructura de la base de datos
+    ------------------------------
+        sesion_id (int)      : ID de la sesión
+        canal (int)          : Número del canal
+        llave (text)         : Parámetros de la referencia, ver
+                               'llave_referencia'
+        fs (int)             : Frecuencia de muestreo en Hertz
+        fc (int)             : Frecuencia de corte del filtro pasabajos
+        forden (int)         : Orden del filtro pasabajos
+        reescalado (float)   : Factor de reescalado del ADC
+        nperseg (int)        : Muestras por segmento de la PSD del reposo
+        cvm_max (float)      : Máximo de la envolvente filtrada de la CVM
+        nombre_cvm (text)    : Registro CVM asignado con 'mapa_cvm', o NULL si
+                               se usó el registro 'CVM CHX'
+        rms_reposo (float)   : RMS de la envolvente filtrada del reposo
+        df (float)           : Resolución en frecuencia de la PSD del reposo
+        psd_reposo (blob)    : PSD de Welch del reposo, como arreglo float32
+
+
+Bastián Rivas
+"""
+import sqlite3
+import os
+import json
+import numpy as np
+
+# Envolvente multicanal (rectificación + filtfilt)
+from kernels_emg import rectificar, filtrar_envolvente
+# Columnas por canal y registros CVM de cada canal
+from esquema_canales import (columnas_raw, columnas_existentes,
+                             es_cvm_de_canal)
+# Lectura de muestras enteras sin pasar por listas de tuplas
+from registro_emg import leer_muestras
+# Registros capturados a otra frecuencia que la de análisis
+from remuestreo import remuestrear
+
+
+#%% Cálculo de la referencia
+def _separar_por_gesto(filas):
+    """
+    Separa filas con formato [gesto_id, CH1, CH2, ...] ordenadas por gesto en
+    una lista de arreglos de (n_muestras, canales), uno por gesto.
+    """
+    filas = np.asarray(filas)
+    _, inicios = np.unique(filas[:, 0], return_index=True)
+    return np.split(filas[:, 1:], np.sort(inicios)[1:])
+
+
+def _remuestrear_tramos(gesto_ids, fs_filas, valores, fs):
+    """
+    Remuestrea a 'fs' cada tramo de filas contiguas de un mismo gesto.
+
+    Return
+    ------
+        valores (np.array): Filas en la grilla de 'fs'
+        origen (np.array): Fila original de cada fila nueva, para repetir
+                           columnas como el nombre del gesto
+    """
+    inicios = np.r_[0, np.flatnonzero(np.diff(gesto_ids)) + 1]
+    fines = np.r_[inicios[1:], len(gesto_ids)]
+    partes, origen = [], []
+    for inicio, fin in zip(inicios, fines):
+        tramo = remuestrear(valores[inicio:fin], fs_filas[inicio], fs)
+        partes.append(tramo)
+        origen.append(inicio + (np.arange(len(tramo)) * (fin - inicio))
+                      // len(tramo))
+    return np.concatenate(partes), np.concatenate(origen)
+
+
+def leer_registros_referencia(conexion, sesion_id, tabla_raw='raw',
+                              reescalado=5.0/1023, canales=[1, 2, 3],
+                              mapa_cvm=None, fs=None):
+    """
+    Lee los registros CVM y Reposo de una sesión y los deja rectificados. No
+    dependen del filtro, así que se pueden filtrar con varias frecuencias de
+    corte y órdenes sin volver a leerlos (ver 'referencia_desde_registros').
+
+    Con 'fs', los registros capturados a otra frecuencia se remuestrean a
+    'fs' antes de rectificarlos (ver 'remuestreo.py').
+
+    Return
+    ------
+        registros: dict
+            'cvm': Lista con la CVM rectificada de cada canal (1-D, vacía si
+                   falta el registro)
+            'reposos': Lista con cada registro de reposo rectificado, de
+                       (n_muestras, canales)
+            'reposo_centrado': Todos los reposos sin su media, concatenados,
+                               para la PSD
+            'canales', 'mapa_cvm', 'reescalado': Datos con que se leyeron
+    """
+    cursor = conexion.cursor()
+    n_canales = len(canales)
+    columnas = ", ".join(columnas_raw(canales))
+
+    # Todos los registros CVM de la sesión se leen en una sola consulta, en
+    # lugar de una por canal
+    nombres_mapa = sorted(set(mapa_cvm.values())) if mapa_cvm else []
+    cursor.execute(f"""
+        SELECT gesto_id, fs, nombre_gesto, {columnas}
+        FROM {tabla_raw}
+        WHERE (nombre_gesto LIKE '%CVM%'
+               OR nombre_gesto IN ({', '.join('?' * len(nombres_mapa))}))
+        AND sesion_id = ?
+        ORDER BY id
+    """, (*nombres_mapa, sesion_id))
+    filas_cvm = cursor.fetchall()
+    nombres_cvm = np.array([fila[2] for fila in filas_cvm], dtype=object)
+    valores_cvm = np.array([fila[3:] for fila in filas_cvm],
+                           dtype=float).reshape(-1, n_canales) * reescalado
+    if fs is not None and len(filas_cvm):
+        valores_cvm, origen = _remuestrear_tramos(
+            np.array([fila[0] for fila in filas_cvm]),
+            np.array([fila[1] for fila in filas_cvm]), valores_cvm, fs)
+        nombres_cvm = nombres_cvm[origen]
+
+    cvm = []
+    for i, num_canal in enumerate(canales):
+        registros = [nombre for nombre in set(nombres_cvm)
+                     if es_cvm_de_canal(nombre, num_canal, mapa_cvm)]
+        emg_cvm = valores_cvm[np.isin(nombres_cvm, registros), i]
+        cvm.append(rectificar(emg_cvm) if len(emg_cvm) else emg_cvm)
+
+    # Los reposos se centran por registro, igual que al normalizar cada gesto
+    # 'Reposo' por separado
+    filas = leer_muestras(cursor, f"""
+        SELECT gesto_id, fs, {columnas}
+        FROM {tabla_raw}
+        WHERE nombre_gesto LIKE '%Reposo%'
+        AND sesion_id = ?
+        ORDER BY gesto_id, id
+    """, (sesion_id,))
+    centrados = []
+    for registro in (_separar_por_gesto(filas) if len(filas) else []):
+        # La primera columna es la 'fs' del registro
+        datos = registro[:, 1:] * reescalado
+        if fs is not None:
+            datos = remuestrear(datos, registro[0, 0], fs)
+        centrados.append(datos - np.mean(datos, axis=0))
+
+    return {
+        'canales': list(canales),
+        'mapa_cvm': dict(mapa_cvm or {}),
+        'reescalado': reescalado,
+        'cvm': cvm,
+        'reposos': [np.abs(centrado) for centrado in centrados],
+        'reposo_centrado': (np.concatenate(centrados) if centrados
+                            else np.zeros((0, n_canales))),
+    }
+
+
+def referencia_desde_registros(registros, fs=1000, fc=150, forden=2,
+                               nperseg=256):
+    """
+    Calcula la referencia a partir de los registros de
+    'leer_registros_referencia', con un filtro dado.
+
+    Parameters
+    ----------
+        nperseg (int): Muestras por segmento de la PSD del reposo. Con None
+                       no se calcula la PSD
+
+    Return
+    ------
+        referencia: dict
+            'cvm_max', 'rms_reposo' (un valor por canal, NaN si falta el
+            registro), 'frecuencias', 'psd_reposo' y 'df'
+    """
+    n_canales = len(registros['canales'])
+
+    # Máximo de la envolvente de la CVM de cada canal
+    cvm_max = np.full(n_canales, np.nan)
+    for i, emg_cvm in enumerate(registros['cvm']):
+        # filtfilt necesita más muestras que su relleno, 3 * (forden + 1)
+        if len(emg_cvm) > 3 * (int(forden) + 1):
+            cvm_max[i] = np.max(filtrar_envolvente(emg_cvm, fs, fc, forden))
+
+    # RMS y PSD del reposo. La envolvente se calcula por registro
+    rms_reposo = np.full(n_canales, np.nan)
+    frecuencias = np.zeros(0)
+    psd_reposo = np.zeros((0, n_canales))
+    if registros['reposos']:
+        envolventes = np.concatenate([filtrar_envolvente(r, fs, fc, forden)
+                                      for r in registros['reposos']])
+        rms_reposo = np.sqrt(np.mean(np.square(envolventes), axis=0))
+        if nperseg is not None:
+            # Importación diferida, para no cargar scipy.signal al arrancar
+            from scipy.signal import welch
+            reposo = registros['reposo_centrado']
+            frecuencias, psd_reposo = welch(reposo, fs,
+                                            nperseg=min(nperseg, len(reposo)),
+                                            axis=0)
+
+    return {
+        'cvm_max': cvm_max,
+        'rms_reposo': rms_reposo,
+        'frecuencias': frecuencias,
+        'psd_reposo': psd_reposo,
+        'df': frecuencias[1] if len(frecuencias) > 1 else 0.0,
+    }
+
+
+def calcular_referencia(conexion, sesion_id, tabla_raw='raw', fs=1000, fc=150,
+                        forden=2, reescalado=5.0/1023, canales=[1, 2, 3],
+                        nperseg=256, mapa_cvm=None):
+    """
+    Calcula la referencia de una sesión a partir de sus datos brutos.
+
+    Parameters
+    ----------
+        mapa_cvm (dict): Registro CVM de cada canal, {canal: nombre_gesto}.
+                         Los canales que no estén usan 'CVM CHX'
+
+    Return
+    ------
+        referencia: dict
+            Diccionario con las entradas 'cvm_max', 'rms_reposo' (np.array con
+            un valor por canal, NaN si falta el registro), 'frecuencias' y
+            'psd_reposo' (de (n_frecuencias, canales)), 'df', 'canales' y los
+            parámetros usados
+    """
+    registros = leer_registros_referencia(conexion, sesion_id, tabla_raw,
+                                          reescalado, canales, mapa_cvm, fs)
+    referencia = {
+        'sesion_id': sesion_id,
+        'canales': list(canales),
+        'fs': fs,
+        'fc': fc,
+        'forden': forden,
+        'reescalado': reescalado,
+        'nperseg': nperseg,
+        'mapa_cvm': dict(mapa_cvm or {}),
+    }
+    referencia.update(referencia_desde_registros(registros, fs, fc, forden,
+                                                 nperseg))
+    return referencia
+
+
+#%% Tabla de referencias
+def llave_referencia(fs, fc, forden, reescalado, nperseg=256,
+                     nombre_cvm=None):
+    """
+    Texto que identifica los parámetros de la referencia de un canal. Los
+    tipos se fijan para que, por ejemplo, fc = 150 y fc = 150.0 den la misma
+    llave.
+    """
+    return json.dumps([float(fs), float(fc), int(forden), float(reescalado),
+                       int(nperseg), nombre_cvm])
+
+
+def crear_tabla_referencia(conexion, tabla_ref='referencia_sesion',
+                           tabla_raw='raw'):
+    """
+    Crea la tabla de referencias y los triggers que la invalidan cuando
+    cambian los registros 'CVM' o 'Reposo' de una sesión.
+    """
+    cursor = conexion.cursor()
+    # Las tablas anteriores guardaban una sola referencia por sesión y canal,
+    # o no guardaban 'nperseg'. Son un caché, así que se vuelven a crear
+    columnas = columnas_existentes(cursor, tabla_ref)
+    if columnas and not {'llave', 'nperseg'} <= set(columnas):
+        cursor.execute(f"DROP TABLE {tabla_ref}")
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_ref} (
+        sesion_id INTEGER,
+        canal INTEGER,
+        llave TEXT,
+        fs INTEGER,
+        fc INTEGER,
+        forden INTEGER,
+        reescalado REAL,
+        nperseg INTEGER,
+        cvm_max REAL,
+        rms_reposo REAL,
+        df REAL,
+        psd_reposo BLOB,
+        nombre_cvm TEXT,
+        PRIMARY KEY (sesion_id, canal, llave)
+    );
+    """)
+
+    # Incluye los registros asignados con 'mapa_cvm', aunque no digan 'CVM'
+    condicion = ("""(nombre_gesto LIKE '%CVM%' OR nombre_gesto LIKE '%Reposo%'"""
+                 f""" OR nombre_gesto IN (SELECT nombre_cvm FROM {tabla_ref}))""")
+    for evento, fila in (("INSERT", "NEW"), ("UPDATE", "NEW"),
+                         ("DELETE", "OLD")):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS invalidar_{tabla_ref}_{evento.lower()}
+        AFTER {evento} ON {tabla_raw}
+        WHEN {condicion.replace('nombre_gesto', fila + '.nombre_gesto')}
+        BEGIN
+            DELETE FROM {tabla_ref} WHERE sesion_id = {fila}.sesion_id;
+        END;
+        """)
+    # Un UPDATE puede mover un registro de sesión, invalidar ambas
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS invalidar_{tabla_ref}_update_old
+    AFTER UPDATE ON {tabla_raw}
+    WHEN {condicion.replace('nombre_gesto', 'OLD.nombre_gesto')}
+    BEGIN
+        DELETE FROM {tabla_ref} WHERE sesion_id = OLD.sesion_id;
+    END;
+    """)
+    conexion.commit()
+
+
+def registrar_referencia(conexion, referencia, tabla_ref='referencia_sesion'):
+    """
+    Guarda la referencia de una sesión, reemplazando solo la que tenga los
+    mismos parámetros. Las de otros parámetros se mantienen.
+    """
+    cursor = conexion.cursor()
+    filas = []
+    for i, num_canal in enumerate(referencia['canales']):
+        psd = referencia['psd_reposo'][:, i].astype(np.float32).tobytes()
+        nombre_cvm = referencia['mapa_cvm'].get(num_canal)
+        llave = llave_referencia(referencia['fs'], referencia['fc'],
+                                 referencia['forden'],
+                                 referencia['reescalado'],
+                                 referencia['nperseg'], nombre_cvm)
+        filas.append((referencia['sesion_id'], num_canal, llave,
+                      referencia['fs'],
+                      referencia['fc'], referencia['forden'],
+                      referencia['reescalado'], referencia['nperseg'],
+                      float(referencia['cvm_max'][i]),
+                      float(referencia['rms_reposo'][i]),
+                      float(referencia['df']), psd, nombre_cvm))
+    cursor.executemany(f"""
+        INSERT OR REPLACE INTO {tabla_ref} (sesion_id, canal, llave, fs, fc,
+                                            forden, reescalado, nperseg,
+                                            cvm_max, rms_reposo, df,
+                                            psd_reposo, nombre_cvm)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", filas)
+    conexion.commit()
+
+
+def invalidar_referencia(conexion, sesion_id, tabla_ref='referencia_sesion'):
+    """
+    Borra la referencia guardada de una sesión para forzar su recálculo.
+    """
+    crear_tabla_referencia(conexion, tabla_ref)
+    conexion.execute(f"DELETE FROM {tabla_ref} WHERE sesion_id = ?",
+                     (sesion_id,))
+    conexion.commit()
+
+
+def obtener_referencia(conexion, sesion_id, tabla_raw='raw', fs=1000, fc=150,
+                       forden=2, reescalado=5.0/1023, canales=[1, 2, 3],
+                       tabla_ref='referencia_sesion', mapa_cvm=None,
+                       nperseg=256):
+    """
+    Obtiene la referencia de una sesión. Si no hay una guardada con estos
+    parámetros, se calcula y se guarda junto a las de otros parámetros.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        sesion_id (int): ID de la sesión
+        tabla_raw (str): Tabla con los datos brutos
+        fs, fc, forden, reescalado: Parámetros de procesamiento, con el mismo
+                                    significado que en 'normalizar_3ch_sql'
+        canales (list): Canales a incluir
+        tabla_ref (str): Tabla donde se guardan las referencias
+        mapa_cvm (dict): Registro CVM de cada canal, {canal: nombre_gesto}
+        nperseg (int): Muestras por segmento de la PSD del reposo, el
+                       'nperseg' del perfil
+
+    Return
+    ------
+        referencia: dict
+            Mismo formato que 'calcular_referencia'
+
+    Raises
+    ------
+        ValueError: Si a algún canal le falta el registro CVM o Reposo
+    """
+    mapa_cvm = dict(mapa_cvm or {})
+    crear_tabla_referencia(conexion, tabla_ref, tabla_raw)
+    cursor = conexion.cursor()
+    llaves = {num_canal: llave_referencia(fs, fc, forden, reescalado, nperseg,
+                                          mapa_cvm.get(num_canal))
+              for num_canal in canales}
+    cursor.execute(f"""
+        SELECT canal, llave, cvm_max, rms_reposo, df, psd_reposo
+        FROM {tabla_ref}
+        WHERE sesion_id = ?
+    """, (sesion_id,))
+    guardadas = {(fila[0], fila[1]): fila[2:] for fila in cursor.fetchall()}
+    filas = {num_canal: guardadas.get((num_canal, llave))
+             for num_canal, llave in llaves.items()}
+
+    # Las referencias con canales en NULL (NaN) se vuelven a calcular, para
+    # avisar que faltan registros
+    if any(fila is None or None in fila[:2] for fila in filas.values()):
+        referencia = calcular_referencia(conexion, sesion_id, tabla_raw, fs, fc,
+                                         forden, reescalado, canales,
+                                         nperseg, mapa_cvm)
+        # Una referencia incompleta no se guarda: normalizar con ella dejaría
+        # los canales sin CVM en NULL sin avisar
+        for clave, registro in (('cvm_max', 'CVM'), ('rms_reposo', 'Reposo')):
+            faltantes = [num_canal for num_canal, valor
+                         in zip(canales, referencia[clave]) if np.isnan(valor)]
+            if faltantes:
+                raise ValueError(f"La sesión {sesion_id} no tiene registro "
+                                 f"{registro} suficiente para los canales "
+                                 f"{faltantes} en '{tabla_raw}'")
+        registrar_referencia(conexion, referencia, tabla_ref)
+        return referencia
+
+    psd_reposo = np.column_stack([
+        np.frombuffer(filas[num_canal][3], dtype=np.float32)
+        for num_canal in canales])
+    df = filas[canales[0]][2]
+    return {
+        'sesion_id': sesion_id,
+        'canales': list(canales),
+        'fs': fs,
+        'fc': fc,
+        'forden': forden,
+        'reescalado': reescalado,
+        'nperseg': nperseg,
+        'cvm_max': np.array([filas[c][0] for c in canales], dtype=float),
+        'mapa_cvm': dict(mapa_cvm),
+        'rms_reposo': np.array([filas[c][1] for c in canales], dtype=float),
+        'frecuencias': np.arange(len(psd_reposo)) * df,
+        'psd_reposo': psd_reposo.astype(float),
+        'df': df,
+    }
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Calcular y guardar la referencia de todas las sesiones registradas
+    '''
+    ruta_db = 'Datos/datos_gestos_3ch.db'
+    tabla_raw = 'raw'
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"SELECT DISTINCT sesion_id FROM {tabla_raw}")
+    sesiones = [fila[0] for fila in cursor.fetchall()]
+
+    print(f"""--- Referencias por sesión ---
+Sesión\tCanal\tCVM máx [V]\tRMS reposo [V]
+------\t-----\t-----------\t--------------""")
+    for sesion_id in sesiones:
+        referencia = obtener_referencia(conexion, sesion_id, tabla_raw)
+        for i, num_canal in enumerate(referencia['canales']):
+            print(f"{sesion_id}\t{num_canal}\t"
+                  f"{referencia['cvm_max'][i]:.4f}\t\t"
+                  f"{referencia['rms_reposo'][i]:.4f}")
+
+    conexion.close()
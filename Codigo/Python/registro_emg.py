@@ -0,0 +1,268 @@
+""" Registro EMG
+Estructura para trabajar con un gesto completo como un solo arreglo contiguo
+de (n_muestras, n_canales) junto a sus metadatos, en lugar de varios
+diccionarios paralelos {1: [], 2: [], 3: []} con un canal por entrada.
+
+Todo el filtrado, las FFT y las métricas se calculan sobre el eje 0 en una
+sola llamada, para cualquier cantidad de canales.
+
+Ejemplo
+-------
+    conexion = sqlite3.connect('Datos/datos_gestos_3ch.db')
+    registro = RegistroEMG.desde_db(conexion, gesto_id=5)
+    envolvente = registro.envolvente(fc=150, forden=2)   # (n_muestras, 3)
+    rms = registro.activos().rms()                      # un valor por canal
+
+Bastián Rivas
+"""
+import re
+from itertools import chain
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+
+# Segmentos de onset precalculados y kernels multicanal
+from segmentos_onset import (obtener_segmentos, extraer_activos,
+                             calcular_segmentos, tabla_segmentos)
+from kernels_emg import calcular_envolvente
+# FFT real con largos rápidos
+from espectro_emg import magnitud_fft
+# Remuestreo a la frecuencia de análisis
+from remuestreo import (TOLERANCIA_FS, necesita_remuestreo, remuestrear,
+                        remuestrear_onset)
+
+
+def detectar_canales(conexion, tabla, columna='CH{}'):
+    """
+    Obtiene los números de canal disponibles en una tabla a partir del nombre
+    de sus columnas (por ejemplo CH1, CH2, ... o ch1_env_fil, ch2_env_fil, ...)
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        tabla (str): Nombre de la tabla
+        columna (str): Formato del nombre de columna, con {} en el número
+
+    Return
+    ------
+        list: Números de canal ordenados
+    """
+    patron = re.compile(re.escape(columna).replace(r'\{\}', r'(\d+)') + '$')
+    cursor = conexion.execute(f"PRAGMA table_info({tabla})")
+    canales = [int(m.group(1)) for fila in cursor.fetchall()
+               if (m := patron.match(fila[1]))]
+    return sorted(canales)
+
+
+def leer_muestras(cursor, consulta, parametros=(), dtype=np.int32):
+    """
+    Ejecuta una consulta y lee todas sus filas directo a un arreglo de NumPy,
+    sin armar la lista de tuplas de 'fetchall'. Los canales del ADC se leen
+    como enteros y se reescalan después con una sola multiplicación, en lugar
+    de multiplicar fila por fila en SQL.
+
+    Parameters
+    ----------
+        cursor (sqlite3.Cursor): Cursor de la base de datos
+        consulta (str): Consulta SELECT
+        parametros (tuple): Parámetros de la consulta
+        dtype: Tipo del arreglo. np.int32 para las columnas del ADC y float
+               para las que ya están en volts
+
+    Return
+    ------
+        np.array: Arreglo de (n_filas, n_columnas). Si alguna columna tiene
+                  NULL (un canal que el gesto no tiene) se lee como float y
+                  los NULL quedan como NaN
+    """
+    cursor.execute(consulta, parametros)
+    n_columnas = len(cursor.description)
+    try:
+        plano = np.fromiter(chain.from_iterable(cursor), dtype=dtype)
+    except TypeError:
+        cursor.execute(consulta, parametros)
+        return np.array(cursor.fetchall(), dtype=float).reshape(-1, n_columnas)
+    return plano.reshape(-1, n_columnas)
+
+
+@dataclass
+class RegistroEMG:
+    """
+    Gesto EMG de varios canales.
+
+    Attributes
+    ----------
+        datos (np.array): Muestras de (n_muestras, n_canales)
+        fs (float): Frecuencia de muestreo en Hertz
+        canales (list): Número de canal de cada columna de 'datos'
+        reescalado (float): Factor que ya se aplicó a los datos del ADC
+        onset (np.array): Vector de onset, de (n_muestras,)
+        segmentos (np.array): Intervalos [inicio, fin) con onset = 1
+        gesto_id, sesion_id, nombre_gesto, fecha: Metadatos del gesto
+    """
+    datos: np.ndarray
+    fs: float
+    canales: list = field(default_factory=lambda: [1, 2, 3])
+    reescalado: float = 1.0
+    onset: np.ndarray = None
+    segmentos: np.ndarray = None
+    gesto_id: int = None
+    sesion_id: int = None
+    nombre_gesto: str = None
+    fecha: str = None
+
+    #%% Lectura
+    @classmethod
+    def desde_db(cls, conexion, gesto_id, tabla='raw', canales=None,
+                 reescalado=5.0/1023, columna='CH{}', fs=None,
+                 tabla_raw='raw'):
+        """
+        Lee un gesto desde la base de datos con una sola consulta.
+
+        Parameters
+        ----------
+            conexion (sqlite3.Connection): Conexión abierta a la base de datos
+            gesto_id (int): ID del gesto
+            tabla (str): Tabla a leer ('raw', 'norm', ...)
+            canales (list): Canales a leer. Por defecto todos los de la tabla
+            reescalado (float): Factor para reescalar los datos. Usar 1.0 para
+                                tablas que ya están en volts, como 'norm'
+            columna (str): Formato de las columnas de canal. 'CH{}' para la
+                           tabla 'raw' y 'ch{}_env_fil' o 'ch{}_norm' para la
+                           tabla 'norm'
+            fs (float): Frecuencia de muestreo. Por defecto la registrada
+            tabla_raw (str): Tabla desde donde calcular los segmentos de onset
+                             si aún no están registrados
+
+        Return
+        ------
+            RegistroEMG
+        """
+        if canales is None:
+            canales = detectar_canales(conexion, tabla, columna)
+        columnas = ", ".join(columna.format(c) for c in canales)
+
+        cursor = conexion.cursor()
+        cursor.execute(f"""
+            SELECT fs, fecha, sesion_id, nombre_gesto
+            FROM {tabla}
+            WHERE gesto_id = ?
+            LIMIT 1
+        """, (gesto_id,))
+        metadatos = cursor.fetchone()
+        if metadatos is None:
+            raise ValueError(f"No existe el gesto con ID {gesto_id} en la "
+                             f"tabla '{tabla}'")
+        fs_registro, fecha, sesion_id, nombre_gesto = metadatos
+
+        # Las columnas del ADC se leen como enteros
+        filas = leer_muestras(cursor, f"""
+            SELECT onset, {columnas}
+            FROM {tabla}
+            WHERE gesto_id = ?
+            ORDER BY id
+        """, (gesto_id,), np.int32 if columna == 'CH{}' else float)
+
+        return cls(
+            datos=filas[:, 1:] * reescalado,
+            fs=fs if fs is not None else fs_registro,
+            canales=list(canales),
+            reescalado=reescalado,
+            onset=filas[:, 0].astype(np.int8),
+            # Las tablas derivadas pueden estar a otra frecuencia que la de
+            # datos brutos, así que tienen sus propios segmentos
+            segmentos=obtener_segmentos(conexion, gesto_id,
+                                        tabla_segmentos(tabla, tabla_raw),
+                                        tabla_raw=tabla),
+            gesto_id=gesto_id,
+            sesion_id=sesion_id,
+            nombre_gesto=nombre_gesto,
+            fecha=fecha,
+        )
+
+    #%% Propiedades
+    @property
+    def n_muestras(self):
+        return self.datos.shape[0]
+
+    @property
+    def n_canales(self):
+        return self.datos.shape[1]
+
+    @property
+    def tiempo(self):
+        """Vector de tiempo en segundos"""
+        return np.arange(self.n_muestras) / self.fs
+
+    def canal(self, num_canal):
+        """Muestras de un canal, según su número (1, 2, 3, ...)"""
+        return self.datos[:, self.canales.index(num_canal)]
+
+    def con_datos(self, datos):
+        """Copia del registro con otros datos y los mismos metadatos"""
+        return replace(self, datos=datos)
+
+    #%% Procesamiento
+    def activos(self):
+        """
+        Registro solo con las muestras con onset = 1, recortadas desde los
+        segmentos de onset.
+        """
+        segmentos = self.segmentos
+        if segmentos is None:
+            segmentos = calcular_segmentos(self.onset)
+        return replace(self,
+                       datos=extraer_activos(self.datos, segmentos),
+                       onset=None if self.onset is None
+                       else extraer_activos(self.onset, segmentos),
+                       segmentos=None)
+
+    def remuestrear(self, fs, tolerancia=TOLERANCIA_FS):
+        """
+        Registro a la frecuencia 'fs', con el onset y los segmentos en la nueva
+        grilla. Si la frecuencia ya es 'fs' (dentro de 'tolerancia') solo se
+        cambia el 'fs' del registro. Ver 'remuestreo.remuestrear'.
+        """
+        if not necesita_remuestreo(self.fs, fs, tolerancia):
+            return replace(self, fs=fs)
+        datos = remuestrear(self.datos, self.fs, fs, tolerancia=tolerancia)
+        onset = (None if self.onset is None
+                 else remuestrear_onset(self.onset, len(datos), self.fs,
+                                        fs))
+        return replace(self, datos=datos, fs=fs, onset=onset,
+                       segmentos=None if onset is None
+                       else calcular_segmentos(onset))
+
+    def envolvente(self, fc, forden):
+        """
+        Envolvente filtrada de todos los canales, igual que 'ajusta_emg_func'
+
+        Return
+        ------
+            np.array: Envolvente de (n_muestras, n_canales)
+        """
+        return calcular_envolvente(self.datos, self.fs, fc, forden)
+
+    def rms(self):
+        """RMS de cada canal"""
+        return np.sqrt(np.mean(np.square(self.datos), axis=0))
+
+    def fft_magnitud(self, modo='rapido', workers=1):
+        """
+        Lado derecho de la FFT real de cada canal, como amplitud de un lado
+        (2/N * |FFT|). Ver 'espectro_emg.magnitud_fft'.
+
+        Parameters
+        ----------
+            modo (str): 'rapido' para rellenar hasta un largo rápido o
+                        'exacto' para usar las N muestras
+            workers (int): Hilos de scipy.fft
+
+        Return
+        ------
+            frecuencias (np.array): Eje de frecuencias en Hertz, de
+                                    (n_fft // 2 + 1,)
+            magnitud (np.array): Magnitud de (n_fft // 2 + 1, n_canales)
+            n_fft (int): Largo de la FFT usado
+        """
+        return magnitud_fft(self.datos, self.fs, modo, workers)
@@ -0,0 +1,175 @@
+""" Remuestreo
+Etapa para llevar gestos capturados a distintas frecuencias de muestreo a una
+frecuencia de análisis común. El sketch de la envolvente usa SAMPLE_RATE 500
+y el de captura 1000 Hz, y la columna 'fs' de cada gesto puede ser distinta,
+pero los filtros, la referencia de la sesión y las figuras suponían un solo
+'fs' para todos.
+
+    - remuestrear: cambia la frecuencia de una señal con resample_poly
+      (filtro polifásico), sobre el eje 0 y para todos los canales a la vez
+    - remuestrear_onset: lleva el vector de onset a la nueva grilla, sin
+      interpolar (sigue siendo 0 o 1)
+    - remuestrear_lote: varios gestos ('RegistroEMG.remuestrear')
+    - fs_envolvente_min: frecuencia mínima para guardar una envolvente
+      filtrada a 'fc' sin que se doble su espectro
+
+Diseño del filtro
+-----------------
+resample_poly diseña en cada llamada un FIR de 20 * max(up, down) + 1
+coeficientes con firwin. Para razones como 1000/998 (la 'fs' medida de un
+gesto, ver 'telemetria_captura') son 10 001 coeficientes, y diseñarlos cuesta
+más que filtrar un gesto entero. Aquí el diseño se guarda en un caché por
+(up, down) y se pasa a resample_poly como 'window', así que cada razón se
+diseña una sola vez por proceso. El filtro es el mismo que usaría
+resample_poly (ventana de Kaiser con beta = 5).
+
+Tolerancia
+----------
+La 'fs' medida durante la captura es la de llegada al computador y varía unas
+décimas por ciento entre gestos. Las frecuencias que difieren de la de destino
+en menos de 'TOLERANCIA_FS' se toman como iguales y la señal no se toca, igual
+que antes de esta etapa.
+
+Envolventes
+-----------
+La envolvente queda limitada en banda a 'fc' por el pasabajos, así que se
+puede guardar en la tabla 'norm' a una frecuencia menor ('fs_norm' del
+perfil) y reducir la tabla y el trabajo de las etapas siguientes. Con
+fc = 150 Hz la ganancia es poca (a lo más unos 330 Hz), pero con envolventes
+de pocos Hz, como las de control, la tabla se reduce decenas de veces.
+
+Bastián Rivas
+"""
+from fractions import Fraction
+from functools import lru_cache
+import numpy as np
+# scipy.signal se importa dentro de las funciones, para no cargarlo al
+# arrancar
+
+
+# Diferencia relativa bajo la cual dos frecuencias se consideran iguales
+TOLERANCIA_FS = 0.005
+
+# Denominador máximo de la razón de remuestreo, para frecuencias no enteras
+MAX_DENOMINADOR = 1000
+
+# Margen sobre 2 * fc para guardar envolventes ('fs_envolvente_min')
+MARGEN_NYQUIST = 1.1
+
+
+#%% Razón y filtro
+def razon_remuestreo(fs_origen, fs_destino):
+    """
+    Factores (up, down) enteros y coprimos tales que
+    fs_destino = fs_origen * up / down.
+    """
+    razon = Fraction(fs_destino / fs_origen).limit_denominator(MAX_DENOMINADOR)
+    if razon <= 0:
+        raise ValueError(f"Frecuencias inválidas: {fs_origen} -> {fs_destino}")
+    return razon.numerator, razon.denominator
+
+
+def necesita_remuestreo(fs_origen, fs_destino, tolerancia=TOLERANCIA_FS):
+    """True si las frecuencias difieren en más de 'tolerancia' (relativa)"""
+    return abs(fs_origen - fs_destino) > tolerancia * fs_destino
+
+
+@lru_cache(maxsize=32)
+def filtro_polifasico(up, down, beta=5.0):
+    """
+    FIR antialias de resample_poly para una razón up/down, calculado una sola
+    vez por razón. El arreglo es de solo lectura porque se comparte.
+    """
+    from scipy.signal import firwin
+    max_razon = max(up, down)
+    medio_largo = 10 * max_razon
+    # resample_poly multiplica los coeficientes por 'up' al usarlos
+    coeficientes = firwin(2 * medio_largo + 1, 1.0 / max_razon,
+                          window=('kaiser', beta))
+    coeficientes.flags.writeable = False
+    return coeficientes
+
+
+#%% Señales
+def remuestrear(datos, fs_origen, fs_destino, eje=0,
+                tolerancia=TOLERANCIA_FS):
+    """
+    Lleva una señal de 'fs_origen' a 'fs_destino' con un filtro polifásico.
+
+    Parameters
+    ----------
+        datos (np.array): Señal, con las muestras en el eje 'eje'
+        fs_origen, fs_destino (float): Frecuencias en Hertz
+        eje (int): Eje de las muestras
+        tolerancia (float): Diferencia relativa bajo la cual no se remuestrea
+
+    Return
+    ------
+        np.array: Señal a 'fs_destino', de ceil(n * up / down) muestras. La
+                  misma señal si no hace falta remuestrear
+    """
+    if not necesita_remuestreo(fs_origen, fs_destino, tolerancia):
+        return datos
+    from scipy.signal import resample_poly
+    up, down = razon_remuestreo(fs_origen, fs_destino)
+    return resample_poly(np.asarray(datos, dtype=float), up, down, axis=eje,
+                         window=filtro_polifasico(up, down))
+
+
+def remuestrear_onset(onset, n_muestras, fs_origen, fs_destino):
+    """
+    Onset en una grilla de 'n_muestras' a 'fs_destino', tomando para cada
+    muestra nueva la muestra original en el mismo instante. Usa la misma
+    razón up/down que 'remuestrear', para que los flancos queden alineados
+    con la señal. Sigue valiendo 0 o 1.
+    """
+    onset = np.asarray(onset)
+    up, down = razon_remuestreo(fs_origen, fs_destino)
+    indices = (np.arange(n_muestras) * down) // up
+    return onset[np.minimum(indices, len(onset) - 1)]
+
+
+def remuestrear_lote(registros, fs_destino, tolerancia=TOLERANCIA_FS):
+    """
+    Lleva varios gestos ('RegistroEMG') a 'fs_destino'. Los filtros quedan en
+    caché, así que cada razón distinta se diseña una sola vez en todo el lote.
+
+    Return
+    ------
+        list: Registros a 'fs_destino', en el mismo orden
+    """
+    return [registro.remuestrear(fs_destino, tolerancia)
+            for registro in registros]
+
+
+def fs_envolvente_min(fc, margen=MARGEN_NYQUIST):
+    """
+    Frecuencia mínima (entera) para guardar una envolvente filtrada a 'fc':
+    sobre 2 * fc, con un margen porque el pasabajos no corta en seco.
+    """
+    return int(np.ceil(2 * fc * margen))
+
+
+#%%
+if __name__ == '__main__':
+    import timeit
+
+    # Gesto de 5 s capturado a 500 Hz y llevado a 1000 Hz, y uno a 998 Hz
+    # (fs medida) llevado a 1000 Hz, con y sin el diseño en caché
+    rng = np.random.default_rng(0)
+    for fs_origen in (500, 998, 997.3):
+        senal = rng.normal(0, 1, (int(5 * fs_origen), 3))
+        up, down = razon_remuestreo(fs_origen, 1000)
+
+        def sin_cache():
+            from scipy.signal import resample_poly
+            return resample_poly(senal, up, down, axis=0)
+
+        con_cache = lambda: remuestrear(senal, fs_origen, 1000, tolerancia=0)
+        assert np.allclose(sin_cache(), con_cache())
+        t_sin = min(timeit.repeat(sin_cache, number=1, repeat=5)) * 1e3
+        t_con = min(timeit.repeat(con_cache, number=1, repeat=5)) * 1e3
+        print(f"{fs_origen:>6} Hz -> 1000 Hz (up={up}, down={down}): "
+              f"{t_sin:.1f} ms sin caché, {t_con:.1f} ms con caché")
+    print(f"Envolvente con fc = 150 Hz: fs_norm >= {fs_envolvente_min(150)} "
+          f"Hz. Con fc = 10 Hz: >= {fs_envolvente_min(10)} Hz")
@@ -0,0 +1,324 @@
+""" Repeticiones de gestos
+Script para separar cada gesto en sus repeticiones (cada vez que se mantuvo
+pulsado el botón de onset) y calcular métricas por repetición: duración, RMS,
+SNR y densidad espectral de potencia (PSD).
+
+A diferencia de 'calcular_fft_snr', que concatena todas las muestras con
+onset = 1 y calcula una sola FFT sobre segmentos discontinuos, acá cada
+repetición se analiza por separado. Las repeticiones de un gesto se rellenan
+con ceros hasta un largo común y se procesan todas juntas en un solo cálculo
+vectorizado.
+
+    Estructura de la base de datos
+    ------------------------------
+        gesto_id (int)       : Identificador único para cada gesto
+        repeticion (int)     : Número de la repetición dentro del gesto
+        sesion_id (int)      : ID de la sesión en la que se hizo la captura
+        nombre_gesto (string): Nombre del gesto hecho
+        fs (int)             : Frecuencia de muestreo en Hertz
+        inicio (int)         : Índice de la primera muestra de la repetición
+        fin (int)            : Índice siguiente a la última muestra
+        duracion (float)     : Duración de la repetición en segundos
+        df (float)           : Resolución en frecuencia de la PSD, en Hertz
+        chX_rms (float)      : RMS de la repetición en el canal X
+        chX_SNR (float)      : SNR de la repetición en el canal X
+        chX_psd (blob)       : PSD de la repetición en el canal X, guardada
+                               como arreglo float32. Leer con 'leer_psd'
+
+
+Bastián Rivas
+"""
+import sqlite3
+import os
+import numpy as np
+from scipy.fft import rfft, next_fast_len
+
+# Gesto como un solo arreglo multicanal
+from registro_emg import RegistroEMG
+
+# Referencia de CVM y reposo calculada una vez por sesión
+from referencia_sesion import obtener_referencia
+
+# Parámetros y tablas de resultados desde un perfil de procesamiento
+from perfil_procesamiento import cargar_perfil_cli, registrar_perfil
+
+
+#%% Separación en repeticiones
+def segmentar_repeticiones(segmentos, fs, duracion_min=0.05):
+    """
+    Obtiene las repeticiones de un gesto a partir de sus segmentos de onset,
+    descartando los segmentos demasiado cortos (rebotes del botón).
+
+    Parameters
+    ----------
+        segmentos (np.array): Arreglo de (n_segmentos, 2) con [inicio, fin]
+        fs (float): Frecuencia de muestreo en Hertz
+        duracion_min (float): Duración mínima de una repetición en segundos
+
+    Return
+    ------
+        np.array: Arreglo de (n_repeticiones, 2) con [inicio, fin]
+    """
+    segmentos = np.asarray(segmentos, dtype=np.int64).reshape(-1, 2)
+    largos = segmentos[:, 1] - segmentos[:, 0]
+    return segmentos[largos >= duracion_min * fs]
+
+
+def apilar_repeticiones(datos, repeticiones):
+    """
+    Apila las repeticiones en un arreglo de largo común, rellenando con ceros.
+
+    Parameters
+    ----------
+        datos (np.array): Muestras del gesto, de (n_muestras, canales)
+        repeticiones (np.array): Arreglo de (n_repeticiones, 2) con [inicio, fin]
+
+    Return
+    ------
+        apiladas (np.array): Arreglo de (n_repeticiones, largo_max, canales)
+        mascara (np.array): Arreglo booleano de (n_repeticiones, largo_max)
+                            que indica qué muestras son válidas
+        largos (np.array): Cantidad de muestras de cada repetición
+    """
+    datos = np.asarray(datos, dtype=float)
+    largos = repeticiones[:, 1] - repeticiones[:, 0]
+    largo_max = int(largos.max()) if len(largos) else 0
+
+    # Índices de todas las repeticiones a la vez, sin ciclos en Python
+    indices = repeticiones[:, :1] + np.arange(largo_max)
+    mascara = np.arange(largo_max) < largos[:, None]
+    indices = np.minimum(indices, len(datos) - 1)
+    apiladas = datos[indices] * mascara[..., None]
+    return apiladas, mascara, largos
+
+
+#%% Métricas por repetición
+def analizar_repeticiones(datos, repeticiones, fs, rms_ruido):
+    """
+    Calcula duración, RMS, SNR y PSD de todas las repeticiones de un gesto en
+    un solo cálculo vectorizado.
+
+    Parameters
+    ----------
+        datos (np.array): Muestras del gesto, de (n_muestras, canales)
+        repeticiones (np.array): Arreglo de (n_repeticiones, 2) con [inicio, fin]
+        fs (float): Frecuencia de muestreo en Hertz
+        rms_ruido (np.array): RMS del reposo de cada canal
+
+    Return
+    ------
+        dict: Diccionario con las entradas 'duracion' (n_repeticiones),
+              'rms' y 'SNR' (n_repeticiones, canales), 'psd'
+              (n_repeticiones, n_frecuencias, canales) y 'df' (float)
+    """
+    apiladas, mascara, largos = apilar_repeticiones(datos, repeticiones)
+    n_validas = largos[:, None].astype(float)
+
+    # Eliminar la componente continua de cada repetición, solo en las muestras
+    # válidas para que el relleno siga en cero
+    media = apiladas.sum(axis=1) / n_validas
+    apiladas = (apiladas - media[:, None, :]) * mascara[..., None]
+
+    # RMS y SNR con SNR = 20 * log10(RMS_Señal / RMS_Ruido)
+    rms = np.sqrt((apiladas ** 2).sum(axis=1) / n_validas + media ** 2)
+    with np.errstate(divide='ignore'):
+        snr = 20 * np.log10(rms / np.asarray(rms_ruido, dtype=float))
+
+    # PSD de un lado (periodograma) de todas las repeticiones y canales juntos
+    n_fft = next_fast_len(apiladas.shape[1], real=True)
+    espectro = rfft(apiladas, n=n_fft, axis=1)
+    psd = np.abs(espectro) ** 2 / (fs * n_validas[:, None, :])
+    # Un lado: se duplican todas menos la continua y, con n_fft par, la de
+    # Nyquist, igual que scipy.signal.welch
+    psd[:, 1:-1 if n_fft % 2 == 0 else None] *= 2
+
+    return {
+        'duracion': largos / fs,
+        'rms': rms,
+        'SNR': snr,
+        'psd': psd,
+        'df': fs / n_fft,
+    }
+
+
+def calcular_repeticiones(gesto_id, ruta_db='Datos/datos_gestos_3ch.db',
+                          tabla_norm='norm', canales=None,
+                          duracion_min=0.05, tabla_raw='raw', forden=2,
+                          reescalado=5.0/1023, mapa_cvm=None,
+                          fs_analisis=None, nperseg=256):
+    """
+    Separa un gesto en repeticiones y calcula sus métricas a partir de la
+    envolvente filtrada registrada en 'tabla_norm'. El ruido se obtiene de la
+    referencia de la sesión, igual que en 'calcular_fft_snr'.
+
+    Parameters
+    ----------
+    - "gesto_id": Número identificador del gesto
+    - "ruta_db": La ruta a la base de datos SQLite
+    - "tabla_norm": Tabla con los datos previamente filtrados
+    - "canales": Lista de canales a analizar. Por defecto, todos los de
+      'tabla_norm'
+    - "duracion_min": Duración mínima de una repetición, en segundos
+    - "tabla_raw", "forden", "reescalado", "mapa_cvm": Tabla de datos brutos y
+      parámetros con los que se calculó 'tabla_norm', para obtener la
+      referencia
+    - "fs_analisis": Frecuencia de análisis del perfil, para la referencia.
+      Por defecto la registrada en 'tabla_norm'. Las repeticiones usan siempre
+      la de 'tabla_norm'
+    - "nperseg": Muestras por segmento de la PSD del reposo en la referencia,
+      el 'nperseg' del perfil
+
+    Return
+    ------
+        datos_rep: dict
+            Diccionario con los datos del gesto ('gesto_id', 'sesion_id',
+            'nombre_gesto', 'fs', 'canales'), las repeticiones [inicio, fin] y
+            las métricas entregadas por 'analizar_repeticiones'
+    """
+    conexion = sqlite3.connect(ruta_db)
+    registro = RegistroEMG.desde_db(conexion, gesto_id, tabla_norm, canales,
+                                    reescalado=1.0, columna='ch{}_env_fil',
+                                    tabla_raw=tabla_raw)
+    fs = registro.fs
+    cursor = conexion.cursor()
+    cursor.execute(f"SELECT fc FROM {tabla_norm} WHERE gesto_id = ? LIMIT 1",
+                   (gesto_id,))
+    fc = cursor.fetchone()[0]
+
+    # Ruido de la sesión, desde la referencia calculada una vez por sesión
+    referencia = obtener_referencia(conexion, registro.sesion_id, tabla_raw,
+                                    fs_analisis or fs, fc, forden, reescalado,
+                                    registro.canales, mapa_cvm=mapa_cvm,
+                                    nperseg=nperseg)
+    conexion.close()
+
+    repeticiones = segmentar_repeticiones(registro.segmentos, fs, duracion_min)
+    datos_rep = {
+        'gesto_id': gesto_id,
+        'sesion_id': registro.sesion_id,
+        'nombre_gesto': registro.nombre_gesto,
+        'fs': fs,
+        'canales': registro.canales,
+        'repeticiones': repeticiones,
+    }
+    if len(repeticiones):
+        datos_rep.update(analizar_repeticiones(registro.datos, repeticiones, fs,
+                                               referencia['rms_reposo']))
+    return datos_rep
+
+
+#%% Registro y lectura
+def registrar_repeticiones(datos_rep, ruta_db='Datos/datos_gestos_3ch.db',
+                           tabla_rep='repeticiones'):
+    """
+    Registra las métricas por repetición de un gesto. Si el gesto ya estaba
+    registrado, se reemplaza.
+
+    Parameters
+    ----------
+    - "datos_rep": Datos entregados por 'calcular_repeticiones'
+    - "ruta_db": La ruta a la base de datos SQLite
+    - "tabla_rep": Tabla donde se registran las repeticiones
+    """
+    canales = datos_rep['canales']
+    columnas_canal = [f"ch{c}_{m}" for c in canales
+                      for m in ('rms', 'SNR', 'psd')]
+    tipos_canal = ",\n        ".join(
+        f"{col} {'BLOB' if col.endswith('psd') else 'REAL'}"
+        for col in columnas_canal)
+
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_rep} (
+        gesto_id INTEGER,
+        repeticion INTEGER,
+        sesion_id INTEGER,
+        nombre_gesto TEXT,
+        fs INTEGER,
+        inicio INTEGER,
+        fin INTEGER,
+        duracion REAL,
+        df REAL,
+        {tipos_canal},
+        PRIMARY KEY (gesto_id, repeticion)
+    );
+    """)
+    cursor.execute(f"""CREATE INDEX IF NOT EXISTS idx_{tabla_rep}_sesion
+                       ON {tabla_rep} (sesion_id, nombre_gesto)""")
+    cursor.execute(f"DELETE FROM {tabla_rep} WHERE gesto_id = ?",
+                   (datos_rep['gesto_id'],))
+
+    filas = []
+    for n, (inicio, fin) in enumerate(datos_rep['repeticiones']):
+        fila = [datos_rep['gesto_id'], n, datos_rep['sesion_id'],
+                datos_rep['nombre_gesto'], datos_rep['fs'], int(inicio),
+                int(fin), float(datos_rep['duracion'][n]),
+                float(datos_rep['df'])]
+        for i, _ in enumerate(canales):
+            fila += [float(datos_rep['rms'][n, i]),
+                     float(datos_rep['SNR'][n, i]),
+                     datos_rep['psd'][n, :, i].astype(np.float32).tobytes()]
+        filas.append(fila)
+
+    marcas = ", ".join("?" * (9 + len(columnas_canal)))
+    cursor.executemany(f"""
+        INSERT INTO {tabla_rep} (gesto_id, repeticion, sesion_id, nombre_gesto,
+                                 fs, inicio, fin, duracion, df,
+                                 {", ".join(columnas_canal)})
+        VALUES ({marcas})""", filas)
+    conexion.commit()
+    conexion.close()
+
+    print(f"Registradas {len(filas)} repeticiones de "
+          f"'{datos_rep['nombre_gesto']}' con ID {datos_rep['gesto_id']} en la "
+          f"tabla '{tabla_rep}'.")
+
+
+def leer_psd(blob, df):
+    """
+    Convierte la PSD guardada en la tabla de repeticiones en arreglos.
+
+    Return
+    ------
+        frecuencias (np.array): Eje de frecuencias en Hertz
+        psd (np.array): PSD en V^2/Hz
+    """
+    psd = np.frombuffer(blob, dtype=np.float32)
+    return np.arange(len(psd)) * df, psd
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Separar en repeticiones TODOS los gestos normalizados de tabla_norm y
+    registrar sus métricas en tabla_rep
+    '''
+    # Parámetros y tablas del perfil de procesamiento
+    perfil = cargar_perfil_cli("Separar los gestos normalizados en "
+                               "repeticiones")
+    ruta_db = perfil.ruta_db
+    tabla_norm = perfil.tabla('norm')
+    tabla_rep = perfil.tabla('repeticiones')
+
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"SELECT DISTINCT gesto_id FROM {tabla_norm}")
+    gestos_a_procesar = [fila[0] for fila in cursor.fetchall()]
+    conexion.close()
+
+    for gesto in gestos_a_procesar:
+        datos_rep = calcular_repeticiones(gesto, ruta_db, tabla_norm,
+                                          tabla_raw=perfil.tabla_raw,
+                                          forden=perfil.forden,
+                                          reescalado=perfil.reescalado,
+                                          mapa_cvm=perfil.mapa_cvm,
+                                          fs_analisis=perfil.fs,
+                                          nperseg=perfil.nperseg)
+        registrar_repeticiones(datos_rep, ruta_db, tabla_rep)
+
+    conexion = sqlite3.connect(ruta_db)
+    registrar_perfil(conexion, perfil)
+    conexion.close()
+    print(f"Finalizado. {len(gestos_a_procesar)} gestos procesados.")
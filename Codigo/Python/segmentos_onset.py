@@ -0,0 +1,227 @@
+''' Segmentos de onset
+
+Funciones para precalcular los intervalos en que el onset de un gesto está
+activo y guardarlos en una tabla indexada. Así, extraer la parte activa de un
+gesto cuesta O(segmentos) en lugar de recorrer todas las muestras con
+"WHERE onset = 1" o con un ciclo en Python.
+
+Los índices son relativos a las muestras del gesto ordenadas por 'id', por lo
+que se pueden usar directamente para recortar los arreglos leídos desde su
+tabla. Los segmentos de los datos brutos van en 'onset_seg' y los de cada
+tabla derivada (por ejemplo 'norm') en 'onset_seg_<tabla>', porque una tabla
+derivada puede estar a otra frecuencia de muestreo (ver 'remuestreo.py'). Los
+de una tabla derivada se calculan desde su propia columna de onset la primera
+vez que se leen.
+
+Estructura de la base de datos
+------------------------------
+    gesto_id: Identificador único para cada gesto
+    segmento: Número correlativo del segmento dentro del gesto (0, 1, 2, ...)
+      inicio: Índice de la primera muestra con onset = 1
+         fin: Índice siguiente a la última muestra con onset = 1. El intervalo
+              es semiabierto: [inicio, fin)
+
+La llave primaria (gesto_id, segmento) actúa como índice, por lo que consultar
+los segmentos de un gesto no recorre la tabla completa.
+
+Bastián Rivas
+'''
+import sqlite3
+import os
+import numpy as np
+
+
+#%% Cálculo de segmentos
+def calcular_segmentos(onset):
+    """
+    Calcula los intervalos en que el onset está activo.
+
+    Parameters
+    ----------
+        onset (list or np.array): Vector de onset del gesto, con 1 mientras se
+                                  ejecuta el gesto y 0 en otro caso.
+
+    Return
+    ------
+        np.array: Arreglo de (n_segmentos, 2) con las columnas [inicio, fin]
+                  de cada intervalo semiabierto.
+    """
+    activo = (np.asarray(onset) != 0).astype(np.int8)
+    # Rellenar con ceros para detectar segmentos al inicio o al final
+    bordes = np.diff(np.concatenate(([0], activo, [0])))
+    inicios = np.flatnonzero(bordes == 1)
+    fines = np.flatnonzero(bordes == -1)
+    return np.column_stack((inicios, fines)).astype(np.int64)
+
+
+def cambios_onset(segmentos, n_muestras):
+    """
+    Obtiene los índices en que cambia el onset a partir de los segmentos.
+    Equivale a buscar los i tales que onset[i] != onset[i-1], pero sin recorrer
+    las muestras.
+
+    Parameters
+    ----------
+        segmentos (np.array): Arreglo de (n_segmentos, 2) con [inicio, fin].
+        n_muestras (int): Cantidad total de muestras del gesto.
+
+    Return
+    ------
+        np.array: Índices ordenados de los cambios de onset.
+    """
+    cambios = np.asarray(segmentos).ravel()
+    # Un segmento que empieza en la primera muestra o termina en la última no 
+    # representa un cambio
+    return cambios[(cambios > 0) & (cambios < n_muestras)]
+
+
+def extraer_activos(datos, segmentos):
+    """
+    Recorta las regiones activas de un arreglo de muestras.
+
+    Parameters
+    ----------
+        datos (np.array): Arreglo con las muestras del gesto en el eje 0.
+                          Puede ser de 1 dimensión o de (n_muestras, canales)
+        segmentos (np.array): Arreglo de (n_segmentos, 2) con [inicio, fin].
+
+    Return
+    ------
+        np.array: Muestras activas concatenadas en el eje 0.
+    """
+    datos = np.asarray(datos)
+    if len(segmentos) == 0:
+        return datos[:0]
+    if len(segmentos) == 1:
+        inicio, fin = segmentos[0]
+        return datos[inicio:fin]
+    return np.concatenate([datos[inicio:fin] for inicio, fin in segmentos])
+
+
+#%% Registro y lectura desde la base de datos
+def tabla_segmentos(tabla, tabla_raw='raw'):
+    """
+    Tabla de segmentos de 'tabla': 'onset_seg' para los datos brutos y
+    'onset_seg_<tabla>' para las tablas derivadas
+    """
+    return 'onset_seg' if tabla == tabla_raw else f'onset_seg_{tabla}'
+
+
+def crear_tabla_segmentos(cursor, tabla_seg='onset_seg'):
+    """
+    Crea la tabla de segmentos si no existe.
+    """
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla_seg} (
+        gesto_id INTEGER,
+        segmento INTEGER,
+        inicio INTEGER,
+        fin INTEGER,
+        PRIMARY KEY (gesto_id, segmento)
+    );
+    """)
+
+
+def registrar_segmentos(conexion, gesto_id, onset, tabla_seg='onset_seg'):
+    """
+    Calcula y registra los segmentos de onset de un gesto. Si el gesto ya tenía
+    segmentos registrados, se reemplazan.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        gesto_id (int): ID del gesto
+        onset (list or np.array): Vector de onset del gesto ordenado por 'id'
+        tabla_seg (str): Nombre de la tabla de segmentos
+
+    Return
+    ------
+        np.array: Segmentos registrados, de (n_segmentos, 2)
+    """
+    segmentos = calcular_segmentos(onset)
+    cursor = conexion.cursor()
+    crear_tabla_segmentos(cursor, tabla_seg)
+    cursor.execute(f"DELETE FROM {tabla_seg} WHERE gesto_id = ?", (gesto_id,))
+    cursor.executemany(f"""
+        INSERT INTO {tabla_seg} (gesto_id, segmento, inicio, fin)
+        VALUES (?, ?, ?, ?)""",
+        [(gesto_id, n, int(inicio), int(fin))
+         for n, (inicio, fin) in enumerate(segmentos)])
+    conexion.commit()
+    return segmentos
+
+
+def obtener_segmentos(conexion, gesto_id, tabla_seg='onset_seg',
+                      tabla_raw='raw'):
+    """
+    Obtiene los segmentos de onset de un gesto. Si el gesto aún no tiene
+    segmentos registrados, los calcula a partir del onset guardado en
+    'tabla_raw' y los registra para las siguientes consultas.
+
+    Parameters
+    ----------
+        conexion (sqlite3.Connection): Conexión abierta a la base de datos
+        gesto_id (int): ID del gesto
+        tabla_seg (str): Nombre de la tabla de segmentos
+        tabla_raw (str): Tabla desde donde leer el onset si no hay segmentos
+
+    Return
+    ------
+        np.array: Arreglo de (n_segmentos, 2) con [inicio, fin]
+    """
+    cursor = conexion.cursor()
+    crear_tabla_segmentos(cursor, tabla_seg)
+    cursor.execute(f"""
+        SELECT inicio, fin FROM {tabla_seg}
+        WHERE gesto_id = ?
+        ORDER BY segmento""", (gesto_id,))
+    filas = cursor.fetchall()
+    if filas:
+        return np.array(filas, dtype=np.int64)
+
+    # Gesto sin segmentos: calcularlos una vez desde el onset
+    cursor.execute(f"""
+        SELECT onset FROM {tabla_raw}
+        WHERE gesto_id = ?
+        ORDER BY id""", (gesto_id,))
+    onset = [fila[0] for fila in cursor.fetchall()]
+    return registrar_segmentos(conexion, gesto_id, onset, tabla_seg)
+
+
+def indexar_segmentos_db(ruta_db='Datos/datos_gestos_3ch.db', tabla_raw='raw',
+                         tabla_seg='onset_seg'):
+    """
+    Calcula y registra los segmentos de todos los gestos de 'tabla_raw'.
+    Útil para bases de datos capturadas antes de que existiera la tabla.
+
+    Return
+    ------
+        int: Cantidad de gestos indexados
+    """
+    conexion = sqlite3.connect(ruta_db)
+    cursor = conexion.cursor()
+    cursor.execute(f"""
+        SELECT gesto_id, onset FROM {tabla_raw}
+        ORDER BY gesto_id, id""")
+    filas = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+
+    # Separar por gesto sin recorrer las muestras en Python
+    ids, inicios = np.unique(filas[:, 0], return_index=True)
+    limites = np.append(inicios, len(filas))
+    for n, gesto_id in enumerate(ids):
+        onset = filas[limites[n]:limites[n + 1], 1]
+        registrar_segmentos(conexion, int(gesto_id), onset, tabla_seg)
+
+    conexion.close()
+    return len(ids)
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Indexar los segmentos de onset de todos los gestos registrados
+    '''
+    ruta_db = 'Datos/datos_gestos_3ch.db'
+    print(f"Usando base de datos en: {os.path.abspath(ruta_db)}")
+    n_gestos = indexar_segmentos_db(ruta_db)
+    print(f"Finalizado. Segmentos de {n_gestos} gestos registrados.")
@@ -0,0 +1,346 @@
+''' Telemetría de la captura
+Mide en línea, mientras se captura, cómo está llegando la señal en vez de
+suponer que llega a 'fs' = 1000 Hz:
+    - Frecuencia de muestreo medida, en total y en una ventana deslizante
+    - Histograma del tiempo entre muestras (jitter), con media, desviación y
+      percentiles
+    - Líneas con error de conversión, incompletas o que no se pudieron
+      decodificar
+    - Pérdida estimada respecto a la frecuencia nominal
+    - Profundidad y latencia de la escritura en segundo plano
+      ('BufferCaptura.estado_cola')
+
+Los tiempos son los de llegada al computador, así que incluyen el
+agrupamiento del USB y del puerto serial: el jitter muestra cómo llegan las
+líneas, y la frecuencia medida en ventanas de algunos segundos es la que
+realmente entrega la placa.
+
+Cada gesto capturado deja su resumen en la tabla 'telemetria_captura', y la
+columna 'fs' de sus muestras en la tabla de datos brutos se reemplaza por la
+frecuencia medida ('actualizar_fs').
+
+Estructura de la base de datos
+------------------------------
+Tabla 'telemetria_captura', una fila por gesto:
+                     gesto_id: ID del gesto
+                    sesion_id: ID de la sesión
+                   fs_nominal: Frecuencia de muestreo configurada, en Hertz
+                    fs_medida: Frecuencia medida en toda la captura, en Hertz
+               fs_ventana_min: Mínima frecuencia medida en una ventana, Hz
+                     duracion: Segundos entre la primera y la última muestra
+                   n_muestras: Muestras recibidas
+                      perdida: Fracción de muestras faltantes según fs_nominal
+           intervalo_media_ms: Media del tiempo entre muestras
+            intervalo_desv_ms: Desviación del tiempo entre muestras (jitter)
+             intervalo_p50_ms: Mediana del tiempo entre muestras
+             intervalo_p99_ms: Percentil 99 del tiempo entre muestras
+             intervalo_max_ms: Máximo tiempo entre muestras
+               errores_parseo: Líneas que no se pudieron convertir a enteros
+           lineas_incompletas: Líneas con menos valores que canales
+       errores_decodificacion: Líneas que no se pudieron decodificar
+                     cola_max: Máximo de muestras esperando al escritor
+    latencia_escritura_max_ms: Máxima demora hasta el fsync
+ latencia_compactacion_max_ms: Máxima demora hasta quedar en SQLite
+                   histograma: Bordes [ms] y conteos del tiempo entre
+                               muestras, como JSON
+                        fecha: Fecha de la captura, YYYY-MM-DD HH:MM:SS
+
+Bastián Rivas
+'''
+import sqlite3
+import bisect
+import json
+import math
+import time
+from collections import deque
+from datetime import datetime
+
+
+# Bordes del histograma del tiempo entre muestras, en milisegundos. El último
+# intervalo no tiene límite superior
+BORDES_MS = (0.0, 0.25, 0.5, 0.75, 0.9, 1.1, 1.25, 1.5, 2.0, 3.0, 5.0, 10.0,
+             20.0, 50.0, 100.0)
+
+
+#%% Telemetría
+class TelemetriaCaptura:
+    """
+    Estadísticas de llegada de las muestras de una captura, actualizadas con
+    cada muestra en tiempo constante.
+
+    Parameters
+    ----------
+        fs_nominal (float): Frecuencia de muestreo configurada en la placa
+        ventana (float): Segundos de la ventana deslizante de la frecuencia
+        bordes_ms (tuple): Bordes del histograma del tiempo entre muestras
+    """
+    def __init__(self, fs_nominal, ventana=2.0, bordes_ms=BORDES_MS):
+        self.fs_nominal = fs_nominal
+        self.ventana = ventana
+        self.bordes_ms = tuple(bordes_ms)
+        self.conteos = [0] * len(self.bordes_ms)
+
+        self.n_muestras = 0
+        self.primera = None
+        self.ultima = None
+        self.errores = {'parseo': 0, 'incompletas': 0, 'decodificacion': 0}
+        self.fs_ventana_min = math.inf
+        self.cola_max = 0
+        self.estado_cola = None
+
+        # Suma y suma de cuadrados de los intervalos, en segundos
+        self._suma = 0.0
+        self._suma_cuad = 0.0
+        self._maximo = 0.0
+        self._tiempos = deque()
+
+    def registrar_muestra(self, instante=None):
+        """Anota la llegada de una muestra, por defecto en este instante"""
+        if instante is None:
+            instante = time.perf_counter()
+        if self.ultima is not None:
+            intervalo = instante - self.ultima
+            self._suma += intervalo
+            self._suma_cuad += intervalo * intervalo
+            if intervalo > self._maximo:
+                self._maximo = intervalo
+            self.conteos[bisect.bisect_right(self.bordes_ms,
+                                             intervalo * 1e3) - 1] += 1
+        else:
+            self.primera = instante
+        self.ultima = instante
+        self.n_muestras += 1
+
+        # Ventana deslizante
+        self._tiempos.append(instante)
+        while instante - self._tiempos[0] > self.ventana:
+            self._tiempos.popleft()
+
+    def registrar_error(self, tipo):
+        """Cuenta una línea con error: 'parseo', 'incompletas' o
+        'decodificacion'"""
+        self.errores[tipo] += 1
+
+    def registrar_cola(self, estado_cola):
+        """Anota el estado de la cola de escritura ('estado_cola')"""
+        self.estado_cola = estado_cola
+        self.cola_max = max(self.cola_max, estado_cola['muestras_pendientes'])
+
+    #%% Métricas
+    @property
+    def duracion(self):
+        """Segundos entre la primera y la última muestra"""
+        return self.ultima - self.primera if self.n_muestras > 1 else 0.0
+
+    @property
+    def fs_medida(self):
+        """Frecuencia de muestreo medida en toda la captura"""
+        if self.duracion <= 0:
+            return float('nan')
+        return (self.n_muestras - 1) / self.duracion
+
+    def fs_ventana(self):
+        """
+        Frecuencia medida en la ventana deslizante. La ventana solo cuenta
+        para el mínimo cuando ya está completa.
+        """
+        if len(self._tiempos) < 2:
+            return float('nan')
+        lapso = self._tiempos[-1] - self._tiempos[0]
+        if lapso <= 0:
+            return float('nan')
+        fs = (len(self._tiempos) - 1) / lapso
+        if self.duracion >= self.ventana:
+            self.fs_ventana_min = min(self.fs_ventana_min, fs)
+        return fs
+
+    @property
+    def perdida(self):
+        """Fracción de muestras faltantes respecto a 'fs_nominal'"""
+        esperadas = self.duracion * self.fs_nominal + 1
+        if self.n_muestras < 2:
+            return 0.0
+        return max(0.0, 1 - self.n_muestras / esperadas)
+
+    def intervalos_ms(self):
+        """
+        Media, desviación, mediana, percentil 99 y máximo del tiempo entre
+        muestras, en milisegundos. Los percentiles se interpolan desde el
+        histograma.
+        """
+        n = self.n_muestras - 1
+        if n < 1:
+            return {'media': float('nan'), 'desv': float('nan'),
+                    'p50': float('nan'), 'p99': float('nan'),
+                    'max': float('nan')}
+        media = self._suma / n
+        varianza = max(self._suma_cuad / n - media * media, 0.0)
+        return {
+            'media': media * 1e3,
+            'desv': math.sqrt(varianza) * 1e3,
+            'p50': self._percentil(0.50),
+            'p99': self._percentil(0.99),
+            'max': self._maximo * 1e3,
+        }
+
+    def _percentil(self, fraccion):
+        objetivo = fraccion * sum(self.conteos)
+        acumulado = 0
+        for i, conteo in enumerate(self.conteos):
+            if conteo and acumulado + conteo >= objetivo:
+                inicio = self.bordes_ms[i]
+                # El último intervalo llega hasta el máximo medido
+                fin = (self.bordes_ms[i + 1] if i + 1 < len(self.bordes_ms)
+                       else max(self._maximo * 1e3, inicio))
+                return inicio + (fin - inicio) * (objetivo - acumulado) / conteo
+            acumulado += conteo
+        return float('nan')
+
+    def linea_estado(self):
+        """Resumen de una línea para mostrar periódicamente en consola"""
+        intervalos = self.intervalos_ms()
+        linea = (f"{self.duracion:6.1f} s  {self.n_muestras} muestras  "
+                 f"fs {self.fs_ventana():7.1f} Hz ({self.ventana:g} s) "
+                 f"{self.fs_medida:7.1f} Hz (total)  "
+                 f"dt p50/p99/max {intervalos['p50']:.2f}/"
+                 f"{intervalos['p99']:.2f}/{intervalos['max']:.1f} ms  "
+                 f"pérdida {100 * self.perdida:.1f} %  "
+                 f"errores {self.errores['parseo']}/"
+                 f"{self.errores['incompletas']}/"
+                 f"{self.errores['decodificacion']}")
+        estado = self.estado_cola
+        if estado is not None:
+            linea += (f"  cola {estado['muestras_pendientes']} muestras, "
+                      f"{estado['segmentos_en_cola']} segmentos, "
+                      f"{estado['latencia_escritura_ms']:.0f} ms")
+        return linea
+
+    def resumen(self):
+        """Métricas de la captura, con las columnas de 'telemetria_captura'"""
+        # Incluir la última ventana en el mínimo
+        self.fs_ventana()
+        intervalos = self.intervalos_ms()
+        estado = self.estado_cola or {}
+        return {
+            'fs_nominal': self.fs_nominal,
+            'fs_medida': self.fs_medida,
+            'fs_ventana_min': (self.fs_ventana_min
+                               if math.isfinite(self.fs_ventana_min)
+                               else None),
+            'duracion': self.duracion,
+            'n_muestras': self.n_muestras,
+            'perdida': self.perdida,
+            'intervalo_media_ms': intervalos['media'],
+            'intervalo_desv_ms': intervalos['desv'],
+            'intervalo_p50_ms': intervalos['p50'],
+            'intervalo_p99_ms': intervalos['p99'],
+            'intervalo_max_ms': intervalos['max'],
+            'errores_parseo': self.errores['parseo'],
+            'lineas_incompletas': self.errores['incompletas'],
+            'errores_decodificacion': self.errores['decodificacion'],
+            'cola_max': self.cola_max,
+            'latencia_escritura_max_ms': estado.get(
+                'latencia_escritura_max_ms'),
+            'latencia_compactacion_max_ms': estado.get(
+                'latencia_compactacion_max_ms'),
+            'histograma': {'bordes_ms': list(self.bordes_ms),
+                           'conteos': list(self.conteos)},
+        }
+
+
+#%% Base de datos
+COLUMNAS = ('gesto_id', 'sesion_id', 'fs_nominal', 'fs_medida',
+            'fs_ventana_min', 'duracion', 'n_muestras', 'perdida',
+            'intervalo_media_ms', 'intervalo_desv_ms', 'intervalo_p50_ms',
+            'intervalo_p99_ms', 'intervalo_max_ms', 'errores_parseo',
+            'lineas_incompletas', 'errores_decodificacion', 'cola_max',
+            'latencia_escritura_max_ms', 'latencia_compactacion_max_ms',
+            'histograma', 'fecha')
+
+
+def crear_tabla_telemetria(cursor, tabla='telemetria_captura'):
+    enteras = ('gesto_id', 'sesion_id', 'n_muestras', 'errores_parseo',
+               'lineas_incompletas', 'errores_decodificacion', 'cola_max')
+    definiciones = [f"{columna} INTEGER" if columna in enteras
+                    else f"{columna} TEXT" if columna in ('histograma',
+                                                          'fecha')
+                    else f"{columna} REAL"
+                    for columna in COLUMNAS]
+    definiciones[0] += " PRIMARY KEY"
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        {', '.join(definiciones)}
+    );
+    """)
+
+
+def registrar_telemetria(conexion, gesto_id, sesion_id, telemetria,
+                         tabla='telemetria_captura'):
+    """Guarda el resumen de la telemetría de un gesto, reemplazando el
+    anterior si lo había"""
+    cursor = conexion.cursor()
+    crear_tabla_telemetria(cursor, tabla)
+    fila = dict(telemetria.resumen(), gesto_id=gesto_id, sesion_id=sesion_id,
+                fecha=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    fila['histograma'] = json.dumps(fila['histograma'])
+    if not math.isfinite(fila['fs_medida']):
+        fila['fs_medida'] = None
+    cursor.execute(f"""INSERT OR REPLACE INTO {tabla} ({', '.join(COLUMNAS)})
+                       VALUES ({', '.join('?' * len(COLUMNAS))})""",
+                   [fila[columna] for columna in COLUMNAS])
+    conexion.commit()
+
+
+def actualizar_fs(conexion, gesto_id, fs, tabla_raw='raw'):
+    """
+    Reemplaza la frecuencia de muestreo guardada en las muestras de un gesto
+    por la medida. La columna es entera, así que se redondea; el valor exacto
+    queda en 'telemetria_captura'.
+    """
+    conexion.execute(f"UPDATE {tabla_raw} SET fs = ? WHERE gesto_id = ?",
+                     (int(round(fs)), gesto_id))
+    conexion.commit()
+
+
+def obtener_telemetria(conexion, gesto_id, tabla='telemetria_captura'):
+    """
+    Telemetría guardada de un gesto.
+
+    Return
+    ------
+        dict: Columnas de la tabla, con el histograma como diccionario. None
+              si el gesto no tiene telemetría
+    """
+    try:
+        cursor = conexion.execute(f"""SELECT {', '.join(COLUMNAS)} FROM {tabla}
+                                      WHERE gesto_id = ?""", (gesto_id,))
+    except sqlite3.OperationalError:
+        # La tabla aún no existe
+        return None
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    datos = dict(zip(COLUMNAS, fila))
+    datos['histograma'] = json.loads(datos['histograma'])
+    return datos
+
+
+#%%
+if __name__ == '__main__':
+    '''
+    Simular una captura con muestras cada 1.05 ms en promedio, con jitter y
+    algunas pausas, y mostrar la línea de estado y el resumen
+    '''
+    import random
+    random.seed(0)
+    telemetria = TelemetriaCaptura(fs_nominal=1000)
+    instante = 0.0
+    for n in range(5000):
+        instante += random.gauss(1.05e-3, 0.1e-3)
+        if n % 1000 == 999:
+            instante += 0.02  # Pausa del puerto
+        telemetria.registrar_muestra(instante)
+        if n % 1000 == 0:
+            print(telemetria.linea_estado())
+    for clave, valor in telemetria.resumen().items():
+        print(f"{clave}: {valor}")